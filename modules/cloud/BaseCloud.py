@@ -10,9 +10,10 @@ from modules.util.time_util import get_string_timestamp
 
 
 class BaseCloud(metaclass=ABCMeta):
-    def __init__(self, config: TrainConfig):
+    def __init__(self, config: TrainConfig, local_cache_dir: str | None = None):
         super().__init__()
         self.config = config
+        self.local_cache_dir = local_cache_dir
         self.file_sync=None
 
 
@@ -92,6 +93,8 @@ class BaseCloud(metaclass=ABCMeta):
 
     @abstractmethod
     def exec_callback(self,callbacks : TrainCallbacks):
+        #returns True if callbacks are streamed. exec_callback then waits for new callbacks itself,
+        #and can be called again immediately
         pass
 
     @abstractmethod
@@ -8,10 +8,11 @@ from modules.util.config.CloudConfig import CloudConfig, CloudSecretsConfig
 
 
 class BaseFileSync(metaclass=ABCMeta):
-    def __init__(self, config: CloudConfig, secrets: CloudSecretsConfig):
+    def __init__(self, config: CloudConfig, secrets: CloudSecretsConfig, cache_dir: str = None):
         super().__init__()
         self.config = config
         self.secrets = secrets
+        self.cache_dir = cache_dir
 
 
     def sync_up(self,local : Path,remote : Path):
@@ -33,7 +34,7 @@ class BaseFileSync(metaclass=ABCMeta):
         pass
 
     @abstractmethod
-    def sync_down_dir(self,local : Path,remote : Path,filter=None):
+    def sync_down_dir(self,local : Path,remote : Path,filter=None,manifest : Path=None):
         pass
 
     @staticmethod
@@ -1,24 +1,43 @@
+import hashlib
+import io
 import shlex
+import tarfile
+import tempfile
+import uuid
 from abc import abstractmethod
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 from modules.cloud.BaseFileSync import BaseFileSync
+from modules.cloud.ChunkIndex import ChunkIndex
+from modules.cloud.WorkspaceManifest import parse_manifest_entry
 from modules.util.config.CloudConfig import CloudConfig, CloudSecretsConfig
 
 import fabric
 
+#chunks that are missing on the remote are uploaded in tar files of about this size:
+DELTA_BATCH_SIZE=256 * 1024 * 1024
+
 
 class BaseSSHFileSync(BaseFileSync):
-    def __init__(self, config: CloudConfig, secrets: CloudSecretsConfig):
-        super().__init__(config, secrets)
+    def __init__(self, config: CloudConfig, secrets: CloudSecretsConfig, cache_dir: str = None):
+        super().__init__(config, secrets, cache_dir)
         self.sync_connection=fabric.Connection(host=secrets.host,
                                port=secrets.port,
                                user=secrets.user,
                                connect_kwargs=secrets.connect_kwargs())
+        #state of each manifest read so far: byte offset, last sequence number and the files it lists
+        self.__manifests={}
+        #delta uploads: local chunk hashes, and the chunks that exist in files on the remote
+        self.__chunk_index=None
+        self.__remote_chunks=None
 
     def close(self):
         if self.sync_connection:
             self.sync_connection.close()
+        if self.__chunk_index:
+            self.__chunk_index.close()
+            self.__chunk_index=None
 
     @abstractmethod
     def upload_files(self,local_files,remote_dir: Path):
@@ -41,26 +60,233 @@ class BaseSSHFileSync(BaseFileSync):
         if not self.__needs_upload(local=local,remote=remote,sync_info=sync_info):
             return
 
-        self.sync_connection.open()
-        self.sync_connection.run(f'mkdir -p {shlex.quote(remote.parent.as_posix())}',in_stream=False)
-        self.upload_file(local_file=local,remote_file=remote)
+        self.__make_remote_dirs([remote.parent])
+        if self.config.delta_upload:
+            self.__delta_upload({remote: local})
+        else:
+            self.upload_file(local_file=local,remote_file=remote)
 
 
     def sync_up_dir(self,local : Path,remote: Path,recursive: bool,sync_info=None):
         if sync_info is None:
             sync_info=self.__get_sync_info(remote)
-        self.sync_connection.open()
-        self.sync_connection.run(f'mkdir -p {shlex.quote(remote.as_posix())}',in_stream=False)
-        files=[]
-        for local_entry in local.iterdir():
-            if local_entry.is_file():
-                remote_entry=remote/local_entry.name
-                if self.__needs_upload(local=local_entry,remote=remote_entry,sync_info=sync_info):
+        dirs=self.__list_local_dir(local=local,remote=remote,recursive=recursive)
+        self.__make_remote_dirs(dirs.keys())
+
+        if self.config.delta_upload:
+            files={}
+            for remote_dir,local_files in dirs.items():
+                for local_file in local_files:
+                    remote_file=remote_dir/local_file.name
+                    if self.__needs_upload(local=local_file,remote=remote_file,sync_info=sync_info):
+                        files[remote_file]=local_file
+            self.__delta_upload(files)
+        else:
+            for remote_dir,local_files in dirs.items():
+                files=[local_file for local_file in local_files
+                       if self.__needs_upload(local=local_file,remote=remote_dir/local_file.name,sync_info=sync_info)]
+                self.upload_files(local_files=files,remote_dir=remote_dir)
+
+    @staticmethod
+    def __list_local_dir(local : Path,remote : Path,recursive : bool):
+        #all local files, grouped by their remote directory
+        dirs={}
+        pending=[(local,remote)]
+        while pending:
+            local_dir,remote_dir=pending.pop()
+            files=dirs.setdefault(remote_dir,[])
+            for local_entry in local_dir.iterdir():
+                if local_entry.is_file():
                     files.append(local_entry)
-            elif recursive and local_entry.is_dir():
-                self.sync_up_dir(local=local_entry,remote=remote/local_entry.name,recursive=True,sync_info=sync_info)
+                elif recursive and local_entry.is_dir():
+                    pending.append((local_entry,remote_dir/local_entry.name))
+        return dirs
+
+    def __make_remote_dirs(self,remote_dirs):
+        #one command for many directories, instead of one round trip per directory
+        remote_dirs=[shlex.quote(remote_dir.as_posix()) for remote_dir in remote_dirs]
+        self.sync_connection.open()
+        for i in range(0,len(remote_dirs),1000):
+            self.sync_connection.run(f'mkdir -p {" ".join(remote_dirs[i:i+1000])}',in_stream=False)
+
+    def __chunk_store(self):
+        return Path(self.config.remote_dir,'chunk_store')
+
+    def __get_remote_chunks(self):
+        """
+        Reads the reference files of the chunk store. Each one lists the chunk hashes of a remote file, together with
+        the size and mtime the file had when it was assembled. Returns the location of every chunk in a remote file
+        that is unchanged since then, as chunk hash -> (remote file, chunk index), and the reference files of remote
+        files that were removed or changed.
+        """
+        if self.__remote_chunks is None:
+            refs=shlex.quote((self.__chunk_store() / 'refs').as_posix())
+            self.sync_connection.open()
+            #the referenced files are listed with one stat for all of them, instead of one command per file
+            result=self.sync_connection.run(
+                f"test -d {refs} && find {refs} -type f -name '*.ref' -printf '\\036%p\\n' -exec cat {{}} \\;",
+                warn=True,hide=True,in_stream=False)
+            stat_result=self.sync_connection.run(
+                f"test -d {refs} && find {refs} -type f -name '*.ref' -exec head -qn 1 {{}} + "
+                f"| xargs -r -d '\\n' stat -c '%n\t%s %Y' --",
+                warn=True,hide=True,in_stream=False)
+
+            current={}
+            for line in stat_result.stdout.splitlines():
+                path,_,state=line.rpartition('\t')
+                current[path]=state
+
+            chunks={}
+            stale_refs=[]
+            for record in result.stdout.split('\036')[1:] if result.exited == 0 else []:
+                lines=record.splitlines()
+                if len(lines) < 3:
+                    continue
+                ref,target,state,hashes=lines[0],lines[1],lines[2],lines[3:]
+                if current.get(target) != state:
+                    stale_refs.append(ref)
+                    continue
+                for i,chunk_hash in enumerate(hashes):
+                    chunks.setdefault(chunk_hash,(target,i))
+            self.__remote_chunks=(chunks,stale_refs)
+        return self.__remote_chunks
+
+    def __delta_upload(self,files):
+        """
+        Uploads files as content addressed chunks. For every file it assembles, the remote keeps a reference file
+        with the chunk hashes of the file, but no copy of the data. Chunks that already exist in an unchanged remote
+        file are copied from there on the remote. Only the other chunks are uploaded, batched into large tar files.
+
+        All files are first assembled next to their target, and then moved into place, so the chunks of a file can
+        be copied from its previous version. Reference files of remote files that were removed or changed since
+        they were assembled are deleted.
+        """
+        if not files:
+            return
+        if self.__chunk_index is None:
+            self.__chunk_index=ChunkIndex(self.cache_dir)
+        chunk_size=self.__chunk_index.chunk_size
+        hashes=self.__chunk_index.hashes(list(files.values()))
+        remote_chunks,stale_refs=self.__get_remote_chunks()
+
+        #chunk hash -> (local file, offset, size)
+        missing={}
+        for local_file in files.values():
+            size=local_file.stat().st_size
+            for i,chunk_hash in enumerate(hashes[local_file]):
+                if chunk_hash not in remote_chunks and chunk_hash not in missing:
+                    missing[chunk_hash]=(local_file,i * chunk_size,min(chunk_size,size - i * chunk_size))
+
+        batches=[]
+        batch_bytes=0
+        for chunk_hash,chunk in missing.items():
+            if not batches or batch_bytes + chunk[2] > DELTA_BATCH_SIZE:
+                batches.append({})
+                batch_bytes=0
+            batches[-1][chunk_hash]=chunk
+            batch_bytes+=chunk[2]
+
+        missing_bytes=sum(chunk[2] for chunk in missing.values())
+        print(f"Delta upload of {len(files)} files: {len(missing)} new chunks, {missing_bytes / 1024**2:.1f} MiB")
+
+        store=self.__chunk_store()
+        #new chunks are only kept until the files are assembled
+        staging=store / f'staging-{uuid.uuid4().hex}'
+        quoted_staging=shlex.quote(staging.as_posix())
+        self.__make_remote_dirs([store / 'refs',staging])
+        try:
+            with tempfile.TemporaryDirectory() as temp_dir, ThreadPoolExecutor(max_workers=1) as executor:
+                def build_batch(i : int):
+                    tar_file=Path(temp_dir,f'{i}.tar')
+                    self.__build_chunk_batch(batches[i],tar_file)
+                    return tar_file
 
-        self.upload_files(local_files=files,remote_dir=remote)
+                #the next batch is built while the current one is uploaded
+                future=executor.submit(build_batch,0) if batches else None
+                for i,_ in enumerate(batches):
+                    tar_file=future.result()
+                    if i + 1 < len(batches):
+                        future=executor.submit(build_batch,i + 1)
+
+                    remote_tar=staging / f'upload-{i}.tar'
+                    self.upload_file(local_file=tar_file,remote_file=remote_tar)
+                    tar_file.unlink()
+
+                    quoted_tar=shlex.quote(remote_tar.as_posix())
+                    self.sync_connection.run(f'tar -xf {quoted_tar} -C {quoted_staging} && rm {quoted_tar}',
+                                             in_stream=False)
+
+                #assembling all files is done by one script, instead of one command per file
+                script_file=Path(temp_dir,'assemble.sh')
+                with script_file.open(mode='w',newline='\n') as f:
+                    self.__write_assemble_script(f,files,hashes,remote_chunks,stale_refs,staging,chunk_size)
+
+                remote_script=staging / 'assemble.sh'
+                quoted_script=shlex.quote(remote_script.as_posix())
+                self.upload_file(local_file=script_file,remote_file=remote_script)
+                self.sync_connection.run(f'sh {quoted_script}',in_stream=False)
+        finally:
+            self.sync_connection.run(f'rm -rf {quoted_staging}',warn=True,in_stream=False)
+            #the assembled files changed the chunks that exist on the remote
+            self.__remote_chunks=None
+
+    def __write_assemble_script(self,f,files,hashes,remote_chunks,stale_refs,staging : Path,chunk_size : int):
+        f.write('set -e\n')
+        f.write(f'S={shlex.quote(staging.as_posix())}\n')
+        f.write(f'R={shlex.quote((self.__chunk_store() / "refs").as_posix())}\n')
+
+        #every chunk is either copied from an unchanged remote file, or taken from the uploaded chunks. Consecutive
+        #chunks of the same remote file are copied with a single dd
+        for remote_file,local_file in files.items():
+            part=shlex.quote(remote_file.as_posix() + '.part')
+            #':' keeps the group valid for empty files
+            f.write('{ :\n')
+            run=None
+            for chunk_hash in hashes[local_file]:
+                source=remote_chunks.get(chunk_hash)
+                if source is not None and run is not None and run[0] == source[0] and run[1] + run[2] == source[1]:
+                    run[2]+=1
+                    continue
+                if run is not None:
+                    f.write(f'dd if={shlex.quote(run[0])} bs={chunk_size} skip={run[1]} count={run[2]} status=none\n')
+                    run=None
+                if source is not None:
+                    run=[source[0],source[1],1]
+                else:
+                    f.write(f'cat "$S/{chunk_hash}"\n')
+            if run is not None:
+                f.write(f'dd if={shlex.quote(run[0])} bs={chunk_size} skip={run[1]} count={run[2]} status=none\n')
+            f.write(f'}} > {part}\n')
+
+        #the previous versions of the files are only replaced after every file is assembled
+        for remote_file,local_file in files.items():
+            target=shlex.quote(remote_file.as_posix())
+            part=shlex.quote(remote_file.as_posix() + '.part')
+            ref=f'"$R/{hashlib.sha256(remote_file.as_posix().encode("utf-8")).hexdigest()}.ref"'
+            stat=local_file.stat()
+            f.write(f'mv -f {part} {target}\n')
+            #the mtime is kept, so the file is not uploaded again:
+            f.write(f'touch -m -d @{int(stat.st_mtime)} {target}\n')
+            f.write(f"cat > {ref} <<'EOF'\n")
+            f.write(f'{remote_file.as_posix()}\n{stat.st_size} {int(stat.st_mtime)}\n')
+            f.write(''.join(f'{chunk_hash}\n' for chunk_hash in hashes[local_file]))
+            f.write('EOF\n')
+
+        for ref in stale_refs:
+            f.write(f'rm -f {shlex.quote(ref)}\n')
+
+    @staticmethod
+    def __build_chunk_batch(chunks,tar_file : Path):
+        with tarfile.open(tar_file,'w') as tar:
+            for chunk_hash,(local_file,offset,size) in chunks.items():
+                with local_file.open(mode='rb') as f:
+                    f.seek(offset)
+                    data=f.read(size)
+                if hashlib.sha256(data).hexdigest() != chunk_hash:
+                    raise RuntimeError(f"{local_file} was modified during the upload")
+                info=tarfile.TarInfo(chunk_hash)
+                info.size=len(data)
+                tar.addfile(info,io.BytesIO(data))
 
     def sync_down_file(self,local : Path,remote : Path):
         sync_info=self.__get_sync_info(remote)
@@ -69,8 +295,12 @@ class BaseSSHFileSync(BaseFileSync):
         local.parent.mkdir(parents=True,exist_ok=True)
         self.download_file(local_file=local,remote_file=remote)
 
-    def sync_down_dir(self,local : Path,remote : Path,filter=None):
-        sync_info=self.__get_sync_info(remote)
+    def sync_down_dir(self,local : Path,remote : Path,filter=None,manifest : Path=None):
+        sync_info=None
+        if manifest is not None:
+            sync_info=self.__get_manifest_sync_info(remote,manifest)
+        if sync_info is None:
+            sync_info=self.__get_sync_info(remote)
         dirs={}
         for remote_entry in sync_info:
             local_entry=local / remote_entry.relative_to(remote)
@@ -88,7 +318,8 @@ class BaseSSHFileSync(BaseFileSync):
 
 
     def __get_sync_info(self,remote : Path):
-        cmd = f'find {shlex.quote(remote.as_posix())} -type f -exec stat --printf "%n\\t%s\\t%Y\\n"' + ' {} \\;'
+        #a single find process lists all files, instead of starting one stat process per file:
+        cmd = f'find {shlex.quote(remote.as_posix())} -type f -printf "%p\\t%s\\t%T@\\n"'
         self.sync_connection.open()
         result=self.sync_connection.run(cmd,warn=True,hide=True,in_stream=False)
         info={}
@@ -96,10 +327,50 @@ class BaseSSHFileSync(BaseFileSync):
             sp=line.split('\t')
             info[Path(sp[0])]={
                     'size': int(sp[1]),
-                    'mtime': int(sp[2])
+                    'mtime': int(float(sp[2]))
                 }
         return info
 
+    def __get_manifest_sync_info(self,remote : Path,manifest : Path):
+        #reads only the manifest entries appended since the last call. Returns None if there is no manifest yet, or if
+        #it can't be read consistently, so the caller lists the files instead
+        file=shlex.quote(manifest.as_posix())
+        self.sync_connection.open()
+
+        #a manifest that was replaced, or entries that are missing or were read twice, are read again from the start
+        for _ in range(2):
+            state=self.__manifests.setdefault(manifest,{'offset': 0,'sequence': 0,'info': {}})
+            cmd=f'test -f {file} && stat -c %s {file} && tail -c +{state["offset"] + 1} {file}'
+            result=self.sync_connection.run(cmd,warn=True,hide=True,in_stream=False)
+            if result.exited != 0:
+                return None
+
+            size_line,_,data=result.stdout.partition('\n')
+            if int(size_line) >= state['offset'] and self.__read_manifest_entries(state,data):
+                return {path: info for path,info in state['info'].items() if remote in path.parents}
+            del self.__manifests[manifest]
+
+        return None
+
+    @staticmethod
+    def __read_manifest_entries(state,data : str):
+        #only complete entries are used, the last one can still be written
+        complete=data[:data.rfind('\n') + 1]
+        for line in complete.splitlines():
+            entry=parse_manifest_entry(line)
+            if entry.sequence != state['sequence'] + 1:
+                return False
+            state['sequence']=entry.sequence
+            if entry.is_deleted():
+                state['info'].pop(Path(entry.path),None)
+            else:
+                state['info'][Path(entry.path)]={
+                        'size': entry.size,
+                        'mtime': entry.mtime
+                    }
+        state['offset']+=len(complete.encode('utf-8'))
+        return True
+
     @staticmethod
     def __needs_upload(local : Path,remote : Path,sync_info):
         return (
@@ -0,0 +1,222 @@
+import contextlib
+import hmac
+import os
+import pickle
+import queue
+import secrets
+import socket
+import struct
+import threading
+import time
+
+from modules.util.commands.TrainCommands import TrainCommands
+
+_FRAME_HEADER = struct.Struct(">Q")
+
+# a client that doesn't accept data for this long is disconnected
+_SEND_TIMEOUT = 30.0
+# maximum number of callbacks waiting to be sent. If the queue is full, progress updates are dropped and other
+# callbacks wait for free space
+_MAX_QUEUED_CALLBACKS = 1024
+# progress updates are replaced by the next one, so they can be dropped without losing information
+_PROGRESS_CALLBACKS = frozenset({
+    "on_update_train_progress",
+    "on_update_sample_default_progress",
+    "on_update_sample_custom_progress",
+})
+# time close() waits for the queued callbacks to be sent
+_CLOSE_TIMEOUT = 30.0
+
+
+def write_frame(connection, data: bytes):
+    connection.sendall(_FRAME_HEADER.pack(len(data)) + data)
+
+
+class FrameReader:
+    """
+    Reads length prefixed frames from a socket, or from a paramiko channel
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.__buffer = bytearray()
+
+    def read(self) -> bytes | None:
+        """
+        Returns the next frame, or None if the connection timed out before a complete frame was received.
+        Raises EOFError if the connection was closed.
+        """
+        while True:
+            if len(self.__buffer) >= _FRAME_HEADER.size:
+                (size,) = _FRAME_HEADER.unpack_from(self.__buffer)
+                end = _FRAME_HEADER.size + size
+                if len(self.__buffer) >= end:
+                    data = bytes(self.__buffer[_FRAME_HEADER.size:end])
+                    del self.__buffer[:end]
+                    return data
+
+            try:
+                data = self.connection.recv(1024 * 1024)
+            except TimeoutError:
+                return None
+            if not data:
+                raise EOFError
+            self.__buffer += data
+
+
+class CallbackStreamServer:
+    """
+    Streams the callbacks of a remote trainer to the client, and receives its commands, over one TCP connection.
+
+    The server only listens on localhost. The port and a random token are written to the stream file, which is only
+    readable by the current user. The client reads this file, connects through an SSH channel, and has to send the
+    token before anything else is accepted. A new connection replaces the previous one, for example after a reattach.
+
+    Callbacks are sent by a background thread, so a slow connection doesn't block training. All callbacks pass
+    through the same queue, so they arrive in order. While no client is connected, the background thread passes them
+    to the fallback function instead. If the queue is full, progress updates are dropped and other callbacks wait
+    for free space. A client that doesn't accept data within the send timeout is disconnected, after which the
+    queue is drained into the fallback function.
+    """
+
+    def __init__(self, stream_path: str, commands: TrainCommands, fallback):
+        self.stream_path = stream_path
+        self.commands = commands
+        self.fallback = fallback
+
+        self.__token = secrets.token_hex(16).encode()
+        self.__server = socket.create_server(("127.0.0.1", 0))
+        self.__lock = threading.Lock()
+        self.__connection = None
+        self.__queue = queue.Queue(maxsize=_MAX_QUEUED_CALLBACKS)
+        self.__closed = False
+
+        port = self.__server.getsockname()[1]
+        fd = os.open(stream_path + ".write", os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as f:
+            f.write(f"{port} {self.__token.decode()}\n")
+        os.replace(stream_path + ".write", stream_path)
+
+        self.__accept_thread = threading.Thread(target=self.__accept, daemon=True)
+        self.__accept_thread.start()
+        self.__send_thread = threading.Thread(target=self.__send, daemon=True)
+        self.__send_thread.start()
+
+    def callback(self, name: str, *params):
+        if self.__closed:
+            self.fallback(name, *params)
+            return
+        if name in _PROGRESS_CALLBACKS:
+            with contextlib.suppress(queue.Full):
+                self.__queue.put_nowait((name, params))
+            return
+        # the send thread frees space within the send timeout, either by sending or by disconnecting the client
+        self.__queue.put((name, params))
+
+    def __accept(self):
+        while True:
+            try:
+                connection, _ = self.__server.accept()
+            except OSError:
+                return  # the server was closed
+            threading.Thread(target=self.__receive, args=(connection,), daemon=True).start()
+
+    def __receive(self, connection: socket.socket):
+        reader = FrameReader(connection)
+        try:
+            connection.settimeout(10)
+            token = reader.read()
+            if token is None or not hmac.compare_digest(token, self.__token):
+                connection.close()
+                return
+            # the timeout applies to sending callbacks. Receiving just waits for the next command
+            connection.settimeout(_SEND_TIMEOUT)
+
+            with self.__lock:
+                previous, self.__connection = self.__connection, connection
+            if previous is not None:
+                self.__close_connection(previous)
+
+            while True:
+                data = reader.read()
+                if data is not None:
+                    self.commands.merge(pickle.loads(data))
+        except (EOFError, OSError):
+            pass
+        finally:
+            self.__disconnect(connection)
+
+    def __disconnect(self, connection: socket.socket):
+        with self.__lock:
+            if self.__connection is connection:
+                self.__connection = None
+        self.__close_connection(connection)
+
+    @staticmethod
+    def __close_connection(connection: socket.socket):
+        with contextlib.suppress(OSError):
+            connection.shutdown(socket.SHUT_RDWR)
+        connection.close()
+
+    def __send(self):
+        while (item := self.__queue.get()) is not None:
+            name, params = item
+            with self.__lock:
+                connection = self.__connection
+            if connection is not None:
+                try:
+                    write_frame(connection, pickle.dumps((name, params)))
+                    continue
+                except OSError:  # includes the send timeout, after which the frame can be incomplete
+                    self.__disconnect(connection)
+            self.fallback(name, *params)
+
+    def close(self):
+        """
+        Sends the queued callbacks, then closes the connection. Callbacks that are not sent within the close timeout
+        are passed to the fallback function.
+        """
+        self.__closed = True
+        with contextlib.suppress(queue.Full):
+            self.__queue.put(None, timeout=_CLOSE_TIMEOUT)
+        self.__send_thread.join(timeout=_CLOSE_TIMEOUT)
+        self.__server.close()
+        with self.__lock:
+            connection, self.__connection = self.__connection, None
+        if connection is not None:
+            self.__close_connection(connection)
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(self.stream_path)
+
+
+class CallbackStreamClient:
+    """
+    The client side of a CallbackStreamServer. The connection can be a socket, or a paramiko channel
+    """
+
+    def __init__(self, connection, token: str):
+        self.connection = connection
+        self.__reader = FrameReader(connection)
+        self.__lock = threading.Lock()
+        write_frame(connection, token.encode())
+
+    def send_commands(self, commands: TrainCommands):
+        data = pickle.dumps(commands)
+        with self.__lock:
+            write_frame(self.connection, data)
+
+    def receive(self, callbacks, timeout: float):
+        """
+        Calls all callbacks that are received within the timeout. Raises EOFError if the connection was closed.
+        """
+        deadline = time.monotonic() + timeout
+        while (remaining := deadline - time.monotonic()) > 0:
+            self.connection.settimeout(remaining)
+            data = self.__reader.read()
+            if data is None:
+                return
+            name, params = pickle.loads(data)
+            getattr(callbacks, name)(*params)
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,72 @@
+import hashlib
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+CHUNK_SIZE = 4 * 1024 * 1024
+
+
+def hash_chunks(path: Path, chunk_size: int = CHUNK_SIZE) -> list[str]:
+    hashes = []
+    with open(path, "rb") as f:
+        while data := f.read(chunk_size):
+            hashes.append(hashlib.sha256(data).hexdigest())
+    return hashes
+
+
+class ChunkIndex:
+    """
+    Caches the chunk hashes of local files for delta uploads. Files are split into chunks of a fixed size, and each
+    chunk is identified by its sha256 hash. Hashes are stored in an sqlite database in the cache directory, and are
+    only calculated again if the size or mtime of a file changes.
+    """
+
+    def __init__(self, cache_dir: str | None, chunk_size: int = CHUNK_SIZE):
+        self.chunk_size = chunk_size
+
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+            database = os.path.join(cache_dir, "chunk_index.sqlite")
+        else:
+            database = ":memory:"
+        self.__connection = sqlite3.connect(database, timeout=60)
+
+        with self.__connection:
+            self.__connection.execute(
+                "CREATE TABLE IF NOT EXISTS files ("
+                "path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, chunk_size INTEGER, hashes TEXT)"
+            )
+
+    def close(self):
+        self.__connection.close()
+
+    def hashes(self, paths: list[Path], max_workers: int | None = None) -> dict[Path, list[str]]:
+        """
+        Returns the chunk hashes of each file. Files that are not cached yet are hashed on worker threads
+        """
+        result = {}
+        missing = []
+        for path in paths:
+            stat = path.stat()
+            row = self.__connection.execute(
+                "SELECT hashes FROM files WHERE path = ? AND size = ? AND mtime_ns = ? AND chunk_size = ?",
+                (str(path.absolute()), stat.st_size, stat.st_mtime_ns, self.chunk_size),
+            ).fetchone()
+            if row is not None:
+                result[path] = row[0].split(",") if row[0] else []
+            else:
+                missing.append((path, stat))
+
+        if missing:
+            # hashlib releases the GIL while hashing, so threads are enough to use all cores
+            with ThreadPoolExecutor(max_workers=max_workers) as executor, self.__connection:
+                missing_hashes = executor.map(lambda x: hash_chunks(x[0], self.chunk_size), missing)
+                for (path, stat), hashes in zip(missing, missing_hashes, strict=True):
+                    result[path] = hashes
+                    self.__connection.execute(
+                        "INSERT OR REPLACE INTO files (path, size, mtime_ns, chunk_size, hashes) VALUES (?, ?, ?, ?, ?)",
+                        (str(path.absolute()), stat.st_size, stat.st_mtime_ns, self.chunk_size, ",".join(hashes)),
+                    )
+
+        return result
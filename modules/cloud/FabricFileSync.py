@@ -7,8 +7,8 @@ import fabric
 
 
 class FabricFileSync(BaseSSHFileSync):
-    def __init__(self, config: CloudConfig, secrets: CloudSecretsConfig):
-        super().__init__(config,secrets)
+    def __init__(self, config: CloudConfig, secrets: CloudSecretsConfig, cache_dir: str = None):
+        super().__init__(config,secrets,cache_dir)
 
     def __upload_batch(self,local_files,remote_dir : Path):
         with fabric.Connection(host=self.secrets.host,
@@ -5,6 +5,7 @@ import time
 from pathlib import Path
 
 from modules.cloud.BaseCloud import BaseCloud
+from modules.cloud.CallbackStream import CallbackStreamClient
 from modules.cloud.FabricFileSync import FabricFileSync
 from modules.cloud.NativeSCPFileSync import NativeSCPFileSync
 from modules.util.callbacks.TrainCallbacks import TrainCallbacks
@@ -18,16 +19,20 @@ import fabric
 
 
 class LinuxCloud(BaseCloud):
-    def __init__(self, config: TrainConfig):
-        super().__init__(config)
+    def __init__(self, config: TrainConfig, local_cache_dir: str | None = None):
+        super().__init__(config, local_cache_dir)
         self.connection=None
         self.callback_connection=None
         self.command_connection=None
         self.tensorboard_tunnel_stop=None
+        self.callback_stream=None
+        self.callback_stream_retry_time=0
 
         name=config.cloud.run_id if config.cloud.detach_trainer else get_string_timestamp()
         self.callback_file=f'{config.cloud.remote_dir}/{name}.callback'
         self.command_pipe=f'{config.cloud.remote_dir}/{name}.command'
+        self.manifest_file=f'{config.cloud.remote_dir}/{name}.manifest'
+        self.stream_file=f'{config.cloud.remote_dir}/{name}.stream'
         self.config_file=f'{config.cloud.remote_dir}/{name}.json'
         self.exit_status_file=f'{config.cloud.remote_dir}/{name}.exit'
         self.log_file=f'{config.cloud.remote_dir}/{name}.log'
@@ -65,11 +70,12 @@ class LinuxCloud(BaseCloud):
             self.command_connection.open()
             self.command_connection.transport.set_keepalive(30)
 
+            #local chunk hashes for delta uploads are cached with the other local caches:
             match config.file_sync:
                 case CloudFileSync.NATIVE_SCP:
-                    self.file_sync=NativeSCPFileSync(config,secrets)
+                    self.file_sync=NativeSCPFileSync(config,secrets,self.local_cache_dir)
                 case CloudFileSync.FABRIC_SFTP:
-                    self.file_sync=FabricFileSync(config,secrets)
+                    self.file_sync=FabricFileSync(config,secrets,self.local_cache_dir)
 
         except Exception:
             if self.connection:
@@ -124,6 +130,9 @@ class LinuxCloud(BaseCloud):
     def close(self):
         if self.tensorboard_tunnel_stop is not None:
             self.tensorboard_tunnel_stop.set()
+        if self.callback_stream:
+            self.callback_stream.close()
+            self.callback_stream=None
         if self.callback_connection:
             self.callback_connection.close()
         if self.command_connection:
@@ -160,7 +169,12 @@ class LinuxCloud(BaseCloud):
 
         cmd+=f' && {config.onetrainer_dir}/run-cmd.sh train_remote --config-path={shlex.quote(self.config_file)} \
                                                                    --callback-path={shlex.quote(self.callback_file)} \
-                                                                   --command-path={shlex.quote(self.command_pipe)}'
+                                                                   --command-path={shlex.quote(self.command_pipe)} \
+                                                                   --manifest-path={shlex.quote(self.manifest_file)} \
+                                                                   --stream-path={shlex.quote(self.stream_file)}'
+
+        #a stream file of a previous trainer would be retried until the new trainer has replaced it:
+        self.connection.run(f'rm -f {shlex.quote(self.stream_file)}',in_stream=False)
 
         if config.detach_trainer:
             self.connection.run(f'rm -f {self.exit_status_file}',in_stream=False)
@@ -189,6 +203,45 @@ class LinuxCloud(BaseCloud):
 
 
     def exec_callback(self,callbacks : TrainCallbacks):
+        #while the trainer is running, callbacks are streamed over one SSH channel. The callback file is
+        #still read until the stream is connected, and for callbacks written while no client was connected
+        if self.callback_stream is None and time.monotonic() >= self.callback_stream_retry_time:
+            self.callback_stream=self.__open_callback_stream()
+            if self.callback_stream is None:
+                self.callback_stream_retry_time=time.monotonic() + 5
+            else:
+                #callbacks written before the stream was connected are older than the streamed ones:
+                self.__exec_file_callback(callbacks)
+
+        if self.callback_stream is not None:
+            try:
+                self.callback_stream.receive(callbacks,timeout=1)
+                return True
+            except (EOFError,OSError):
+                #the trainer has exited, or the connection was lost
+                self.callback_stream.close()
+                self.callback_stream=None
+                self.callback_stream_retry_time=time.monotonic() + 5
+
+        self.__exec_file_callback(callbacks)
+        return False
+
+    def __open_callback_stream(self):
+        self.callback_connection.open()
+        result=self.callback_connection.run(f'cat {shlex.quote(self.stream_file)}',warn=True,hide=True,in_stream=False)
+        if result.exited != 0:
+            return None
+
+        try:
+            port,token=result.stdout.split()
+            channel=self.callback_connection.client.get_transport().open_channel(
+                'direct-tcpip',('127.0.0.1',int(port)),('127.0.0.1',0))
+            return CallbackStreamClient(channel,token)
+        except Exception as e:
+            print(f"Could not connect the callback stream, reading the callback file instead: {e}")
+            return None
+
+    def __exec_file_callback(self,callbacks : TrainCallbacks):
         #callbacks are a file instead of a named pipe, because of the blocking behaviour of linux pipes:
         #writing to pipes on the cloud can slow down training, and would cause issues in case
         #of a detached cloud trainer.
@@ -225,6 +278,15 @@ class LinuxCloud(BaseCloud):
 
 
     def send_commands(self,commands : TrainCommands):
+        callback_stream=self.callback_stream
+        if callback_stream is not None:
+            try:
+                callback_stream.send_commands(commands)
+                commands.reset()
+                return
+            except OSError:
+                pass #fall back to the command pipe
+
         try:
             self.command_connection.open()
             in_file,out_file,err_file=self.command_connection.client.exec_command(
@@ -255,7 +317,8 @@ class LinuxCloud(BaseCloud):
     def sync_workspace(self):
         self.file_sync.sync_down_dir(local=Path(self.config.local_workspace_dir),
                                   remote=Path(self.config.workspace_dir),
-                                  filter=lambda path:BaseCloud._filter_download(config=self.config.cloud,path=path))
+                                  filter=lambda path:BaseCloud._filter_download(config=self.config.cloud,path=path),
+                                  manifest=Path(self.manifest_file))
 
     def delete_workspace(self):
         self.connection.run(f"rm -r {shlex.quote(self.config.workspace_dir)}",in_stream=False)
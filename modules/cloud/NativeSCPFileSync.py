@@ -6,8 +6,8 @@ from modules.util.config.CloudConfig import CloudConfig, CloudSecretsConfig
 
 
 class NativeSCPFileSync(BaseSSHFileSync):
-    def __init__(self, config: CloudConfig, secrets: CloudSecretsConfig):
-        super().__init__(config, secrets)
+    def __init__(self, config: CloudConfig, secrets: CloudSecretsConfig, cache_dir: str = None):
+        super().__init__(config, secrets, cache_dir)
         password = getattr(secrets, "password", "").strip()
         if password:
             # Requires sshpass to be installed locally, will error if not
@@ -9,8 +9,8 @@ import runpod
 
 
 class RunpodCloud(LinuxCloud):
-    def __init__(self, config: TrainConfig):
-        super().__init__(config)
+    def __init__(self, config: TrainConfig, local_cache_dir: str | None = None):
+        super().__init__(config, local_cache_dir)
 
         runpod.api_key=config.secrets.cloud.api_key
 
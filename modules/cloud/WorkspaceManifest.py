@@ -0,0 +1,147 @@
+import os
+import threading
+from typing import NamedTuple
+
+# size of the entry that records the removal of a file
+DELETED_SIZE = -1
+
+
+class ManifestEntry(NamedTuple):
+    sequence: int
+    size: int
+    mtime: int
+    path: str
+
+    def is_deleted(self) -> bool:
+        return self.size == DELETED_SIZE
+
+
+def format_manifest_entry(entry: ManifestEntry) -> str:
+    return f"{entry.sequence}\t{entry.size}\t{entry.mtime}\t{entry.path}\n"
+
+
+def parse_manifest_entry(line: str) -> ManifestEntry:
+    sequence, size, mtime, path = line.rstrip("\n").split("\t", 3)
+    return ManifestEntry(int(sequence), int(size), int(mtime), path)
+
+
+class WorkspaceManifest:
+    """
+    Maintains an append-only manifest of the files in a directory, written on the cloud while the trainer runs.
+    Every scan appends one entry for each file that is new, changed or removed since the previous scan, with a sequence
+    number that increases by one for every entry. Removed files are recorded with a size of DELETED_SIZE. The client only reads the entries that were appended since its last sync,
+    instead of listing the whole workspace.
+
+    An existing manifest is continued, so the offsets and sequence numbers a client has seen stay valid if the trainer
+    is restarted with the same manifest path.
+    """
+
+    def __init__(self, directory: str, manifest_path: str, interval: float = 2.0):
+        self.directory = directory
+        self.manifest_path = manifest_path
+        self.interval = interval
+
+        self.__files: dict[str, tuple[int, int]] = {}
+        self.__sequence = 0
+        self.__stop_event = threading.Event()
+        self.__thread = None
+
+        self.__load()
+
+    def __load(self):
+        try:
+            with open(self.manifest_path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return
+
+        # an interrupted write can leave an incomplete last entry
+        valid_size = data.rfind(b"\n") + 1
+        for line in data[:valid_size].decode("utf-8").splitlines():
+            entry = parse_manifest_entry(line)
+            if entry.is_deleted():
+                self.__files.pop(entry.path, None)
+            else:
+                self.__files[entry.path] = (entry.size, entry.mtime)
+            self.__sequence = entry.sequence
+
+        if valid_size != len(data):
+            os.truncate(self.manifest_path, valid_size)
+
+    def __scan(self) -> list[tuple[str, int, int]]:
+        changed = []
+        seen = set()
+        # files in directories that exist but can't be listed are kept, instead of being recorded as removed
+        unreadable = []
+        pending = [self.directory]
+        while pending:
+            directory = pending.pop()
+            try:
+                entries = list(os.scandir(directory))
+            except FileNotFoundError:
+                continue
+            except OSError:
+                unreadable.append(directory.replace(os.sep, "/") + "/")
+                continue
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        pending.append(entry.path)
+                    elif entry.is_file():
+                        stat = entry.stat()
+                        path = entry.path.replace(os.sep, "/")
+                        seen.add(path)
+                        state = (stat.st_size, int(stat.st_mtime))
+                        if self.__files.get(path) != state:
+                            self.__files[path] = state
+                            changed.append((path, *state))
+                except OSError:  # noqa: PERF203
+                    continue  # removed while scanning
+
+        removed = [
+            path for path in self.__files
+            if path not in seen and not any(path.startswith(prefix) for prefix in unreadable)
+        ]
+        for path in removed:
+            del self.__files[path]
+            changed.append((path, DELETED_SIZE, 0))
+
+        return changed
+
+    def update(self):
+        """
+        Scans the directory once, and appends entries for all new, changed or removed files
+        """
+        changed = self.__scan()
+        if not changed:
+            return
+
+        lines = []
+        for path, size, mtime in changed:
+            self.__sequence += 1
+            lines.append(format_manifest_entry(ManifestEntry(self.__sequence, size, mtime, path)))
+
+        with open(self.manifest_path, "a", encoding="utf-8") as f:
+            f.write("".join(lines))
+
+    def start(self):
+        def run():
+            while not self.__stop_event.is_set():
+                try:
+                    self.update()
+                except Exception as e:
+                    print(f"Could not update the workspace manifest: {e}")
+                self.__stop_event.wait(self.interval)
+
+        self.__thread = threading.Thread(target=run, daemon=True)
+        self.__thread.start()
+
+    def stop(self):
+        """
+        Stops the background scans, and records all files written until now
+        """
+        self.__stop_event.set()
+        if self.__thread is not None:
+            self.__thread.join()
+            self.__thread = None
+        self.update()
@@ -4,6 +4,7 @@ from abc import ABCMeta, abstractmethod
 from modules.dataLoader.mixin.DataLoaderMgdsMixin import DataLoaderMgdsMixin
 from modules.model.BaseModel import BaseModel
 from modules.modelSetup.BaseModelSetup import BaseModelSetup
+from modules.util.config.ConceptConfig import ConceptConfig
 from modules.util.config.TrainConfig import TrainConfig
 from modules.util.TrainProgress import TrainProgress
 
@@ -26,16 +27,18 @@ class BaseDataLoader(
             model_setup: BaseModelSetup,
             train_progress: TrainProgress,
             is_validation: bool = False,
+            pad_batches: bool = False,
     ):
         super().__init__()
 
         self.train_device = train_device
         self.temp_device = temp_device
+        # validation uses every sample once. Incomplete batches are padded instead of dropped
+        self.pad_batches = pad_batches or is_validation
 
         if is_validation:
             config = copy.copy(config)
-            config.batch_size = 1
-            config.multi_gpu = False
+            config.batch_size = config.validation_batch_size
 
         self.__ds = self._create_dataset(
             config=config,
@@ -52,6 +55,9 @@ class BaseDataLoader(
     def get_data_loader(self) -> TrainDataLoader:
         return self.__dl
 
+    def get_concepts(self) -> list[ConceptConfig]:
+        return self.concepts
+
     @abstractmethod
     def _create_dataset(
             self,
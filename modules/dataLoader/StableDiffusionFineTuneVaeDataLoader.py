@@ -1,7 +1,10 @@
 import os
 import re
 
+import modules.util.multi_gpu_util as multi
 from modules.dataLoader.BaseDataLoader import BaseDataLoader
+from modules.dataLoader.pipelineModules.CollectIndexedPaths import CollectIndexedPaths
+from modules.dataLoader.pipelineModules.PaddedAspectBatchSorting import PaddedAspectBatchSorting
 from modules.model.StableDiffusionModel import StableDiffusionModel
 from modules.modelSetup.BaseModelSetup import BaseModelSetup
 from modules.util import factory, path_util
@@ -15,9 +18,9 @@ from mgds.OutputPipelineModule import OutputPipelineModule
 from mgds.pipelineModules.AspectBatchSorting import AspectBatchSorting
 from mgds.pipelineModules.AspectBucketing import AspectBucketing
 from mgds.pipelineModules.CalcAspect import CalcAspect
-from mgds.pipelineModules.CollectPaths import CollectPaths
 from mgds.pipelineModules.DecodeVAE import DecodeVAE
 from mgds.pipelineModules.DiskCache import DiskCache
+from mgds.pipelineModules.DistributedSampler import DistributedSampler
 from mgds.pipelineModules.EncodeVAE import EncodeVAE
 from mgds.pipelineModules.InlineAspectBatchSorting import InlineAspectBatchSorting
 from mgds.pipelineModules.LoadImage import LoadImage
@@ -57,10 +60,11 @@ class StableDiffusionFineTuneVaeDataLoader(BaseDataLoader):
     def __enumerate_input_modules(self, config: TrainConfig) -> list:
         supported_extensions = path_util.supported_image_extensions()
 
-        collect_paths = CollectPaths(
+        collect_paths = CollectIndexedPaths(
             concept_in_name='concept', path_in_name='path', include_subdirectories_in_name='concept.include_subdirectories', enabled_in_name='enabled',
             path_out_name='image_path', concept_out_name='concept',
-            extensions=supported_extensions, include_postfix=None, exclude_postfix=['-masklabel']
+            extensions=supported_extensions, include_postfix=None, exclude_postfix=['-masklabel'],
+            cache_dir=config.cache_dir,
         )
 
         mask_path = ModifyPath(in_name='image_path', out_name='mask_path', postfix='-masklabel', extension='.png')
@@ -221,7 +225,14 @@ class StableDiffusionFineTuneVaeDataLoader(BaseDataLoader):
 
         image_sample = SampleVAEDistribution(in_name='latent_image_distribution', out_name='latent_image', mode='mean')
 
-        if config.latent_caching:
+        world_size = multi.world_size() if config.multi_gpu else 1
+        distributed_sampler = None
+        if self.pad_batches:
+            #every sample is used once, incomplete batches are padded and the padding is marked in 'padding_sample'
+            batch_sorting = PaddedAspectBatchSorting(resolution_in_name='crop_resolution', names=sort_names, batch_size=config.batch_size * world_size, padding_out_name='padding_sample')
+            distributed_sampler = DistributedSampler(names=sort_names + ['padding_sample'], world_size=world_size, rank=multi.rank())
+            output_names = output_names + ['padding_sample']
+        elif config.latent_caching:
             batch_sorting = AspectBatchSorting(resolution_in_name='crop_resolution', names=sort_names, batch_size=config.batch_size)
         else:
             batch_sorting = InlineAspectBatchSorting(resolution_in_name='crop_resolution', names=sort_names, batch_size=config.batch_size)
@@ -231,6 +242,8 @@ class StableDiffusionFineTuneVaeDataLoader(BaseDataLoader):
         modules = [image_sample]
 
         modules.append(batch_sorting)
+        if distributed_sampler is not None and world_size > 1:
+            modules.append(distributed_sampler)
 
         modules.append(output)
 
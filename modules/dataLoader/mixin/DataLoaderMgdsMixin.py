@@ -28,6 +28,7 @@ class DataLoaderMgdsMixin(metaclass=ABCMeta):
 
         # choose all validation concepts, or none of them, depending on is_validation
         concepts = [concept for concept in concepts if (ConceptType(concept.type) == ConceptType.VALIDATION) == is_validation]
+        self.concepts = concepts
 
         # convert before passing to MGDS
         concepts = [c.to_dict() for c in concepts]
@@ -4,6 +4,8 @@ from abc import ABCMeta, abstractmethod
 from collections.abc import Callable
 
 import modules.util.multi_gpu_util as multi
+from modules.dataLoader.pipelineModules.CollectIndexedPaths import CollectIndexedPaths
+from modules.dataLoader.pipelineModules.PaddedAspectBatchSorting import PaddedAspectBatchSorting
 from modules.model.BaseModel import BaseModel
 from modules.modelSetup.BaseModelSetup import BaseModelSetup
 from modules.modelSetup.mixin.ModelSetupText2ImageMixin import ModelSetupText2ImageMixin
@@ -18,7 +20,6 @@ from mgds.pipelineModules.AspectBatchSorting import AspectBatchSorting
 from mgds.pipelineModules.AspectBucketing import AspectBucketing
 from mgds.pipelineModules.CalcAspect import CalcAspect
 from mgds.pipelineModules.CapitalizeTags import CapitalizeTags
-from mgds.pipelineModules.CollectPaths import CollectPaths
 from mgds.pipelineModules.DiskCache import DiskCache
 from mgds.pipelineModules.DistributedSampler import DistributedSampler
 from mgds.pipelineModules.DownloadHuggingfaceDatasets import DownloadHuggingfaceDatasets
@@ -68,10 +69,11 @@ class DataLoaderText2ImageMixin(metaclass=ABCMeta):
             concept_out_name='concept',
         )
 
-        collect_paths = CollectPaths(
+        collect_paths = CollectIndexedPaths(
             concept_in_name='concept', path_in_name='path', include_subdirectories_in_name='concept.include_subdirectories', enabled_in_name='enabled',
             path_out_name='image_path', concept_out_name='concept',
-            extensions=supported_extensions, include_postfix=None, exclude_postfix=['-masklabel','-condlabel']
+            extensions=supported_extensions, include_postfix=None, exclude_postfix=['-masklabel','-condlabel'],
+            cache_dir=config.cache_dir,
         )
 
         mask_path = ModifyPath(in_name='image_path', out_name='mask_path', postfix='-masklabel', extension='.png')
@@ -300,8 +302,13 @@ class DataLoaderText2ImageMixin(metaclass=ABCMeta):
             before_cache_fun=before_cache_image_fun,
         )
 
-        world_size = multi.world_size() if config.multi_gpu else 1  #world_size can be 1 for validation dataloader, even if multi.world_size() returns > 1
-        if config.latent_caching:
+        world_size = multi.world_size() if config.multi_gpu else 1
+        if self.pad_batches:
+            #every sample is used once, incomplete batches are padded and the padding is marked in 'padding_sample'
+            batch_sorting = PaddedAspectBatchSorting(resolution_in_name='crop_resolution', names=sort_names, batch_size=config.batch_size * world_size, padding_out_name='padding_sample')
+            distributed_sampler = DistributedSampler(names=sort_names + ['padding_sample'], world_size=world_size, rank=multi.rank())
+            output_names = output_names + ['padding_sample']
+        elif config.latent_caching:
             batch_sorting = AspectBatchSorting(resolution_in_name='crop_resolution', names=sort_names, batch_size=config.batch_size * world_size)
             distributed_sampler = DistributedSampler(names=sort_names, world_size=world_size, rank=multi.rank())
         else:
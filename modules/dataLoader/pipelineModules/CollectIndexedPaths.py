@@ -0,0 +1,106 @@
+import os
+
+import modules.util.multi_gpu_util as multi
+from modules.util.concept_index import ConceptFileType, ConceptIndex
+
+from mgds.PipelineModule import PipelineModule
+from mgds.pipelineModuleTypes.SingleVariationRandomAccessPipelineModule import SingleVariationRandomAccessPipelineModule
+
+
+class CollectIndexedPaths(
+    PipelineModule,
+    SingleVariationRandomAccessPipelineModule,
+):
+    """
+    Replacement for mgds' CollectPaths that reads the files of each concept from its ConceptIndex. Only directories
+    that changed since the index was last updated are listed again. With multiple GPUs, only the master rank updates
+    the index, the other ranks read it afterwards.
+    """
+
+    def __init__(
+            self,
+            concept_in_name: str,
+            path_in_name: str,
+            include_subdirectories_in_name: str,
+            enabled_in_name: str,
+            path_out_name: str,
+            concept_out_name: str,
+            extensions: set[str],
+            include_postfix: list[str] | None,
+            exclude_postfix: list[str] | None,
+            cache_dir: str,
+    ):
+        super().__init__()
+        self.concept_in_name = concept_in_name
+        self.path_in_name = path_in_name
+        self.include_subdirectories_in_name = include_subdirectories_in_name
+        self.enabled_in_name = enabled_in_name
+        self.path_out_name = path_out_name
+        self.concept_out_name = concept_out_name
+        self.extensions = {extension.lower() for extension in extensions}
+        self.include_postfix = include_postfix
+        self.exclude_postfix = exclude_postfix
+        self.cache_dir = cache_dir
+
+        self.paths = []
+        self.concepts = []
+
+    def length(self) -> int:
+        return len(self.paths)
+
+    def get_inputs(self) -> list[str]:
+        return [self.concept_in_name]
+
+    def get_outputs(self) -> list[str]:
+        return [self.path_out_name, self.concept_out_name]
+
+    @staticmethod
+    def __get_nested(concept: dict, name: str):
+        # names are given relative to the pipeline item, like 'concept.include_subdirectories'
+        for part in name.removeprefix('concept.').split('.'):
+            concept = concept[part]
+        return concept
+
+    def __filter(self, path: str) -> bool:
+        name, extension = os.path.splitext(path)
+        if extension.lower() not in self.extensions:
+            return False
+        if self.include_postfix and not any(name.endswith(postfix) for postfix in self.include_postfix):
+            return False
+        return not (self.exclude_postfix and any(name.endswith(postfix) for postfix in self.exclude_postfix))
+
+    def start(self, variation: int):
+        for _ in multi.master_first():
+            self.__collect(variation, update=multi.is_master())
+
+    def __collect(self, variation: int, update: bool):
+        self.paths = []
+        self.concepts = []
+
+        for index in range(self._get_previous_length(self.concept_in_name)):
+            concept = self._get_previous_item(variation, self.concept_in_name, index)
+            if not self.__get_nested(concept, self.enabled_in_name):
+                continue
+
+            path = self.__get_nested(concept, self.path_in_name)
+            if not os.path.isdir(path):
+                print(f"Skipping concept '{concept.get('name', '')}': {path} is not a directory")
+                continue
+
+            include_subdirectories = self.__get_nested(concept, self.include_subdirectories_in_name)
+            with ConceptIndex(path, self.cache_dir, read_only=not update) as concept_index:
+                if update:
+                    concept_index.update(include_subdirectories)
+                paths = concept_index.paths(include_subdirectories, [
+                    ConceptFileType.IMAGE, ConceptFileType.VIDEO, ConceptFileType.MASK, ConceptFileType.CONDITIONING,
+                ])
+
+            paths = [path for path in paths if self.__filter(path)]
+            self.paths.extend(paths)
+            self.concepts.extend([concept] * len(paths))
+
+    def get_item(self, index: int, requested_name: str = None) -> dict:
+        return {
+            self.path_out_name: self.paths[index],
+            self.concept_out_name: self.concepts[index],
+        }
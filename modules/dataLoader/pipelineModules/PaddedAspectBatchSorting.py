@@ -0,0 +1,64 @@
+from mgds.PipelineModule import PipelineModule
+from mgds.pipelineModuleTypes.RandomAccessPipelineModule import RandomAccessPipelineModule
+
+import torch
+
+
+class PaddedAspectBatchSorting(
+    PipelineModule,
+    RandomAccessPipelineModule,
+):
+    """
+    Replacement for mgds' AspectBatchSorting that keeps every sample. Samples are sorted into batches of the same
+    resolution, but the last batch of a resolution is filled up by repeating samples of that resolution, instead of
+    being dropped. Repeated samples are marked in padding_out_name, so they can be masked out of per-sample results.
+
+    Samples are not shuffled. This is meant for passes that evaluate every sample once, like the validation loss.
+    """
+
+    def __init__(
+            self,
+            resolution_in_name: str,
+            names: list[str],
+            batch_size: int,
+            padding_out_name: str,
+    ):
+        super().__init__()
+        self.resolution_in_name = resolution_in_name
+        self.names = names
+        self.batch_size = batch_size
+        self.padding_out_name = padding_out_name
+
+        self.index_list = []
+        self.padding_list = []
+
+    def length(self) -> int:
+        return len(self.index_list)
+
+    def get_inputs(self) -> list[str]:
+        return [self.resolution_in_name] + self.names
+
+    def get_outputs(self) -> list[str]:
+        return self.names + [self.padding_out_name]
+
+    def start(self, variation: int):
+        buckets = {}
+        for index in range(self._get_previous_length(self.resolution_in_name)):
+            resolution = self._get_previous_item(variation, self.resolution_in_name, index)
+            buckets.setdefault(tuple(int(x) for x in resolution), []).append(index)
+
+        self.index_list = []
+        self.padding_list = []
+        for indices in buckets.values():
+            padding_count = -len(indices) % self.batch_size
+            self.index_list.extend(indices)
+            self.index_list.extend(indices[i % len(indices)] for i in range(padding_count))
+            self.padding_list.extend([False] * len(indices))
+            self.padding_list.extend([True] * padding_count)
+
+    def get_item(self, variation: int, index: int, requested_name: str = None) -> dict:
+        previous_index = self.index_list[index]
+
+        item = {name: self._get_previous_item(variation, name, previous_index) for name in self.names}
+        item[self.padding_out_name] = torch.tensor(self.padding_list[index])
+        return item
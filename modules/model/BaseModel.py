@@ -7,6 +7,7 @@ from modules.module.LoRAModule import LoRAModuleWrapper
 from modules.util.config.TrainConfig import TrainConfig
 from modules.util.enum.DataType import DataType
 from modules.util.enum.ModelType import ModelType
+from modules.util.LayerOffloadConductor import LayerOffloadConductor
 from modules.util.modelSpec.ModelSpec import ModelSpec
 from modules.util.NamedParameterGroup import NamedParameterGroupCollection
 from modules.util.TrainProgress import TrainProgress
@@ -106,6 +107,9 @@ class BaseModel(metaclass=ABCMeta):
     def adapters(self) -> list[LoRAModuleWrapper]:
         pass
 
+    def offload_conductors(self) -> list[LayerOffloadConductor]:
+        return [x for x in vars(self).values() if isinstance(x, LayerOffloadConductor)]
+
     @staticmethod
     def _add_embeddings_to_prompt(
             additional_embeddings: list[BaseModelEmbedding],
@@ -1,15 +1,23 @@
 import json
 import os
 import re
+import threading
 import traceback
 from abc import ABCMeta
+from collections import defaultdict
+from collections.abc import Iterable
+from concurrent.futures import ThreadPoolExecutor
 from itertools import repeat
 
+from modules.module.quantized.mixin.QuantizedModuleMixin import QuantizedModuleMixin
 from modules.util.config.TrainConfig import QuantizationConfig
 from modules.util.enum.DataType import DataType
 from modules.util.quantization_util import (
+    get_quantization_cache_filename,
     is_quantized_parameter,
+    load_quantization_cache,
     replace_linear_with_quantized_layers,
+    save_quantization_cache,
 )
 
 import torch
@@ -18,7 +26,59 @@ from torch import nn
 import accelerate
 import huggingface_hub
 from huggingface_hub.utils import EntryNotFoundError
-from safetensors.torch import load_file
+from safetensors import safe_open
+
+MAX_LOAD_WORKERS = 8
+
+
+class _QuantizeOnLoad:
+    """
+    Quantizes each quantized layer as soon as all its parameters are loaded, so the unquantized weights of the
+    whole model never need to be in memory at the same time. Layers without loaded parameters are left for
+    quantize_layers() during the model setup.
+    """
+
+    def __init__(self, sub_module: nn.Module, train_dtype: DataType):
+        self.__sub_module = sub_module
+        self.__train_dtype = train_dtype
+        self.__pending = {}
+        self.__quantized = set()
+        self.__lock = threading.Lock()
+
+        if torch.cuda.is_available():
+            self.__device = torch.device("cuda", torch.cuda.current_device())
+        else:
+            self.__device = None
+
+    def set_keys(self, keys: Iterable[str]):
+        modules = dict(self.__sub_module.named_modules())
+        for key in keys:
+            module_name, _, tensor_name = key.rpartition(".")
+            module = modules.get(module_name)
+            if isinstance(module, QuantizedModuleMixin) and tensor_name in module._parameters:
+                self.__pending.setdefault(module, set()).add(tensor_name)
+
+    def add_quantized(self, modules: Iterable[nn.Module]):
+        self.__quantized.update(modules)
+
+    def quantized_modules(self) -> set[nn.Module]:
+        return self.__quantized
+
+    def tensor_loaded(self, module: nn.Module, tensor_name: str):
+        with self.__lock:
+            pending = self.__pending.get(module)
+            if pending is None:
+                return
+            pending.discard(tensor_name)
+            if len(pending) > 0:
+                return
+            del self.__pending[module]
+
+        module.compute_dtype = self.__train_dtype.torch_dtype()
+        module.quantize(device=self.__device)
+
+        with self.__lock:
+            self.__quantized.add(module)
 
 
 class HFModelLoaderMixin(metaclass=ABCMeta):
@@ -71,7 +131,6 @@ class HFModelLoaderMixin(metaclass=ABCMeta):
         else:
             safetensors_filenames = [model_filename]
 
-        state_dict = {}
         is_torch_pickle = False
 
         if is_local:
@@ -101,16 +160,81 @@ class HFModelLoaderMixin(metaclass=ABCMeta):
                 )]
                 is_torch_pickle = True
 
+        quantizer = _QuantizeOnLoad(sub_module, train_dtype)
+
+        # layers found in the quantization cache are loaded already quantized, their tensors are skipped below
+        cache_filename = get_quantization_cache_filename(
+            sub_module, full_filenames, dtype, train_dtype, keep_in_fp32_modules, quantization,
+        )
+        is_cached = cache_filename is not None and os.path.isfile(cache_filename)
+        cached_keys = {}
+        if is_cached:
+            print(f"Loading quantized weights from cache {cache_filename}")
+            cached_keys = load_quantization_cache(sub_module, cache_filename, train_dtype)
+            quantizer.add_quantized(cached_keys.values())
+
         if is_torch_pickle:
+            state_dict = {}
             for f in full_filenames:
                 file_state_dict = torch.load(f, weights_only=True)
                 while 'state_dict' in file_state_dict:
                     file_state_dict = file_state_dict['state_dict']
                 state_dict |= file_state_dict
+
+            state_dict = self.__fix_state_dict_keys(sub_module, state_dict)
+            state_dict = {k: v for (k, v) in state_dict.items() if k not in cached_keys}
+            quantizer.set_keys(state_dict.keys())
+            for key, value in state_dict.items():
+                self.__set_tensor(sub_module, key, value, dtype, train_dtype, keep_in_fp32_modules, quantizer)
+            del state_dict
         else:
+            # only the key names are read here, the tensors stay in the memory mapped files until they are assigned
+            tensor_sources = {}
             for f in full_filenames:
-                state_dict |= load_file(f)
+                with safe_open(f, framework="pt") as file:
+                    for key in file.keys():  # noqa: SIM118
+                        tensor_sources[key] = (f, key)
+
+            tensor_sources = self.__fix_state_dict_keys(sub_module, tensor_sources)
+            tensor_sources = {k: v for (k, v) in tensor_sources.items() if k not in cached_keys}
+            quantizer.set_keys(tensor_sources.keys())
+
+            file_keys = defaultdict(list)
+            for key, (f, source_key) in tensor_sources.items():
+                file_keys[f].append((key, source_key))
+            del tensor_sources
+
+            def load_file_tensors(f: str, keys: list[tuple[str, str]]):
+                with safe_open(f, framework="pt") as file:
+                    for key, source_key in keys:
+                        value = file.get_tensor(source_key)
+                        self.__set_tensor(sub_module, key, value, dtype, train_dtype, keep_in_fp32_modules, quantizer)
+                        del value
+
+            # every worker opens its own view of the file. Each file is split into one chunk per worker, so
+            # unsharded models are also loaded in parallel
+            max_workers = max(1, min(os.cpu_count() or 1, MAX_LOAD_WORKERS))
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                futures = [
+                    executor.submit(load_file_tensors, f, keys[i::max_workers])
+                    for f, keys in file_keys.items()
+                    for i in range(min(max_workers, len(keys)))
+                ]
+                for future in futures:
+                    future.result()
+
+        if cache_filename is not None and not is_cached:
+            save_quantization_cache(
+                sub_module,
+                cache_filename,
+                quantizer.quantized_modules(),
+                int(quantization.cache_size_limit * 1024**3),
+            )
+
+        return sub_module
 
+    @staticmethod
+    def __fix_state_dict_keys(sub_module: nn.Module, state_dict: dict) -> dict:
         if hasattr(sub_module, '_fix_state_dict_keys_on_load'):
             sub_module._fix_state_dict_keys_on_load(state_dict)
 
@@ -123,42 +247,51 @@ class HFModelLoaderMixin(metaclass=ABCMeta):
                 new_state_dict[new_k] = v
             state_dict = new_state_dict
 
+        return state_dict
+
+    @staticmethod
+    def __set_tensor(
+            sub_module: nn.Module,
+            key: str,
+            value: torch.Tensor,
+            dtype: DataType,
+            train_dtype: DataType,
+            keep_in_fp32_modules: list[str],
+            quantizer: _QuantizeOnLoad,
+    ):
         #tensors that will be quantized are loaded at their original dtype. non-quantized tensors are converted
         #to their intended dtype here
         #TODO the following code requires quite a few workarounds by now. Is there a better way?
-        for key, value in state_dict.items():
-            module = sub_module
-            tensor_name = key
-            module_name = None
-            key_splits = tensor_name.split(".")
-            for split in key_splits[:-1]:
-                module = getattr(module, split)
-                module_name = split
-            tensor_name = key_splits[-1]
-
-            is_buffer = tensor_name in module._buffers
-            if not is_buffer and tensor_name not in module._parameters:
-                continue
-            old_value = module._buffers[tensor_name] if is_buffer else module._parameters[tensor_name]
-
-            if torch.is_floating_point(old_value):
-                old_type = type(old_value)
-                if not is_quantized_parameter(module, tensor_name):
-                    if dtype.is_quantized() or module_name in keep_in_fp32_modules:
-                        value = value.to(dtype=train_dtype.torch_dtype())
-                    else:
-                        value = value.to(dtype=dtype.torch_dtype())
-
-                new_value = old_type(value)
-
-                if is_buffer:
-                    module._buffers[tensor_name].data = new_value
+        module = sub_module
+        tensor_name = key
+        module_name = None
+        key_splits = tensor_name.split(".")
+        for split in key_splits[:-1]:
+            module = getattr(module, split)
+            module_name = split
+        tensor_name = key_splits[-1]
+
+        is_buffer = tensor_name in module._buffers
+        if not is_buffer and tensor_name not in module._parameters:
+            return
+        old_value = module._buffers[tensor_name] if is_buffer else module._parameters[tensor_name]
+
+        if torch.is_floating_point(old_value):
+            old_type = type(old_value)
+            if not is_quantized_parameter(module, tensor_name):
+                if dtype.is_quantized() or module_name in keep_in_fp32_modules:
+                    value = value.to(dtype=train_dtype.torch_dtype())
                 else:
-                    module._parameters[tensor_name] = new_value
+                    value = value.to(dtype=dtype.torch_dtype())
 
-        del state_dict
+            new_value = old_type(value)
 
-        return sub_module
+            if is_buffer:
+                module._buffers[tensor_name].data = new_value
+            else:
+                module._parameters[tensor_name] = new_value
+
+        quantizer.tensor_loaded(module, tensor_name)
 
     def _load_transformers_sub_module(
             self,
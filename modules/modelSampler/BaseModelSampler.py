@@ -1,14 +1,19 @@
 import io
 import os
+import traceback
 from abc import ABCMeta, abstractmethod
-from collections.abc import Callable
+from collections.abc import Callable, Hashable
 from pathlib import Path
+from typing import Any
 
 from modules.util.config.SampleConfig import SampleConfig
+from modules.util.config.TrainConfig import TrainConfig
 from modules.util.enum.AudioFormat import AudioFormat
 from modules.util.enum.FileType import FileType
 from modules.util.enum.ImageFormat import ImageFormat
 from modules.util.enum.VideoFormat import VideoFormat
+from modules.util.PromptEmbeddingCache import PromptEmbeddingCache
+from modules.util.torch_util import torch_gc
 
 import torch
 from torchvision.io import write_video
@@ -48,6 +53,24 @@ class ModelSamplerOutput:
                 return ModelSamplerOutput, (self.file_type, None)
 
 
+class SampleRequest:
+    """
+    One sample of a sampling round, with its own destination and callbacks
+    """
+
+    def __init__(
+            self,
+            sample_config: SampleConfig,
+            destination: str,
+            on_sample: Callable[[ModelSamplerOutput], None] = lambda _: None,
+            on_update_progress: Callable[[int, int], None] = lambda _, __: None,
+    ):
+        self.sample_config = sample_config
+        self.destination = destination
+        self.on_sample = on_sample
+        self.on_update_progress = on_update_progress
+
+
 class BaseModelSampler(metaclass=ABCMeta):
 
     def __init__(
@@ -60,6 +83,9 @@ class BaseModelSampler(metaclass=ABCMeta):
         self.train_device = train_device
         self.temp_device = temp_device
 
+        # the sampler is reused for every sampling round of a training run, so this cache lives across rounds
+        self.prompt_embedding_cache = PromptEmbeddingCache()
+
     @abstractmethod
     def sample(
             self,
@@ -73,6 +99,148 @@ class BaseModelSampler(metaclass=ABCMeta):
     ):
         pass
 
+    def sample_batch(
+            self,
+            requests: list[SampleRequest],
+            image_format: ImageFormat | None = None,
+            video_format: VideoFormat | None = None,
+            audio_format: AudioFormat | None = None,
+            batch_size: int = 1,
+    ):
+        """
+        Samples all requests of a sampling round. This implementation samples them one at a time. Samplers that
+        support batching override it, to move each model to the train device only once per round, and to denoise
+        requests with compatible settings together in batches of up to batch_size. An error only skips the requests
+        it affects.
+        """
+        for request in requests:
+            self.run_isolated(lambda request=request: self.sample(
+                sample_config=request.sample_config,
+                destination=request.destination,
+                image_format=image_format,
+                video_format=video_format,
+                audio_format=audio_format,
+                on_sample=request.on_sample,
+                on_update_progress=request.on_update_progress,
+            ))
+
+            torch_gc()
+
+    @staticmethod
+    def run_isolated(function: Callable[[], Any]) -> Any | None:
+        """
+        Runs one part of a sampling round. Errors are printed and None is returned, so they only skip the requests
+        of that part.
+        """
+        try:
+            return function()
+        except Exception:
+            traceback.print_exc()
+            print("Error during sampling, proceeding without sampling")
+            return None
+
+    @staticmethod
+    def group_requests(
+            requests: list[SampleRequest],
+            key: Callable[[SampleConfig], Hashable | None],
+            batch_size: int,
+    ) -> list[list[int]]:
+        """
+        Groups the indices of requests with the same key into batches of at most batch_size.
+        Requests with a key of None are sampled alone.
+        """
+        groups = {}
+        batches = []
+        for i, request in enumerate(requests):
+            request_key = key(request.sample_config)
+            if request_key is None:
+                batches.append([i])
+            else:
+                groups.setdefault(request_key, []).append(i)
+
+        for group in groups.values():
+            batches.extend(group[i:i + batch_size] for i in range(0, len(group), max(1, batch_size)))
+        return batches
+
+    def cached_prompt_embeddings(
+            self,
+            keys: list[Hashable],
+            encode: Callable[[int], Any],
+            text_encoder_to: Callable[[torch.device], None],
+            train_config: TrainConfig | None,
+    ) -> list[Any]:
+        """
+        Returns the prompt embeddings for each key. encode(i) is only called for keys that are not cached, and the
+        text encoders are only moved to the train device if at least one prompt has to be encoded. Nothing is cached
+        while a text encoder or an embedding is trained. The embedding of a prompt that can't be encoded is None.
+        """
+        self.prompt_embedding_cache.set_enabled(not self.__changes_prompt_embeddings(train_config))
+
+        embeddings = [self.prompt_embedding_cache.get(key, self.train_device) for key in keys]
+        if all(embedding is not None for embedding in embeddings):
+            return embeddings
+
+        text_encoder_to(self.train_device)
+        for i, key in enumerate(keys):
+            if embeddings[i] is None:
+                # the same prompt can appear more than once in a round
+                embeddings[i] = self.prompt_embedding_cache.get(key, self.train_device)
+            if embeddings[i] is None:
+                embeddings[i] = self.run_isolated(lambda i=i: encode(i))
+                if embeddings[i] is not None:
+                    self.prompt_embedding_cache.put(key, embeddings[i])
+        text_encoder_to(self.temp_device)
+        torch_gc()
+
+        return embeddings
+
+    @staticmethod
+    def __changes_prompt_embeddings(train_config: TrainConfig | None) -> bool:
+        # output embeddings are applied to the text encoder output, so training them changes the prompt embeddings too
+        return train_config is not None and (
+            train_config.train_text_encoder_or_embedding()
+            or train_config.train_text_encoder_2_or_embedding()
+            or train_config.train_text_encoder_3_or_embedding()
+            or train_config.train_text_encoder_4_or_embedding()
+            or train_config.train_any_output_embedding()
+        )
+
+    @staticmethod
+    def create_generator(sample_config: SampleConfig, device: torch.device) -> torch.Generator:
+        generator = torch.Generator(device=device)
+        if sample_config.random_seed:
+            generator.seed()
+        else:
+            generator.manual_seed(sample_config.seed)
+        return generator
+
+    @staticmethod
+    def batch_noise(
+            generators: list[torch.Generator],
+            size: tuple[int, ...],
+            device: torch.device,
+            dtype: torch.dtype,
+    ) -> torch.Tensor:
+        # each sample is drawn from its own generator, so it doesn't depend on the other samples in the batch
+        return torch.cat([
+            torch.randn(size=(1, *size), generator=generator, device=device, dtype=dtype)
+            for generator in generators
+        ])
+
+    def finish_request(
+            self,
+            request: SampleRequest,
+            sampler_output: ModelSamplerOutput,
+            image_format: ImageFormat | None,
+            video_format: VideoFormat | None,
+            audio_format: AudioFormat | None,
+    ):
+        self.save_sampler_output(
+            sampler_output, request.destination,
+            image_format, video_format, audio_format,
+        )
+        request.on_sample(sampler_output)
+
     @staticmethod
     def quantize_resolution(resolution: int, quantization: int) -> int:
         return round(resolution / quantization) * quantization
@@ -4,7 +4,7 @@ import math
 from collections.abc import Callable
 
 from modules.model.FluxModel import FluxModel
-from modules.modelSampler.BaseModelSampler import BaseModelSampler, ModelSamplerOutput
+from modules.modelSampler.BaseModelSampler import BaseModelSampler, ModelSamplerOutput, SampleRequest
 from modules.util import factory
 from modules.util.config.SampleConfig import SampleConfig
 from modules.util.enum.AudioFormat import AudioFormat
@@ -396,6 +396,194 @@ class FluxSampler(BaseModelSampler):
                 data=image[0],
             )
 
+    @torch.no_grad()
+    def sample_batch(
+            self,
+            requests: list[SampleRequest],
+            image_format: ImageFormat | None = None,
+            video_format: VideoFormat | None = None,
+            audio_format: AudioFormat | None = None,
+            batch_size: int = 1,
+    ):
+        if self.model_type.has_conditioning_image_input():
+            super().sample_batch(requests, image_format, video_format, audio_format, batch_size)
+            return
+
+        with self.model.autocast_context:
+            # prepare all prompts. Cached prompts are not encoded again, the text encoders are moved at most once
+            def encode(i: int) -> tuple[torch.Tensor, torch.Tensor]:
+                sample_config = requests[i].sample_config
+                return self.model.encode_text(
+                    text=sample_config.prompt,
+                    train_device=self.train_device,
+                    text_encoder_1_layer_skip=sample_config.text_encoder_1_layer_skip,
+                    text_encoder_2_layer_skip=sample_config.text_encoder_2_layer_skip,
+                    text_encoder_2_sequence_length=sample_config.text_encoder_2_sequence_length,
+                    apply_attention_mask=sample_config.transformer_attention_mask,
+                )
+
+            prompt_embeddings = self.cached_prompt_embeddings(
+                keys=[(
+                    request.sample_config.prompt,
+                    request.sample_config.text_encoder_1_layer_skip,
+                    request.sample_config.text_encoder_2_layer_skip,
+                    request.sample_config.text_encoder_2_sequence_length,
+                    request.sample_config.transformer_attention_mask,
+                ) for request in requests],
+                encode=encode,
+                text_encoder_to=self.model.text_encoder_to,
+                train_config=self.model.train_config,
+            )
+
+            # requests with the same resolution, number of steps and prompt shape share a denoising loop
+            batches = self.group_requests(
+                requests,
+                key=lambda sample_config: (
+                    self.quantize_resolution(sample_config.height, 64),
+                    self.quantize_resolution(sample_config.width, 64),
+                    sample_config.diffusion_steps,
+                    sample_config.text_encoder_2_sequence_length,
+                    sample_config.transformer_attention_mask,
+                ),
+                batch_size=batch_size,
+            )
+            # requests with a prompt that couldn't be encoded are skipped
+            batches = [
+                batch for batch in ([i for i in batch if prompt_embeddings[i] is not None] for batch in batches) if batch
+            ]
+
+            # an error only skips the batch it occurs in
+            self.model.transformer_to(self.train_device)
+            latent_images = [
+                self.run_isolated(lambda batch=batch: self.__denoise_batch(
+                    [requests[i] for i in batch], [prompt_embeddings[i] for i in batch],
+                ))
+                for batch in batches
+            ]
+            self.model.transformer_to(self.temp_device)
+            torch_gc()
+
+            # decode
+            self.model.vae_to(self.train_device)
+
+            for batch, latent_image in zip(batches, latent_images, strict=True):
+                if latent_image is not None:
+                    self.run_isolated(lambda batch=batch, latent_image=latent_image: self.__decode_batch(
+                        [requests[i] for i in batch], latent_image, image_format, video_format, audio_format,
+                    ))
+
+            self.model.vae_to(self.temp_device)
+            torch_gc()
+
+    def __decode_batch(
+            self,
+            requests: list[SampleRequest],
+            latent_image: torch.Tensor,
+            image_format: ImageFormat | None,
+            video_format: VideoFormat | None,
+            audio_format: AudioFormat | None,
+    ):
+        vae = self.pipeline.vae
+        latents = (latent_image / vae.config.scaling_factor) + vae.config.shift_factor
+        images = vae.decode(latents, return_dict=False)[0]
+
+        do_denormalize = [True] * images.shape[0]
+        images = self.pipeline.image_processor.postprocess(images, output_type='pil', do_denormalize=do_denormalize)
+
+        for request, image in zip(requests, images, strict=True):
+            self.finish_request(
+                request, ModelSamplerOutput(file_type=FileType.IMAGE, data=image),
+                image_format, video_format, audio_format,
+            )
+
+    def __denoise_batch(
+            self,
+            requests: list[SampleRequest],
+            prompt_embeddings: list[tuple[torch.Tensor, torch.Tensor]],
+    ) -> torch.Tensor:
+        sample_config = requests[0].sample_config
+        height = self.quantize_resolution(sample_config.height, 64)
+        width = self.quantize_resolution(sample_config.width, 64)
+        diffusion_steps = sample_config.diffusion_steps
+
+        noise_scheduler = copy.deepcopy(self.model.noise_scheduler)
+        transformer = self.pipeline.transformer
+        vae_scale_factor = 8
+        num_latent_channels = 16
+        train_dtype = self.model.train_dtype.torch_dtype()
+
+        generators = [self.create_generator(request.sample_config, self.train_device) for request in requests]
+
+        # prepare latent image
+        latent_image = self.batch_noise(
+            generators,
+            size=(num_latent_channels, height // vae_scale_factor, width // vae_scale_factor),
+            device=self.train_device,
+            dtype=torch.float32,
+        )
+
+        image_ids = self.model.prepare_latent_image_ids(
+            height // vae_scale_factor,
+            width // vae_scale_factor,
+            self.train_device,
+            train_dtype,
+        )
+
+        shift = self.model.calculate_timestep_shift(latent_image.shape[-2], latent_image.shape[-1])
+        latent_image = self.model.pack_latents(latent_image)
+
+        # prepare timesteps
+        noise_scheduler.set_timesteps(diffusion_steps, device=self.train_device, mu=math.log(shift))
+        timesteps = noise_scheduler.timesteps
+
+        # denoising loop
+        extra_step_kwargs = {}
+        if "generator" in set(inspect.signature(noise_scheduler.step).parameters.keys()):
+            # the flow matching scheduler doesn't add noise with the default settings
+            extra_step_kwargs["generator"] = generators[0]
+
+        prompt_embedding = torch.cat([embedding for embedding, _ in prompt_embeddings]).to(dtype=train_dtype)
+        pooled_prompt_embedding = torch.cat([pooled for _, pooled in prompt_embeddings]).to(dtype=train_dtype)
+        text_ids = torch.zeros(prompt_embedding.shape[1], 3, device=self.train_device)
+
+        # each request has its own guidance scale
+        if transformer.config.guidance_embeds:
+            guidance = torch.tensor(
+                [request.sample_config.cfg_scale for request in requests], device=self.train_device, dtype=train_dtype,
+            )
+        else:
+            guidance = None
+
+        for i, timestep in enumerate(tqdm(timesteps, desc=f"sampling {len(requests)}")):
+            expanded_timestep = timestep.expand(latent_image.shape[0])
+
+            # predict the noise residual
+            noise_pred = transformer(
+                hidden_states=latent_image.to(dtype=train_dtype),
+                timestep=expanded_timestep / 1000,
+                guidance=guidance,
+                pooled_projections=pooled_prompt_embedding,
+                encoder_hidden_states=prompt_embedding,
+                txt_ids=text_ids,
+                img_ids=image_ids,
+                joint_attention_kwargs=None,
+                return_dict=True
+            ).sample
+
+            # compute the previous noisy sample x_t -> x_t-1
+            latent_image = noise_scheduler.step(
+                noise_pred, timestep, latent_image, return_dict=False, **extra_step_kwargs
+            )[0]
+
+            for request in requests:
+                request.on_update_progress(i + 1, len(timesteps))
+
+        return self.model.unpack_latents(
+            latent_image,
+            height // vae_scale_factor,
+            width // vae_scale_factor,
+        )
+
     def sample(
             self,
             sample_config: SampleConfig,
@@ -2,7 +2,7 @@ import inspect
 from collections.abc import Callable
 
 from modules.model.StableDiffusionXLModel import StableDiffusionXLModel
-from modules.modelSampler.BaseModelSampler import BaseModelSampler, ModelSamplerOutput
+from modules.modelSampler.BaseModelSampler import BaseModelSampler, ModelSamplerOutput, SampleRequest
 from modules.util import create, factory
 from modules.util.config.SampleConfig import SampleConfig
 from modules.util.enum.AudioFormat import AudioFormat
@@ -447,6 +447,216 @@ class StableDiffusionXLSampler(BaseModelSampler):
                 data=image[0],
             )
 
+    @torch.no_grad()
+    def sample_batch(
+            self,
+            requests: list[SampleRequest],
+            image_format: ImageFormat | None = None,
+            video_format: VideoFormat | None = None,
+            audio_format: AudioFormat | None = None,
+            batch_size: int = 1,
+    ):
+        if self.model_type.has_conditioning_image_input():
+            super().sample_batch(requests, image_format, video_format, audio_format, batch_size)
+            return
+
+        with self.model.autocast_context:
+            # prepare all prompts. Cached prompts are not encoded again, the text encoders are moved at most once.
+            # Negative and positive prompts are cached separately, most requests share the same negative prompt
+            texts = [
+                (text, request.sample_config)
+                for request in requests
+                for text in [request.sample_config.negative_prompt, request.sample_config.prompt]
+            ]
+
+            def encode(i: int) -> tuple[torch.Tensor, torch.Tensor]:
+                text, sample_config = texts[i]
+                return self.model.combine_text_encoder_output(*self.model.encode_text(
+                    text=text,
+                    train_device=self.train_device,
+                    text_encoder_1_layer_skip=sample_config.text_encoder_1_layer_skip,
+                    text_encoder_2_layer_skip=sample_config.text_encoder_2_layer_skip,
+                ))
+
+            text_embeddings = self.cached_prompt_embeddings(
+                keys=[(
+                    text,
+                    sample_config.text_encoder_1_layer_skip,
+                    sample_config.text_encoder_2_layer_skip,
+                ) for text, sample_config in texts],
+                encode=encode,
+                text_encoder_to=self.model.text_encoder_to,
+                train_config=self.model.train_config,
+            )
+            prompt_embeddings = [
+                (text_embeddings[i], text_embeddings[i + 1]) for i in range(0, len(text_embeddings), 2)
+            ]
+
+            # requests with the same resolution, number of steps, scheduler and timestep settings share a denoising
+            # loop. Stochastic schedulers draw new noise for the whole batch in each step, so they are not batched
+            batches = self.group_requests(
+                requests,
+                key=lambda sample_config: None if sample_config.noise_scheduler.is_stochastic() else (
+                    self.quantize_resolution(sample_config.height, 64),
+                    self.quantize_resolution(sample_config.width, 64),
+                    sample_config.diffusion_steps,
+                    sample_config.noise_scheduler,
+                    sample_config.force_last_timestep,
+                ),
+                batch_size=batch_size,
+            )
+            # requests with a prompt that couldn't be encoded are skipped
+            batches = [
+                batch for batch in ([i for i in batch if None not in prompt_embeddings[i]] for batch in batches) if batch
+            ]
+
+            # an error only skips the batch it occurs in
+            self.model.unet_to(self.train_device)
+            latent_images = [
+                self.run_isolated(lambda batch=batch: self.__denoise_batch(
+                    [requests[i] for i in batch], [prompt_embeddings[i] for i in batch],
+                ))
+                for batch in batches
+            ]
+            self.model.unet_to(self.temp_device)
+            torch_gc()
+
+            # decode
+            self.model.vae_to(self.train_device)
+
+            for batch, latent_image in zip(batches, latent_images, strict=True):
+                if latent_image is not None:
+                    self.run_isolated(lambda batch=batch, latent_image=latent_image: self.__decode_batch(
+                        [requests[i] for i in batch], latent_image, image_format, video_format, audio_format,
+                    ))
+
+            self.model.vae_to(self.temp_device)
+            torch_gc()
+
+    def __decode_batch(
+            self,
+            requests: list[SampleRequest],
+            latent_image: torch.Tensor,
+            image_format: ImageFormat | None,
+            video_format: VideoFormat | None,
+            audio_format: AudioFormat | None,
+    ):
+        vae = self.pipeline.vae
+        latent_image = latent_image.to(dtype=self.model.vae_train_dtype.torch_dtype())
+        with self.model.vae_autocast_context:
+            images = vae.decode(latent_image / vae.config.scaling_factor, return_dict=False)[0]
+
+        do_denormalize = [True] * images.shape[0]
+        images = self.pipeline.image_processor.postprocess(images, output_type='pil', do_denormalize=do_denormalize)
+
+        for request, image in zip(requests, images, strict=True):
+            self.finish_request(
+                request, ModelSamplerOutput(file_type=FileType.IMAGE, data=image),
+                image_format, video_format, audio_format,
+            )
+
+    def __denoise_batch(
+            self,
+            requests: list[SampleRequest],
+            prompt_embeddings: list[tuple[tuple[torch.Tensor, torch.Tensor], tuple[torch.Tensor, torch.Tensor]]],
+    ) -> torch.Tensor:
+        sample_config = requests[0].sample_config
+        height = self.quantize_resolution(sample_config.height, 64)
+        width = self.quantize_resolution(sample_config.width, 64)
+        diffusion_steps = sample_config.diffusion_steps
+        force_last_timestep = sample_config.force_last_timestep
+        cfg_rescale = 0.7 if force_last_timestep else 0.0
+
+        noise_scheduler = create.create_noise_scheduler(
+            sample_config.noise_scheduler, self.model.noise_scheduler, diffusion_steps,
+        )
+        unet = self.pipeline.unet
+        vae_scale_factor = self.pipeline.vae_scale_factor
+        train_dtype = self.model.train_dtype.torch_dtype()
+
+        generators = [self.create_generator(request.sample_config, self.train_device) for request in requests]
+
+        # prepare timesteps
+        noise_scheduler.set_timesteps(diffusion_steps, device=self.train_device)
+        timesteps = noise_scheduler.timesteps
+
+        if force_last_timestep:
+            last_timestep = torch.ones(1, device=self.train_device, dtype=torch.int64) \
+                            * (noise_scheduler.config.num_train_timesteps - 1)
+
+            # add the final timestep to force predicting with zero snr if it's not already here
+            if timesteps[0] != last_timestep:
+                noise_scheduler.set_timesteps(diffusion_steps + 1, device=self.train_device)
+                timesteps = torch.cat([last_timestep, timesteps])
+
+        # original size, crop coordinates and target size
+        add_time_ids = torch.tensor([height, width, 0, 0, height, width], device=self.train_device) \
+            .unsqueeze(dim=0).expand(2 * len(requests), -1)
+
+        # prepare latent image
+        latent_image = self.batch_noise(
+            generators,
+            size=(unet.config.in_channels, height // vae_scale_factor, width // vae_scale_factor),
+            device=self.train_device,
+            dtype=train_dtype,
+        ) * noise_scheduler.init_noise_sigma
+
+        # all negative prompts first, then all positive prompts
+        combined_prompt_embedding = torch.cat(
+            [negative[0] for negative, _ in prompt_embeddings] + [positive[0] for _, positive in prompt_embeddings]
+        ).to(dtype=train_dtype)
+        added_cond_kwargs = {
+            "text_embeds": torch.cat(
+                [negative[1] for negative, _ in prompt_embeddings] + [positive[1] for _, positive in prompt_embeddings]
+            ),
+            "time_ids": add_time_ids,
+        }
+
+        # each request has its own cfg scale
+        cfg_scale = torch.tensor(
+            [request.sample_config.cfg_scale for request in requests], device=self.train_device, dtype=train_dtype,
+        ).view(-1, 1, 1, 1)
+
+        # denoising loop
+        extra_step_kwargs = {}
+        if "generator" in set(inspect.signature(noise_scheduler.step).parameters.keys()):
+            extra_step_kwargs["generator"] = generators[0]
+
+        for i, timestep in enumerate(tqdm(timesteps, desc=f"sampling {len(requests)}")):
+            latent_model_input = torch.cat([latent_image] * 2)
+            latent_model_input = noise_scheduler.scale_model_input(latent_model_input, timestep)
+
+            # predict the noise residual
+            noise_pred = unet(
+                sample=latent_model_input,
+                timestep=timestep,
+                encoder_hidden_states=combined_prompt_embedding,
+                added_cond_kwargs=added_cond_kwargs,
+            )[0]
+
+            # cfg
+            noise_pred_negative, noise_pred_positive = noise_pred.chunk(2)
+            noise_pred = noise_pred_negative + cfg_scale * (noise_pred_positive - noise_pred_negative)
+
+            if cfg_rescale > 0.0:
+                # From: Common Diffusion Noise Schedules and Sample Steps are Flawed (https://arxiv.org/abs/2305.08891)
+                std_positive = noise_pred_positive.std(dim=list(range(1, noise_pred_positive.ndim)), keepdim=True)
+                std_pred = noise_pred.std(dim=list(range(1, noise_pred.ndim)), keepdim=True)
+                noise_pred_rescaled = noise_pred * (std_positive / std_pred)
+                noise_pred = (
+                        cfg_rescale * noise_pred_rescaled + (1 - cfg_rescale) * noise_pred
+                )
+
+            # compute the previous noisy sample x_t -> x_t-1
+            latent_image = noise_scheduler.step(
+                noise_pred, timestep, latent_image, return_dict=False, **extra_step_kwargs
+            )[0]
+
+            for request in requests:
+                request.on_update_progress(i + 1, len(timesteps))
+
+        return latent_image
+
     def sample(
             self,
             sample_config: SampleConfig,
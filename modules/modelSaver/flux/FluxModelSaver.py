@@ -1,4 +1,3 @@
-import copy
 import os.path
 from pathlib import Path
 
@@ -11,8 +10,6 @@ import torch
 
 from transformers import T5EncoderModel
 
-from safetensors.torch import save_file
-
 
 class FluxModelSaver(
     DtypeModelSaverMixin,
@@ -35,8 +32,7 @@ class FluxModelSaver(
             tokenizer_2 = pipeline.tokenizer_2
             tokenizer_2.__deepcopy__ = lambda memo: tokenizer_2
 
-            save_pipeline = copy.deepcopy(pipeline)
-            save_pipeline.to(device="cpu", dtype=dtype, silence_dtype_warnings=True)
+            save_pipeline = self._copy_to_dtype(pipeline, dtype)
 
             delattr(tokenizer_2, '__deepcopy__')
         else:
@@ -77,12 +73,9 @@ class FluxModelSaver(
         state_dict = convert_flux_diffusers_to_ckpt(
             model.transformer.state_dict(),
         )
-        save_state_dict = self._convert_state_dict_dtype(state_dict, dtype)
-        self._convert_state_dict_to_contiguous(save_state_dict)
-
         os.makedirs(Path(destination).parent.absolute(), exist_ok=True)
 
-        save_file(save_state_dict, destination, self._create_safetensors_header(model, save_state_dict))
+        self._save_safetensors_file(model, state_dict, destination, dtype)
 
     def __save_internal(
             self,
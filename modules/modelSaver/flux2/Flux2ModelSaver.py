@@ -1,4 +1,3 @@
-import copy
 import os.path
 from pathlib import Path
 
@@ -9,8 +8,6 @@ from modules.util.enum.ModelFormat import ModelFormat
 
 import torch
 
-from safetensors.torch import save_file
-
 
 class Flux2ModelSaver(
     DtypeModelSaverMixin,
@@ -33,8 +30,7 @@ class Flux2ModelSaver(
             tokenizer = pipeline.tokenizer
             tokenizer.__deepcopy__ = lambda memo: tokenizer
 
-            save_pipeline = copy.deepcopy(pipeline)
-            save_pipeline.to(device="cpu", dtype=dtype, silence_dtype_warnings=True)
+            save_pipeline = self._copy_to_dtype(pipeline, dtype)
 
             delattr(tokenizer, '__deepcopy__')
         else:
@@ -55,12 +51,9 @@ class Flux2ModelSaver(
         state_dict = model.transformer.state_dict()
         state_dict = convert(state_dict, diffusers_checkpoint_to_original)
 
-        save_state_dict = self._convert_state_dict_dtype(state_dict, dtype)
-        self._convert_state_dict_to_contiguous(save_state_dict)
-
         os.makedirs(Path(destination).parent.absolute(), exist_ok=True)
 
-        save_file(save_state_dict, destination, self._create_safetensors_header(model, save_state_dict))
+        self._save_safetensors_file(model, state_dict, destination, dtype)
 
     def __save_internal(
             self,
@@ -1,4 +1,3 @@
-import copy
 import os.path
 from pathlib import Path
 
@@ -8,8 +7,6 @@ from modules.util.enum.ModelFormat import ModelFormat
 
 import torch
 
-from safetensors.torch import save_file
-
 
 class HiDreamModelSaver(
     DtypeModelSaverMixin,
@@ -34,8 +31,7 @@ class HiDreamModelSaver(
             tokenizer_4 = pipeline.tokenizer_4
             tokenizer_4.__deepcopy__ = lambda memo: tokenizer_4
 
-            save_pipeline = copy.deepcopy(pipeline)
-            save_pipeline.to(device="cpu", dtype=dtype, silence_dtype_warnings=True)
+            save_pipeline = self._copy_to_dtype(pipeline, dtype)
 
             delattr(tokenizer_3, '__deepcopy__')
             delattr(tokenizer_4, '__deepcopy__')
@@ -55,12 +51,9 @@ class HiDreamModelSaver(
             dtype: torch.dtype | None,
     ):
         state_dict = model.transformer.state_dict()
-        save_state_dict = self._convert_state_dict_dtype(state_dict, dtype)
-        self._convert_state_dict_to_contiguous(save_state_dict)
-
         os.makedirs(Path(destination).parent.absolute(), exist_ok=True)
 
-        save_file(save_state_dict, destination, self._create_safetensors_header(model, save_state_dict))
+        self._save_safetensors_file(model, state_dict, destination, dtype)
 
     def __save_internal(
             self,
@@ -1,48 +1,49 @@
 import copy
-import hashlib
+import itertools
 import json
-from collections import OrderedDict
 from datetime import datetime
+from typing import Any
 
 from modules.model.BaseModel import BaseModel
-from modules.util import git_util
+from modules.util import git_util, safetensors_util
 from modules.util.enum.ConfigPart import ConfigPart
+from modules.util.enum.ModelHashMode import ModelHashMode
 from modules.util.modelSpec.ModelSpec import ModelSpec
 
 import torch
-from torch import Tensor
-
-import safetensors.torch as safetensors
+from torch import Tensor, nn
 
 
 class DtypeModelSaverMixin:
     def __init__(self):
         super().__init__()
 
-    def _convert_state_dict_dtype(
+    def _copy_to_dtype(
             self,
-            state_dict: dict,
+            obj: Any,
             dtype: torch.dtype | None,
-    ) -> dict:
-        converted_state_dict = {}
+    ) -> Any:
+        """
+        Deep copies a module or pipeline to the cpu. Floating point parameters and buffers are converted to dtype while
+        they are copied, so no intermediate copy in the original dtype is created.
+        """
+        if isinstance(obj, nn.Module):
+            modules = [obj]
+        else:
+            modules = [component for component in obj.components.values() if isinstance(component, nn.Module)]
 
-        for (key, value) in state_dict.items():
-            if isinstance(value, dict):
-                converted_state_dict[key] = self._convert_state_dict_dtype(value, dtype)
-            else:
-                converted_state_dict[key] = value.to(device='cpu', dtype=dtype)
+        memo = {}
+        for module in modules:
+            for tensor in itertools.chain(module.parameters(), module.buffers()):
+                if id(tensor) in memo:
+                    continue
 
-        return converted_state_dict
+                converted = tensor.detach().to(device="cpu", dtype=dtype if tensor.is_floating_point() else None)
+                if isinstance(tensor, nn.Parameter):
+                    converted = nn.Parameter(converted, requires_grad=tensor.requires_grad)
+                memo[id(tensor)] = converted
 
-    def _convert_state_dict_to_contiguous(
-            self,
-            state_dict: dict,
-    ):
-        for (key, value) in state_dict.items():
-            if isinstance(value, dict):
-                self._convert_state_dict_to_contiguous(value)
-            else:
-                state_dict[key] = value.contiguous()
+        return copy.deepcopy(obj, memo)
 
     def __calculate_safetensors_hash(
             self,
@@ -51,14 +52,7 @@ class DtypeModelSaverMixin:
         if state_dict is None:
             return None
 
-        sha256_hash = hashlib.sha256()
-
-        ordered_state_dict = OrderedDict(sorted(state_dict.items()))
-        for key, tensor in ordered_state_dict.items():
-            data = safetensors._tobytes(tensor, key)
-            sha256_hash.update(data)
-
-        return f"0x{sha256_hash.hexdigest()}"
+        return safetensors_util.calculate_hash(state_dict, ModelHashMode.SHA256)
 
     def _create_safetensors_header(
             self,
@@ -93,3 +87,21 @@ class DtypeModelSaverMixin:
         elif model.model_type.is_sd_v2():
             kohya_header["ss_v2"] = "True"
         return model_spec_dict | one_trainer_header | kohya_header
+
+    def _save_safetensors_file(
+            self,
+            model: BaseModel,
+            state_dict: dict[str, Tensor],
+            destination: str,
+            dtype: torch.dtype | None = None,
+    ):
+        # Tensors are converted to dtype and moved to the cpu one at a time while the file is written, instead of
+        # creating a converted copy of the whole state dict. The hash is also calculated while writing.
+        hash_mode = model.train_config.output_model_hash if model.train_config is not None else ModelHashMode.SHA256
+        safetensors_util.save_file(
+            state_dict,
+            destination,
+            self._create_safetensors_header(model),
+            dtype=dtype,
+            hash_mode=hash_mode,
+        )
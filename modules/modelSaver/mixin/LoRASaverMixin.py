@@ -14,8 +14,6 @@ from modules.util.enum.ModelFormat import ModelFormat
 import torch
 from torch import Tensor
 
-from safetensors.torch import save_file
-
 
 class LoRASaverMixin(
     DtypeModelSaverMixin,
@@ -42,14 +40,13 @@ class LoRASaverMixin(
             dtype: torch.dtype | None,
     ):
         state_dict = self._get_state_dict(model)
-        save_state_dict = self._convert_state_dict_dtype(state_dict, dtype)
 
         key_sets = self._get_convert_key_sets(model)
         if key_sets is not None:
-            save_state_dict = convert_to_omi(save_state_dict, key_sets)
+            state_dict = convert_to_omi(state_dict, key_sets)
 
         os.makedirs(Path(destination).parent.absolute(), exist_ok=True)
-        save_file(save_state_dict, destination, self._create_safetensors_header(model, save_state_dict))
+        self._save_safetensors_file(model, state_dict, destination, dtype)
 
     def __save_legacy_safetensors(
             self,
@@ -58,14 +55,13 @@ class LoRASaverMixin(
             dtype: torch.dtype | None,
     ):
         state_dict = self._get_state_dict(model)
-        save_state_dict = self._convert_state_dict_dtype(state_dict, dtype)
 
         key_sets = self._get_convert_key_sets(model)
         if key_sets is not None:
-            save_state_dict = convert_to_legacy_diffusers(save_state_dict, key_sets)
+            state_dict = convert_to_legacy_diffusers(state_dict, key_sets)
 
         os.makedirs(Path(destination).parent.absolute(), exist_ok=True)
-        save_file(save_state_dict, destination, self._create_safetensors_header(model, save_state_dict))
+        self._save_safetensors_file(model, state_dict, destination, dtype)
 
     def __save_internal(
             self,
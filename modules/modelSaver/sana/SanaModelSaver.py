@@ -1,4 +1,3 @@
-import copy
 import os.path
 from pathlib import Path
 
@@ -31,8 +30,7 @@ class SanaModelSaver(
             tokenizer = pipeline.tokenizer
             tokenizer.__deepcopy__ = lambda memo: tokenizer
 
-            save_pipeline = copy.deepcopy(pipeline)
-            save_pipeline.to(device="cpu", dtype=dtype, silence_dtype_warnings=True)
+            save_pipeline = self._copy_to_dtype(pipeline, dtype)
 
             delattr(tokenizer, '__deepcopy__')
         else:
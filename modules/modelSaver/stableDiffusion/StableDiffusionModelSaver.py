@@ -1,4 +1,3 @@
-import copy
 import os.path
 from pathlib import Path
 
@@ -11,7 +10,6 @@ from modules.util.enum.ModelType import ModelType
 import torch
 
 import yaml
-from safetensors.torch import save_file
 
 
 class StableDiffusionModelSaver(
@@ -30,11 +28,7 @@ class StableDiffusionModelSaver(
         pipeline = model.create_pipeline()
         pipeline.to("cpu")
 
-        if dtype is not None:
-            save_pipeline = copy.deepcopy(pipeline)
-            save_pipeline.to(device="cpu", dtype=dtype, silence_dtype_warnings=True)
-        else:
-            save_pipeline = pipeline
+        save_pipeline = self._copy_to_dtype(pipeline, dtype) if dtype is not None else pipeline
 
         os.makedirs(Path(destination).absolute(), exist_ok=True)
         save_pipeline.save_pretrained(destination)
@@ -56,12 +50,9 @@ class StableDiffusionModelSaver(
             model.text_encoder.state_dict(),
             model.noise_scheduler
         )
-        save_state_dict = self._convert_state_dict_dtype(state_dict, dtype)
-        self._convert_state_dict_to_contiguous(save_state_dict)
-
         os.makedirs(Path(destination).parent.absolute(), exist_ok=True)
 
-        save_file(save_state_dict, destination, self._create_safetensors_header(model, save_state_dict))
+        self._save_safetensors_file(model, state_dict, destination, dtype)
 
         yaml_name = os.path.splitext(destination)[0] + '.yaml'
         with open(yaml_name, 'w', encoding='utf8') as f:
@@ -1,4 +1,3 @@
-import copy
 import os.path
 from pathlib import Path
 
@@ -9,8 +8,6 @@ from modules.util.enum.ModelFormat import ModelFormat
 
 import torch
 
-from safetensors.torch import save_file
-
 
 class WuerstchenModelSaver(
     DtypeModelSaverMixin,
@@ -28,11 +25,9 @@ class WuerstchenModelSaver(
         pipeline = model.create_pipeline().prior_pipe
         original_device = pipeline.device
         pipeline.to("cpu")
-        pipeline_copy = copy.deepcopy(pipeline)
+        pipeline_copy = self._copy_to_dtype(pipeline, dtype)
         pipeline.to(original_device)
 
-        pipeline_copy.to("cpu", dtype, silence_dtype_warnings=True)
-
         os.makedirs(Path(destination).absolute(), exist_ok=True)
         pipeline_copy.save_pretrained(destination)
 
@@ -50,22 +45,10 @@ class WuerstchenModelSaver(
             unet_state_dict = convert_stable_cascade_diffusers_to_ckpt(
                 model.prior_prior.state_dict(),
             )
-            unet_save_state_dict = self._convert_state_dict_dtype(unet_state_dict, dtype)
-            self._convert_state_dict_to_contiguous(unet_save_state_dict)
-            save_file(
-                unet_save_state_dict,
-                os.path.join(destination, "stage_c.safetensors"),
-                self._create_safetensors_header(model, unet_save_state_dict)
-            )
+            self._save_safetensors_file(model, unet_state_dict, os.path.join(destination, "stage_c.safetensors"), dtype)
 
             te_state_dict = model.prior_text_encoder.state_dict()
-            te_save_state_dict = self._convert_state_dict_dtype(te_state_dict, dtype)
-            self._convert_state_dict_to_contiguous(te_save_state_dict)
-            save_file(
-                te_save_state_dict,
-                os.path.join(destination, "text_encoder.safetensors"),
-                self._create_safetensors_header(model, te_save_state_dict)
-            )
+            self._save_safetensors_file(model, te_state_dict, os.path.join(destination, "text_encoder.safetensors"), dtype)
         else:
             raise NotImplementedError
 
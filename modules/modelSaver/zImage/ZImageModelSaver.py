@@ -1,4 +1,3 @@
-import copy
 import os.path
 from pathlib import Path
 
@@ -8,8 +7,6 @@ from modules.util.enum.ModelFormat import ModelFormat
 
 import torch
 
-from safetensors.torch import save_file
-
 
 class ZImageModelSaver(
     DtypeModelSaverMixin,
@@ -33,8 +30,7 @@ class ZImageModelSaver(
             tokenizer = pipeline.tokenizer
             tokenizer.__deepcopy__ = lambda memo: tokenizer
 
-            save_pipeline = copy.deepcopy(pipeline)
-            save_pipeline.to(device="cpu", dtype=dtype, silence_dtype_warnings=True)
+            save_pipeline = self._copy_to_dtype(pipeline, dtype)
 
             delattr(tokenizer, '__deepcopy__')
         else:
@@ -53,14 +49,11 @@ class ZImageModelSaver(
             dtype: torch.dtype | None,
     ):
         state_dict = model.transformer.state_dict()
-        save_state_dict = self._convert_state_dict_dtype(state_dict, dtype)
-        self._convert_state_dict_to_contiguous(save_state_dict)
-
         os.makedirs(Path(destination).parent.absolute(), exist_ok=True)
 
         print("Warning: Comfy can only load their own incompatible format of Z-Image full finetunes. To use this file in Comfy, it can be converted using https://huggingface.co/Comfy-Org/z_image_turbo/resolve/main/z_image_convert_original_to_comfy.py")
 
-        save_file(save_state_dict, destination, self._create_safetensors_header(model, save_state_dict))
+        self._save_safetensors_file(model, state_dict, destination, dtype)
 
     def __save_internal(
             self,
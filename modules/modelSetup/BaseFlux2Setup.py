@@ -18,6 +18,7 @@ from modules.util.checkpointing_util import (
 from modules.util.config.TrainConfig import TrainConfig
 from modules.util.dtype_util import create_autocast_context, disable_fp16_autocast_context
 from modules.util.enum.TrainingMethod import TrainingMethod
+from modules.util.PredictionPlan import PredictionPlan
 from modules.util.quantization_util import quantize_layers
 from modules.util.torch_util import torch_gc
 from modules.util.TrainProgress import TrainProgress
@@ -94,12 +95,13 @@ class BaseFlux2Setup(
             train_progress: TrainProgress,
             *,
             deterministic: bool = False,
+            plan: PredictionPlan | None = None,
     ) -> dict:
         with model.autocast_context:
             batch_seed = 0 if deterministic else train_progress.global_step * multi.world_size() + multi.rank()
             generator = torch.Generator(device=config.train_device)
             generator.manual_seed(batch_seed)
-            rand = Random(batch_seed)
+            rand = Random(batch_seed) if plan is None else plan.random(batch_seed)
 
             text_encoder_output = model.encode_text(
                 train_device=self.train_device,
@@ -116,7 +118,7 @@ class BaseFlux2Setup(
             latent_width = latent_image.shape[-1]
             scaled_latent_image = model.scale_latents(latent_image)
 
-            latent_noise = self._create_noise(scaled_latent_image, config, generator)
+            latent_noise = self._create_noise(scaled_latent_image, config, generator, plan=plan)
 
             shift = model.calculate_timestep_shift(latent_height, latent_width)
             timestep = self._get_timestep_discrete(
@@ -126,6 +128,7 @@ class BaseFlux2Setup(
                 scaled_latent_image.shape[0],
                 config,
                 shift = shift if config.dynamic_timestep_shifting else config.timestep_shift,
+                plan=plan,
             )
 
             scaled_noisy_latent_image, sigma = self._add_noise_discrete(
@@ -191,14 +194,17 @@ class BaseFlux2Setup(
             batch: dict,
             data: dict,
             config: TrainConfig,
+            *,
+            per_sample: bool = False,
     ) -> Tensor:
-        return self._flow_matching_losses(
+        losses = self._flow_matching_losses(
             batch=batch,
             data=data,
             config=config,
             train_device=self.train_device,
             sigmas=model.noise_scheduler.sigmas,
-        ).mean()
+        )
+        return losses if per_sample else losses.mean()
 
     def prepare_text_caching(self, model: FluxModel, config: TrainConfig):
         model.to(self.temp_device)
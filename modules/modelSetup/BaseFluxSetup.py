@@ -20,6 +20,7 @@ from modules.util.config.TrainConfig import TrainConfig
 from modules.util.conv_util import apply_circular_padding_to_conv2d
 from modules.util.dtype_util import create_autocast_context, disable_fp16_autocast_context
 from modules.util.enum.TrainingMethod import TrainingMethod
+from modules.util.PredictionPlan import PredictionPlan
 from modules.util.quantization_util import quantize_layers
 from modules.util.torch_util import torch_gc
 from modules.util.TrainProgress import TrainProgress
@@ -209,12 +210,13 @@ class BaseFluxSetup(
             train_progress: TrainProgress,
             *,
             deterministic: bool = False,
+            plan: PredictionPlan | None = None,
     ) -> dict:
         with model.autocast_context:
             batch_seed = 0 if deterministic else train_progress.global_step * multi.world_size() + multi.rank()
             generator = torch.Generator(device=config.train_device)
             generator.manual_seed(batch_seed)
-            rand = Random(batch_seed)
+            rand = Random(batch_seed) if plan is None else plan.random(batch_seed)
 
             vae_scaling_factor = model.vae.config['scaling_factor']
             vae_shift_factor = model.vae.config['shift_factor']
@@ -246,7 +248,7 @@ class BaseFluxSetup(
                 scaled_latent_conditioning_image = \
                     (batch['latent_conditioning_image'] - vae_shift_factor) * vae_scaling_factor
 
-            latent_noise = self._create_noise(scaled_latent_image, config, generator)
+            latent_noise = self._create_noise(scaled_latent_image, config, generator, plan=plan)
 
             shift = model.calculate_timestep_shift(scaled_latent_image.shape[-2], scaled_latent_image.shape[-1])
             timestep = self._get_timestep_discrete(
@@ -256,6 +258,7 @@ class BaseFluxSetup(
                 scaled_latent_image.shape[0],
                 config,
                 shift = shift if config.dynamic_timestep_shifting else config.timestep_shift,
+                plan=plan,
             )
 
             scaled_noisy_latent_image, sigma = self._add_noise_discrete(
@@ -336,14 +339,17 @@ class BaseFluxSetup(
             batch: dict,
             data: dict,
             config: TrainConfig,
+            *,
+            per_sample: bool = False,
     ) -> Tensor:
-        return self._flow_matching_losses(
+        losses = self._flow_matching_losses(
             batch=batch,
             data=data,
             config=config,
             train_device=self.train_device,
             sigmas=model.noise_scheduler.sigmas,
-        ).mean()
+        )
+        return losses if per_sample else losses.mean()
 
     def prepare_text_caching(self, model: FluxModel, config: TrainConfig):
         model.to(self.temp_device)
@@ -19,6 +19,7 @@ from modules.util.checkpointing_util import (
 from modules.util.config.TrainConfig import TrainConfig
 from modules.util.dtype_util import create_autocast_context, disable_fp16_autocast_context
 from modules.util.enum.TrainingMethod import TrainingMethod
+from modules.util.PredictionPlan import PredictionPlan
 from modules.util.quantization_util import quantize_layers
 from modules.util.torch_util import torch_gc
 from modules.util.TrainProgress import TrainProgress
@@ -295,12 +296,13 @@ class BaseHiDreamSetup(
             train_progress: TrainProgress,
             *,
             deterministic: bool = False,
+            plan: PredictionPlan | None = None,
     ) -> dict:
         with model.autocast_context:
             batch_seed = 0 if deterministic else train_progress.global_step
             generator = torch.Generator(device=config.train_device)
             generator.manual_seed(batch_seed)
-            rand = Random(batch_seed)
+            rand = Random(batch_seed) if plan is None else plan.random(batch_seed)
 
             vae_scaling_factor = model.vae.config['scaling_factor']
             vae_shift_factor = model.vae.config['shift_factor']
@@ -340,7 +342,7 @@ class BaseHiDreamSetup(
                 scaled_latent_conditioning_image = \
                     (batch['latent_conditioning_image'] - vae_shift_factor) * vae_scaling_factor
 
-            latent_noise = self._create_noise(scaled_latent_image, config, generator)
+            latent_noise = self._create_noise(scaled_latent_image, config, generator, plan=plan)
 
             timestep = self._get_timestep_discrete(
                 model.noise_scheduler.config['num_train_timesteps'],
@@ -348,6 +350,7 @@ class BaseHiDreamSetup(
                 generator,
                 scaled_latent_image.shape[0],
                 config,
+                plan=plan,
             )
 
             scaled_noisy_latent_image, sigma = self._add_noise_discrete(
@@ -422,14 +425,17 @@ class BaseHiDreamSetup(
             batch: dict,
             data: dict,
             config: TrainConfig,
+            *,
+            per_sample: bool = False,
     ) -> Tensor:
-        return self._flow_matching_losses(
+        losses = self._flow_matching_losses(
             batch=batch,
             data=data,
             config=config,
             train_device=self.train_device,
             sigmas=model.noise_scheduler.sigmas,
-        ).mean()
+        )
+        return losses if per_sample else losses.mean()
 
     def prepare_text_caching(self, model: HiDreamModel, config: TrainConfig):
         model.to(self.temp_device)
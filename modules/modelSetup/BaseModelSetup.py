@@ -6,6 +6,7 @@ from modules.util.config.TrainConfig import TrainConfig, TrainEmbeddingConfig, T
 from modules.util.enum.TrainingMethod import TrainingMethod
 from modules.util.ModuleFilter import ModuleFilter
 from modules.util.NamedParameterGroup import NamedParameterGroup, NamedParameterGroupCollection
+from modules.util.PredictionPlan import PredictionPlan
 from modules.util.TimedActionMixin import TimedActionMixin
 from modules.util.TrainProgress import TrainProgress
 
@@ -73,6 +74,7 @@ class BaseModelSetup(
             train_progress: TrainProgress,
             *,
             deterministic: bool = False,
+            plan: PredictionPlan | None = None,
     ) -> dict:
         pass
 
@@ -83,6 +85,8 @@ class BaseModelSetup(
             batch: dict,
             data: dict,
             config: TrainConfig,
+            *,
+            per_sample: bool = False,
     ) -> Tensor:
         pass
 
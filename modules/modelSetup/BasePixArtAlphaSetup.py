@@ -19,6 +19,7 @@ from modules.util.config.TrainConfig import TrainConfig
 from modules.util.conv_util import apply_circular_padding_to_conv2d
 from modules.util.dtype_util import create_autocast_context, disable_fp16_autocast_context
 from modules.util.enum.TrainingMethod import TrainingMethod
+from modules.util.PredictionPlan import PredictionPlan
 from modules.util.quantization_util import quantize_layers
 from modules.util.torch_util import torch_gc
 from modules.util.TrainProgress import TrainProgress
@@ -164,12 +165,13 @@ class BasePixArtAlphaSetup(
             train_progress: TrainProgress,
             *,
             deterministic: bool = False,
+            plan: PredictionPlan | None = None,
     ) -> dict:
         with model.autocast_context:
             batch_seed = 0 if deterministic else train_progress.global_step * multi.world_size() + multi.rank()
             generator = torch.Generator(device=config.train_device)
             generator.manual_seed(batch_seed)
-            rand = Random(batch_seed)
+            rand = Random(batch_seed) if plan is None else plan.random(batch_seed)
 
             vae_scaling_factor = model.vae.config['scaling_factor']
 
@@ -192,7 +194,7 @@ class BasePixArtAlphaSetup(
             if config.model_type.has_conditioning_image_input():
                 scaled_latent_conditioning_image = batch['latent_conditioning_image'] * vae_scaling_factor
 
-            latent_noise = self._create_noise(scaled_latent_image, config, generator)
+            latent_noise = self._create_noise(scaled_latent_image, config, generator, plan=plan)
 
             timestep = self._get_timestep_discrete(
                 model.noise_scheduler.config['num_train_timesteps'],
@@ -200,6 +202,7 @@ class BasePixArtAlphaSetup(
                 generator,
                 scaled_latent_image.shape[0],
                 config,
+                plan=plan,
             )
 
             scaled_noisy_latent_image = self._add_noise_discrete(
@@ -337,14 +340,17 @@ class BasePixArtAlphaSetup(
             batch: dict,
             data: dict,
             config: TrainConfig,
+            *,
+            per_sample: bool = False,
     ) -> Tensor:
-        return self._diffusion_losses(
+        losses = self._diffusion_losses(
             batch=batch,
             data=data,
             config=config,
             train_device=self.train_device,
             betas=model.noise_scheduler.betas,
-        ).mean()
+        )
+        return losses if per_sample else losses.mean()
 
     def prepare_text_caching(self, model: PixArtAlphaModel, config: TrainConfig):
         model.to(self.temp_device)
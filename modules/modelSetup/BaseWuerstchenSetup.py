@@ -23,6 +23,7 @@ from modules.util.dtype_util import (
     disable_fp16_autocast_context,
 )
 from modules.util.enum.TrainingMethod import TrainingMethod
+from modules.util.PredictionPlan import PredictionPlan
 from modules.util.quantization_util import quantize_layers
 from modules.util.torch_util import torch_gc
 from modules.util.TrainProgress import TrainProgress
@@ -202,6 +203,7 @@ class BaseWuerstchenSetup(
             train_progress: TrainProgress,
             *,
             deterministic: bool = False,
+            plan: PredictionPlan | None = None,
     ) -> dict:
         with model.autocast_context:
             latent_image = batch['latent_image']
@@ -213,15 +215,16 @@ class BaseWuerstchenSetup(
             batch_seed = 0 if deterministic else train_progress.global_step * multi.world_size() + multi.rank()
             generator = torch.Generator(device=config.train_device)
             generator.manual_seed(batch_seed)
-            rand = Random(batch_seed)
+            rand = Random(batch_seed) if plan is None else plan.random(batch_seed)
 
-            latent_noise = self._create_noise(scaled_latent_image, config, generator)
+            latent_noise = self._create_noise(scaled_latent_image, config, generator, plan=plan)
 
             timestep = self._get_timestep_continuous(
                 deterministic,
                 generator,
                 scaled_latent_image.shape[0],
                 config,
+                plan=plan,
             )
 
             if model.model_type.is_wuerstchen_v2():
@@ -352,14 +355,17 @@ class BaseWuerstchenSetup(
             batch: dict,
             data: dict,
             config: TrainConfig,
+            *,
+            per_sample: bool = False,
     ) -> Tensor:
-        return self._diffusion_losses(
+        losses = self._diffusion_losses(
             batch=batch,
             data=data,
             config=config,
             train_device=self.train_device,
             alphas_cumprod_fun=self.__alpha_cumprod,
-        ).mean()
+        )
+        return losses if per_sample else losses.mean()
 
     def prepare_text_caching(self, model: WuerstchenModel, config: TrainConfig):
         model.to(self.temp_device)
@@ -7,6 +7,7 @@ from modules.util.enum.ModelType import ModelType
 from modules.util.enum.TrainingMethod import TrainingMethod
 from modules.util.NamedParameterGroup import NamedParameterGroup, NamedParameterGroupCollection
 from modules.util.optimizer_util import init_model_parameters
+from modules.util.PredictionPlan import PredictionPlan
 from modules.util.TrainProgress import TrainProgress
 
 import torch
@@ -77,6 +78,7 @@ class StableDiffusionFineTuneVaeSetup(
             train_progress: TrainProgress,
             *,
             deterministic: bool = False,
+            plan: PredictionPlan | None = None,
     ) -> dict:
         latent_image = batch['latent_image']
         image = batch['image']
@@ -4,11 +4,11 @@ from collections.abc import Callable
 from modules.util.config.TrainConfig import TrainConfig
 from modules.util.DiffusionScheduleCoefficients import DiffusionScheduleCoefficients
 from modules.util.enum.LossWeight import LossWeight
-from modules.util.loss.masked_loss import masked_losses, masked_losses_with_prior
+from modules.util.loss.fused_loss import compiled_fused_losses, fused_losses
+from modules.util.loss.masked_loss import masked_losses
 from modules.util.loss.vb_loss import vb_losses
 
 import torch
-import torch.nn.functional as F
 from torch import Tensor
 
 
@@ -23,14 +23,28 @@ class ModelSetupDiffusionLossMixin(metaclass=ABCMeta):
         self.__alphas_cumprod_fun = None
         self.__sigmas = None
 
-    def __log_cosh_loss(
-            self,
-            pred: torch.Tensor,
-            target: torch.Tensor,
+    @staticmethod
+    def __fused_losses(
+            batch: dict,
+            data: dict,
+            config: TrainConfig,
+            masked: bool,
     ) -> Tensor:
-        diff = pred - target
-        loss = diff + torch.nn.functional.softplus(-2.0*diff) - torch.log(torch.full(size=diff.size(), fill_value=2.0, dtype=torch.float32, device=diff.device))
-        return loss
+        fused_losses_fn = compiled_fused_losses() if config.compile else fused_losses
+        return fused_losses_fn(
+            predicted=data['predicted'],
+            target=data['target'],
+            prior_target=data.get('prior_target') if masked else None,
+            mask=batch['latent_mask'] if masked else None,
+            mse_strength=config.mse_strength,
+            mae_strength=config.mae_strength,
+            log_cosh_strength=config.log_cosh_strength,
+            huber_strength=config.huber_strength,
+            huber_delta=config.huber_delta,
+            unmasked_weight=config.unmasked_weight,
+            normalize_masked_area_loss=config.normalize_masked_area_loss,
+            masked_prior_preservation_weight=config.masked_prior_preservation_weight,
+        )
 
     def __masked_losses(
             self,
@@ -42,81 +56,10 @@ class ModelSetupDiffusionLossMixin(metaclass=ABCMeta):
 
         mean_dim = list(range(1, data['predicted'].ndim))
 
-        # MSE/L2 Loss
-        if config.mse_strength != 0:
-            losses += masked_losses_with_prior(
-                losses=F.mse_loss(
-                    data['predicted'].to(dtype=torch.float32),
-                    data['target'].to(dtype=torch.float32),
-                    reduction='none'
-                ),
-                prior_losses=F.mse_loss(
-                    data['predicted'].to(dtype=torch.float32),
-                    data['prior_target'].to(dtype=torch.float32),
-                    reduction='none'
-                ) if 'prior_target' in data else None,
-                mask=batch['latent_mask'].to(dtype=torch.float32),
-                unmasked_weight=config.unmasked_weight,
-                normalize_masked_area_loss=config.normalize_masked_area_loss,
-                masked_prior_preservation_weight=config.masked_prior_preservation_weight,
-            ).mean(mean_dim) * config.mse_strength
-
-        # MAE/L1 Loss
-        if config.mae_strength != 0:
-            losses += masked_losses_with_prior(
-                losses=F.l1_loss(
-                    data['predicted'].to(dtype=torch.float32),
-                    data['target'].to(dtype=torch.float32),
-                    reduction='none'
-                ),
-                prior_losses=F.l1_loss(
-                    data['predicted'].to(dtype=torch.float32),
-                    data['prior_target'].to(dtype=torch.float32),
-                    reduction='none'
-                ) if 'prior_target' in data else None,
-                mask=batch['latent_mask'].to(dtype=torch.float32),
-                unmasked_weight=config.unmasked_weight,
-                normalize_masked_area_loss=config.normalize_masked_area_loss,
-                masked_prior_preservation_weight=config.masked_prior_preservation_weight,
-            ).mean(mean_dim) * config.mae_strength
-
-        # log-cosh Loss
-        if config.log_cosh_strength != 0:
-            losses += masked_losses_with_prior(
-                losses=self.__log_cosh_loss(
-                    data['predicted'].to(dtype=torch.float32),
-                    data['target'].to(dtype=torch.float32)
-                ),
-                prior_losses=self.__log_cosh_loss(
-                    data['predicted'].to(dtype=torch.float32),
-                    data['prior_target'].to(dtype=torch.float32)
-                ) if 'prior_target' in data else None,
-                mask=batch['latent_mask'].to(dtype=torch.float32),
-                unmasked_weight=config.unmasked_weight,
-                normalize_masked_area_loss=config.normalize_masked_area_loss,
-                masked_prior_preservation_weight=config.masked_prior_preservation_weight,
-            ).mean(mean_dim) * config.log_cosh_strength
-
-        # Huber Loss
-        if config.huber_strength != 0:
-            losses += masked_losses_with_prior(
-                losses=F.huber_loss(
-                    data['predicted'].to(dtype=torch.float32),
-                    data['target'].to(dtype=torch.float32),
-                    reduction='none',
-                    delta=config.huber_delta,
-                ),
-                prior_losses=F.huber_loss(
-                    data['predicted'].to(dtype=torch.float32),
-                    data['prior_target'].to(dtype=torch.float32),
-                    reduction='none',
-                    delta=config.huber_delta,
-                ) if 'prior_target' in data else None,
-                mask=batch['latent_mask'].to(dtype=torch.float32),
-                unmasked_weight=config.unmasked_weight,
-                normalize_masked_area_loss=config.normalize_masked_area_loss,
-                masked_prior_preservation_weight=config.masked_prior_preservation_weight,
-            ).mean(mean_dim) * config.huber_strength
+        # MSE/L2, MAE/L1, log-cosh and Huber Loss
+        if config.mse_strength != 0 or config.mae_strength != 0 \
+                or config.log_cosh_strength != 0 or config.huber_strength != 0:
+            losses += self.__fused_losses(batch, data, config, masked=True)
 
         # VB loss
         if config.vb_loss_strength != 0 and 'predicted_var_values' in data and self.__coefficients is not None:
@@ -146,37 +89,10 @@ class ModelSetupDiffusionLossMixin(metaclass=ABCMeta):
 
         mean_dim = list(range(1, data['predicted'].ndim))
 
-        # MSE/L2 Loss
-        if config.mse_strength != 0:
-            losses += F.mse_loss(
-                data['predicted'].to(dtype=torch.float32),
-                data['target'].to(dtype=torch.float32),
-                reduction='none'
-            ).mean(mean_dim) * config.mse_strength
-
-        # MAE/L1 Loss
-        if config.mae_strength != 0:
-            losses += F.l1_loss(
-                data['predicted'].to(dtype=torch.float32),
-                data['target'].to(dtype=torch.float32),
-                reduction='none'
-            ).mean(mean_dim) * config.mae_strength
-
-        # log-cosh Loss
-        if config.log_cosh_strength != 0:
-            losses += self.__log_cosh_loss(
-                    data['predicted'].to(dtype=torch.float32),
-                    data['target'].to(dtype=torch.float32)
-                ).mean(mean_dim) * config.log_cosh_strength
-
-        # Huber Loss
-        if config.huber_strength != 0:
-            losses += F.huber_loss(
-                data['predicted'].to(dtype=torch.float32),
-                data['target'].to(dtype=torch.float32),
-                reduction='none',
-                delta=config.huber_delta,
-            ).mean(mean_dim) * config.huber_strength
+        # MSE/L2, MAE/L1, log-cosh and Huber Loss
+        if config.mse_strength != 0 or config.mae_strength != 0 \
+                or config.log_cosh_strength != 0 or config.huber_strength != 0:
+            losses += self.__fused_losses(batch, data, config, masked=False)
 
         # VB loss
         if config.vb_loss_strength != 0 and 'predicted_var_values' in data:
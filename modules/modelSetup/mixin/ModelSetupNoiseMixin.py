@@ -3,6 +3,7 @@ from abc import ABCMeta
 
 from modules.util.config.TrainConfig import TrainConfig
 from modules.util.enum.TimestepDistribution import TimestepDistribution
+from modules.util.PredictionPlan import PredictionPlan
 
 import torch
 from torch import Generator, Tensor
@@ -81,20 +82,18 @@ class ModelSetupNoiseMixin(metaclass=ABCMeta):
             generator: Generator,
             timestep: Tensor | None = None,
             betas: Tensor | None = None,
+            plan: PredictionPlan | None = None,
     ) -> Tensor:
-        noise = torch.randn(
-            source_tensor.shape,
-            generator=generator,
-            device=config.train_device,
-            dtype=source_tensor.dtype
-        )
+        def randn(shape: tuple[int, ...]) -> Tensor:
+            if plan is None:
+                return torch.randn(shape, generator=generator, device=config.train_device, dtype=source_tensor.dtype)
+            return plan.randn(shape, generator, config.train_device, source_tensor.dtype)
+
+        noise = randn(source_tensor.shape)
 
         if config.offset_noise_weight > 0:
-            offset_noise = torch.randn(
+            offset_noise = randn(
                 (source_tensor.shape[0], source_tensor.shape[1], *[1 for _ in range(source_tensor.ndim - 2)]),
-                generator=generator,
-                device=config.train_device,
-                dtype=source_tensor.dtype
             )
             # Use the time-dependent generalized method if enabled.
             # This will only be true for Diffusion models (which uses betas)
@@ -108,12 +107,7 @@ class ModelSetupNoiseMixin(metaclass=ABCMeta):
                 noise = noise + (config.offset_noise_weight * offset_noise)
 
         if config.perturbation_noise_weight > 0:
-            perturbation_noise = torch.randn(
-                source_tensor.shape,
-                generator=generator,
-                device=config.train_device,
-                dtype=source_tensor.dtype
-            )
+            perturbation_noise = randn(source_tensor.shape)
             noise = noise + (config.perturbation_noise_weight * perturbation_noise)
 
         return noise
@@ -126,17 +120,33 @@ class ModelSetupNoiseMixin(metaclass=ABCMeta):
             batch_size: int,
             config: TrainConfig,
             shift: float = None,
+            plan: PredictionPlan | None = None,
+            deterministic_timestep: float = 0.5,
     ) -> Tensor:
+        if plan is not None and plan.has_sample_seeds():
+            return torch.cat([
+                self._get_timestep_discrete(
+                    num_train_timesteps, deterministic, sample_generator, 1, config, shift,
+                    deterministic_timestep=plan.deterministic_timestep,
+                ) for sample_generator in plan.sample_generators(generator.device)
+            ])
+        if plan is not None:
+            return plan.select(self._get_timestep_discrete(
+                num_train_timesteps, deterministic, generator, plan.batch_size, config, shift,
+                deterministic_timestep=plan.deterministic_timestep,
+            ))
+
         if shift is None:
             shift = config.timestep_shift
 
         if deterministic:
             # -1 is for zero-based indexing
-            return torch.tensor(
-                int(num_train_timesteps * 0.5) - 1,
+            return torch.full(
+                size=(batch_size,),
+                fill_value=max(int(num_train_timesteps * deterministic_timestep) - 1, 0),
                 dtype=torch.long,
                 device=generator.device,
-            ).unsqueeze(0)
+            )
         else:
             min_timestep = int(num_train_timesteps * config.min_noising_strength)
             max_timestep = int(num_train_timesteps * config.max_noising_strength)
@@ -217,11 +227,24 @@ class ModelSetupNoiseMixin(metaclass=ABCMeta):
             generator: Generator,
             batch_size: int,
             config: TrainConfig,
+            plan: PredictionPlan | None = None,
+            deterministic_timestep: float = 0.5,
     ) -> Tensor:
+        if plan is not None and plan.has_sample_seeds():
+            return torch.cat([
+                self._get_timestep_continuous(
+                    deterministic, sample_generator, 1, config, deterministic_timestep=plan.deterministic_timestep,
+                ) for sample_generator in plan.sample_generators(generator.device)
+            ])
+        if plan is not None:
+            return plan.select(self._get_timestep_continuous(
+                deterministic, generator, plan.batch_size, config, deterministic_timestep=plan.deterministic_timestep,
+            ))
+
         if deterministic:
             return torch.full(
                 size=(batch_size,),
-                fill_value=0.5,
+                fill_value=deterministic_timestep,
                 device=generator.device,
             )
         else:
@@ -1,8 +1,11 @@
 import contextlib
 import os
 from abc import ABCMeta, abstractmethod
+from collections import deque
 from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import Any
 
 from modules.util import path_util
 from modules.util.image_util import load_image
@@ -18,6 +21,8 @@ class CaptionSample:
 
         self.image = None
         self.captions = None
+        self.inputs: Any = None  # model specific inputs, set by BaseImageCaptionModel.prepare_sample
+
 
         self.height = 0
         self.width = 0
@@ -80,6 +85,53 @@ class BaseImageCaptionModel(metaclass=ABCMeta):
         Returns: the generated caption
         """
 
+    def prepare_sample(self, caption_sample: CaptionSample):
+        """
+        Loads and preprocesses a CaptionSample before it is captioned. This is called from prefetch worker threads,
+        so it should only do cpu work that doesn't depend on other samples. The default implementation decodes the
+        image.
+
+        Args:
+            caption_sample (`CaptionSample`): the sample to prepare
+        """
+        caption_sample.get_image()
+
+    def generate_captions(
+            self,
+            caption_samples: list[CaptionSample],
+            initial_caption: str = "",
+            caption_prefix: str = "",
+            caption_postfix: str = "",
+    ) -> list[str]:
+        """
+        Generates captions for a batch of CaptionSamples. The default implementation captions them one at a time.
+
+        Args:
+            caption_samples (`[CaptionSample]`): the samples to caption, already passed to prepare_sample
+            initial_caption (`str`): the initial caption
+            caption_prefix (`str`): add this to the start of the generated captions
+            caption_postfix (`str`): add this to the end of the generated captions
+
+        Returns: the generated captions, in the order of caption_samples
+        """
+        return [
+            self.generate_caption(caption_sample, initial_caption, caption_prefix, caption_postfix)
+            for caption_sample in caption_samples
+        ]
+
+    @staticmethod
+    def __skip_sample(caption_sample: CaptionSample, mode: str) -> bool:
+        existing_caption = caption_sample.get_caption()
+        return mode == 'fill' and existing_caption is not None and existing_caption != ""
+
+    @staticmethod
+    def __apply_caption(caption_sample: CaptionSample, predicted_caption: str, mode: str):
+        if mode == 'replace' or mode == 'fill':
+            caption_sample.set_caption(predicted_caption)
+
+        if mode == 'add':
+            caption_sample.add_caption(predicted_caption)
+
     def caption_image(
             self,
             filename: str,
@@ -103,18 +155,11 @@ class BaseImageCaptionModel(metaclass=ABCMeta):
         """
         caption_sample = CaptionSample(filename)
 
-        existing_caption = caption_sample.get_caption()
-        if mode == 'fill' and existing_caption is not None and existing_caption != "":
+        if self.__skip_sample(caption_sample, mode):
             return
 
         predicted_caption = self.generate_caption(caption_sample, initial_caption, caption_prefix, caption_postfix)
-
-        if mode == 'replace' or mode == 'fill':
-            caption_sample.set_caption(predicted_caption)
-
-        if mode == 'add':
-            caption_sample.add_caption(predicted_caption)
-
+        self.__apply_caption(caption_sample, predicted_caption, mode)
         caption_sample.save_caption()
 
     def caption_images(
@@ -126,9 +171,13 @@ class BaseImageCaptionModel(metaclass=ABCMeta):
             mode: str = 'fill',
             progress_callback: Callable[[int, int], None] = None,
             error_callback: Callable[[str], None] = None,
+            batch_size: int = 1,
+            num_workers: int = 4,
     ):
         """
-        Captions all samples in a list
+        Captions all samples in a list. Images are decoded and preprocessed by prepare_sample on num_workers threads
+        ahead of the model, captions are generated in batches of batch_size, and caption files are written on a
+        separate thread.
 
         Parameters:
             filenames (`[str]`): a list of sample filenames
@@ -139,20 +188,114 @@ class BaseImageCaptionModel(metaclass=ABCMeta):
                 - replace: creates a new caption for all samples, even if a caption already exists
                 - fill: creates a new caption for all samples without a caption
                 - add: creates a new caption for all samples, appending if a caption already exists
-            progress_callback (`Callable[[int, int], None]`): called after every processed image
+            progress_callback (`Callable[[int, int], None]`): called after every processed batch
             error_callback (`Callable[[str], None]`): called for every exception
+            batch_size (`int`): number of images captioned in a single model call
+            num_workers (`int`): number of threads that load images ahead of the model
         """
+        batch_size = max(1, batch_size)
+        num_workers = max(1, num_workers)
+        # enough samples to fill the next batch while the current one is processed
+        prefetch_count = 2 * batch_size + num_workers
+
+        def load(filename: str) -> CaptionSample | None:
+            caption_sample = CaptionSample(filename)
+            if self.__skip_sample(caption_sample, mode):
+                return None
+            self.prepare_sample(caption_sample)
+            return caption_sample
+
+        processed_count = 0
+
+        def processed(count: int):
+            nonlocal processed_count
+            processed_count += count
+            progress_bar.update(count)
+            if progress_callback is not None:
+                progress_callback(processed_count, len(filenames))
 
-        if progress_callback is not None:
-            progress_callback(0, len(filenames))
-        for i, filename in enumerate(tqdm(filenames)):
+        def on_error(filename: str):
+            if error_callback is not None:
+                error_callback(filename)
+
+        # caption files that are written in the background, with the image filename to report failures
+        writes = deque()
+
+        def check_writes(wait: bool):
+            while writes and (wait or writes[0][1].done()):
+                filename, write = writes.popleft()
+                if write.exception() is not None:
+                    on_error(filename)
+
+        def caption_batch(caption_samples: list[CaptionSample]):
             try:
-                self.caption_image(filename, initial_caption, caption_prefix, caption_postfix, mode)
+                predicted_captions = self.generate_captions(
+                    caption_samples, initial_caption, caption_prefix, caption_postfix
+                )
             except Exception:
-                if error_callback is not None:
-                    error_callback(filename)
-            if progress_callback is not None:
-                progress_callback(i + 1, len(filenames))
+                # retry one sample at a time, so a single broken sample doesn't fail the whole batch
+                predicted_captions = []
+                for caption_sample in caption_samples:
+                    try:
+                        predicted_captions.extend(self.generate_captions(
+                            [caption_sample], initial_caption, caption_prefix, caption_postfix
+                        ))
+                    except Exception:  # noqa: PERF203
+                        predicted_captions.append(None)
+
+            for caption_sample, predicted_caption in zip(caption_samples, predicted_captions, strict=True):
+                # the image is no longer needed, only the caption is kept until it is written
+                caption_sample.image = None
+                caption_sample.inputs = None
+                try:
+                    if predicted_caption is None:
+                        raise RuntimeError(f"no caption generated for {caption_sample.image_filename}")
+                    self.__apply_caption(caption_sample, predicted_caption, mode)
+                    writes.append((caption_sample.image_filename, writer.submit(caption_sample.save_caption)))
+                except Exception:
+                    on_error(caption_sample.image_filename)
+            processed(len(caption_samples))
+
+        if progress_callback is not None:
+            progress_callback(0, len(filenames))
+
+        with tqdm(total=len(filenames)) as progress_bar, \
+                ThreadPoolExecutor(max_workers=num_workers, thread_name_prefix="caption_loader") as loader, \
+                ThreadPoolExecutor(max_workers=1, thread_name_prefix="caption_writer") as writer:
+            remaining_filenames = iter(filenames)
+            pending = deque()
+
+            def prefetch():
+                while len(pending) < prefetch_count:
+                    filename = next(remaining_filenames, None)
+                    if filename is None:
+                        return
+                    pending.append((filename, loader.submit(load, filename)))
+
+            prefetch()
+            batch = []
+            while pending:
+                filename, future = pending.popleft()
+                prefetch()
+
+                try:
+                    caption_sample = future.result()
+                except Exception:
+                    on_error(filename)
+                    processed(1)
+                    continue
+
+                if caption_sample is None:
+                    processed(1)
+                else:
+                    batch.append(caption_sample)
+
+                if batch and (len(batch) >= batch_size or not pending):
+                    caption_batch(batch)
+                    batch = []
+                    check_writes(wait=False)
+
+            check_writes(wait=True)
 
     def caption_folder(
             self,
@@ -164,6 +307,8 @@ class BaseImageCaptionModel(metaclass=ABCMeta):
             progress_callback: Callable[[int, int], None] = None,
             error_callback: Callable[[str], None] = None,
             include_subdirectories: bool = False,
+            batch_size: int = 1,
+            num_workers: int = 4,
     ):
         """
         Captions all samples in a folder
@@ -177,9 +322,11 @@ class BaseImageCaptionModel(metaclass=ABCMeta):
                 - replace: creates a new caption for all samples, even if a caption already exists
                 - fill: creates a new caption for all samples without a caption
                 - add: creates a new caption for all samples, appending if a caption already exists
-            progress_callback (`Callable[[int, int], None]`): called after every processed image
+            progress_callback (`Callable[[int, int], None]`): called after every processed batch
             error_callback (`Callable[[str], None]`): called for every exception
             include_subdirectories (`bool`): whether to include subfolders when processing samples
+            batch_size (`int`): number of images captioned in a single model call
+            num_workers (`int`): number of threads that load images ahead of the model
         """
 
         filenames = self.__get_sample_filenames(sample_dir, include_subdirectories)
@@ -191,4 +338,6 @@ class BaseImageCaptionModel(metaclass=ABCMeta):
             mode=mode,
             progress_callback=progress_callback,
             error_callback=error_callback,
+            batch_size=batch_size,
+            num_workers=num_workers,
         )
@@ -19,18 +19,38 @@ class BlipModel(BaseImageCaptionModel):
         self.model.eval()
         self.model.to(self.device)
 
-    def generate_caption(
+    def prepare_sample(self, caption_sample: CaptionSample):
+        # resize on the loader threads, with the same size and filter the image processor would use
+        image_processor = self.processor.image_processor
+        image = caption_sample.get_image()
+        caption_sample.image = image.resize(
+            (image_processor.size["width"], image_processor.size["height"]), image_processor.resample
+        )
+
+    def generate_captions(
             self,
-            caption_sample: CaptionSample,
+            caption_samples: list[CaptionSample],
             initial_caption: str = "",
             caption_prefix: str = "",
             caption_postfix: str = "",
-    ):
-        inputs = self.processor(caption_sample.get_image(), initial_caption, return_tensors="pt")
+    ) -> list[str]:
+        images = [caption_sample.get_image() for caption_sample in caption_samples]
+        inputs = self.processor(images, [initial_caption] * len(images), return_tensors="pt")
         inputs = inputs.to(self.device, self.dtype)
         with torch.no_grad():
             outputs = self.model.generate(**inputs)
-        predicted_caption = self.processor.decode(outputs[0], skip_special_tokens=True)
-        predicted_caption = (caption_prefix + predicted_caption + caption_postfix).strip()
+        predicted_captions = self.processor.batch_decode(outputs, skip_special_tokens=True)
+
+        return [
+            (caption_prefix + predicted_caption + caption_postfix).strip()
+            for predicted_caption in predicted_captions
+        ]
 
-        return predicted_caption
+    def generate_caption(
+            self,
+            caption_sample: CaptionSample,
+            initial_caption: str = "",
+            caption_prefix: str = "",
+            caption_postfix: str = "",
+    ):
+        return self.generate_captions([caption_sample], initial_caption, caption_prefix, caption_postfix)[0]
@@ -1,22 +1,39 @@
+import glob
 import json
+import os
+import platform
+import socket
+import traceback
+from datetime import timedelta
 
+import modules.util.multi_gpu_util as multi
 from modules.dataLoader import StableDiffusionFineTuneDataLoader
 from modules.model.BaseModel import BaseModel
 from modules.modelLoader.BaseModelLoader import BaseModelLoader
 from modules.modelSetup.BaseModelSetup import BaseModelSetup
 from modules.util import create
 from modules.util.config.TrainConfig import TrainConfig
+from modules.util.enum.LossScaler import LossScaler
+from modules.util.PredictionPlan import PredictionPlan
 from modules.util.torch_util import torch_gc
 from modules.util.TrainProgress import TrainProgress
 
 import torch
+from torch import Tensor
 
 from tqdm import tqdm
 
 
 class GenerateLossesModel:
     """Based on train args, writes a JSON instead of a model with filenames mapped to losses,
-    in order of decreasing loss."""
+    in order of decreasing loss.
+
+    Losses are calculated per sample at the configured batch size, and averaged over one deterministic prediction
+    for each of the given timesteps. Results are streamed to a partial JSONL file per process, which is used to resume
+    an interrupted run, and merged into the output file at the end. If the output path ends with .jsonl, the output is
+    written as JSONL records instead of a single JSON object. With multi_gpu, the dataset is sharded over all devices
+    the same way the MultiTrainer shards it. Incomplete batches are padded, so every sample is calculated in a single
+    pass."""
     config: TrainConfig
     train_device: torch.device
     temp_device: torch.device
@@ -25,19 +42,116 @@ class GenerateLossesModel:
     data_loader: StableDiffusionFineTuneDataLoader
     model: BaseModel
 
-    def __init__(self, config: TrainConfig, output_path: str):
+    def __init__(
+            self,
+            config: TrainConfig,
+            output_path: str,
+            timesteps: list[float] | None = None,
+            flush_interval: int = 64,
+            master_port: int | None = None,
+    ):
         # Create a copy of args because we will mutate
-        # the batch size and gradient accumulation steps.
+        # the gradient accumulation steps and loss scaler.
         config = TrainConfig.default_values().from_dict(config.to_dict())
-        config.batch_size = 1
         config.gradient_accumulation_steps = 1
+        # losses are compared between samples, so they should not depend on the batch size
+        config.loss_scaler = LossScaler.NONE
 
         self.config = config
         self.output_path = output_path
+        self.timesteps = timesteps if timesteps else [0.5]
+        self.flush_interval = flush_interval
+        self.master_port = master_port
         self.train_device = torch.device(self.config.train_device)
         self.temp_device = torch.device(self.config.temp_device)
 
+    def __partial_path(self, rank: int) -> str:
+        return f"{self.output_path}.{rank}.partial.jsonl"
+
+    def __partial_paths(self) -> list[str]:
+        return sorted(glob.glob(glob.escape(self.output_path) + ".*.partial.jsonl"))
+
+    def __read_partial_results(self) -> dict[str, dict]:
+        results = {}
+        for partial_path in self.__partial_paths():
+            with open(partial_path, "r") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # the last line can be incomplete if the process was interrupted while writing it
+                        continue
+                    results[record["path"]] = record
+        return results
+
     def start(self):
+        if self.config.multi_gpu:
+            self.__start_multi()
+        else:
+            self._calculate()
+        self.__merge()
+
+    @staticmethod
+    def __find_free_port() -> int:
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+            s.bind(('localhost', 0))
+            return s.getsockname()[1]
+
+    def __start_multi(self):
+        # a free port is chosen if none is given, so that several runs can share a machine
+        os.environ.setdefault('MASTER_ADDR', 'localhost')
+        if self.master_port is not None:
+            os.environ['MASTER_PORT'] = str(self.master_port)
+        else:
+            os.environ.setdefault('MASTER_PORT', str(self.__find_free_port()))
+
+        config_dict = self.config.to_pack_dict(secrets=True)
+
+        devices = self.config.device_indexes.split(',')
+        if len(devices) == 1 and not devices[0]:
+            devices = None
+            world_size = torch.cuda.device_count()
+        else:
+            devices = [torch.device(self.config.train_device, int(d)) for d in devices]
+            world_size = len(devices)
+
+        args = (world_size, config_dict, devices, self.output_path, self.timesteps, self.flush_interval)
+        workers = torch.multiprocessing.spawn(
+            GenerateLossesModel._loss_process, args=args, nprocs=world_size - 1, join=False,
+        )
+        GenerateLossesModel._loss_process(-1, *args)  # main process is rank #0
+        workers.join()
+
+    @staticmethod  # must be static and not use __ prefix, otherwise the pickling done by torch.multiprocessing fails
+    def _loss_process(
+            spawn_rank: int,
+            world_size: int,
+            config_dict: dict,
+            devices: list[torch.device] | None,
+            output_path: str,
+            timesteps: list[float],
+            flush_interval: int,
+    ):
+        rank = spawn_rank + 1
+        config = TrainConfig.default_values().from_dict(config_dict)
+        device = torch.device(devices[rank]) if devices else torch.device(config.train_device, rank)
+
+        # caching is only done by the first process, the others have to wait without timing out
+        timeout = timedelta(hours=24)
+        torch.distributed.init_process_group(rank=rank, world_size=world_size, device_id=device, timeout=timeout,
+            backend='gloo' if platform.system() == 'Windows' else 'nccl',
+        )
+        torch.cuda.set_device(device.index)
+
+        try:
+            GenerateLossesModel(config, output_path, timesteps, flush_interval)._calculate()
+        except Exception:
+            traceback.print_exc()
+            raise
+        finally:
+            torch.distributed.destroy_process_group()
+
+    def _calculate(self):
         if self.config.train_dtype.enable_tf():
             torch.backends.cuda.matmul.allow_tf32 = True
             torch.backends.cudnn.allow_tf32 = True
@@ -66,42 +180,110 @@ class GenerateLossesModel:
         self.model.train_progress = TrainProgress()
         torch_gc()
 
+        completed_paths = set(self.__read_partial_results().keys())
+        if completed_paths and multi.is_master():
+            print(f"Resuming, {len(completed_paths)} samples already have a loss")
+
+        with open(self.__partial_path(multi.rank()), "a") as partial_file:
+            self.__calculate_pass(completed_paths, partial_file)
+
+    def __calculate_pass(self, completed_paths: set[str], partial_file):
+        # incomplete batches are padded instead of dropped, the padding is marked in 'padding_sample'
         self.data_loader = create.create_data_loader(
             self.train_device,
             self.temp_device,
             self.model,
             self.config.model_type,
+            self.model_setup,
             self.config.training_method,
             self.config,
             self.model.train_progress,
+            pad_batches=True,
         )
 
-        self.data_loader.get_data_set().start_next_epoch()
-        step_tqdm = tqdm(self.data_loader.get_data_loader(), desc="step")
+        # start_next_epoch can write to the cache, so it is called by one process first
+        for _ in multi.master_first():
+            self.data_loader.get_data_set().start_next_epoch()
+        batches = self.data_loader.get_data_loader()
+        if multi.is_master():
+            batches = tqdm(batches, desc="step")
 
         self.model_setup.setup_train_device(self.model, self.config)
 
-        filename_loss_list: list[tuple[str, float]] = []
+        # losses stay on the train device until they are flushed, to avoid a device sync for each batch
+        pending_paths: list[list[str]] = []
+        pending_losses: list[Tensor] = []
+        pending_padding: list[Tensor] = []
+
+        def flush():
+            if not pending_losses:
+                return
+            losses = torch.cat(pending_losses).to(device="cpu", dtype=torch.float32).tolist()
+            padding = torch.cat(pending_padding).to(device="cpu").tolist()
+            paths = [path for batch_paths in pending_paths for path in batch_paths]
+            for path, timestep_losses, is_padding in zip(paths, losses, padding, strict=True):
+                if is_padding or path in completed_paths:
+                    continue
+                completed_paths.add(path)
+                record = {
+                    "path": path,
+                    "loss": sum(timestep_losses) / len(timestep_losses),
+                    "timestep_losses": dict(zip([str(t) for t in self.timesteps], timestep_losses, strict=True)),
+                }
+                partial_file.write(json.dumps(record) + "\n")
+            partial_file.flush()
+            pending_paths.clear()
+            pending_losses.clear()
+            pending_padding.clear()
+
         # Don't really need a backward pass here, so we can make the calculation MUCH faster.
         with torch.inference_mode():
-            for batch in step_tqdm:
+            for batch in batches:
+                paths = batch['image_path']
+                if all(path in completed_paths for path in paths):
+                    continue
+
+                batch_size = len(paths)
+                timestep_losses = []
+                for timestep in self.timesteps:
                     model_output_data = self.model_setup.predict(
                         self.model,
                         batch,
                         self.config,
                         self.model.train_progress,
                         deterministic=True,
+                        plan=PredictionPlan.from_samples(batch, deterministic_timestep=timestep),
                     )
-                    loss = self.model_setup.calculate_loss(
+                    losses = self.model_setup.calculate_loss(
                         self.model,
                         batch,
                         model_output_data,
                         self.config,
+                        per_sample=True,
                     )
-                    filename_loss_list.append((batch['image_path'][0], float(loss)))
+                    timestep_losses.append(losses.detach().reshape(batch_size, -1).mean(dim=1))
+
+                pending_paths.append(paths)
+                pending_losses.append(torch.stack(timestep_losses, dim=1))
+                pending_padding.append(batch['padding_sample'].reshape(-1))
+                if len(pending_losses) >= self.flush_interval:
+                    flush()
+
+        flush()
+
+    def __merge(self):
+        results = list(self.__read_partial_results().values())
 
         # Sort such that highest loss comes first
-        filename_loss_list.sort(key=lambda x: x[1], reverse=True)
-        filename_to_loss: dict[str, float] = {x[0]: x[1] for x in filename_loss_list}
-        with open(self.output_path, "w") as f:
-            json.dump(filename_to_loss, f, indent=4)
+        results.sort(key=lambda x: x["loss"], reverse=True)
+        if self.output_path.endswith(".jsonl"):
+            with open(self.output_path, "w") as f:
+                for record in results:
+                    f.write(json.dumps(record) + "\n")
+        else:
+            filename_to_loss: dict[str, float] = {x["path"]: x["loss"] for x in results}
+            with open(self.output_path, "w") as f:
+                json.dump(filename_to_loss, f, indent=4)
+
+        for partial_path in self.__partial_paths():
+            os.remove(partial_path)
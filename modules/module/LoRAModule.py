@@ -7,6 +7,7 @@ from typing import Any
 
 from modules.module.oft_utils import OFTRotationModule
 from modules.module.quantized.LinearSVD import BaseLinearSVD
+from modules.module.quantized.mixin.QuantizedLinearMixin import QuantizedLinearMixin
 from modules.util.config.TrainConfig import TrainConfig
 from modules.util.enum.ModelType import PeftType
 from modules.util.ModuleFilter import ModuleFilter
@@ -17,6 +18,61 @@ import torch.nn.functional as F
 from torch import Tensor, nn
 from torch.nn import Conv2d, Dropout, Linear, Parameter
 
+from diffusers.quantizers.gguf.utils import GGUFLinear
+
+
+def _get_float_weight(module: nn.Module, device: torch.device) -> Tensor:
+    if isinstance(module, nn.Linear):
+        return get_unquantized_weight(module, torch.float, device).to(device=device)
+    return module.weight.detach().to(device=device, dtype=torch.float)
+
+
+def _low_rank_approximation(deltas: Tensor, rank: int) -> tuple[Tensor, Tensor]:
+    """Batched truncated SVD of deltas with shape (n, out, in).
+
+    Returns up (n, out, rank) and down (n, rank, in), so that up @ down is the
+    best rank-limited approximation of each delta. The singular values are
+    split evenly between both factors.
+    """
+    U, S, Vh = torch.linalg.svd(deltas, full_matrices=False)
+    S = S[:, :rank].sqrt()
+    up = U[:, :, :rank] * S.unsqueeze(1)
+    down = Vh[:, :rank, :] * S.unsqueeze(2)
+
+    # pad layers smaller than the rank with zeros
+    if up.shape[2] < rank:
+        up = F.pad(up, (0, rank - up.shape[2]))
+        down = F.pad(down, (0, 0, 0, rank - down.shape[1]))
+
+    return up, down
+
+
+def extract_low_rank(
+        modules: list['LoRAModule | LoHaModule'],
+        base_modules: list[nn.Module],
+        device: torch.device | None = None,
+        batch_size: int = 16,
+):
+    """Extracts low rank modules from the difference between their orig_module and the matching base module.
+
+    Differences of the same shape are decomposed together, with one SVD call
+    for up to batch_size layers.
+    """
+    groups = defaultdict(list)
+    for module, base_module in zip(modules, base_modules, strict=True):
+        groups[(tuple(module.shape), module.rank)].append((module, base_module))
+
+    for group in groups.values():
+        for i in range(0, len(group), batch_size):
+            chunk = group[i:i + batch_size]
+            chunk_device = device if device is not None else chunk[0][0].orig_module.weight.device
+            deltas = torch.stack([module.weight_delta(base_module, chunk_device) for module, base_module in chunk])
+            ups, downs = _low_rank_approximation(deltas, chunk[0][0].rank)
+            del deltas
+
+            for (module, _), up, down in zip(chunk, ups, downs, strict=True):
+                module.set_low_rank(up, down)
+
 
 class PeftBase(nn.Module):
     is_applied: bool
@@ -27,6 +83,9 @@ class PeftBase(nn.Module):
     prefix: str
     layer_kwargs: dict  # Applied during the forward op() call.
     _initialized: bool  # Tracks whether we've created the layers or not.
+    is_merged: bool
+    _hooked_before_merge: bool
+    _original_state: dict[str, Tensor] | None  # Tensors of orig_module before merging.
 
     def __init__(self, prefix: str, orig_module: nn.Module | None):
         super().__init__()
@@ -35,6 +94,9 @@ class PeftBase(nn.Module):
         self.is_applied = False
         self.layer_kwargs = {}
         self._initialized = False
+        self.is_merged = False
+        self._hooked_before_merge = False
+        self._original_state = None
 
         if orig_module is not None:
             match orig_module:
@@ -118,14 +180,92 @@ class PeftBase(nn.Module):
     def initialize_weights(self):
         pass
 
+    # Returns the float weight of orig_module with this module merged into it.
+    @abstractmethod
+    def merge_weight(self, weight: Tensor) -> Tensor:
+        pass
+
+    # Inverse of merge_weight.
     @abstractmethod
-    def apply_to_module(self):
+    def unmerge_weight(self, weight: Tensor) -> Tensor:
         pass
 
     @abstractmethod
     def extract_from_module(self, base_module: nn.Module):
         pass
 
+    def _check_mergeable(self):
+        if not self._initialized:
+            raise RuntimeError(f"Module {self.prefix} is not initialized.")
+        if isinstance(self.orig_module, GGUFLinear):
+            raise NotImplementedError("Merging into GGUF layers is not supported.")
+
+    def _set_orig_weight(self, weight: Tensor):
+        module = self.orig_module
+        if isinstance(module, QuantizedLinearMixin):
+            module.requantize(weight.to(device=module.weight.device))
+        else:
+            # copy in place, the storage can be owned by the layer offloading allocator
+            module.weight.data.copy_(weight)
+
+    @torch.no_grad()
+    def apply_to_module(self, stash_device: torch.device | None = None):
+        """Merges this module into the weights of orig_module.
+
+        The hook is removed while merged, and restored by remove_from_module.
+        Quantized layers are dequantized, merged and requantized. The
+        original tensors of every layer are kept on stash_device until they
+        are restored, or on their current device if it is None.
+        """
+        if self.is_merged:
+            return
+        self._check_mergeable()
+
+        self._hooked_before_merge = self.is_applied
+        if self.is_applied:
+            self.remove_hook_from_module()
+
+        # The original tensors are kept to restore the exact weights. Unmerging by calculation accumulates rounding
+        # or quantization errors in the frozen weights on every merge and unmerge.
+        module = self.orig_module
+        if isinstance(module, QuantizedLinearMixin):
+            # requantizing replaces these tensors instead of writing into them
+            self._original_state = {
+                name: tensor.data if stash_device is None else tensor.data.to(device=stash_device)
+                for name, tensor
+                in list(module.named_parameters(recurse=False)) + list(module.named_buffers(recurse=False))
+            }
+        else:
+            # the merged weight is written into this tensor, so a copy is kept
+            self._original_state = {
+                'weight': module.weight.data.to(device=stash_device or module.weight.device, copy=True),
+            }
+
+        weight = _get_float_weight(module, module.weight.device)
+        self._set_orig_weight(self.merge_weight(weight))
+        self.is_merged = True
+
+    @torch.no_grad()
+    def remove_from_module(self):
+        """Reverts apply_to_module, restoring the weights of orig_module."""
+        if not self.is_merged:
+            return
+
+        module = self.orig_module
+        tensors = dict(module.named_parameters(recurse=False)) | dict(module.named_buffers(recurse=False))
+        for name, data in self._original_state.items():
+            if isinstance(module, QuantizedLinearMixin):
+                # the layer can be moved to another device while merged
+                tensors[name].data = data.to(device=tensors[name].device)
+            else:
+                # copy in place, the storage can be owned by the layer offloading allocator
+                tensors[name].data.copy_(data)
+        self._original_state = None
+        self.is_merged = False
+
+        if self._hooked_before_merge:
+            self.hook_to_module()
+
     def create_layer(self) -> tuple[nn.Module, nn.Module]:
         """Generic helper function for creating a PEFT layer, like LoRA.
 
@@ -201,7 +341,16 @@ class PeftBase(nn.Module):
             def remove_hook_from_module(self):
                 raise NotImplementedError("Should never be called on a dummy module.")
 
-            def apply_to_module(self):
+            def apply_to_module(self, stash_device: torch.device | None = None):
+                raise NotImplementedError("Should never be called on a dummy module.")
+
+            def remove_from_module(self):
+                raise NotImplementedError("Should never be called on a dummy module.")
+
+            def merge_weight(self, weight: Tensor) -> Tensor:
+                raise NotImplementedError("Should never be called on a dummy module.")
+
+            def unmerge_weight(self, weight: Tensor) -> Tensor:
                 raise NotImplementedError("Should never be called on a dummy module.")
 
             def extract_from_module(self, base_module: nn.Module):
@@ -275,13 +424,39 @@ class LoHaModule(PeftBase):
         W = (W1 * W2) * (self.alpha / self.rank)
         return self.orig_forward(x) + self.op(x, W, bias=None, **self.layer_kwargs)
 
-    def apply_to_module(self):
-        # TODO
-        pass
+    def _delta_weight(self, device: torch.device) -> Tensor:
+        W1 = self.make_weight(self.hada_w1_b.float(), self.hada_w1_a.float())
+        W2 = self.make_weight(self.hada_w2_b.float(), self.hada_w2_a.float())
+        return ((W1 * W2) * (self.alpha.float() / self.rank)).to(device=device)
+
+    def merge_weight(self, weight: Tensor) -> Tensor:
+        return weight + self._delta_weight(weight.device)
+
+    def unmerge_weight(self, weight: Tensor) -> Tensor:
+        return weight - self._delta_weight(weight.device)
+
+    def weight_delta(self, base_module: nn.Module, device: torch.device) -> Tensor:
+        delta = _get_float_weight(self.orig_module, device) - _get_float_weight(base_module, device)
+        return delta.reshape(delta.shape[0], -1)
+
+    @torch.no_grad()
+    def set_low_rank(self, up: Tensor, down: Tensor):
+        # W1 holds the low rank approximation, W2 is set to all ones. This
+        # only uses rank instead of rank^2 of the Hadamard product, but it is
+        # an exact starting point for further training.
+        self.hada_w1_a.copy_((up * (self.rank / self.alpha.item())).reshape(self.hada_w1_a.shape))
+        self.hada_w1_b.copy_(down.reshape(self.hada_w1_b.shape))
+
+        hada_w2_a = torch.zeros_like(self.hada_w2_a)
+        hada_w2_a.view(hada_w2_a.shape[0], -1)[:, 0] = 1
+        hada_w2_b = torch.zeros_like(self.hada_w2_b)
+        hada_w2_b[0] = 1
+        self.hada_w2_a.copy_(hada_w2_a)
+        self.hada_w2_b.copy_(hada_w2_b)
 
     def extract_from_module(self, base_module: nn.Module):
-        # TODO
-        pass
+        self._check_mergeable()
+        extract_low_rank([self], [base_module])
 
 
 class LoRAModule(PeftBase):
@@ -328,13 +503,28 @@ class LoRAModule(PeftBase):
         ld = self.lora_up(self.dropout(self.lora_down(x)))
         return self.orig_forward(x) + ld * (self.alpha / self.rank)
 
-    def apply_to_module(self):
-        # TODO
-        pass
+    def _delta_weight(self, device: torch.device) -> Tensor:
+        W = self.make_weight(self.lora_down.weight.float(), self.lora_up.weight.float())
+        return (W * (self.alpha.float() / self.rank)).to(device=device)
+
+    def merge_weight(self, weight: Tensor) -> Tensor:
+        return weight + self._delta_weight(weight.device)
+
+    def unmerge_weight(self, weight: Tensor) -> Tensor:
+        return weight - self._delta_weight(weight.device)
+
+    def weight_delta(self, base_module: nn.Module, device: torch.device) -> Tensor:
+        delta = _get_float_weight(self.orig_module, device) - _get_float_weight(base_module, device)
+        return delta.reshape(delta.shape[0], -1)
+
+    @torch.no_grad()
+    def set_low_rank(self, up: Tensor, down: Tensor):
+        self.lora_up.weight.copy_((up * (self.rank / self.alpha.item())).reshape(self.lora_up.weight.shape))
+        self.lora_down.weight.copy_(down.reshape(self.lora_down.weight.shape))
 
     def extract_from_module(self, base_module: nn.Module):
-        # TODO
-        pass
+        self._check_mergeable()
+        extract_low_rank([self], [base_module])
 
 
 class OFTModule(PeftBase):
@@ -453,13 +643,62 @@ class OFTModule(PeftBase):
 
         return self.op(x, rotated_weight, self.orig_module.bias, **self.layer_kwargs)
 
-    def apply_to_module(self):
-        # TODO
-        pass
+    def _weight_rotation(self, device: torch.device) -> Tensor:
+        """Returns the rotation applied to the weight blocks, shape (rank, block_size, block_size)."""
+        orth_rotate = self.oft_R._cayley_batch(
+            self.oft_R.weight.detach().float(), self.oft_R.block_size, self.oft_R.use_cayley_neumann, self.oft_R.num_cayley_neumann_terms
+        ).to(device=device)
+
+        if self.block_share:
+            orth_rotate = orth_rotate.repeat(self.rank, 1, 1)
+
+        # The Linear forward pass rotates the input, which is equivalent to
+        # rotating the weight with the transposed rotation.
+        if isinstance(self.orig_module, nn.Linear):
+            orth_rotate = orth_rotate.transpose(1, 2)
+
+        return orth_rotate
+
+    def merge_weight(self, weight: Tensor) -> Tensor:
+        weight_reshaped = weight.reshape(weight.shape[0], self.rank, self.oft_block_size)
+        rotated_weight_reshaped = torch.einsum("ork,rkc->orc", weight_reshaped, self._weight_rotation(weight.device))
+        return rotated_weight_reshaped.reshape(weight.shape)
 
+    def unmerge_weight(self, weight: Tensor) -> Tensor:
+        # The Cayley-Neumann rotation is only approximately orthogonal, so
+        # solve instead of multiplying with the transposed rotation.
+        weight_reshaped = weight.reshape(weight.shape[0], self.rank, self.oft_block_size).transpose(0, 1)
+        weight_reshaped = torch.linalg.solve(self._weight_rotation(weight.device), weight_reshaped, left=False)
+        return weight_reshaped.transpose(0, 1).reshape(weight.shape)
+
+    @torch.no_grad()
     def extract_from_module(self, base_module: nn.Module):
-        # TODO
-        pass
+        """Finds the block rotations closest to the difference between base_module and orig_module.
+
+        Solves the orthogonal Procrustes problem for each block (or for all
+        blocks together if block_share is set), then inverts the Cayley
+        parametrization R = (I + Q)(I - Q)^-1 to get the skew symmetric
+        parameters.
+        """
+        self._check_mergeable()
+        device = self.oft_R.weight.device
+
+        weight = _get_float_weight(self.orig_module, device)
+        weight = weight.reshape(weight.shape[0], self.rank, self.oft_block_size).transpose(0, 1)
+        base_weight = _get_float_weight(base_module, device)
+        base_weight = base_weight.reshape(base_weight.shape[0], self.rank, self.oft_block_size).transpose(0, 1)
+
+        correlation = base_weight.transpose(1, 2) @ weight
+        if self.block_share:
+            correlation = correlation.sum(dim=0, keepdim=True)
+        U, _, Vh = torch.linalg.svd(correlation)
+        orth_rotate = U @ Vh
+        if isinstance(self.orig_module, nn.Linear):
+            orth_rotate = orth_rotate.transpose(1, 2)
+
+        eye = torch.eye(self.oft_block_size, device=device).expand_as(orth_rotate)
+        Q_skew = torch.linalg.solve(orth_rotate + eye, orth_rotate - eye, left=False)
+        self.oft_R.weight.copy_(self.oft_R._pytorch_skew_symmetric_inv(Q_skew, self.oft_block_size))
 
     def check_initialized(self):
         super().check_initialized()
@@ -475,16 +714,31 @@ class DoRAModule(LoRAModule):
 
     Not unlike LoRA in theory but the forward pass is significantly more
     complicated, as it involves taking the norm of the directional result.
+
+    With low_rank_norm, Linear layers never materialize the merged weight.
+    The output is computed as the base output plus the LoRA output, scaled per
+    channel. The norm is computed from the cached norm of the base weight and
+    a low rank correction, without dequantizing the base weight on every call.
     """
     dora_num_dims: int
     dora_scale: Tensor | None
+    _merged_norm: Tensor | None
+    _base_norm_squared: Tensor | None
+    _cross_term: Tensor | None
+    _cross_term_key: tuple | None
     norm_epsilon: bool
     decompose_output_axis: bool
+    low_rank_norm: bool
 
     def __init__(self, *args, **kwargs):
         self.dora_scale = None
+        self._merged_norm = None
+        self._base_norm_squared = None
+        self._cross_term = None
+        self._cross_term_key = None
         self.norm_epsilon = kwargs.pop('norm_epsilon', False)
         self.decompose_output_axis = kwargs.pop('decompose_output_axis', False)
+        self.low_rank_norm = kwargs.pop('low_rank_norm', False)
         self.train_device = kwargs.pop('train_device')
         super().__init__(*args, **kwargs)
 
@@ -501,32 +755,35 @@ class DoRAModule(LoRAModule):
         # wrangling that works for both Linear and Convolutional layers. If you
         # were just doing this for Linear, it would be substantially simpler.
         self.dora_num_dims = orig_weight.dim() - 1
-        if self.decompose_output_axis:
-            self.dora_scale = nn.Parameter(
-                torch.norm(
-                    orig_weight.reshape(orig_weight.shape[0], -1),
-                    dim=1, keepdim=True)
-                .reshape(orig_weight.shape[0], *[1] * self.dora_num_dims)
-                .to(device=self.orig_module.weight.device)
-            )
-        else:
-            self.dora_scale = nn.Parameter(
-                torch.norm(
-                    orig_weight.transpose(1, 0).reshape(orig_weight.shape[1], -1),
-                    dim=1, keepdim=True)
-                .reshape(orig_weight.shape[1], *[1] * self.dora_num_dims)
-                .transpose(1, 0)
-                .to(device=self.orig_module.weight.device)
-            )
+        self.dora_scale = nn.Parameter(
+            self._weight_norm(orig_weight).to(device=self.orig_module.weight.device)
+        )
 
         del orig_weight
 
+    def _weight_norm(self, weight: Tensor) -> Tensor:
+        if self.decompose_output_axis:
+            return weight \
+                .reshape(weight.shape[0], -1) \
+                .norm(dim=1) \
+                .reshape(weight.shape[0], *[1] * self.dora_num_dims)
+        else:
+            return weight \
+                .transpose(0, 1) \
+                .reshape(weight.shape[1], -1) \
+                .norm(dim=1, keepdim=True) \
+                .reshape(weight.shape[1], *[1] * self.dora_num_dims) \
+                .transpose(0, 1)
+
     def check_initialized(self):
         super().check_initialized()
         assert self.dora_scale is not None
 
     def forward(self, x, *args, **kwargs):
         self.check_initialized()
+        if self.low_rank_norm and isinstance(self.orig_module, nn.Linear):
+            return self._forward_low_rank_norm(x)
+
         A = self.lora_down.weight
         B = self.lora_up.weight
 
@@ -544,19 +801,7 @@ class DoRAModule(LoRAModule):
         # backpropagation in order to save VRAM (to do this, we detach it from
         # the gradient graph).
         eps = torch.finfo(WP.dtype).eps if self.norm_epsilon else 0.0
-        if self.decompose_output_axis:
-            norm = WP.detach() \
-                    .reshape(WP.shape[0], -1) \
-                    .norm(dim=1) \
-                    .reshape(WP.shape[0], *[1] * self.dora_num_dims) \
-                    + eps
-        else:
-            norm = WP.detach() \
-                    .transpose(0, 1) \
-                    .reshape(WP.shape[1], -1) \
-                    .norm(dim=1, keepdim=True) \
-                    .reshape(WP.shape[1], *[1] * self.dora_num_dims) \
-                    .transpose(0, 1) + eps
+        norm = self._weight_norm(WP.detach()) + eps
         WP = self.dora_scale * (WP / norm)
         # In the DoRA codebase (and thus the paper results), they perform
         # dropout on the *input*, rather than between layers, so we duplicate
@@ -566,6 +811,104 @@ class DoRAModule(LoRAModule):
                        self.orig_module.bias,
                        **self.layer_kwargs)
 
+    def _base_weight_norm_squared(self) -> Tensor:
+        # The base weight is frozen, its norm only needs to be calculated once while no adapter is merged into it
+        if self._base_norm_squared is None:
+            orig_weight = get_unquantized_weight(self.orig_module, torch.float, self.train_device)
+            self._base_norm_squared = self._weight_norm(orig_weight.to(device=self.train_device)).square()
+            del orig_weight
+        return self._base_norm_squared
+
+    def _orig_forward_without_bias(self, x: Tensor) -> Tensor:
+        y = self.orig_forward(x)
+        if self.orig_module.bias is not None:
+            y = y - self.orig_module.bias.to(dtype=y.dtype)
+        return y
+
+    def _base_weight_times_lora_up(self, B: Tensor, dtype: torch.dtype) -> Tensor:
+        # B^T @ W can't be calculated by the forward pass of the base layer, so it needs the full base weight. It only
+        # changes when B is updated, so it is calculated once per optimizer step, and reused by the recomputation of
+        # gradient checkpointing. The version counter of B is increased by every in-place update.
+        key = (B._version, B.data_ptr(), dtype)
+        if self._cross_term_key != key:
+            self._cross_term = None
+            orig_weight = get_unquantized_weight(self.orig_module, dtype, self.train_device)
+            self._cross_term = (B.to(device=orig_weight.device, dtype=dtype).T @ orig_weight).float()
+            self._cross_term_key = key
+            del orig_weight
+        return self._cross_term
+
+    @torch.no_grad()
+    def _low_rank_weight_norm(self, dtype: torch.dtype) -> Tensor:
+        # |W + s*B@A|^2 = |W|^2 + 2s * <W, B@A> + s^2 * |B@A|^2, per row or column.
+        # The cross term only needs W @ A^T or B^T @ W.
+        A = self.lora_down.weight.detach()
+        B = self.lora_up.weight.detach()
+        scale = self.alpha.float() / self.rank
+
+        if self.decompose_output_axis:
+            # W @ A^T is the output of the base layer for the rank rows of A, quantized layers calculate it without
+            # dequantizing their full weight
+            WA = self._orig_forward_without_bias(A.to(device=self.train_device, dtype=dtype)).float().T
+            A = A.float().to(device=WA.device)
+            B = B.float().to(device=WA.device)
+            cross = (WA * B).sum(dim=1, keepdim=True)
+            quadratic = ((B @ (A @ A.T)) * B).sum(dim=1, keepdim=True)
+        else:
+            BW = self._base_weight_times_lora_up(B, dtype)
+            A = A.float().to(device=BW.device)
+            B = B.float().to(device=BW.device)
+            cross = (BW * A).sum(dim=0, keepdim=True)
+            quadratic = (((B.T @ B) @ A) * A).sum(dim=0, keepdim=True)
+
+        base_norm_squared = self._base_weight_norm_squared().to(device=cross.device)
+        norm_squared = base_norm_squared + (2 * scale) * cross + (scale * scale) * quadratic
+        return norm_squared.clamp(min=0).sqrt()
+
+    def _forward_low_rank_norm(self, x: Tensor) -> Tensor:
+        eps = torch.finfo(torch.float).eps if self.norm_epsilon else 0.0
+        norm = self._low_rank_weight_norm(x.dtype) + eps
+        channel_scale = (self.dora_scale / norm).reshape(-1)
+
+        # Dropout is applied to the input, as in the weight based forward pass
+        x = self.dropout(x)
+        scale = self.alpha / self.rank
+        if self.decompose_output_axis:
+            y = self._orig_forward_without_bias(x) + self.lora_up(self.lora_down(x)) * scale
+            y = y * channel_scale.to(dtype=y.dtype)
+            if self.orig_module.bias is not None:
+                y = y + self.orig_module.bias.to(dtype=y.dtype)
+            return y
+        else:
+            x = x * channel_scale.to(dtype=x.dtype)
+            return self.orig_forward(x) + self.lora_up(self.lora_down(x)) * scale
+
+    def remove_from_module(self):
+        # the original weight is restored exactly, so the cached norm of the base weight stays valid
+        super().remove_from_module()
+        self._merged_norm = None
+
+    def merge_weight(self, weight: Tensor) -> Tensor:
+        WP = super().merge_weight(weight)
+        eps = torch.finfo(WP.dtype).eps if self.norm_epsilon else 0.0
+        self._merged_norm = self._weight_norm(WP) + eps
+        return self.dora_scale.detach().float().to(device=WP.device) * (WP / self._merged_norm)
+
+    def unmerge_weight(self, weight: Tensor) -> Tensor:
+        WP = weight * (self._merged_norm / self.dora_scale.detach().float().to(device=weight.device))
+        self._merged_norm = None
+        return super().unmerge_weight(WP)
+
+    @torch.no_grad()
+    def set_low_rank(self, up: Tensor, down: Tensor):
+        super().set_low_rank(up, down)
+
+        # The magnitude is taken from the fine-tuned weight, the direction
+        # from the base weight and the low rank difference.
+        orig_weight = _get_float_weight(self.orig_module, up.device)
+        self.dora_scale.copy_(self._weight_norm(orig_weight))
+        del orig_weight
+
 
 DummyLoRAModule = LoRAModule.make_dummy()
 DummyDoRAModule = DoRAModule.make_dummy()
@@ -608,6 +951,7 @@ class LoRAModuleWrapper:
                 self.additional_kwargs = {
                     'norm_epsilon': config.lora_decompose_norm_epsilon,
                     'decompose_output_axis': config.lora_decompose_output_axis,
+                    'low_rank_norm': config.lora_decompose_low_rank_norm,
                     'train_device': torch.device(config.train_device),
                 }
             else:
@@ -783,19 +1127,52 @@ class LoRAModuleWrapper:
         for module in self.lora_modules.values():
             module.remove_hook_from_module()
 
-    def apply_to_module(self):
+    def apply_to_module(self, stash_device: torch.device | None = None):
         """
         Applys the LoRA to the module, changing its weights
+
+        Args:
+            stash_device: the device that keeps the original tensors of quantized layers until they are restored
         """
         for module in self.lora_modules.values():
-            module.apply_to_module()
+            if not isinstance(module, self.dummy_klass):
+                module.apply_to_module(stash_device)
 
-    def extract_from_module(self, base_module: nn.Module):
+    def remove_from_module(self):
         """
-        Creates a LoRA from the difference between the base_module and the orig_module
+        Removes the applied LoRA from the module, restoring its weights
         """
         for module in self.lora_modules.values():
-            module.extract_from_module(base_module)
+            if not isinstance(module, self.dummy_klass):
+                module.remove_from_module()
+
+    def extract_from_module(self, base_module: nn.Module, device: torch.device | None = None, batch_size: int = 16):
+        """
+        Creates a LoRA from the difference between the base_module and the orig_module
+
+        Args:
+            base_module: the base module, with the same structure as the orig_module
+            device: the device used for the decomposition, defaults to the device of each layer
+            batch_size: the maximum number of same-shaped layers decomposed in a single SVD call
+        """
+        base_modules = {name.replace(".checkpoint.", "."): module for name, module in base_module.named_modules()}
+        lora_modules = {
+            name: module for (name, module) in self.lora_modules.items()
+            if not isinstance(module, self.dummy_klass)
+        }
+
+        low_rank_names = [name for (name, module) in lora_modules.items() if isinstance(module, LoRAModule | LoHaModule)]
+        if low_rank_names:
+            extract_low_rank(
+                [lora_modules[name] for name in low_rank_names],
+                [base_modules[name] for name in low_rank_names],
+                device=device,
+                batch_size=batch_size,
+            )
+
+        for name, module in lora_modules.items():
+            if name not in low_rank_names:
+                module.extract_from_module(base_modules[name])
 
     def prune(self):
         """
@@ -23,6 +23,13 @@ class WDModel(BaseImageCaptionModel):
             provider = "CUDAExecutionProvider" if "CUDAExecutionProvider" in onnxruntime.get_available_providers() else "CPUExecutionProvider"
         self.model = onnxruntime.InferenceSession(model_path, providers=[provider])
 
+        model_input = self.model.get_inputs()[0]
+        self.input_name = model_input.name
+        self.label_name = self.model.get_outputs()[0].name
+        _, self.input_height, self.input_width, _ = model_input.shape
+        # the batch dimension is a name if it is dynamic. a fixed batch size of 1 can only process single images
+        self.max_batch_size = model_input.shape[0] if isinstance(model_input.shape[0], int) else None
+
         label_path = huggingface_hub.hf_hub_download(
             "SmilingWolf/wd-v1-4-vit-tagger-v2", "selected_tags.csv"
         )
@@ -42,26 +49,15 @@ class WDModel(BaseImageCaptionModel):
 
                 self.tag_names.append(row["name"])
 
-    def generate_caption(
-            self,
-            caption_sample: CaptionSample,
-            initial_caption: str = "",
-            caption_prefix: str = "",
-            caption_postfix: str = "",
-    ):
-        _, height, width, _ = self.model.get_inputs()[0].shape
-
+    def prepare_sample(self, caption_sample: CaptionSample):
         image = caption_sample.get_image()
-        image = image.resize((width, height))
+        image = image.resize((self.input_width, self.input_height))
         image = np.asarray(image)
         image = image[:, :, ::-1]  # RGB to BGR
-        image = image.astype(np.float32)
-        image = np.expand_dims(image, 0)
+        caption_sample.inputs = image.astype(np.float32)
 
-        input_name = self.model.get_inputs()[0].name
-        label_name = self.model.get_outputs()[0].name
-        probs = self.model.run([label_name], {input_name: image})[0]
-        probs = probs[0].astype(float)
+    def __format_caption(self, probs: np.ndarray, caption_prefix: str, caption_postfix: str) -> str:
+        probs = probs.astype(float)
 
         general_labels = [(self.tag_names[i], probs[i]) for i in self.general_indexes if probs[i] > 0.35]
 
@@ -74,3 +70,32 @@ class WDModel(BaseImageCaptionModel):
         predicted_caption = (caption_prefix + predicted_caption + caption_postfix).strip()
 
         return predicted_caption
+
+    def generate_captions(
+            self,
+            caption_samples: list[CaptionSample],
+            initial_caption: str = "",
+            caption_prefix: str = "",
+            caption_postfix: str = "",
+    ) -> list[str]:
+        for caption_sample in caption_samples:
+            if caption_sample.inputs is None:
+                self.prepare_sample(caption_sample)
+
+        batch_size = self.max_batch_size or len(caption_samples)
+        predicted_captions = []
+        for start in range(0, len(caption_samples), batch_size):
+            images = np.stack([caption_sample.inputs for caption_sample in caption_samples[start:start + batch_size]])
+            probs = self.model.run([self.label_name], {self.input_name: images})[0]
+            predicted_captions.extend(self.__format_caption(p, caption_prefix, caption_postfix) for p in probs)
+
+        return predicted_captions
+
+    def generate_caption(
+            self,
+            caption_sample: CaptionSample,
+            initial_caption: str = "",
+            caption_prefix: str = "",
+            caption_postfix: str = "",
+    ):
+        return self.generate_captions([caption_sample], initial_caption, caption_prefix, caption_postfix)[0]
@@ -49,6 +49,16 @@ class LinearFp8(
                 weight = weight.to(device=orig_device)
         self.weight.data = weight
 
+    def _set_quantized(self):
+        self.is_quantized = True
+
+    def requantize(self, weight: torch.Tensor, device: torch.device | None = None):
+        # quantize() writes the scale in place, detach it from the previous scale tensor first
+        self.is_quantized = False
+        self._scale.data = torch.empty_like(self._scale)
+        self.weight.data = weight
+        self.quantize(device=device)
+
     def forward(self, x: torch.Tensor) -> torch.Tensor:
         weight = self.weight.detach()
         weight = weight.to(dtype=self.compute_dtype if self.compute_dtype is not None else x.dtype)
@@ -64,6 +64,9 @@ class LinearNf4(
 
     def quantize(self, device: torch.device | None = None):
         if self.is_quantized:
+            # the layer can be quantized while loading, before the final compute dtype is known
+            if self.quant_state is not None:
+                self.quant_state.dtype = self.compute_dtype
             return
         self.is_quantized = True
 
@@ -94,6 +97,11 @@ class LinearNf4(
         self.requires_grad_(False)
         self.weight.data = weight
 
+        self._set_quantized()
+
+    def _set_quantized(self):
+        self.is_quantized = True
+        self.requires_grad_(False)
         self.quant_state = bnb.functional.QuantState(
             absmax=self._absmax,
             shape=self.shape,
@@ -114,6 +122,12 @@ class LinearNf4(
             ),
         )
 
+    def requantize(self, weight: torch.Tensor, device: torch.device | None = None):
+        # quantize() replaces the data of all quantization buffers, the previous tensors stay untouched
+        self.is_quantized = False
+        self.weight.data = weight
+        self.quantize(device=device)
+
     def forward(self, x: torch.Tensor) -> torch.Tensor:
         orig_dtype = x.dtype
         x = x.to(dtype=self.compute_dtype)
@@ -98,6 +98,20 @@ def make_svd_linear(linear_class):
             self.weight.data = weight
             super().quantize(device=device)
 
+        def _set_quantized(self):
+            self.__svd_is_quantized = True
+            super()._set_quantized()
+
+        @torch.no_grad()
+        def requantize(self, weight: torch.Tensor, device: torch.device | None = None):
+            if not self.__svd_is_quantized:
+                super().requantize(weight, device=device)
+                return
+
+            # keep the SVD components and only requantize the residual
+            svd_weight = (self.svd_up @ self.svd_down).to(device=weight.device, dtype=weight.dtype)
+            super().requantize(weight - svd_weight, device=device)
+
         def forward(self, x: torch.Tensor) -> torch.Tensor:
             assert self.__svd_is_quantized
             assert not self.svd_down.requires_grad and not self.svd_up.requires_grad
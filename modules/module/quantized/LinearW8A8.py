@@ -119,6 +119,18 @@ class LinearW8A8(
 
         self.scale.copy_(scale)
 
+    def _set_quantized(self):
+        self.__is_quantized = True
+        self.requires_grad_(False)
+
+    @torch.no_grad()
+    def requantize(self, weight: torch.Tensor, device: torch.device | None = None):
+        # quantize() writes the scale in place, detach it from the previous scale tensor first
+        self.__is_quantized = False
+        self.scale.data = torch.empty_like(self.scale)
+        self.weight.data = weight
+        self.quantize(device=device)
+
     def forward(self, x_orig: torch.Tensor) -> torch.Tensor:
         assert not self.weight.requires_grad
         assert self.__is_quantized
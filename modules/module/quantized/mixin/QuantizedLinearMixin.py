@@ -11,3 +11,7 @@ class QuantizedLinearMixin(metaclass=ABCMeta):
     @abstractmethod
     def unquantized_weight(self, dtype: torch.dtype, device: torch.device) -> torch.Tensor:
         pass
+
+    @abstractmethod
+    def requantize(self, weight: torch.Tensor, device: torch.device | None = None):
+        pass
@@ -1,9 +1,31 @@
 from abc import ABCMeta, abstractmethod
 
 import torch
+from torch import nn
 
 
 class QuantizedModuleMixin(metaclass=ABCMeta):
     @abstractmethod
     def quantize(self, device: torch.device | None = None):
         pass
+
+    @abstractmethod
+    def _set_quantized(self):
+        pass
+
+    def quantized_state_dict(self) -> dict[str, torch.Tensor]:
+        # all direct tensors of the module after quantization, including the unquantized bias
+        return {
+            name: tensor.detach()
+            for name, tensor in list(self._parameters.items()) + list(self._buffers.items())
+            if tensor is not None
+        }
+
+    def load_quantized_state_dict(self, state_dict: dict[str, torch.Tensor]):
+        # restores a quantized_state_dict() without quantizing again
+        for name, value in state_dict.items():
+            if name in self._parameters:
+                self._parameters[name] = nn.Parameter(value, requires_grad=False)
+            else:
+                self._buffers[name].data = value
+        self._set_quantized()
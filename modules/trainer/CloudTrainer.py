@@ -32,11 +32,14 @@ class CloudTrainer(BaseTrainer):
         if config.tensorboard and not config.cloud.tensorboard_tunnel and not config.tensorboard_always_on:
             super()._start_tensorboard()
 
+        #a cache directory on the cloud can't be used for local caches:
+        local_cache_dir=config.cache_dir if config.cache_dir and not config.cache_dir.startswith("cloud:") else None
+
         match config.cloud.type:
             case CloudType.RUNPOD:
-                self.cloud=RunpodCloud(self.remote_config)
+                self.cloud=RunpodCloud(self.remote_config,local_cache_dir)
             case CloudType.LINUX:
-                self.cloud=LinuxCloud(self.remote_config)
+                self.cloud=LinuxCloud(self.remote_config,local_cache_dir)
 
     def start(self):
         try:
@@ -66,7 +69,8 @@ class CloudTrainer(BaseTrainer):
         def callback():
             while not self.stop_event.is_set():
                 try:
-                    self.cloud.exec_callback(self.callbacks)
+                    if self.cloud.exec_callback(self.callbacks):
+                        continue
                 except Exception:
                     traceback.print_exc()
                     self.callbacks.on_update_status("error: check the console for more information")
@@ -12,9 +12,10 @@ import modules.util.multi_gpu_util as multi
 from modules.dataLoader.BaseDataLoader import BaseDataLoader
 from modules.model.BaseModel import BaseModel
 from modules.modelLoader.BaseModelLoader import BaseModelLoader
-from modules.modelSampler.BaseModelSampler import BaseModelSampler, ModelSamplerOutput
+from modules.modelSampler.BaseModelSampler import BaseModelSampler, ModelSamplerOutput, SampleRequest
 from modules.modelSaver.BaseModelSaver import BaseModelSaver
 from modules.modelSetup.BaseModelSetup import BaseModelSetup
+from modules.module.LoRAModule import LoRAModuleWrapper
 from modules.trainer.BaseTrainer import BaseTrainer
 from modules.util import create, path_util
 from modules.util.bf16_stochastic_rounding import set_seed as bf16_stochastic_rounding_set_seed
@@ -29,7 +30,8 @@ from modules.util.enum.FileType import FileType
 from modules.util.enum.ModelFormat import ModelFormat
 from modules.util.enum.TimeUnit import TimeUnit
 from modules.util.enum.TrainingMethod import TrainingMethod
-from modules.util.profiling_util import TorchMemoryRecorder, TorchProfiler
+from modules.util.PredictionPlan import PredictionPlan
+from modules.util.profiling_util import OffloadTraceRecorder, TorchMemoryRecorder, TorchProfiler
 from modules.util.time_util import get_string_timestamp
 from modules.util.torch_util import torch_gc
 from modules.util.TrainProgress import TrainProgress
@@ -77,6 +79,7 @@ class GenericTrainer(BaseTrainer):
         self.model = None
         self.one_step_trained = False
         self.grad_hook_handles = []
+        self.merge_adapters_for_sampling = True
 
     def start(self):
         if multi.is_master():
@@ -214,63 +217,98 @@ class GenericTrainer(BaseTrainer):
             folder_postfix: str = "",
             is_custom_sample: bool = False,
     ):
+        def on_sample_default(tensorboard_tag: str):
+            def on_sample(sampler_output: ModelSamplerOutput):
+                if self.config.samples_to_tensorboard and sampler_output.file_type == FileType.IMAGE:
+                    self.tensorboard.add_image(
+                        tensorboard_tag, pil_to_tensor(sampler_output.data), train_progress.global_step
+                    )
+                self.callbacks.on_sample_default(sampler_output)
+            return on_sample
+
+        requests = []
         for i, sample_config in multi.distributed_enumerate(sample_config_list, distribute=not self.config.samples_to_tensorboard and not ema_applied):
             if sample_config.enabled:
-                try:
-                    safe_prompt = path_util.safe_filename(sample_config.prompt)
-
-                    if is_custom_sample:
-                        sample_dir = os.path.join(
-                            self.config.workspace_dir,
-                            "samples",
-                            "custom",
-                        )
-                    else:
-                        sample_dir = os.path.join(
-                            self.config.workspace_dir,
-                            "samples",
-                            f"{str(i)} - {safe_prompt}{folder_postfix}",
-                        )
-
-                    sample_path = os.path.join(
-                        sample_dir,
-                        f"{self.config.save_filename_prefix}{get_string_timestamp()}-training-sample-{train_progress.filename_string()}"
+                safe_prompt = path_util.safe_filename(sample_config.prompt)
+
+                if is_custom_sample:
+                    sample_dir = os.path.join(
+                        self.config.workspace_dir,
+                        "samples",
+                        "custom",
+                    )
+                else:
+                    sample_dir = os.path.join(
+                        self.config.workspace_dir,
+                        "samples",
+                        f"{str(i)} - {safe_prompt}{folder_postfix}",
                     )
 
-                    def on_sample_default(sampler_output: ModelSamplerOutput):
-                        if self.config.samples_to_tensorboard and sampler_output.file_type == FileType.IMAGE:
-                            self.tensorboard.add_image(
-                                f"sample{str(i)} - {safe_prompt}", pil_to_tensor(sampler_output.data),  # noqa: B023
-                                train_progress.global_step
-                            )
-                        self.callbacks.on_sample_default(sampler_output)
+                sample_path = os.path.join(
+                    sample_dir,
+                    f"{self.config.save_filename_prefix}{get_string_timestamp()}-training-sample-{train_progress.filename_string()}"
+                )
 
-                    def on_sample_custom(sampler_output: ModelSamplerOutput):
-                        self.callbacks.on_sample_custom(sampler_output)
+                if is_custom_sample:
+                    on_sample = self.callbacks.on_sample_custom
+                    on_update_progress = self.callbacks.on_update_sample_custom_progress
+                else:
+                    on_sample = on_sample_default(f"sample{str(i)} - {safe_prompt}")
+                    on_update_progress = self.callbacks.on_update_sample_default_progress
 
-                    on_sample = on_sample_custom if is_custom_sample else on_sample_default
-                    on_update_progress = self.callbacks.on_update_sample_custom_progress if is_custom_sample else self.callbacks.on_update_sample_default_progress
+                sample_config = copy.copy(sample_config)
+                sample_config.from_train_config(self.config)
 
-                    self.model.to(self.temp_device)
-                    self.model.eval()
+                requests.append(SampleRequest(sample_config, sample_path, on_sample, on_update_progress))
 
-                    sample_config = copy.copy(sample_config)
-                    sample_config.from_train_config(self.config)
+        if not requests:
+            return
 
-                    self.model_sampler.sample(
-                        sample_config=sample_config,
-                        destination=sample_path,
-                        image_format=self.config.sample_image_format,
-                        video_format=self.config.sample_video_format,
-                        audio_format=self.config.sample_audio_format,
-                        on_sample=on_sample,
-                        on_update_progress=on_update_progress,
-                    )
-                except Exception:
-                    traceback.print_exc()
-                    print("Error during sampling, proceeding without sampling")
+        # all samples of this round are passed to the sampler at once, so it can batch them. The sampler handles the
+        # errors of single samples, this only catches errors that affect the whole round
+        merged_adapters = self.__merge_adapters()
+        try:
+            self.model.to(self.temp_device)
+            self.model.eval()
+
+            self.model_sampler.sample_batch(
+                requests,
+                image_format=self.config.sample_image_format,
+                video_format=self.config.sample_video_format,
+                audio_format=self.config.sample_audio_format,
+                batch_size=self.config.sample_batch_size,
+            )
+        except Exception:
+            traceback.print_exc()
+            print("Error during sampling, proceeding without sampling")
+        finally:
+            for adapter in merged_adapters:
+                adapter.remove_from_module()
 
-                torch_gc()
+        torch_gc()
+
+    def __merge_adapters(self) -> list[LoRAModuleWrapper]:
+        # samples are created with the adapters merged into the weights, so the sampler runs at the speed of the base
+        # model instead of executing the hooked low rank layers. Layer offloading copies layers between devices on its
+        # own, so merging is skipped if it is enabled.
+        if not self.merge_adapters_for_sampling or (self.config.gradient_checkpointing.offload() \
+                and (self.config.layer_offload_fraction > 0 or self.config.layer_offload_vram_budget > 0)):
+            return []
+
+        adapters = self.model.adapters()
+        try:
+            for adapter in adapters:
+                # the original tensors of the merged layers are kept on the temp device until they are restored
+                adapter.apply_to_module(stash_device=self.temp_device)
+        except Exception as e:
+            # some layers can't be merged, like GGUF layers. Sampling then always uses the hooked layers
+            print(f"Could not merge the adapters into the model, sampling with unmerged adapters: {e}")
+            for adapter in adapters:
+                adapter.remove_from_module()
+            self.merge_adapters_for_sampling = False
+            return []
+
+        return adapters
 
     def __sample_during_training(
             self,
@@ -339,9 +377,34 @@ class GenericTrainer(BaseTrainer):
 
         torch_gc()
 
+    def __validation_concept_labels(self) -> tuple[list[int], list[str]]:
+        concept_seeds = []
+        concept_labels = []
+        for concept in self.validation_data_loader.get_concepts():
+            if concept.seed in concept_seeds:
+                continue
+
+            label = concept.name if concept.name else os.path.basename(concept.path)
+            # check and fix collision to display both graphs in tensorboard
+            if label in concept_labels:
+                suffix = 1
+                new_label = f"{label}({suffix})"
+                while new_label in concept_labels:
+                    suffix += 1
+                    new_label = f"{label}({suffix})"
+                label = new_label
+
+            concept_seeds.append(concept.seed)
+            concept_labels.append(label)
+
+        return concept_seeds, concept_labels
+
     def __validate(self, train_progress: TrainProgress):
         if self.__needs_validate(train_progress):
-            self.validation_data_loader.get_data_set().start_next_epoch()
+            # validation batches are distributed over all processes. Call start_next_epoch with only one process at first,
+            # because it might write to the cache:
+            for _ in multi.master_first():
+                self.validation_data_loader.get_data_set().start_next_epoch()
             current_epoch_length_validation = self.validation_data_loader.get_data_set().approximate_length()
 
             if current_epoch_length_validation == 0:
@@ -352,59 +415,62 @@ class GenericTrainer(BaseTrainer):
 
             torch_gc()
 
-            step_tqdm_validation = tqdm(
-                self.validation_data_loader.get_data_loader(),
-                desc="validation_step",
-                total=current_epoch_length_validation)
+            batches = self.validation_data_loader.get_data_loader()
+            if multi.is_master():
+                batches = tqdm(batches, desc="validation_step", total=current_epoch_length_validation)
 
-            accumulated_loss_per_concept = {}
-            concept_counts = {}
-            mapping_seed_to_label = {}
-            mapping_label_to_seed = {}
+            # losses are accumulated per concept on the train device, to avoid a device sync for each batch.
+            # They are only transferred once, after all batches are done
+            concept_seeds, concept_labels = self.__validation_concept_labels()
+            concept_seed_tensor = None
+            accumulated_loss_per_concept = torch.zeros(len(concept_seeds), dtype=torch.float32, device=self.train_device)
+            concept_counts = torch.zeros(len(concept_seeds), dtype=torch.float32, device=self.train_device)
 
-            for validation_batch in step_tqdm_validation:
+            for validation_batch in batches:
                 if self.__needs_gc(train_progress):
                     torch_gc()
 
                 with torch.no_grad():
+                    # noise, timestep and dropout of each sample are seeded from the sample itself, so the loss does not
+                    # depend on the batch size, the number of processes or the position of the sample in its batch
                     model_output_data = self.model_setup.predict(
-                        self.model, validation_batch, self.config, train_progress, deterministic=True)
+                        self.model, validation_batch, self.config, train_progress, deterministic=True,
+                        plan=PredictionPlan.from_samples(validation_batch))
                     loss_validation = self.model_setup.calculate_loss(
-                        self.model, validation_batch, model_output_data, self.config)
-
-                # since validation batch size = 1
-                concept_name = validation_batch["concept_name"][0]
-                concept_path = validation_batch["concept_path"][0]
-                concept_seed = validation_batch["concept_seed"].item()
-                loss = loss_validation.item()
-
-                label = concept_name if concept_name else os.path.basename(concept_path)
-                # check and fix collision to display both graphs in tensorboard
-                if label in mapping_label_to_seed and mapping_label_to_seed[label] != concept_seed:
-                    suffix = 1
-                    new_label = f"{label}({suffix})"
-                    while new_label in mapping_label_to_seed and mapping_label_to_seed[new_label] != concept_seed:
-                        suffix += 1
-                        new_label = f"{label}({suffix})"
-                    label = new_label
+                        self.model, validation_batch, model_output_data, self.config, per_sample=True)
+
+                    batch_concept_seeds = validation_batch["concept_seed"].to(device=self.train_device)
+                    if concept_seed_tensor is None:
+                        concept_seed_tensor = torch.tensor(concept_seeds, dtype=batch_concept_seeds.dtype, device=self.train_device)
+
+                    # one-hot mapping of the samples to their concepts, shape (batch_size, concept_count).
+                    # Samples that only pad an incomplete batch are not counted
+                    concept_mask = (batch_concept_seeds.unsqueeze(1) == concept_seed_tensor.unsqueeze(0)) \
+                        & ~validation_batch["padding_sample"].to(device=self.train_device).unsqueeze(1)
+                    concept_mask = concept_mask.to(torch.float32)
+                    accumulated_loss_per_concept += (concept_mask * loss_validation.to(torch.float32).unsqueeze(1)).sum(dim=0)
+                    concept_counts += concept_mask.sum(dim=0)
 
-                if concept_seed not in mapping_seed_to_label:
-                    mapping_seed_to_label[concept_seed] = label
-                    mapping_label_to_seed[label] = concept_seed
+            totals = torch.stack([accumulated_loss_per_concept, concept_counts])
+            if multi.is_enabled():
+                torch.distributed.all_reduce(totals, op=torch.distributed.ReduceOp.SUM)
+
+            if not multi.is_master():
+                return
 
-                accumulated_loss_per_concept[concept_seed] = accumulated_loss_per_concept.get(concept_seed, 0) + loss
-                concept_counts[concept_seed] = concept_counts.get(concept_seed, 0) + 1
+            accumulated_loss_per_concept, concept_counts = totals.tolist()
+            validated_concepts = [i for i, count in enumerate(concept_counts) if count > 0]
 
-            for concept_seed, total_loss in accumulated_loss_per_concept.items():
-                average_loss = total_loss / concept_counts[concept_seed]
+            for i in validated_concepts:
+                average_loss = accumulated_loss_per_concept[i] / concept_counts[i]
 
-                self.tensorboard.add_scalar(f"loss/validation_step/{mapping_seed_to_label[concept_seed]}",
+                self.tensorboard.add_scalar(f"loss/validation_step/{concept_labels[i]}",
                                             average_loss,
                                             train_progress.global_step)
 
-            if len(concept_counts) > 1:
-                total_loss = sum(accumulated_loss_per_concept[key] for key in concept_counts)
-                total_count = sum(concept_counts[key] for key in concept_counts)
+            if len(validated_concepts) > 1:
+                total_loss = sum(accumulated_loss_per_concept[i] for i in validated_concepts)
+                total_count = sum(concept_counts[i] for i in validated_concepts)
                 total_average_loss = total_loss / total_count
 
                 self.tensorboard.add_scalar("loss/validation_step/total_average",
@@ -542,9 +608,13 @@ class GenericTrainer(BaseTrainer):
         return self.repeating_action_needed("gc", 5, TimeUnit.MINUTE, train_progress, start_at_zero=False)
 
     def __needs_validate(self, train_progress: TrainProgress):
-        return self.repeating_action_needed(
+        needs_validate = self.repeating_action_needed(
             "validate", self.config.validate_after, self.config.validate_after_unit, train_progress
         )
+        if self.config.validate_after_unit.is_time_unit():
+            # validation is done by all processes, but time based intervals can elapse at different steps in each process
+            needs_validate = multi.broadcast_bool(needs_validate)
+        return needs_validate
 
     def __is_update_step(self, train_progress: TrainProgress) -> bool:
         return self.repeating_action_needed(
@@ -590,6 +660,8 @@ class GenericTrainer(BaseTrainer):
                                     after_reduce=__optimizer_step if fused_optimizer_step else None,
                                     async_op=self.config.async_gradient_reduce,
                                     max_buffer=self.config.async_gradient_reduce_buffer * 1024 * 1024,
+                                    bucket_size=self.config.gradient_reduce_bucket_size * 1024 * 1024,
+                                    defer=True,
                                 )
                             elif fused_optimizer_step:
                                 __optimizer_step(tensor)
@@ -720,24 +792,32 @@ class GenericTrainer(BaseTrainer):
 
                 self.callbacks.on_update_status("Training ...")
 
-                with TorchMemoryRecorder(enabled=False), TorchProfiler(enabled=False, filename=f"step{train_progress.global_step}.json"):
+                with TorchMemoryRecorder(enabled=False), TorchProfiler(enabled=False, filename=f"step{train_progress.global_step}.json"), \
+                        OffloadTraceRecorder(enabled=False, filename=f"offload_step{train_progress.global_step}.json"):
                     step_seed = train_progress.global_step
                     bf16_stochastic_rounding_set_seed(step_seed, train_device)
 
                     prior_pred_indices = [i for i in range(self.config.batch_size)
                                           if ConceptType(batch['concept_type'][i]) == ConceptType.PRIOR_PREDICTION]
-                    if len(prior_pred_indices) > 0 \
-                            or (self.config.masked_training
-                                and self.config.masked_prior_preservation_weight > 0
-                                and self.config.training_method == TrainingMethod.LORA):
+                    masked_prior_preservation = self.config.masked_training \
+                        and self.config.masked_prior_preservation_weight > 0 \
+                        and self.config.training_method == TrainingMethod.LORA
+                    if len(prior_pred_indices) > 0 or masked_prior_preservation:
+                        #masked prior preservation needs the prior prediction of all samples. Otherwise, the prior model only
+                        #predicts the prior prediction samples. The plan ensures that the subbatch uses exactly the same
+                        #timesteps, noise and conditioning as the same samples in the full batch:
+                        batch_size = len(batch['concept_type'])
+                        prior_plan = PredictionPlan(batch_size, None if masked_prior_preservation else prior_pred_indices)
                         with self.model_setup.prior_model(self.model, self.config), torch.no_grad():
-                            #do NOT create a subbatch using the indices, even though it would be more efficient:
-                            #different timesteps are used for a smaller subbatch by predict(), but the conditioning must match exactly:
-                            prior_model_output_data = self.model_setup.predict(self.model, batch, self.config, train_progress)
+                            prior_model_output_data = self.model_setup.predict(
+                                self.model, prior_plan.subbatch(batch), self.config, train_progress, plan=prior_plan)
                         model_output_data = self.model_setup.predict(self.model, batch, self.config, train_progress)
                         prior_model_prediction = prior_model_output_data['predicted'].to(dtype=model_output_data['target'].dtype)
-                        model_output_data['target'][prior_pred_indices] = prior_model_prediction[prior_pred_indices]
-                        model_output_data['prior_target'] = prior_model_prediction
+                        if masked_prior_preservation:
+                            model_output_data['target'][prior_pred_indices] = prior_model_prediction[prior_pred_indices]
+                            model_output_data['prior_target'] = prior_model_prediction
+                        else:
+                            model_output_data['target'][prior_pred_indices] = prior_model_prediction
                     else:
                         model_output_data = self.model_setup.predict(self.model, batch, self.config, train_progress)
 
@@ -758,7 +838,11 @@ class GenericTrainer(BaseTrainer):
                         if self.config.fused_gradient_reduce:
                             multi.finish_async(self.config.gradient_reduce_precision)
                         else:
-                            multi.reduce_grads_mean(self.parameters, self.config.gradient_reduce_precision)
+                            multi.reduce_grads_mean(
+                                self.parameters,
+                                self.config.gradient_reduce_precision,
+                                bucket_size=self.config.gradient_reduce_bucket_size * 1024 * 1024,
+                            )
 
                         if scaler and self.config.optimizer.optimizer.supports_fused_back_pass() and self.config.optimizer.fused_back_pass:
                             scaler.step_after_unscale_parameter_(self.model.optimizer)
@@ -816,7 +900,7 @@ class GenericTrainer(BaseTrainer):
 
                         self.one_step_trained = True
 
-                if self.config.validation and multi.is_master():
+                if self.config.validation:
                     self.__validate(train_progress)
 
                 train_progress.next_step(self.config.batch_size)
@@ -867,6 +951,8 @@ class GenericTrainer(BaseTrainer):
 
         if self.model is not None:
             self.model.to(self.temp_device)
+            for conductor in self.model.offload_conductors():
+                conductor.close()
 
         if multi.is_master():
             self.tensorboard.close()
@@ -101,6 +101,10 @@ class CloudTab:
                          tooltip="Update OneTrainer if it already exists on the cloud.")
         components.switch(self.frame, 6, 3, self.ui_state, "cloud.update_onetrainer")
 
+        components.label(self.frame, 7, 2, "Delta upload",
+                         tooltip="Upload files as content addressed chunks, and only upload the chunks that don't exist on the cloud yet. Files that were only touched, or changed in a few places, are not uploaded again. Unchanged chunks are copied from the existing files on the cloud, so no extra copy of the data is stored. The remote directory only keeps a list of chunk hashes for each uploaded file, about 65 bytes per 4 MiB of data.")
+        components.switch(self.frame, 7, 3, self.ui_state, "cloud.delta_upload")
+
         components.label(self.frame, 8, 2, "Detach remote trainer",
                          tooltip="Allows the trainer to keep running even if your connection to the cloud is lost.")
         components.switch(self.frame, 8, 3, self.ui_state, "cloud.detach_trainer")
@@ -9,6 +9,7 @@ import time
 import traceback
 
 from modules.util import concept_stats, path_util
+from modules.util.concept_index import ConceptFileType, ConceptIndex
 from modules.util.config.ConceptConfig import ConceptConfig
 from modules.util.config.TrainConfig import TrainConfig
 from modules.util.enum.BalancingStrategy import BalancingStrategy
@@ -604,19 +605,20 @@ class ConceptWindow(ctk.CTkToplevel):
 
     def __get_preview_image(self):
         preview_image_path = "resources/icons/icon.png"
-        file_index = -1
-        glob_pattern = "**/*.*" if self.concept.include_subdirectories else "*.*"
 
         concept_path = self.get_concept_path(self.concept.path)
         if concept_path:
-            for path in pathlib.Path(concept_path).glob(glob_pattern):
-                extension = os.path.splitext(path)[1]
-                if path.is_file() and path_util.is_supported_image_extension(extension) \
-                        and not path.name.endswith("-masklabel.png") and not path.name.endswith("-condlabel.png"):
-                    preview_image_path = path_util.canonical_join(concept_path, path)
-                    file_index += 1
-                    if file_index == self.image_preview_file_index:
-                        break
+            with ConceptIndex(concept_path, self.train_config.cache_dir) as concept_index:
+                concept_index.update(self.concept.include_subdirectories)
+                path = concept_index.path_at(
+                    self.image_preview_file_index, self.concept.include_subdirectories, [ConceptFileType.IMAGE])
+                if path is None:  # index past the end, show the last image
+                    count = concept_index.count(self.concept.include_subdirectories, [ConceptFileType.IMAGE])
+                    if count > 0:
+                        path = concept_index.path_at(
+                            count - 1, self.concept.include_subdirectories, [ConceptFileType.IMAGE])
+                if path is not None:
+                    preview_image_path = path
 
         image = load_image(preview_image_path, 'RGB')
         image_tensor = functional.to_tensor(image)
@@ -866,7 +868,6 @@ class ConceptWindow(ctk.CTkToplevel):
             print(f"Unable to get statistics for invalid concept path: {self.concept.path}")
             return
         start_time = time.perf_counter()
-        last_update = time.perf_counter()
         self.cancel_scan_flag.clear()
         self.concept_stats_tab.after(0, self.__disable_scan_buttons)
         concept_path = self.get_concept_path(self.concept.path)
@@ -875,20 +876,17 @@ class ConceptWindow(ctk.CTkToplevel):
            print(f"Unable to get statistics for invalid concept path: {self.concept.path}")
            self.concept_stats_tab.after(0, self.__enable_scan_buttons)
            return
-        subfolders = [concept_path]
 
         stats_dict = concept_stats.init_concept_stats(advanced_checks)
-        for path in subfolders:
-            if self.cancel_scan_flag.is_set() or time.perf_counter() - start_time > wait_time:
-                break
-            stats_dict = concept_stats.folder_scan(path, stats_dict, advanced_checks, self.concept, start_time, wait_time, self.cancel_scan_flag)
-            if self.concept.include_subdirectories and not self.cancel_scan_flag.is_set():     #add all subfolders of current directory to for loop
-                subfolders.extend([f for f in os.scandir(path) if f.is_dir()])
-            self.concept.concept_stats = stats_dict
-            #update GUI approx every half second
-            if time.perf_counter() > (last_update + 0.5):
-                last_update = time.perf_counter()
-                self.concept_stats_tab.after(0, self.__update_concept_stats)
+
+        def update_progress(progress_dict: dict):
+            self.concept.concept_stats = progress_dict
+            self.concept_stats_tab.after(0, self.__update_concept_stats)
+
+        with ConceptIndex(concept_path, self.train_config.cache_dir) as concept_index:
+            stats_dict = concept_stats.index_scan(concept_index, stats_dict, advanced_checks, self.concept.include_subdirectories, start_time, wait_time, self.cancel_scan_flag,
+                                                  progress_callback=update_progress)
+        self.concept.concept_stats = stats_dict
 
         self.cancel_scan_flag.clear()
         self.concept_stats_tab.after(0, self.__enable_scan_buttons)
@@ -83,6 +83,9 @@ class LoraTab:
             components.label(master, 3, 3, "Apply on output axis (DoRA Only)",
                              tooltip="Apply the weight decomposition on the output axis instead of the input axis.")
             components.switch(master, 3, 4, self.ui_state, "lora_decompose_output_axis")
+            components.label(master, 4, 3, "Low-Rank Norm (DoRA Only)",
+                             tooltip="Compute DoRA on Linear layers from the base output and a low-rank norm correction, instead of building the full weight in every step. Reduces memory and step time, especially for quantized models.")
+            components.switch(master, 4, 4, self.ui_state, "lora_decompose_low_rank_norm")
 
         # LoRA and LoHA shared settings
         if peft_type == PeftType.LORA or peft_type == PeftType.LOHA:
@@ -5,6 +5,7 @@ from modules.util.config.TrainConfig import TrainConfig
 from modules.util.enum.ConfigPart import ConfigPart
 from modules.util.enum.DataType import DataType
 from modules.util.enum.ModelFormat import ModelFormat
+from modules.util.enum.ModelHashMode import ModelHashMode
 from modules.util.enum.TrainingMethod import TrainingMethod
 from modules.util.ui import components
 from modules.util.ui.UIState import UIState
@@ -470,6 +471,16 @@ class ModelTab:
         components.entry(svd_entry_frame, 1, 0, self.ui_state, "quantization.svd_rank")
         row += 1
 
+        components.label(frame, row, 3, "Cache Quantized Weights",
+                         tooltip="Stores the quantized weights of each model in the cache directory, and loads them from there the next time the same model is quantized the same way. Each cached model can take several GB of disk space")
+        components.switch(frame, row, 4, self.ui_state, "quantization.cache_quantized_weights")
+        row += 1
+
+        components.label(frame, row, 3, "Quantization Cache Limit (GB)",
+                         tooltip="The maximum disk space used by cached quantized weights. The least recently used models are removed first")
+        components.entry(frame, row, 4, self.ui_state, "quantization.cache_size_limit")
+        row += 1
+
 
         if has_text_encoder:
             # text encoder weight dtype
@@ -660,4 +671,19 @@ class ModelTab:
 
         row += 1
 
+        # output hash
+        components.label(frame, row, 3, "Output Hash",
+                         tooltip="Hash stored in the header of safetensors files. It is calculated while the file is written. "
+                                 "SHA256: A single sha256 of the tensor data, stored as the model spec hash. "
+                                 "SHA256 Tree: A sha256 of the sha256 hashes of 16MB chunks, calculated on multiple threads. "
+                                 "Faster for large models, but not comparable to hashes calculated by other tools. "
+                                 "It is stored in a separate OneTrainer entry, and the model spec hash is omitted.")
+        components.options_kv(frame, row, 4, [
+            ("None", ModelHashMode.NONE),
+            ("SHA256", ModelHashMode.SHA256),
+            ("SHA256 Tree", ModelHashMode.SHA256_TREE),
+        ], self.ui_state, "output_model_hash")
+
+        row += 1
+
         return row
@@ -68,6 +68,16 @@ class OffloadingWindow(ctk.CTkToplevel):
                          tooltip="Enables offloading of individual layers during training to reduce VRAM usage. Increases training time and uses more RAM. Only available if checkpointing is set to CPU_OFFLOADED. values between 0 and 1, 0=disabled")
         components.entry(frame, 3, 1, self.ui_state, "layer_offload_fraction")
 
+        # automatic layer offloading
+        components.label(frame, 4, 0, "Layer offload VRAM budget",
+                         tooltip="Automatically chooses the layer offload fraction, and whether activations are offloaded if Offload Activations is enabled, for each resolution, using the fastest setting that keeps the VRAM usage of a training step below this budget in GiB. The layer offload fraction is used as a starting point. Only available if checkpointing is set to CPU_OFFLOADED. 0=disabled")
+        components.entry(frame, 4, 1, self.ui_state, "layer_offload_vram_budget")
+
+        # disk tier for offloaded layers
+        components.label(frame, 5, 0, "Layer offload disk directory",
+                         tooltip="Stores offloaded layers in a file in this directory instead of RAM, ideally on a fast NVMe drive. Reduces RAM usage, but transfers can be slower. Needs free disk space for the size of the offloaded model. Only used if layer offloading is enabled. Training offloaded layers requires Fused Back Pass. Empty=disabled")
+        components.dir_entry(frame, 5, 1, self.ui_state, "layer_offload_disk_path")
+
         frame.pack(fill="both", expand=1)
         return frame
 
@@ -291,6 +291,10 @@ class TrainUI(ctk.CTk):
                          tooltip="The interval used when validate training")
         components.time_entry(frame, 8, 3, self.ui_state, "validate_after", "validate_after_unit")
 
+        components.label(frame, 9, 2, "Validation Batch Size",
+                         tooltip="The batch size used to calculate the validation loss. With Multi-GPU, validation batches are distributed over all GPUs")
+        components.entry(frame, 9, 3, self.ui_state, "validation_batch_size")
+
         # device
         components.label(frame, 10, 0, "Dataloader Threads",
                          tooltip="Number of threads used for the data loader. Increase if your GPU has room during caching, decrease if it's going out of memory during caching.")
@@ -330,6 +334,9 @@ class TrainUI(ctk.CTk):
         components.label(frame, 15, 0, "Temp Device",
                          tooltip="The device used to temporarily offload models while they are not used. Default:\"cpu\"")
         components.entry(frame, 15, 1, self.ui_state, "temp_device")
+        components.label(frame, 15, 2, "Bucket size (MB)",
+                         tooltip="Multi-GPU: Gradients are packed into buckets of this size, in megabytes, and each bucket is reduced in a single operation. Fewer, larger operations are more efficient. 0 reduces each gradient separately")
+        components.entry(frame, 15, 3, self.ui_state, "gradient_reduce_bucket_size")
 
         frame.pack(fill="both", expand=1)
         return frame
@@ -410,6 +417,10 @@ class TrainUI(ctk.CTk):
                          tooltip="Whether to include sample images in the Tensorboard output.")
         components.switch(sub_frame, 0, 3, self.ui_state, "samples_to_tensorboard")
 
+        components.label(sub_frame, 0, 4, "Sample Batch Size",
+                         tooltip="The number of samples with the same resolution and settings that are generated together. Higher values sample faster, but need more VRAM.")
+        components.entry(sub_frame, 0, 5, self.ui_state, "sample_batch_size", width=50, sticky="nw")
+
         # table
         frame = ctk.CTkFrame(master=master, corner_radius=0)
         frame.grid(row=1, column=0, sticky="nsew")
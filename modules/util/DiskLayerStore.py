@@ -0,0 +1,313 @@
+import contextlib
+import glob
+import os
+import tempfile
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from modules.util.torch_util import pin_tensor_, unpin_tensor_
+
+import torch
+
+# number of staging buffers, each one can hold the largest layer
+DEFAULT_NUM_STAGING_SLOTS = 4
+
+
+def _ceil_16(number: int) -> int:
+    return number + (16 - (number % 16)) % 16
+
+
+class _TensorLayout:
+    def __init__(self, offset: int, num_bytes: int, dtype: torch.dtype, shape: torch.Size):
+        self.offset = offset
+        self.num_bytes = num_bytes
+        self.dtype = dtype
+        self.shape = shape
+
+
+class _StagingSlot:
+    def __init__(self, buffer: torch.Tensor):
+        self.buffer = buffer
+
+        # the layer with valid data in the buffer, or None if the slot is free
+        self.layer_index: int | None = None
+        # a pending read into, or write from the buffer
+        self.future: Future | None = None
+        # the end of the last transfer between the buffer and the train device
+        self.transfer_event: torch.cuda.Event | None = None
+        # the buffer is used by the caller between load() and release()
+        self.in_use = False
+        # tensors that point to the buffer until the pending write has finished
+        self.written_tensors: list[torch.Tensor] | None = None
+
+
+class DiskLayerStore:
+    """
+    Stores the offloaded tensors of a list of layers in a memory mapped file, as a tier below the host memory. Each
+    layer is a contiguous range of the file, and each tensor is placed at a 16 byte aligned offset within its layer.
+    Only the staging buffers use host memory. The file itself is cached by the operating system, which can evict it
+    when host memory is needed.
+
+    The file is read and written by a single background thread, through a small ring of staging buffers that are
+    pinned for asynchronous transfers. Reads and writes are executed in the order they are requested, so a layer that
+    is read after it was written always returns the written data. All other methods must be called from the thread
+    that owns the layers.
+
+    The file is created with a unique name in the given directory, so several stores and processes can share it. On
+    POSIX systems, the file is deleted after it is mapped, and its disk space is freed when the process exits. On other
+    systems, a mapped file can't be deleted. It is deleted by close() if possible, and otherwise by the next store that
+    is created with the same prefix.
+    """
+
+    def __init__(
+            self,
+            directory: str,
+            prefix: str,
+            layer_tensors: list[list[torch.Tensor]],
+            num_staging_slots: int = DEFAULT_NUM_STAGING_SLOTS,
+    ):
+        self.__layer_offsets = []
+        self.__layer_sizes = []
+        self.__tensor_layouts = []
+        file_size = 0
+        for tensors in layer_tensors:
+            layouts = []
+            layer_size = 0
+            for tensor in tensors:
+                num_bytes = tensor.element_size() * tensor.numel()
+                layouts.append(_TensorLayout(layer_size, num_bytes, tensor.dtype, tensor.shape))
+                layer_size += _ceil_16(num_bytes)
+
+            self.__layer_offsets.append(file_size)
+            self.__layer_sizes.append(layer_size)
+            self.__tensor_layouts.append(layouts)
+            file_size += layer_size
+
+        os.makedirs(directory, exist_ok=True)
+        if os.name != "posix":
+            # files of processes that exited without deleting them. Files that are still mapped can't be deleted
+            for stale_filename in glob.glob(os.path.join(glob.escape(directory), glob.escape(prefix) + "*.bin")):
+                with contextlib.suppress(OSError):
+                    os.remove(stale_filename)
+
+        fd, self.__filename = tempfile.mkstemp(suffix=".bin", prefix=prefix, dir=directory)
+        try:
+            os.ftruncate(fd, max(file_size, 1))
+        finally:
+            os.close(fd)
+        self.__file = torch.from_file(self.__filename, shared=True, size=max(file_size, 1), dtype=torch.uint8)
+        if os.name == "posix":
+            # the mapping stays valid after the file is removed
+            os.remove(self.__filename)
+            self.__filename = None
+
+        slot_size = max(self.__layer_sizes, default=0)
+        self.__slots = []
+        for _ in range(num_staging_slots):
+            buffer = torch.zeros((max(slot_size, 1),), dtype=torch.uint8)
+            pin_tensor_(buffer)
+            self.__slots.append(_StagingSlot(buffer))
+
+        self.__is_written = [False] * len(layer_tensors)
+        self.__executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="disk_layer_store")
+
+    def num_staging_slots(self) -> int:
+        return len(self.__slots)
+
+    def staging_bytes(self) -> int:
+        return sum(slot.buffer.shape[0] for slot in self.__slots)
+
+    def is_written(self, layer_index: int) -> bool:
+        return self.__is_written[layer_index]
+
+    def host_tensors(self, layer_index: int) -> list[torch.Tensor]:
+        """
+        Returns the tensors of a layer, backed by the memory mapped file
+        """
+        return self.__views(self.__file, self.__layer_offsets[layer_index], layer_index)
+
+    def write(self, layer_index: int, tensors: list[torch.Tensor]):
+        """
+        Writes the tensors of a layer to the file, and waits until the data is written
+        """
+        self.synchronize()
+        self.__drop_staged(layer_index)
+        for host_tensor, tensor in zip(self.host_tensors(layer_index), tensors, strict=True):
+            host_tensor.copy_(tensor.detach())
+        self.__is_written[layer_index] = True
+
+    def prefetch(self, layer_index: int) -> bool:
+        """
+        Starts reading a layer into a free staging buffer. Returns False if no buffer is free.
+        """
+        if self.__find_slot(layer_index) is not None:
+            return True
+
+        slot = self.__free_slot(blocking=False)
+        if slot is None:
+            return False
+
+        self.__read_async(slot, layer_index)
+        return True
+
+    def load(self, layer_index: int) -> list[torch.Tensor]:
+        """
+        Returns the tensors of a layer in a staging buffer, which can be copied to the train device. The buffer can
+        not be reused until release() is called.
+        """
+        slot = self.__find_slot(layer_index)
+        if slot is None:
+            slot = self.__free_slot(blocking=True)
+            self.__read_async(slot, layer_index)
+
+        if slot.future is not None and slot.written_tensors is None:
+            slot.future.result()
+            slot.future = None
+        # the tensors are loaded by the caller, they should not point to the file after the write finished
+        slot.written_tensors = None
+        slot.in_use = True
+        return self.__views(slot.buffer, 0, layer_index)
+
+    def release(self, layer_index: int, transfer_event: torch.cuda.Event | None):
+        """
+        Releases the staging buffer of a layer after load(). transfer_event marks the end of the copies from it.
+        """
+        slot = self.__find_slot(layer_index)
+        slot.in_use = False
+        slot.transfer_event = transfer_event
+        if slot.future is not None:
+            # the layer was loaded while its data was still being written from this buffer
+            slot.future.result()
+            slot.future = None
+        # the buffer is free for other layers, a later load() reads the layer from the file again
+        slot.layer_index = None
+
+    def begin_write(self, layer_index: int) -> list[torch.Tensor]:
+        """
+        Returns tensors in a staging buffer to copy the current data of a layer into. The data is written to the file
+        after end_write() is called.
+        """
+        self.__drop_staged(layer_index)
+        slot = self.__free_slot(blocking=True)
+        slot.layer_index = layer_index
+        slot.in_use = True
+        return self.__views(slot.buffer, 0, layer_index)
+
+    def end_write(self, layer_index: int, tensors: list[torch.Tensor], transfer_event: torch.cuda.Event | None):
+        """
+        Writes a layer to the file in the background, after the copies into the staging buffer are finished.
+        transfer_event marks the end of the copies. The tensors of the layer point to the staging buffer until the
+        data is written, then they point to the file.
+        """
+        slot = self.__find_slot(layer_index)
+        slot.in_use = False
+        slot.transfer_event = None
+        slot.written_tensors = tensors
+        for tensor, staged_tensor in zip(tensors, self.__views(slot.buffer, 0, layer_index), strict=True):
+            tensor.data = staged_tensor
+
+        offset = self.__layer_offsets[layer_index]
+        size = self.__layer_sizes[layer_index]
+        slot.future = self.__executor.submit(self.__write_slot, slot, transfer_event, offset, size)
+        self.__is_written[layer_index] = True
+
+    def synchronize(self):
+        """
+        Waits until all reads and writes are finished
+        """
+        for slot in self.__slots:
+            if slot.future is not None and not slot.in_use:
+                slot.future.result()
+                self.__finish_write(slot)
+
+    def __views(self, buffer: torch.Tensor, offset: int, layer_index: int) -> list[torch.Tensor]:
+        return [
+            buffer[offset + layout.offset:offset + layout.offset + layout.num_bytes]
+            .view(dtype=layout.dtype).view(size=layout.shape)
+            for layout in self.__tensor_layouts[layer_index]
+        ]
+
+    def __find_slot(self, layer_index: int) -> _StagingSlot | None:
+        for slot in self.__slots:
+            if slot.layer_index == layer_index:
+                return slot
+        return None
+
+    def __drop_staged(self, layer_index: int):
+        # the data of the layer will change, staged copies are no longer valid
+        slot = self.__find_slot(layer_index)
+        if slot is not None and not slot.in_use:
+            if slot.future is not None:
+                slot.future.result()
+                self.__finish_write(slot)
+            slot.layer_index = None
+
+    def __finish_write(self, slot: _StagingSlot):
+        slot.future = None
+        if slot.written_tensors is not None:
+            for tensor, host_tensor in zip(slot.written_tensors, self.host_tensors(slot.layer_index), strict=True):
+                tensor.data = host_tensor
+            slot.written_tensors = None
+            slot.layer_index = None
+
+    def __is_free(self, slot: _StagingSlot) -> bool:
+        if slot.in_use or slot.layer_index is not None:
+            return False
+        return slot.transfer_event is None or slot.transfer_event.query()
+
+    def __free_slot(self, blocking: bool) -> _StagingSlot | None:
+        for slot in self.__slots:
+            if slot.future is not None and slot.written_tensors is not None and slot.future.done():
+                self.__finish_write(slot)
+
+        for slot in self.__slots:
+            if self.__is_free(slot):
+                slot.transfer_event = None
+                return slot
+
+        if not blocking:
+            return None
+
+        # wait for pending transfers and writes first, then drop staged layers that were not requested
+        candidates = [slot for slot in self.__slots if not slot.in_use]
+        if not candidates:
+            raise RuntimeError("all staging buffers of the disk layer store are in use")
+        slot = min(candidates, key=lambda x: x.layer_index is not None and x.written_tensors is None)
+        if slot.future is not None:
+            slot.future.result()
+            self.__finish_write(slot)
+        if slot.transfer_event is not None:
+            slot.transfer_event.synchronize()
+            slot.transfer_event = None
+        slot.layer_index = None
+        return slot
+
+    def __read_async(self, slot: _StagingSlot, layer_index: int):
+        slot.layer_index = layer_index
+        offset = self.__layer_offsets[layer_index]
+        size = self.__layer_sizes[layer_index]
+        slot.future = self.__executor.submit(self.__read_slot, slot, offset, size)
+
+    def __read_slot(self, slot: _StagingSlot, offset: int, size: int):
+        slot.buffer[:size].copy_(self.__file[offset:offset + size])
+
+    def __write_slot(self, slot: _StagingSlot, transfer_event: torch.cuda.Event | None, offset: int, size: int):
+        if transfer_event is not None:
+            transfer_event.synchronize()
+        self.__file[offset:offset + size].copy_(slot.buffer[:size])
+
+    def close(self):
+        """
+        Waits for pending writes and frees the staging buffers. Tensors returned by host_tensors() stay valid. On
+        systems other than POSIX, the file is deleted if no tensor points to it anymore.
+        """
+        self.synchronize()
+        self.__executor.shutdown()
+        for slot in self.__slots:
+            unpin_tensor_(slot.buffer)
+        self.__slots = []
+
+        if self.__filename is not None:
+            self.__file = None
+            with contextlib.suppress(OSError):
+                os.remove(self.__filename)
+            self.__filename = None
@@ -1,9 +1,13 @@
 import math
 import random
+from collections.abc import Callable
 from typing import Any
 
 from modules.util.config.TrainConfig import TrainConfig
-from modules.util.quantization_util import get_offload_tensor_bytes, offload_quantized
+from modules.util.DiskLayerStore import DiskLayerStore
+from modules.util.LayerOffloadPlanner import LayerOffloadPlanner
+from modules.util.OffloadTrace import OffloadTrace, active_offload_trace
+from modules.util.quantization_util import get_offload_tensor_bytes, get_offload_tensors, offload_quantized
 from modules.util.torch_util import (
     create_stream_context,
     device_equals,
@@ -166,23 +170,30 @@ class StaticLayerAllocator:
             self.__max_tensor_bytes = max(self.__max_tensor_bytes, *layer_tensor_bytes)
             self.__layer_bytes.append(sum(layer_tensor_bytes))
 
-        cache_bytes = target_bytes
+        num_cache_tensors, self.cache_tensor_size = self.get_cache_layout(target_bytes, self.__max_tensor_bytes)
+
+        self.__tensor_allocators = [None] * len(layers)
+        self.cache_tensors = [None] * num_cache_tensors
+        self.allocation_start = 0
+        self.allocation_end = 0
+
+    @staticmethod
+    def get_cache_layout(cache_bytes: int, max_tensor_bytes: int) -> tuple[int, int]:
+        """
+        Returns the number of cache tensors and the size of each cache tensor in bytes
+        """
         num_cache_tensors = min(
             # no more than 10% overhead
-            math.ceil(int(cache_bytes * 0.10) / self.__max_tensor_bytes),
-            # at least twice self.__max_tensor_bytes for each tensor
-            math.ceil(cache_bytes / (self.__max_tensor_bytes * 2)),
+            math.ceil(int(cache_bytes * 0.10) / max_tensor_bytes),
+            # at least twice max_tensor_bytes for each tensor
+            math.ceil(cache_bytes / (max_tensor_bytes * 2)),
             # no more than 10 cache tensors
             10
         )
-        # add self.__max_tensor_bytes to ensure even the largest tensors can be allocated in the remaining space
+        # add max_tensor_bytes to ensure even the largest tensors can be allocated in the remaining space
         # add 4kb for the alignment overhead
-        self.cache_tensor_size = math.ceil(cache_bytes / num_cache_tensors) + self.__max_tensor_bytes + 4096
-
-        self.__tensor_allocators = [None] * len(layers)
-        self.cache_tensors = [None] * num_cache_tensors
-        self.allocation_start = 0
-        self.allocation_end = 0
+        cache_tensor_size = math.ceil(cache_bytes / num_cache_tensors) + max_tensor_bytes + 4096
+        return num_cache_tensors, cache_tensor_size
 
     def ensure_allocation(self, cache_tensor_index: int):
         if self.cache_tensors[cache_tensor_index] is None:
@@ -192,6 +203,8 @@ class StaticLayerAllocator:
                 torch.zeros((self.cache_tensor_size,), dtype=torch.int8, device=self.device)
 
             log(f"tensor {cache_tensor_index} not allocated, allocating {self.cache_tensor_size} bytes")
+            if (trace := active_offload_trace()) is not None:
+                trace.counter(f"layer cache {self.device}", self.cache_tensor_size)
 
             if self.__is_pinned:
                 pin_tensor_(self.cache_tensors[cache_tensor_index])
@@ -204,9 +217,15 @@ class StaticLayerAllocator:
             if cache_tensor is not None and self.__is_pinned:
                 unpin_tensor_(cache_tensor)
 
+        if (trace := active_offload_trace()) is not None:
+            trace.counter(f"layer cache {self.device}", -self.allocated_cache_bytes())
+
         self.cache_tensors = [None] * len(self.cache_tensors)
         self.__tensor_allocators = [None] * len(self.__tensor_allocators)
 
+    def allocated_cache_bytes(self) -> int:
+        return sum(self.cache_tensor_size for x in self.cache_tensors if x is not None)
+
     def get_allocator(self, layer_index: int, allocate_forward: bool) -> StaticLayerTensorAllocator | None:
         if self.__allocate_statically:
             allocator = StaticLayerTensorAllocator(self, allocate_forward, layer_index)
@@ -277,6 +296,9 @@ class StaticActivationAllocator:
             self.__cache_tensors.append(cache_tensor)
             self.__allocated_bytes += num_bytes
 
+            if (trace := active_offload_trace()) is not None:
+                trace.counter(f"activations cache {self.__device}", num_bytes)
+
         self.__max_allocated_bytes = max(self.__max_allocated_bytes, self.__allocated_bytes)
 
     def allocate_like(self, source_tensor: torch.Tensor) -> torch.Tensor:
@@ -295,6 +317,9 @@ class StaticActivationAllocator:
                 for cache_tensor in self.__cache_tensors:
                     unpin_tensor_(cache_tensor)
 
+            if (trace := active_offload_trace()) is not None:
+                trace.counter(f"activations cache {self.__device}", -self.__allocated_bytes)
+
             self.__cache_tensors = []
             torch_gc()
 
@@ -308,6 +333,9 @@ class StaticActivationAllocator:
 
             self.__cache_tensors = [cache_tensor]
 
+            if (trace := active_offload_trace()) is not None:
+                trace.counter(f"activations cache {self.__device}", num_bytes)
+
         self.__current_cache_tensor = 0
         self.__current_cache_tensor_offset = 0
         self.__allocated_bytes = sum(cache_tensor.shape[0] for cache_tensor in self.__cache_tensors)
@@ -317,6 +345,10 @@ class StaticActivationAllocator:
             for cache_tensor in self.__cache_tensors:
                 unpin_tensor_(cache_tensor)
 
+        if (trace := active_offload_trace()) is not None:
+            trace.counter(
+                f"activations cache {self.__device}", -sum(x.shape[0] for x in self.__cache_tensors))
+
         self.__cache_tensors = []
 
 
@@ -376,10 +408,9 @@ class SyncEvent:
 class LayerOffloadStrategy:
     def __init__(
             self,
-            layers: list[nn.Module],
+            layer_bytes: list[int],
             layer_offload_fraction: float,
     ):
-        layer_bytes = [sum([get_offload_tensor_bytes(x) for x in layer.modules()]) for layer in layers]
         total_bytes = sum(layer_bytes)
         target_loaded_bytes = int(total_bytes * (1.0 - layer_offload_fraction))
 
@@ -407,7 +438,7 @@ class LayerOffloadStrategy:
             max_bytes=target_loaded_bytes,
             is_forward=True,
             is_cyclic=False,
-        ) for i in range(len(layers))]
+        ) for i in range(len(layer_bytes))]
 
         self.forward_forward_loaded_layers = [self.__get_layers_below(
             layer_bytes=layer_bytes,
@@ -415,7 +446,7 @@ class LayerOffloadStrategy:
             max_bytes=target_loaded_bytes,
             is_forward=True,
             is_cyclic=True,
-        ) for i in range(len(layers))]
+        ) for i in range(len(layer_bytes))]
 
         self.backward_forward_loaded_layers = [self.__get_layers_below(
             layer_bytes=layer_bytes,
@@ -423,7 +454,7 @@ class LayerOffloadStrategy:
             max_bytes=target_loaded_bytes,
             is_forward=False,
             is_cyclic=False,
-        ) for i in range(len(layers))]
+        ) for i in range(len(layer_bytes))]
 
         all_loaded_layers = self.forward_backward_loaded_layers \
                             + self.forward_forward_loaded_layers \
@@ -560,6 +591,24 @@ class LayerOffloadConductor:
 
     __deferred_layers: list[int]
 
+    __name: str
+    __layer_bytes: list[int]
+    __max_tensor_bytes: int
+    __trace_compute_start: tuple[torch.cuda.Event | None, float] | None
+
+    __vram_budget_bytes: int
+    __allow_activation_offloading: bool
+    __planner: LayerOffloadPlanner | None
+    __plan_pending: bool
+    __plan_key: tuple | None
+    __plan_layer_activation_bytes: int
+    __step_activation_bytes: int
+
+    __disk_path: str
+    __disk_store: DiskLayerStore | None
+    __dirty_layers: set[int]
+    __fused_optimizer_step: bool
+
     def __init__(
             self,
             module: nn.Module,
@@ -579,7 +628,8 @@ class LayerOffloadConductor:
         self.__temp_device = torch.device(config.temp_device)
 
         self.__offload_activations = config.gradient_checkpointing.offload() and config.enable_activation_offloading
-        self.__offload_layers = config.gradient_checkpointing.offload() and config.layer_offload_fraction > 0
+        self.__offload_layers = config.gradient_checkpointing.offload() \
+            and (config.layer_offload_fraction > 0 or config.layer_offload_vram_budget > 0)
         self.__async_transfer = self.__train_device.type == "cuda" and config.enable_async_offloading
 
         if self.__async_transfer:
@@ -610,17 +660,58 @@ class LayerOffloadConductor:
 
         self.__deferred_layers = []
 
+        self.__name = type(module).__name__
+        self.__layer_bytes = []
+        self.__max_tensor_bytes = 0
+        self.__trace_compute_start = None
+
+        # automatic offloading needs the memory statistics of the train device
+        self.__vram_budget_bytes = 0
+        if self.__offload_layers and config.layer_offload_vram_budget > 0:
+            if self.__train_device.type == "cuda":
+                self.__vram_budget_bytes = int(config.layer_offload_vram_budget * 1024**3)
+                self.__layer_offload_fraction = LayerOffloadPlanner.nearest_fraction(config.layer_offload_fraction)
+            else:
+                print(f"automatic layer offloading is not supported on {self.__train_device.type}, "
+                      f"using a layer offload fraction of {config.layer_offload_fraction}")
+                self.__offload_layers = config.layer_offload_fraction > 0
+        self.__allow_activation_offloading = self.__offload_activations
+        self.__planner = None
+        self.__plan_pending = False
+        self.__plan_key = None
+        self.__plan_layer_activation_bytes = 0
+        self.__step_activation_bytes = 0
+
+        # offloaded layers are stored in a file instead of the temp device cache
+        self.__disk_path = config.layer_offload_disk_path if self.__offload_layers else ""
+        self.__disk_store = None
+        self.__dirty_layers = set()
+        self.__fused_optimizer_step = config.optimizer.optimizer is not None \
+            and config.optimizer.optimizer.supports_fused_back_pass() and bool(config.optimizer.fused_back_pass)
+
     def offload_activated(self) -> bool:
         return self.__offload_activations or self.__offload_layers
 
     def layer_offload_activated(self) -> bool:
         return self.__offload_layers
 
+    def close(self):
+        """
+        Releases the disk store of offloaded layers. Must be called after the module was moved to the temp device.
+        A store is created again if the module is moved to the train device later.
+        """
+        if self.__disk_store is not None:
+            self.__disk_store.close()
+            self.__disk_store = None
+
     def to(self, device: torch.device):
         torch_gc()
 
         self.__wait_all_layer_transfers()
         self.__wait_all_activation_transfers()
+        self.__measure_step()
+        if self.__disk_store is not None:
+            self.__disk_store.synchronize()
 
         if device_equals(device, self.__temp_device):
             log("to temp device")
@@ -631,46 +722,23 @@ class LayerOffloadConductor:
             self.__temp_device_activations_allocator.deallocate_cache()
 
             self.__module_to_device_except_layers(self.__temp_device)
-            for layer_index, layer in enumerate(self.__layers):
-                self.__layers[layer_index].to(self.__temp_device)
-                for module in layer.modules():
-                    offload_quantized(module, self.__temp_device, allocator=clone_tensor_allocator)
-                self.__layer_device_map[layer_index] = None
+            self.__layers_to_temp_device()
 
             self.__is_active = False
 
         elif device_equals(device, self.__train_device):
             log("to train device")
 
-            self.__offload_strategy = LayerOffloadStrategy(self.__layers, self.__layer_offload_fraction)
-
-            self.__train_device_layer_allocator.allocate_cache(
-                self.__layers, self.__offload_strategy.max_loaded_bytes)
-            self.__temp_device_layer_allocator.allocate_cache(
-                self.__layers, self.__offload_strategy.max_offloaded_bytes)
             self.__module_to_device_except_layers(self.__train_device)
+            self.__layers_to_train_device()
 
-            # move all layers to the train device, then move offloadable tensors back to the temp device
-            for layer_index, layer in enumerate(self.__layers):
-                if self.__layer_device_map[layer_index] is None:
-                    log(f"layer {layer_index} to train device")
-                    layer.to(self.__train_device)
-
-                    if layer_index in self.__offload_strategy.initial_loaded_layers:
-                        allocator = self.__train_device_layer_allocator.get_allocator(
-                            layer_index, allocate_forward=True)
-                        for module in layer.modules():
-                            offload_quantized(module, self.__train_device, allocator=allocator.allocate_like)
-                        self.__layer_device_map[layer_index] = self.__train_device
-                    else:
-                        allocator = self.__temp_device_layer_allocator.get_allocator(layer_index, allocate_forward=True)
-                        for module in layer.modules():
-                            offload_quantized(module, self.__temp_device, allocator=allocator.allocate_like)
-                        self.__layer_device_map[layer_index] = self.__temp_device
-
-                    if self.__async_transfer:
-                        event = SyncEvent(self.__train_stream.record_event(), f"train on {self.__train_device}")
-                        self.__layer_train_event_map[layer_index] = event
+            if self.__vram_budget_bytes > 0 and self.__planner is None:
+                self.__planner = LayerOffloadPlanner(
+                    layer_bytes=self.__layer_bytes,
+                    max_tensor_bytes=self.__max_tensor_bytes,
+                    vram_budget_bytes=self.__vram_budget_bytes,
+                    allow_activation_offloading=self.__allow_activation_offloading,
+                )
 
             self.__is_active = True
 
@@ -701,6 +769,11 @@ class LayerOffloadConductor:
         self.__is_forward_pass = True
         self.__keep_graph = keep_graph
 
+        if self.__planner is not None:
+            self.__measure_step()
+            # only training steps are planned, other passes use the current layout
+            self.__plan_pending = keep_graph
+
     def before_layer(self, layer_index: int, call_index: int, activations: Any) -> Any:
         log()
         log(f"before layer {layer_index}, {call_index}")
@@ -710,6 +783,10 @@ class LayerOffloadConductor:
 
         self.__call_index_layer_index_map[call_index] = layer_index
 
+        if self.__plan_pending:
+            self.__plan_pending = False
+            self.__plan_step(layer_index, activations)
+
         if torch.is_grad_enabled() and self.__is_forward_pass:
             # Offloading can only be used with the use_reentrant=True checkpointing variant.
             # Gradients are only enabled during the back pass.
@@ -742,6 +819,15 @@ class LayerOffloadConductor:
 
         # schedule loading of the next layer and offloading of the previous layer
         if self.__offload_layers:
+            if self.__disk_store is not None and not self.__is_forward_pass \
+                    and any(x.requires_grad for x in self.__get_offload_tensors(layer_index)):
+                # the weights are changed during the backward pass, and need to be written back when offloaded.
+                # Without a fused optimizer step, they would only change after the layer is already written back
+                if not self.__fused_optimizer_step:
+                    raise RuntimeError('training offloaded layers with "layer_offload_disk_path" requires an optimizer '
+                                       'that supports "fused_back_pass", with "fused_back_pass" enabled')
+                self.__dirty_layers.add(layer_index)
+
             self.__wait_layer_transfer(layer_index)
 
             self.__schedule_deferred_layers_to_temp(except_layer=layer_index)
@@ -761,6 +847,12 @@ class LayerOffloadConductor:
             ):
                 self.__schedule_layer_to(i, self.__train_device, is_forward=self.__is_forward_pass)
 
+            if self.__disk_store is not None:
+                self.__prefetch_disk_layers(layer_index)
+
+        if (trace := self.__trace()) is not None:
+            self.__trace_compute_start = (trace.stream_event(self.__train_stream), trace.now_us())
+
         return activations
 
     def after_layer(self, layer_index: int, call_index: int, activations: Any):
@@ -769,10 +861,29 @@ class LayerOffloadConductor:
         if not self.__is_active:
             return
 
+        if (trace := self.__trace()) is not None and self.__trace_compute_start is not None:
+            start_event, start_us = self.__trace_compute_start
+            self.__trace_compute_start = None
+            name = f"layer {layer_index} {'forward' if self.__is_forward_pass else 'recompute'}"
+            lane = f"{self.__name}/train"
+            forward_layer = (self.__name, layer_index) if self.__is_forward_pass else None
+            if start_event is not None:
+                trace.stream_span(name, "compute", lane, start_event, trace.stream_event(self.__train_stream),
+                                  forward_layer=forward_layer, call_index=call_index)
+            elif forward_layer is not None:
+                trace.host_forward_span(name, lane, forward_layer, start_us, call_index=call_index)
+            else:
+                trace.host_span(name, "compute", lane, start_us, call_index=call_index)
+
         # record stream
         if self.__async_transfer:
             tensors_record_stream(self.__train_stream, activations)
 
+        if self.__plan_key is not None and self.__keep_graph and self.__is_forward_pass:
+            tensor_indices = self.__layer_activations_included_offload_param_indices_map[layer_index]
+            self.__step_activation_bytes += \
+                sum(x.element_size() * x.numel() for x in get_tensor_data(activations, tensor_indices))
+
         # save activations during the forward pass to make them accessible during the backward pass
         if self.__offload_activations and self.__keep_graph and self.__is_forward_pass:
             log(f"saving layer {call_index} activations for back pass")
@@ -783,6 +894,152 @@ class LayerOffloadConductor:
             event = SyncEvent(self.__train_stream.record_event(), f"train on {self.__train_device}")
             self.__layer_train_event_map[layer_index] = event
 
+    def __get_layer_bytes(self) -> list[int]:
+        self.__layer_bytes = []
+        self.__max_tensor_bytes = 0
+        for layer in self.__layers:
+            layer_tensor_bytes = [get_offload_tensor_bytes(x) for x in layer.modules()]
+            self.__max_tensor_bytes = max(self.__max_tensor_bytes, *layer_tensor_bytes)
+            self.__layer_bytes.append(sum(layer_tensor_bytes))
+        return self.__layer_bytes
+
+    def __trace(self) -> OffloadTrace | None:
+        trace = active_offload_trace()
+        if trace is not None and self.__layer_bytes and not trace.has_layers(self.__name):
+            trace.set_layers(self.__name, self.__layer_bytes, self.__max_tensor_bytes)
+        return trace
+
+    def __layers_to_temp_device(self):
+        for layer_index, layer in enumerate(self.__layers):
+            if self.__disk_store is not None:
+                # point the offloaded tensors to the file after writing back changes, then move the other tensors
+                tensors = self.__get_offload_tensors(layer_index)
+                if layer_index in self.__dirty_layers:
+                    self.__disk_store.write(layer_index, tensors)
+                    self.__dirty_layers.discard(layer_index)
+                for tensor, host_tensor in zip(tensors, self.__disk_store.host_tensors(layer_index), strict=True):
+                    tensor.data = host_tensor
+                self.__layers[layer_index].to(self.__temp_device)
+            else:
+                self.__layers[layer_index].to(self.__temp_device)
+                for module in layer.modules():
+                    offload_quantized(module, self.__temp_device, allocator=clone_tensor_allocator)
+            self.__layer_device_map[layer_index] = None
+
+    def __layers_to_train_device(self):
+        self.__offload_strategy = LayerOffloadStrategy(self.__get_layer_bytes(), self.__layer_offload_fraction)
+
+        self.__train_device_layer_allocator.allocate_cache(
+            self.__layers, self.__offload_strategy.max_loaded_bytes)
+        if self.__disk_path and self.__disk_store is None:
+            self.__disk_store = DiskLayerStore(
+                self.__disk_path,
+                f"{self.__name}_layers_",
+                [self.__get_offload_tensors(i) for i in range(len(self.__layers))],
+            )
+        if self.__disk_store is None:
+            self.__temp_device_layer_allocator.allocate_cache(
+                self.__layers, self.__offload_strategy.max_offloaded_bytes)
+
+        # move all layers to the train device, then move offloadable tensors back to the temp device
+        for layer_index, layer in enumerate(self.__layers):
+            if self.__layer_device_map[layer_index] is None:
+                if self.__disk_store is not None and not self.__disk_store.is_written(layer_index):
+                    self.__disk_store.write(layer_index, self.__get_offload_tensors(layer_index))
+
+                if self.__disk_store is not None and layer_index not in self.__offload_strategy.initial_loaded_layers:
+                    # only move the tensors that are not offloaded, the others stay in the file. They are pointed to
+                    # the file, so the host memory they used before is freed
+                    log(f"layer {layer_index} to train device, except offloaded tensors")
+                    offload_tensors = self.__get_offload_tensors(layer_index)
+                    for tensor, host_tensor in zip(
+                            offload_tensors, self.__disk_store.host_tensors(layer_index), strict=True):
+                        tensor.data = host_tensor
+                    offload_tensors = set(offload_tensors)
+
+                    def convert(t, offload_tensors=offload_tensors):
+                        if t in offload_tensors:
+                            return t
+                        return t.to(device=self.__train_device)
+
+                    layer._apply(convert)
+                    self.__layer_device_map[layer_index] = self.__temp_device
+                    continue
+
+                log(f"layer {layer_index} to train device")
+                layer.to(self.__train_device)
+
+                if layer_index in self.__offload_strategy.initial_loaded_layers:
+                    allocator = self.__train_device_layer_allocator.get_allocator(
+                        layer_index, allocate_forward=True)
+                    for module in layer.modules():
+                        offload_quantized(module, self.__train_device, allocator=allocator.allocate_like)
+                    self.__layer_device_map[layer_index] = self.__train_device
+                else:
+                    allocator = self.__temp_device_layer_allocator.get_allocator(layer_index, allocate_forward=True)
+                    for module in layer.modules():
+                        offload_quantized(module, self.__temp_device, allocator=allocator.allocate_like)
+                    self.__layer_device_map[layer_index] = self.__temp_device
+
+                if self.__async_transfer:
+                    event = SyncEvent(self.__train_stream.record_event(), f"train on {self.__train_device}")
+                    self.__layer_train_event_map[layer_index] = event
+
+    def __set_layer_offload_fraction(self, layer_offload_fraction: float):
+        # moves all layers back to the temp device, then places them again with a new strategy
+        log(f"changing layer offload fraction to {layer_offload_fraction}")
+
+        self.__wait_all_layer_transfers()
+        self.__deferred_layers = []
+        if self.__disk_store is not None:
+            self.__disk_store.synchronize()
+
+        self.__train_device_layer_allocator.deallocate_cache()
+        self.__temp_device_layer_allocator.deallocate_cache()
+        self.__layers_to_temp_device()
+        torch_gc()
+
+        self.__layer_offload_fraction = layer_offload_fraction
+        self.__layers_to_train_device()
+        torch_gc()
+
+    def __plan_step(self, layer_index: int, activations: Any):
+        # the activation shapes identify the resolution bucket and batch size of the step
+        key = tuple((tuple(x.shape), x.dtype) for x in get_tensor_data(activations))
+        tensor_indices = self.__layer_activations_included_offload_param_indices_map[layer_index]
+        layer_activation_bytes = sum(x.element_size() * x.numel() for x in get_tensor_data(activations, tensor_indices))
+        allocated_bytes = torch.cuda.memory_allocated(self.__train_device) \
+                          - self.__train_device_layer_allocator.allocated_cache_bytes()
+
+        plan = self.__planner.plan(key, layer_activation_bytes, allocated_bytes, self.__layer_offload_fraction)
+
+        if plan.layer_offload_fraction != self.__layer_offload_fraction:
+            print(f"changing the layer offload fraction of {self.__name} to {plan.layer_offload_fraction}, "
+                  f"predicted peak VRAM {plan.predicted_peak_bytes / 1024**3:.2f} GiB"
+                  f"{'' if plan.fits else ', which does not fit into the VRAM budget'}")
+            self.__set_layer_offload_fraction(plan.layer_offload_fraction)
+        self.__offload_activations = plan.offload_activations
+
+        self.__plan_key = key
+        self.__plan_layer_activation_bytes = layer_activation_bytes
+        self.__step_activation_bytes = 0
+        torch.cuda.reset_peak_memory_stats(self.__train_device)
+
+    def __measure_step(self):
+        # called after a planned training step has finished, before the next forward pass or device change
+        if self.__plan_key is None:
+            return
+
+        self.__planner.add_measurement(
+            key=self.__plan_key,
+            peak_bytes=torch.cuda.max_memory_allocated(self.__train_device),
+            layer_cache_bytes=self.__train_device_layer_allocator.allocated_cache_bytes(),
+            activation_bytes=self.__step_activation_bytes,
+            layer_activation_bytes=self.__plan_layer_activation_bytes,
+            activations_offloaded=self.__offload_activations,
+        )
+        self.__plan_key = None
+
     def __get_loaded_layers(self) -> list[int]:
         return [i for i in range(len(self.__layers)) if device_equals(self.__layer_device_map[i], self.__train_device)]
 
@@ -826,6 +1083,8 @@ class LayerOffloadConductor:
 
     def __wait_layer_transfer(self, layer_index: int):
         if self.__async_transfer:
+            if (trace := self.__trace()) is not None:
+                trace.instant(f"wait layer transfer {layer_index}", "wait", f"{self.__name}/host")
             self.__layer_transfer_event_map[layer_index] \
                 .wait(self.__train_stream, f"wait layer transfer {layer_index}")
             self.__layer_transfer_event_map[layer_index] = SyncEvent()
@@ -834,6 +1093,8 @@ class LayerOffloadConductor:
         event = self.__activations_transfer_event_map.pop(call_index, None)
 
         if event is not None:
+            if (trace := self.__trace()) is not None:
+                trace.instant(f"wait activations transfer {call_index}", "wait", f"{self.__name}/host")
             event.wait(self.__train_stream, f"wait activations transfer {call_index}")
 
     def __schedule_layer_to(
@@ -854,7 +1115,13 @@ class LayerOffloadConductor:
         layer_allocator = self.__train_device_layer_allocator \
             if device_equals(device, self.__train_device) \
             else self.__temp_device_layer_allocator
-        allocator = layer_allocator.get_allocator(layer_index, is_forward)
+
+        if self.__disk_store is not None:
+            # the temp device cache is not used, offloaded tensors are stored in the file
+            layer_deallocator = layer_deallocator if device_equals(device, self.__temp_device) else None
+            layer_allocator = layer_allocator if device_equals(device, self.__train_device) else None
+
+        allocator = layer_allocator.get_allocator(layer_index, is_forward) if layer_allocator is not None else None
 
         allocator_fn = allocator.allocate_like if allocator is not None else None
 
@@ -870,15 +1137,37 @@ class LayerOffloadConductor:
                         #has not finished yet. The gradients are then set to None during the backward of one of the next layers.
                         #Record which layers were ready to be offloaded, and offload them later:
                         self.__deferred_layers.append(layer_index)
+                        if (trace := self.__trace()) is not None:
+                            trace.instant(f"defer layer {layer_index} offload", "schedule", f"{self.__name}/host")
                         return
 
         with create_stream_context(self.__layer_transfer_stream):
             self.__wait_layer_train(layer_index)
-            layer = self.__layers[layer_index]
-            for module in layer.modules():
-                offload_quantized(module, device, non_blocking=self.__async_transfer, allocator=allocator_fn)
 
-            layer_deallocator.deallocate_layer(layer_index, deallocate_forward=is_forward)
+            trace = self.__trace()
+            if trace is not None:
+                trace_start_event = trace.stream_event(self.__layer_transfer_stream)
+                trace_start_us = trace.now_us()
+
+            if self.__disk_store is not None:
+                self.__disk_layer_to(layer_index, device, allocator_fn)
+            else:
+                layer = self.__layers[layer_index]
+                for module in layer.modules():
+                    offload_quantized(module, device, non_blocking=self.__async_transfer, allocator=allocator_fn)
+
+            if trace is not None:
+                name = f"layer {layer_index} to {device}"
+                lane = f"{self.__name}/layer transfer"
+                layer_bytes = self.__layer_bytes[layer_index] if self.__layer_bytes else 0
+                if trace_start_event is not None:
+                    trace.stream_span(name, "transfer", lane, trace_start_event,
+                                      trace.stream_event(self.__layer_transfer_stream), bytes=layer_bytes)
+                else:
+                    trace.host_span(name, "transfer", lane, trace_start_us, bytes=layer_bytes)
+
+            if layer_deallocator is not None:
+                layer_deallocator.deallocate_layer(layer_index, deallocate_forward=is_forward)
 
             if self.__async_transfer:
                 event = SyncEvent(self.__layer_transfer_stream.record_event(), f"transfer to {device}")
@@ -889,6 +1178,75 @@ class LayerOffloadConductor:
 
             self.__layer_device_map[layer_index] = device
 
+    def __disk_layer_to(
+            self,
+            layer_index: int,
+            device: torch.device,
+            allocator_fn: Callable[[torch.Tensor], torch.Tensor] | None,
+    ):
+        tensors = self.__get_offload_tensors(layer_index)
+        transfer_event = None
+
+        if device_equals(device, self.__train_device):
+            # copy from a staging buffer, which was hopefully filled by __prefetch_disk_layers
+            staged_tensors = self.__disk_store.load(layer_index)
+            for tensor, staged_tensor in zip(tensors, staged_tensors, strict=True):
+                if allocator_fn is not None:
+                    new_tensor = allocator_fn(tensor)
+                    new_tensor.copy_(staged_tensor, non_blocking=self.__async_transfer)
+                else:
+                    new_tensor = staged_tensor.to(device=device, non_blocking=self.__async_transfer)
+                tensor.data = new_tensor
+            if self.__async_transfer:
+                transfer_event = self.__layer_transfer_stream.record_event()
+            self.__disk_store.release(layer_index, transfer_event)
+        elif layer_index in self.__dirty_layers:
+            # copy to a staging buffer, which is written to the file in the background
+            self.__dirty_layers.discard(layer_index)
+            staged_tensors = self.__disk_store.begin_write(layer_index)
+            for tensor, staged_tensor in zip(tensors, staged_tensors, strict=True):
+                staged_tensor.copy_(tensor.data, non_blocking=self.__async_transfer)
+            if self.__async_transfer:
+                transfer_event = self.__layer_transfer_stream.record_event()
+            self.__disk_store.end_write(layer_index, tensors, transfer_event)
+        else:
+            # the file already contains the current data
+            for tensor, host_tensor in zip(tensors, self.__disk_store.host_tensors(layer_index), strict=True):
+                tensor.data = host_tensor
+
+    def __prefetch_disk_layers(self, layer_index: int):
+        # follows the offload strategy for the next layers, and stages the layers it will load
+        loaded_layers = set(self.__get_loaded_layers())
+        direction = 1 if self.__is_forward_pass else -1
+        next_layer_index = layer_index
+        for _ in range(self.__disk_store.num_staging_slots()):
+            next_layer_index += direction
+            if not self.__keep_graph:
+                # inference passes are cyclic, the last layers load the first ones of the next pass
+                next_layer_index %= len(self.__layers)
+            elif not 0 <= next_layer_index < len(self.__layers):
+                return
+
+            loaded_layers -= set(self.__offload_strategy.get_layers_to_offload(
+                layer_index=next_layer_index,
+                is_forward=self.__is_forward_pass,
+                is_next_forward=not self.__keep_graph,
+                loaded_layers=sorted(loaded_layers),
+            ))
+            for i in self.__offload_strategy.get_layers_to_load(
+                    layer_index=next_layer_index,
+                    is_forward=self.__is_forward_pass,
+                    is_next_forward=not self.__keep_graph,
+                    loaded_layers=sorted(loaded_layers),
+            ):
+                loaded_layers.add(i)
+                # only layers that are offloaded now, the file is not up to date for the others
+                if device_equals(self.__layer_device_map[i], self.__temp_device) and not self.__disk_store.prefetch(i):
+                    return
+
+    def __get_offload_tensors(self, layer_index: int) -> list[torch.Tensor]:
+        return [tensor for module in self.__layers[layer_index].modules() for tensor in get_offload_tensors(module)]
+
     def __schedule_deferred_layers_to_temp(
             self,
             except_layer: int,
@@ -930,8 +1288,24 @@ class LayerOffloadConductor:
             tensors = get_tensor_data(activations, tensor_indices)
             if activations_allocator is not None:
                 activations_allocator.reserve_cache(tensors)
+
+            trace = self.__trace()
+            if trace is not None:
+                trace_start_event = trace.stream_event(self.__activations_transfer_stream)
+                trace_start_us = trace.now_us()
+
             tensors_to_device_(activations, device, tensor_indices, non_blocking=self.__async_transfer, allocator=allocator_fn)
 
+            if trace is not None:
+                name = f"activations {call_index} to {device}"
+                lane = f"{self.__name}/activations transfer"
+                num_bytes = sum(tensor.element_size() * tensor.numel() for tensor in tensors)
+                if trace_start_event is not None:
+                    trace.stream_span(name, "transfer", lane, trace_start_event,
+                                      trace.stream_event(self.__activations_transfer_stream), bytes=num_bytes)
+                else:
+                    trace.host_span(name, "transfer", lane, trace_start_us, bytes=num_bytes)
+
             if self.__async_transfer:
                 tensors_record_stream(self.__activations_transfer_stream, tensors)
                 self.__activations_transfer_event_map[call_index] = \
@@ -0,0 +1,192 @@
+from collections import deque
+from typing import NamedTuple
+
+# the fractions considered by the planner
+FRACTION_STEP = 0.05
+# part of the budget that is kept free for fragmentation and allocations outside of the measured peak
+SAFETY_MARGIN = 0.05
+# estimated working memory of one layer during the backward pass, relative to the size of its input activations.
+# only used until two different activation sizes have been measured
+DEFAULT_WORKING_MEMORY_FACTOR = 16.0
+# number of consecutive steps that have to fit a lower fraction before the layers are moved again
+LOWER_FRACTION_AFTER_STEPS = 8
+
+
+class LayerOffloadPlan(NamedTuple):
+    layer_offload_fraction: float
+    offload_activations: bool
+    predicted_peak_bytes: int
+    transferred_bytes: int
+    fits: bool
+
+
+class _Measurement(NamedTuple):
+    base_bytes: int
+    activation_bytes: int
+    layer_activation_bytes: int
+
+
+class LayerOffloadPlanner:
+    """
+    Chooses the layer offload fraction and the activation offloading setting of a LayerOffloadConductor from a VRAM
+    budget. The peak memory of a training step is modeled as
+
+        base + layer cache(fraction) + saved activations (if they are not offloaded)
+
+    The layer cache size and the transferred bytes of each fraction are predicted by OffloadSimulator. The base memory
+    (everything else: other weights, gradients, optimizer state and the working memory of the executed layer) and the
+    saved activations are measured after each step, separately for each activation shape. For shapes without a
+    measurement, both are extrapolated from the size of the inputs of the first layer. The first step is a dry run with
+    the estimated base memory.
+
+    Of all settings that fit into the budget, the one with the least transferred bytes per step is chosen. Changing
+    the fraction moves all layers, so a higher fraction is applied immediately, but a lower fraction only after it fit
+    for LOWER_FRACTION_AFTER_STEPS consecutive steps. Activation offloading can change on every step.
+    """
+
+    def __init__(
+            self,
+            layer_bytes: list[int],
+            max_tensor_bytes: int,
+            vram_budget_bytes: int,
+            allow_activation_offloading: bool,
+    ):
+        # imported here, because the simulator depends on LayerOffloadConductor, which uses the planner
+        from modules.util.OffloadSimulator import OffloadSimulator
+
+        self.vram_budget_bytes = vram_budget_bytes
+        self.num_layers = len(layer_bytes)
+        self.allow_activation_offloading = allow_activation_offloading
+
+        # bandwidth and compute time do not change the schedule, only the transferred bytes are used
+        simulator = OffloadSimulator(
+            layer_bytes=layer_bytes,
+            forward_ms=[0.0] * len(layer_bytes),
+            max_tensor_bytes=max_tensor_bytes,
+            host_to_device_bytes_per_s=1.0,
+            device_to_host_bytes_per_s=1.0,
+        )
+        fractions = [self.nearest_fraction(i * FRACTION_STEP) for i in range(round(1.0 / FRACTION_STEP) + 1)]
+        self.__layer_cache_bytes = {}
+        self.__layer_transferred_bytes = {}
+        for fraction in fractions:
+            result = simulator.simulate(fraction)
+            self.__layer_cache_bytes[fraction] = result.train_device_cache_bytes
+            self.__layer_transferred_bytes[fraction] = result.transferred_bytes
+
+        self.__measurements: dict[tuple, _Measurement] = {}
+        self.__lower_fractions = deque(maxlen=LOWER_FRACTION_AFTER_STEPS)
+
+    @staticmethod
+    def nearest_fraction(layer_offload_fraction: float) -> float:
+        # the nearest fraction considered by the planner
+        return round(round(layer_offload_fraction / FRACTION_STEP) * FRACTION_STEP, 4)
+
+    def layer_cache_bytes(self, layer_offload_fraction: float) -> int:
+        return self.__layer_cache_bytes[layer_offload_fraction]
+
+    def add_measurement(
+            self,
+            key: tuple,
+            peak_bytes: int,
+            layer_cache_bytes: int,
+            activation_bytes: int,
+            layer_activation_bytes: int,
+            activations_offloaded: bool,
+    ):
+        """
+        Records the peak memory of a training step. layer_cache_bytes is the allocated layer cache, activation_bytes
+        the size of all saved activations and layer_activation_bytes the size of the inputs of the first layer.
+        """
+        base_bytes = peak_bytes - layer_cache_bytes - (0 if activations_offloaded else activation_bytes)
+        previous = self.__measurements.get(key)
+        if previous is not None:
+            # the peak can vary between steps, keep the highest one
+            base_bytes = max(base_bytes, previous.base_bytes)
+        self.__measurements[key] = _Measurement(max(base_bytes, 0), activation_bytes, layer_activation_bytes)
+
+    def estimate_base_bytes(self, key: tuple, layer_activation_bytes: int, allocated_bytes: int) -> int:
+        """
+        Returns the measured base memory of a key, or an estimate if it was not measured yet. allocated_bytes is the
+        memory allocated before the step without the layer cache, the lower bound of the base memory.
+        """
+        measurement = self.__measurements.get(key)
+        if measurement is not None:
+            return measurement.base_bytes
+
+        if not self.__measurements:
+            return allocated_bytes + int(DEFAULT_WORKING_MEMORY_FACTOR * layer_activation_bytes)
+
+        # working memory per byte of layer input, from the smallest and largest measured activation size
+        smallest = min(self.__measurements.values(), key=lambda x: x.layer_activation_bytes)
+        largest = max(self.__measurements.values(), key=lambda x: x.layer_activation_bytes)
+        if largest.layer_activation_bytes > smallest.layer_activation_bytes:
+            working_memory_factor = max(0.0, (largest.base_bytes - smallest.base_bytes)
+                                        / (largest.layer_activation_bytes - smallest.layer_activation_bytes))
+        else:
+            working_memory_factor = DEFAULT_WORKING_MEMORY_FACTOR
+
+        # extrapolate from the nearest measurement, but never below it
+        nearest = min(self.__measurements.values(),
+                      key=lambda x: abs(x.layer_activation_bytes - layer_activation_bytes))
+        additional_bytes = max(0, layer_activation_bytes - nearest.layer_activation_bytes)
+        return max(nearest.base_bytes + int(working_memory_factor * additional_bytes), allocated_bytes)
+
+    def __evaluate(self, fraction: float, offload_activations: bool, base_bytes: int, activation_bytes: int):
+        peak_bytes = base_bytes + self.__layer_cache_bytes[fraction] + (0 if offload_activations else activation_bytes)
+        # activations are transferred to the temp device and back
+        transferred_bytes = self.__layer_transferred_bytes[fraction] + (2 * activation_bytes if offload_activations else 0)
+        fits = peak_bytes <= self.vram_budget_bytes * (1.0 - SAFETY_MARGIN)
+        return LayerOffloadPlan(fraction, offload_activations, peak_bytes, transferred_bytes, fits)
+
+    def __best_plan(self, fractions: list[float], base_bytes: int, activation_bytes: int) -> LayerOffloadPlan:
+        activation_settings = [False, True] if self.allow_activation_offloading else [False]
+        plans = [
+            self.__evaluate(fraction, offload_activations, base_bytes, activation_bytes)
+            for fraction in fractions
+            for offload_activations in activation_settings
+        ]
+
+        fitting_plans = [plan for plan in plans if plan.fits]
+        if fitting_plans:
+            return min(fitting_plans, key=lambda x: (x.transferred_bytes, x.layer_offload_fraction))
+        # nothing fits, use the setting with the lowest memory usage
+        return min(plans, key=lambda x: (x.predicted_peak_bytes, x.transferred_bytes))
+
+    def plan(
+            self,
+            key: tuple,
+            layer_activation_bytes: int,
+            allocated_bytes: int,
+            current_fraction: float,
+    ) -> LayerOffloadPlan:
+        """
+        Plans the next training step. current_fraction is the fraction of the current layer layout.
+        """
+        base_bytes = self.estimate_base_bytes(key, layer_activation_bytes, allocated_bytes)
+        measurement = self.__measurements.get(key)
+        activation_bytes = measurement.activation_bytes if measurement is not None \
+            else layer_activation_bytes * self.num_layers
+        best = self.__best_plan(list(self.__layer_cache_bytes.keys()), base_bytes, activation_bytes)
+
+        if best.layer_offload_fraction > current_fraction or not best.fits:
+            self.__lower_fractions.clear()
+            return best
+
+        current = self.__best_plan([current_fraction], base_bytes, activation_bytes)
+        if not current.fits:
+            self.__lower_fractions.clear()
+            return best
+
+        if best.layer_offload_fraction < current_fraction:
+            self.__lower_fractions.append(best.layer_offload_fraction)
+        else:
+            self.__lower_fractions.clear()
+
+        if len(self.__lower_fractions) == self.__lower_fractions.maxlen:
+            # every recent step fits this fraction
+            fraction = max(self.__lower_fractions)
+            self.__lower_fractions.clear()
+            return self.__best_plan([fraction], base_bytes, activation_bytes)
+
+        return current
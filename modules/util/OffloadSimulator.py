@@ -0,0 +1,138 @@
+from typing import NamedTuple
+
+from modules.util.LayerOffloadConductor import LayerOffloadStrategy, StaticLayerAllocator
+
+
+class OffloadSimulationResult(NamedTuple):
+    layer_offload_fraction: float
+    step_time_ms: float
+    compute_time_ms: float
+    stall_time_ms: float
+    transferred_bytes: int
+    peak_loaded_bytes: int
+    train_device_cache_bytes: int
+    temp_device_cache_bytes: int
+
+
+class OffloadSimulator:
+    """
+    Predicts the step time and memory usage of layer offloading without a GPU. The simulator replays the schedule of
+    LayerOffloadConductor, using the same LayerOffloadStrategy: before each layer, the train stream waits for the
+    pending transfer of that layer, then layers are scheduled for offloading and loading on a single transfer stream.
+    Each transfer waits until the last execution of its layer has finished, and takes bytes / bandwidth.
+
+    The compute time of each layer is given for the forward pass. During the backward pass, a layer is executed
+    again for gradient checkpointing, followed by its backward pass, which takes backward_factor times the forward
+    time. Activation offloading is not simulated.
+    """
+
+    def __init__(
+            self,
+            layer_bytes: list[int],
+            forward_ms: list[float],
+            max_tensor_bytes: int,
+            host_to_device_bytes_per_s: float,
+            device_to_host_bytes_per_s: float,
+            backward_factor: float = 2.0,
+            training: bool = True,
+    ):
+        self.layer_bytes = layer_bytes
+        self.forward_ms = forward_ms
+        self.max_tensor_bytes = max_tensor_bytes
+        self.host_to_device_bytes_per_ms = host_to_device_bytes_per_s / 1000.0
+        self.device_to_host_bytes_per_ms = device_to_host_bytes_per_s / 1000.0
+        self.backward_factor = backward_factor
+        self.training = training
+
+    def simulate(self, layer_offload_fraction: float, steps: int = 3) -> OffloadSimulationResult:
+        """
+        Simulates several steps, and returns the result of the last one, when the schedule has settled
+        """
+        strategy = LayerOffloadStrategy(self.layer_bytes, layer_offload_fraction)
+        num_layers = len(self.layer_bytes)
+
+        loaded_layers = set(strategy.initial_loaded_layers)
+        transfer_done = [0.0] * num_layers
+        train_done = [0.0] * num_layers
+        transfer_stream_free = 0.0
+        now = 0.0
+
+        result = None
+        for _ in range(steps):
+            step_start = now
+            stall_time = 0.0
+            compute_time = 0.0
+            transferred_bytes = 0
+            peak_loaded_bytes = sum(self.layer_bytes[i] for i in loaded_layers)
+
+            def schedule(layer_index: int, to_train_device: bool):
+                nonlocal transfer_stream_free, transferred_bytes, peak_loaded_bytes
+                bandwidth = self.host_to_device_bytes_per_ms if to_train_device else self.device_to_host_bytes_per_ms
+                start = max(transfer_stream_free, train_done[layer_index])
+                transfer_stream_free = start + self.layer_bytes[layer_index] / bandwidth
+                transfer_done[layer_index] = transfer_stream_free
+                transferred_bytes += self.layer_bytes[layer_index]
+
+                if to_train_device:
+                    loaded_layers.add(layer_index)
+                    peak_loaded_bytes = max(peak_loaded_bytes, sum(self.layer_bytes[i] for i in loaded_layers))
+                else:
+                    loaded_layers.discard(layer_index)
+
+            # start_forward waits for all transfers
+            if transfer_stream_free > now:
+                stall_time += transfer_stream_free - now
+                now = transfer_stream_free
+
+            passes = [(range(num_layers), True)]
+            if self.training:
+                passes.append((range(num_layers - 1, -1, -1), False))
+
+            for layer_indices, is_forward in passes:
+                for layer_index in layer_indices:
+                    if transfer_done[layer_index] > now:
+                        stall_time += transfer_done[layer_index] - now
+                        now = transfer_done[layer_index]
+
+                    for i in strategy.get_layers_to_offload(
+                            layer_index=layer_index,
+                            is_forward=is_forward,
+                            is_next_forward=not self.training,
+                            loaded_layers=sorted(loaded_layers),
+                    ):
+                        schedule(i, to_train_device=False)
+
+                    for i in strategy.get_layers_to_load(
+                            layer_index=layer_index,
+                            is_forward=is_forward,
+                            is_next_forward=not self.training,
+                            loaded_layers=sorted(loaded_layers),
+                    ):
+                        schedule(i, to_train_device=True)
+
+                    # the train event is recorded after the forward pass, or after the recomputation
+                    now += self.forward_ms[layer_index]
+                    train_done[layer_index] = now
+                    compute_time += self.forward_ms[layer_index]
+                    if not is_forward:
+                        now += self.forward_ms[layer_index] * self.backward_factor
+                        compute_time += self.forward_ms[layer_index] * self.backward_factor
+
+            result = OffloadSimulationResult(
+                layer_offload_fraction=layer_offload_fraction,
+                step_time_ms=now - step_start,
+                compute_time_ms=compute_time,
+                stall_time_ms=stall_time,
+                transferred_bytes=transferred_bytes,
+                peak_loaded_bytes=peak_loaded_bytes,
+                train_device_cache_bytes=self.__cache_bytes(strategy.max_loaded_bytes),
+                temp_device_cache_bytes=self.__cache_bytes(strategy.max_offloaded_bytes),
+            )
+
+        return result
+
+    def __cache_bytes(self, target_bytes: int) -> int:
+        # the memory allocated by StaticLayerAllocator
+        num_cache_tensors, cache_tensor_size = StaticLayerAllocator.get_cache_layout(
+            target_bytes, self.max_tensor_bytes)
+        return num_cache_tensors * cache_tensor_size
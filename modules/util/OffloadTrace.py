@@ -0,0 +1,181 @@
+import json
+import time
+from collections import defaultdict
+
+import torch
+
+
+class OffloadTrace:
+    """
+    Records the events of LayerOffloadConductor: layer execution, layer and activation transfers, waits and cache
+    allocations. The trace can be saved in the Chrome trace format, which can be opened in chrome://tracing or
+    https://ui.perfetto.dev, or summarized as a layer profile for the offload simulator.
+
+    Host events are timed with perf_counter. Work on CUDA streams is timed with CUDA events, which are resolved when
+    the trace is exported. Stream times are aligned to the host clock by a reference event, which is recorded when the
+    first stream event is requested, so they can be slightly late compared to host events.
+    """
+
+    def __init__(self):
+        self.__start_ns = time.perf_counter_ns()
+        self.__events = []
+        self.__stream_spans = []
+        self.__counters = defaultdict(int)
+        self.__reference_event = None
+        self.__reference_us = 0.0
+
+        # per module statistics for the layer profiles, keyed by module name
+        self.__layer_bytes: dict[str, list[int]] = {}
+        self.__max_tensor_bytes: dict[str, int] = {}
+        self.__forward_spans: dict[tuple[str, int], list[float]] = defaultdict(list)
+
+    def has_layers(self, module_name: str) -> bool:
+        return module_name in self.__layer_bytes
+
+    def set_layers(self, module_name: str, layer_bytes: list[int], max_tensor_bytes: int):
+        self.__layer_bytes[module_name] = layer_bytes
+        self.__max_tensor_bytes[module_name] = max_tensor_bytes
+
+    def now_us(self) -> float:
+        return (time.perf_counter_ns() - self.__start_ns) / 1000.0
+
+    def instant(self, name: str, category: str, lane: str, **args):
+        self.__events.append({
+            "name": name, "cat": category, "ph": "i", "s": "t", "ts": self.now_us(), "tid": lane, "args": args,
+        })
+
+    def host_span(self, name: str, category: str, lane: str, start_us: float, **args):
+        end_us = self.now_us()
+        self.__events.append({
+            "name": name, "cat": category, "ph": "X", "ts": start_us, "dur": end_us - start_us, "tid": lane, "args": args,
+        })
+
+    def counter(self, name: str, delta: int):
+        self.__counters[name] += delta
+        self.__events.append({
+            "name": name, "ph": "C", "ts": self.now_us(), "tid": "memory", "args": {"bytes": self.__counters[name]},
+        })
+
+    def stream_event(self, stream: torch.Stream | None) -> torch.cuda.Event | None:
+        """
+        Records a timing event on a CUDA stream. Returns None if there is no stream to record on.
+        """
+        if stream is None or not isinstance(stream, torch.cuda.Stream):
+            return None
+
+        if self.__reference_event is None:
+            self.__reference_event = torch.cuda.Event(enable_timing=True)
+            self.__reference_event.record(stream)
+            self.__reference_us = self.now_us()
+
+        event = torch.cuda.Event(enable_timing=True)
+        event.record(stream)
+        return event
+
+    def stream_span(
+            self,
+            name: str,
+            category: str,
+            lane: str,
+            start_event: torch.cuda.Event | None,
+            end_event: torch.cuda.Event | None,
+            forward_layer: tuple[str, int] | None = None,
+            **args,
+    ):
+        """
+        Records a span between two stream events. forward_layer is the module name and layer index, if the span is
+        the forward pass of a layer
+        """
+        if start_event is not None and end_event is not None:
+            self.__stream_spans.append((name, category, lane, start_event, end_event, forward_layer, args))
+
+    def host_forward_span(self, name: str, lane: str, forward_layer: tuple[str, int], start_us: float, **args):
+        # the forward pass of a layer without async transfers, measured on the host
+        self.host_span(name, "compute", lane, start_us, **args)
+        self.__forward_spans[forward_layer].append(self.__events[-1]["dur"])
+
+    def __resolve_stream_spans(self) -> list[dict]:
+        if not self.__stream_spans:
+            return []
+
+        torch.cuda.synchronize()
+        events = []
+        for name, category, lane, start_event, end_event, forward_layer, args in self.__stream_spans:
+            start_us = self.__reference_us + self.__reference_event.elapsed_time(start_event) * 1000.0
+            duration_us = start_event.elapsed_time(end_event) * 1000.0
+            events.append({
+                "name": name, "cat": category, "ph": "X", "ts": start_us, "dur": duration_us, "tid": lane, "args": args,
+            })
+            if forward_layer is not None:
+                self.__forward_spans[forward_layer].append(duration_us)
+        self.__stream_spans = []
+        self.__events.extend(events)
+        return events
+
+    def to_chrome_trace(self) -> dict:
+        self.__resolve_stream_spans()
+
+        lanes = sorted({event["tid"] for event in self.__events})
+        lane_ids = {lane: i for i, lane in enumerate(lanes)}
+
+        trace_events = [
+            {"name": "thread_name", "ph": "M", "pid": 0, "tid": lane_ids[lane], "args": {"name": lane}}
+            for lane in lanes
+        ]
+        trace_events.extend(
+            event | {"pid": 0, "tid": lane_ids[event["tid"]]}
+            for event in sorted(self.__events, key=lambda x: x["ts"])
+        )
+
+        return {"traceEvents": trace_events, "displayTimeUnit": "ms"}
+
+    def save(self, filename: str):
+        with open(filename, "w") as f:
+            json.dump(self.to_chrome_trace(), f)
+
+    def layer_profiles(self) -> dict[str, dict]:
+        """
+        Returns the byte size and the median forward time of each layer of each module, in the input format of
+        OffloadSimulator. Forward times are only known for layers that were executed while the trace was recorded.
+        """
+        self.__resolve_stream_spans()
+
+        profiles = {}
+        for module_name, layer_bytes in self.__layer_bytes.items():
+            forward_ms = []
+            for layer_index in range(len(layer_bytes)):
+                durations = sorted(self.__forward_spans.get((module_name, layer_index), []))
+                forward_ms.append(durations[len(durations) // 2] / 1000.0 if durations else None)
+
+            profiles[module_name] = {
+                "layer_bytes": layer_bytes,
+                "max_tensor_bytes": self.__max_tensor_bytes[module_name],
+                "forward_ms": forward_ms,
+            }
+        return profiles
+
+    def save_layer_profiles(self, filename: str):
+        with open(filename, "w") as f:
+            json.dump(self.layer_profiles(), f, indent=4)
+
+
+_active_trace: OffloadTrace | None = None
+
+
+def start_offload_trace() -> OffloadTrace:
+    """
+    Starts recording the events of all LayerOffloadConductors into a new trace
+    """
+    global _active_trace
+    _active_trace = OffloadTrace()
+    return _active_trace
+
+
+def stop_offload_trace() -> OffloadTrace | None:
+    global _active_trace
+    trace, _active_trace = _active_trace, None
+    return trace
+
+
+def active_offload_trace() -> OffloadTrace | None:
+    return _active_trace
@@ -0,0 +1,136 @@
+import zlib
+from random import Random
+
+import torch
+from torch import Tensor
+
+
+class _SubbatchRandom(Random):
+    """
+    Returns the same values for a subbatch that a Random with the same seed returns for the full batch.
+    Random values are consumed in blocks of one value per sample, as done for the conditioning dropout.
+    """
+
+    def __init__(self, seed: int, batch_size: int, indices: list[int]):
+        super().__init__(seed)
+        self.__batch_size = batch_size
+        self.__indices = indices
+        self.__full_batch_values = []
+        self.__count = 0
+
+    def random(self) -> float:
+        block, i = divmod(self.__count, len(self.__indices))
+        self.__count += 1
+
+        index = block * self.__batch_size + self.__indices[i]
+        while len(self.__full_batch_values) <= index:
+            self.__full_batch_values.append(super().random())
+        return self.__full_batch_values[index]
+
+
+class _SampleSeededRandom(Random):
+    """
+    Returns the values of a separate Random for each sample, seeded with the seed of that sample.
+    Random values are consumed in blocks of one value per sample, as done for the conditioning dropout.
+    """
+
+    def __init__(self, seeds: list[int]):
+        super().__init__(0)
+        self.__randoms = [Random(seed) for seed in seeds]
+        self.__count = 0
+
+    def random(self) -> float:
+        i = self.__count % len(self.__randoms)
+        self.__count += 1
+        return self.__randoms[i].random()
+
+
+class PredictionPlan:
+    """
+    Describes a predict() call on a subbatch of a full batch. All random inputs (noise, timesteps and conditioning
+    dropout) are drawn for the full batch, and only the rows of the subbatch are used. A prediction on the subbatch
+    therefore uses exactly the same inputs as the matching samples of a prediction on the full batch with the same seed.
+
+    deterministic_timestep is the position of the timestep used by deterministic predictions, as a fraction of the
+    timestep range.
+
+    If sample_seeds is set, the random inputs of each sample are drawn from its own seed instead, so they don't depend
+    on the other samples of the batch, or on the position of the sample in the batch. A plan with sample seeds is only
+    used for a single predict() call.
+    """
+
+    def __init__(
+            self,
+            batch_size: int,
+            indices: list[int] | None = None,
+            deterministic_timestep: float = 0.5,
+            sample_seeds: list[int] | None = None,
+    ):
+        self.batch_size = batch_size
+        self.indices = indices
+        self.deterministic_timestep = deterministic_timestep
+        self.sample_seeds = sample_seeds
+        self.__sample_generators = None
+
+    @staticmethod
+    def from_samples(batch: dict, deterministic_timestep: float = 0.5) -> 'PredictionPlan':
+        # the seed of a sample is derived from its path, which is the same in every process and every epoch
+        paths = batch['image_path']
+        return PredictionPlan(
+            len(paths),
+            deterministic_timestep=deterministic_timestep,
+            sample_seeds=[zlib.crc32(path.encode('utf-8')) for path in paths],
+        )
+
+    def is_full_batch(self) -> bool:
+        return self.indices is None
+
+    def select(self, tensor: Tensor) -> Tensor:
+        return tensor if self.is_full_batch() else tensor[self.indices]
+
+    def has_sample_seeds(self) -> bool:
+        return self.sample_seeds is not None
+
+    def __selected_sample_seeds(self) -> list[int]:
+        return self.sample_seeds if self.is_full_batch() else [self.sample_seeds[i] for i in self.indices]
+
+    def sample_generators(self, device: torch.device) -> list[torch.Generator]:
+        # created once, so consecutive draws of the same sample continue the same random sequence
+        if self.__sample_generators is None:
+            self.__sample_generators = [
+                torch.Generator(device=device).manual_seed(seed) for seed in self.__selected_sample_seeds()
+            ]
+        return self.__sample_generators
+
+    def randn(
+            self,
+            shape: tuple[int, ...],
+            generator: torch.Generator,
+            device: torch.device,
+            dtype: torch.dtype,
+    ) -> Tensor:
+        if self.has_sample_seeds():
+            return torch.stack([
+                torch.randn(shape[1:], generator=sample_generator, device=device, dtype=dtype)
+                for sample_generator in self.sample_generators(device)
+            ])
+        return self.select(torch.randn((self.batch_size, *shape[1:]), generator=generator, device=device, dtype=dtype))
+
+    def random(self, seed: int) -> Random:
+        if self.has_sample_seeds():
+            return _SampleSeededRandom(self.__selected_sample_seeds())
+        return Random(seed) if self.is_full_batch() else _SubbatchRandom(seed, self.batch_size, self.indices)
+
+    def subbatch(self, batch: dict) -> dict:
+        if self.is_full_batch():
+            return batch
+
+        subbatch = {}
+        for key, value in batch.items():
+            if isinstance(value, Tensor) and value.ndim > 0 and value.shape[0] == self.batch_size:
+                subbatch[key] = value[self.indices]
+            elif isinstance(value, list) and len(value) == self.batch_size:
+                subbatch[key] = [value[i] for i in self.indices]
+            else:
+                subbatch[key] = value
+        return subbatch
@@ -0,0 +1,74 @@
+from collections import OrderedDict
+from collections.abc import Callable, Hashable
+from typing import Any
+
+import torch
+
+
+def _map_tensors(value: Any, function: Callable[[torch.Tensor], torch.Tensor]) -> Any:
+    if isinstance(value, torch.Tensor):
+        return function(value)
+    if isinstance(value, tuple | list):
+        return type(value)(_map_tensors(x, function) for x in value)
+    return value
+
+
+def _tensor_bytes(value: Any) -> int:
+    if isinstance(value, torch.Tensor):
+        return value.nelement() * value.element_size()
+    if isinstance(value, tuple | list):
+        return sum(_tensor_bytes(x) for x in value)
+    return 0
+
+
+class PromptEmbeddingCache:
+    """
+    Caches text encoder outputs in host memory, so prompts that are sampled in every sampling round are only encoded
+    once. The key has to include every setting that changes the output, like the layer skips or the sequence length.
+    Values can be tensors, or nested tuples and lists of tensors. The least recently used entries are removed once the
+    cache grows beyond max_bytes.
+
+    The cache is only valid as long as the text encoders and embeddings don't change. It is cleared when it is
+    disabled, which the samplers do whenever a text encoder or an embedding is trained.
+    """
+
+    def __init__(self, max_bytes: int = 1024 ** 3):
+        self.max_bytes = max_bytes
+        self.enabled = True
+
+        self.__entries: OrderedDict[Hashable, tuple[Any, int]] = OrderedDict()
+        self.__bytes = 0
+
+    def set_enabled(self, enabled: bool):
+        if not enabled:
+            self.clear()
+        self.enabled = enabled
+
+    def clear(self):
+        self.__entries.clear()
+        self.__bytes = 0
+
+    def get(self, key: Hashable, device: torch.device) -> Any | None:
+        if not self.enabled or key not in self.__entries:
+            return None
+        self.__entries.move_to_end(key)
+        value, _ = self.__entries[key]
+        return _map_tensors(value, lambda x: x.to(device=device))
+
+    def put(self, key: Hashable, value: Any):
+        if not self.enabled:
+            return
+
+        value = _map_tensors(value, lambda x: x.detach().to(device="cpu"))
+        size = _tensor_bytes(value)
+        if size > self.max_bytes:
+            return
+
+        if key in self.__entries:
+            self.__bytes -= self.__entries.pop(key)[1]
+        self.__entries[key] = (value, size)
+        self.__bytes += size
+
+        while self.__bytes > self.max_bytes:
+            _, (_, removed_size) = self.__entries.popitem(last=False)
+            self.__bytes -= removed_size
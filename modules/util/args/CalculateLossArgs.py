@@ -7,6 +7,9 @@ from modules.util.args.BaseArgs import BaseArgs
 class CalculateLossArgs(BaseArgs):
     config_path: str
     output_path: str
+    timesteps: list[float]
+    flush_interval: int
+    master_port: int
 
     def __init__(self, data: list[(str, Any, type, bool)]):
         super().__init__(data)
@@ -18,7 +21,10 @@ class CalculateLossArgs(BaseArgs):
         # @formatter:off
 
         parser.add_argument("--config-path", type=str, required=True, dest="config_path", help="The path to the config file")
-        parser.add_argument("--output-path", type=str, required=True, dest="output_path", help="The path to the output file")
+        parser.add_argument("--output-path", type=str, required=True, dest="output_path", help="The path to the output file. Written as JSONL if it ends with .jsonl")
+        parser.add_argument("--add-timestep", type=float, required=False, action="append", dest="timesteps", help="A deterministic timestep, as a fraction between 0 and 1. The loss is averaged over all timesteps. Defaults to 0.5")
+        parser.add_argument("--flush-interval", type=int, required=False, default=64, dest="flush_interval", help="The number of batches after which results are written to the partial output file")
+        parser.add_argument("--master-port", type=int, required=False, default=None, dest="master_port", help="The port used to connect the processes with multi_gpu. Defaults to a free port")
 
         # @formatter:on
 
@@ -33,5 +39,8 @@ class CalculateLossArgs(BaseArgs):
         # name, default value, data type, nullable
         data.append(("config_path", None, str, True))
         data.append(("output_path", "losses.json", str, False))
+        data.append(("timesteps", [], list[float], False))
+        data.append(("flush_interval", 64, int, False))
+        data.append(("master_port", None, int, True))
 
         return CalculateLossArgs(data)
@@ -21,6 +21,8 @@ class TrainArgs(BaseArgs):
         parser.add_argument("--secrets-path", type=str, required=False, dest="secrets_path", help="The path to the secrets file")
         parser.add_argument("--callback-path", type=str, required=False, dest="callback_path", help="The path to the callback pickle file")
         parser.add_argument("--command-path", type=str, required=False, dest="command_path", help="The path to the command pickle file")
+        parser.add_argument("--manifest-path", type=str, required=False, dest="manifest_path", help="The path to the workspace manifest file")
+        parser.add_argument("--stream-path", type=str, required=False, dest="stream_path", help="The path to the callback stream file")
 
         # @formatter:on
 
@@ -37,5 +39,7 @@ class TrainArgs(BaseArgs):
         data.append(("secrets_path", None, str, True))
         data.append(("callback_path", None, str, True))
         data.append(("command_path", None, str, True))
+        data.append(("manifest_path", None, str, True))
+        data.append(("stream_path", None, str, True))
 
         return TrainArgs(data)
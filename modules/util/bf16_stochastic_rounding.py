@@ -71,3 +71,61 @@ def addcdiv_stochastic_(input: Tensor, tensor1: Tensor, tensor2: Tensor, value:
 
     result.addcdiv_(tensor1, tensor2, value=value)
     copy_stochastic_(input, result)
+
+
+def copy_stochastic_foreach_(targets: list[Tensor], sources: list[Tensor]):
+    """
+    copies each source into its target using stochastic rounding. The random numbers for all tensors are generated
+    by a single call, in the same order as calling copy_stochastic_ for each tensor.
+
+    Args:
+        targets: the target tensors with dtype=bfloat16, all on the same device
+        sources: the source tensors with dtype=float32
+    """
+
+    global generator
+
+    numels = [source.numel() for source in sources]
+
+    # create a random 16 bit integer for every element of every tensor
+    random = torch.randint(
+        size=(sum(numels),),
+        device=sources[0].device,
+        dtype=torch.int32,
+        low=0,
+        high=(1 << 16),
+        generator=generator,
+    )
+    results = [x.view(source.shape) for x, source in zip(random.split(numels), sources, strict=True)]
+
+    # add the random numbers to the lower 16 bit of the mantissas
+    torch._foreach_add_(results, [source.view(dtype=torch.int32) for source in sources])
+
+    # mask off the lower 16 bit of the mantissas
+    random.bitwise_and_(-65536)  # -65536 = FFFF0000 as a signed int32
+
+    # copy the higher 16 bit into the target tensors
+    torch._foreach_copy_(targets, [result.view(dtype=torch.float32) for result in results])
+
+    del random, results
+
+
+def addcdiv_stochastic_foreach_(
+        inputs: list[Tensor],
+        tensor1s: list[Tensor],
+        tensor2s: list[Tensor],
+        values: list[float],
+):
+    """
+    adds (tensor1 / tensor2 * value) to each input using stochastic rounding
+
+    Args:
+        inputs: the input tensors with dtype=bfloat16, all on the same device
+        tensor1s: the numerator tensors
+        tensor2s: the denominator tensors
+        values: a multiplier for each tensor1/tensor2
+    """
+    results = [x.to(dtype=torch.float32) for x in inputs]
+
+    torch._foreach_addcdiv_(results, tensor1s, tensor2s, values)
+    copy_stochastic_foreach_(inputs, results)
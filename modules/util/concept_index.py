@@ -0,0 +1,469 @@
+import hashlib
+import os
+import pathlib
+import sqlite3
+import threading
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from enum import IntEnum
+from typing import NamedTuple
+
+from modules.util import path_util
+from modules.util.image_util import load_image
+
+from mgds.pipelineModules.AspectBucketing import AspectBucketing
+
+import cv2
+import imagesize
+import numpy as np
+
+CONCEPT_INDEX_VERSION = 1
+
+# number of files whose dimensions are read between two cancellation checks and index writes
+_DIMENSIONS_BATCH_SIZE = 256
+
+
+class ConceptFileType(IntEnum):
+    IMAGE = 0
+    VIDEO = 1
+    MASK = 2
+    CONDITIONING = 3
+    CAPTION = 4
+
+
+class ConceptIndexEntry(NamedTuple):
+    path: str  # relative to the concept path, with / as separator
+    directory: str
+    file_type: ConceptFileType
+    size: int
+    mtime_ns: int
+    width: int | None
+    height: int | None
+    frames: float | None
+    fps: float | None
+    aspect_bucket: float | None
+    has_mask: bool
+    has_caption: bool
+
+
+_aspect_buckets = None
+
+
+def aspect_buckets() -> np.ndarray:
+    # all height/width ratios that aspect bucketing can select, independent of the target resolution, sorted
+    global _aspect_buckets
+    if _aspect_buckets is None:
+        ratios = set()
+        for aspect in AspectBucketing.all_possible_input_aspects:
+            ratios.add(round(aspect[0] / aspect[1], 6))
+            ratios.add(round(aspect[1] / aspect[0], 6))
+        _aspect_buckets = np.array(sorted(ratios))
+    return _aspect_buckets
+
+
+def nearest_aspect_buckets(widths, heights) -> np.ndarray:
+    """
+    Returns the nearest aspect bucket for each width/height pair. Ties resolve to the smaller bucket, like
+    min(buckets, key=lambda x: abs(x - aspect)) does.
+    """
+    buckets = aspect_buckets()
+    true_aspects = np.asarray(heights, dtype=np.float64) / np.asarray(widths, dtype=np.float64)
+    upper = np.clip(np.searchsorted(buckets, true_aspects), 1, len(buckets) - 1)
+    lower = upper - 1
+    nearest = np.where(true_aspects - buckets[lower] <= buckets[upper] - true_aspects, lower, upper)
+    return buckets[nearest]
+
+
+def nearest_aspect_bucket(width: float, height: float) -> float:
+    return float(nearest_aspect_buckets([width], [height])[0])
+
+
+def get_file_type(name: str) -> ConceptFileType | None:
+    extension = os.path.splitext(name)[1].lower()
+    if name.endswith("-masklabel.png"):
+        return ConceptFileType.MASK
+    if name.endswith("-condlabel.png"):
+        return ConceptFileType.CONDITIONING
+    if extension in path_util.SUPPORTED_IMAGE_EXTENSIONS:
+        return ConceptFileType.IMAGE
+    if extension in path_util.SUPPORTED_VIDEO_EXTENSIONS:
+        return ConceptFileType.VIDEO
+    if extension == ".txt":
+        return ConceptFileType.CAPTION
+    return None
+
+
+def read_dimensions(path: str, file_type: ConceptFileType) -> tuple[int, int, float | None, float | None]:
+    """
+    Returns (width, height, frames, fps). frames and fps are None for images.
+    """
+    if file_type == ConceptFileType.VIDEO:
+        video = cv2.VideoCapture(path)
+        width = video.get(cv2.CAP_PROP_FRAME_WIDTH)
+        height = video.get(cv2.CAP_PROP_FRAME_HEIGHT)
+        frames = video.get(cv2.CAP_PROP_FRAME_COUNT)
+        fps = video.get(cv2.CAP_PROP_FPS)
+        video.release()
+        return int(width), int(height), frames, fps
+
+    try:  # use imagesize if possible due to better speed
+        width, height = imagesize.get(path)
+        if width == -1:  # if imagesize doesn't recognize format it returns (-1, -1)
+            raise ValueError
+    except ValueError:  # use PIL if not supported by imagesize
+        image = load_image(path)
+        width, height = image.size
+        image.close()
+    return width, height, None, None
+
+
+class ConceptIndex:
+    """
+    An on-disk index of the files in a concept directory, stored as an sqlite database in the cache directory.
+
+    update() only lists directories that changed since the last update, based on the directory mtime. Adding, removing
+    or renaming files changes the mtime of their directory. Files that are modified in place are only detected by
+    update(verify_files=True), which compares the size and mtime of every file. Dimensions are read on demand by
+    update_dimensions(), and are kept until the file changes.
+
+    With read_only, an existing index is opened without write access, and the update functions can't be used. This is
+    used by processes that read an index while a different process keeps it up to date.
+    """
+
+    __lock = threading.Lock()
+
+    def __init__(self, concept_path: str, cache_dir: str, read_only: bool = False):
+        self.concept_path = concept_path
+        self.__root = os.path.realpath(concept_path)
+
+        digest = hashlib.sha256(self.__root.encode("utf-8")).hexdigest()[:32]
+        index_dir = os.path.join(cache_dir, "concept_index")
+        index_path = os.path.join(index_dir, f"{digest}.sqlite")
+
+        if read_only:
+            self.__connection = sqlite3.connect(
+                pathlib.Path(os.path.abspath(index_path)).as_uri() + "?mode=ro",
+                uri=True, timeout=60, check_same_thread=False,
+            )
+            with ConceptIndex.__lock:
+                version = self.__connection.execute("SELECT value FROM info WHERE key = 'version'").fetchone()
+            if version is None or int(version[0]) != CONCEPT_INDEX_VERSION:
+                self.__connection.close()
+                raise RuntimeError(f"the concept index of {concept_path} is missing or outdated")
+            return
+
+        os.makedirs(index_dir, exist_ok=True)
+        self.__connection = sqlite3.connect(index_path, timeout=60, check_same_thread=False)
+
+        with ConceptIndex.__lock, self.__connection:
+            self.__connection.execute("CREATE TABLE IF NOT EXISTS info (key TEXT PRIMARY KEY, value TEXT)")
+            version = self.__connection.execute("SELECT value FROM info WHERE key = 'version'").fetchone()
+            if version is None or int(version[0]) != CONCEPT_INDEX_VERSION:
+                self.__connection.execute("DROP TABLE IF EXISTS directories")
+                self.__connection.execute("DROP TABLE IF EXISTS files")
+                self.__connection.execute(
+                    "INSERT OR REPLACE INTO info (key, value) VALUES ('version', ?)", (str(CONCEPT_INDEX_VERSION),)
+                )
+                self.__connection.execute("INSERT OR REPLACE INTO info (key, value) VALUES ('path', ?)", (self.__root,))
+
+            self.__connection.execute(
+                "CREATE TABLE IF NOT EXISTS directories (path TEXT PRIMARY KEY, parent TEXT, mtime_ns INTEGER)"
+            )
+            self.__connection.execute(
+                "CREATE TABLE IF NOT EXISTS files ("
+                "path TEXT PRIMARY KEY, directory TEXT, file_type INTEGER, size INTEGER, mtime_ns INTEGER, "
+                "width INTEGER, height INTEGER, frames REAL, fps REAL, aspect_bucket REAL, "
+                "has_mask INTEGER, has_caption INTEGER)"
+            )
+            self.__connection.execute("CREATE INDEX IF NOT EXISTS files_directory ON files (directory)")
+
+    def close(self):
+        self.__connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def absolute_path(self, path: str) -> str:
+        return path_util.canonical_join(self.concept_path, path) if path else self.concept_path
+
+    @staticmethod
+    def __join(directory: str, name: str) -> str:
+        return f"{directory}/{name}" if directory else name
+
+    def __read_directory(
+            self,
+            directory: str,
+            known_mtime_ns: int | None,
+            verify_files: bool,
+    ) -> tuple[int, list[str] | None, dict[str, tuple[ConceptFileType, int, int]] | None] | None:
+        # only touches the file system, so it can run on worker threads.
+        # returns None if the directory doesn't exist, and no listing if it is unchanged
+        try:
+            mtime_ns = os.stat(self.absolute_path(directory)).st_mtime_ns
+        except OSError:
+            return None
+        if known_mtime_ns == mtime_ns and not verify_files:
+            return mtime_ns, None, None
+
+        subdirectories = []
+        files = {}
+        for entry in os.scandir(self.absolute_path(directory)):
+            if entry.is_dir():
+                subdirectories.append(self.__join(directory, entry.name))
+            elif entry.is_file():
+                file_type = get_file_type(entry.name)
+                if file_type is not None:
+                    stat = entry.stat()
+                    files[self.__join(directory, entry.name)] = (file_type, stat.st_size, stat.st_mtime_ns)
+        return mtime_ns, subdirectories, files
+
+    def __write_directory(
+            self,
+            directory: str,
+            mtime_ns: int,
+            parent: str | None,
+            subdirectories: list[str],
+            files: dict[str, tuple[ConceptFileType, int, int]],
+    ):
+        names = {os.path.basename(path) for path in files}
+
+        with ConceptIndex.__lock, self.__connection:
+            known_files = {
+                row[0]: (row[1], row[2]) for row in self.__connection.execute(
+                    "SELECT path, size, mtime_ns FROM files WHERE directory = ?", (directory,)
+                )
+            }
+
+            removed_files = [(path,) for path in known_files if path not in files]
+            self.__connection.executemany("DELETE FROM files WHERE path = ?", removed_files)
+
+            rows = []
+            unchanged_rows = []
+            for path, (file_type, size, file_mtime_ns) in files.items():
+                basename = os.path.splitext(os.path.basename(path))[0]
+                has_mask = (basename + "-masklabel.png") in names
+                has_caption = (basename + ".txt") in names
+
+                if known_files.get(path) == (size, file_mtime_ns):
+                    unchanged_rows.append((has_mask, has_caption, path))
+                else:
+                    rows.append((path, directory, int(file_type), size, file_mtime_ns, has_mask, has_caption))
+
+            self.__connection.executemany(
+                "UPDATE files SET has_mask = ?, has_caption = ? WHERE path = ?", unchanged_rows,
+            )
+            self.__connection.executemany(
+                "INSERT OR REPLACE INTO files (path, directory, file_type, size, mtime_ns, has_mask, has_caption) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)", rows,
+            )
+
+            # subdirectories are registered without an mtime, so they are scanned when they are first included
+            self.__connection.executemany(
+                "INSERT OR IGNORE INTO directories (path, parent, mtime_ns) VALUES (?, ?, NULL)",
+                [(subdirectory, directory) for subdirectory in subdirectories],
+            )
+
+            # the directory mtime is written last, so an interrupted scan is repeated on the next update
+            self.__connection.execute(
+                "INSERT OR REPLACE INTO directories (path, parent, mtime_ns) VALUES (?, ?, ?)",
+                (directory, parent, mtime_ns),
+            )
+
+    def update(
+            self,
+            include_subdirectories: bool,
+            verify_files: bool = False,
+            is_cancelled: Callable[[], bool] | None = None,
+            progress_callback: Callable[[int], None] | None = None,
+            max_workers: int | None = None,
+    ) -> bool:
+        """
+        Updates the index from the file system. Directories are listed in parallel, one level of the tree at a time,
+        while the index itself is only written from the calling thread. progress_callback is called with the number
+        of directories processed so far. Returns False if the update was cancelled.
+        """
+        known_directories = {}
+        known_subdirectories = {}
+        with ConceptIndex.__lock:
+            for path, parent, mtime_ns in self.__connection.execute("SELECT path, parent, mtime_ns FROM directories"):
+                known_directories[path] = mtime_ns
+                known_subdirectories.setdefault(parent, []).append(path)
+
+        seen_directories = set()
+        pending = [("", None)]
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="concept_index") as executor:
+            while pending:
+                futures = [
+                    executor.submit(self.__read_directory, directory, known_directories.get(directory), verify_files)
+                    for directory, _ in pending
+                ]
+
+                next_pending = []
+                for (directory, parent), future in zip(pending, futures, strict=True):
+                    if is_cancelled is not None and is_cancelled():
+                        for remaining in futures:
+                            remaining.cancel()
+                        return False
+
+                    result = future.result()
+                    if result is None:
+                        continue
+                    mtime_ns, subdirectories, files = result
+                    seen_directories.add(directory)
+
+                    if subdirectories is None:
+                        subdirectories = known_subdirectories.get(directory, [])
+                    else:
+                        self.__write_directory(directory, mtime_ns, parent, subdirectories, files)
+
+                    if include_subdirectories:
+                        next_pending.extend((subdirectory, directory) for subdirectory in subdirectories)
+
+                    if progress_callback is not None:
+                        progress_callback(len(seen_directories))
+
+                pending = next_pending
+
+        # remove directories that no longer exist. Without subdirectories, only the root directory was checked
+        removed_directories = [
+            (path,) for path in known_directories
+            if path not in seen_directories and (include_subdirectories or path == "")
+        ]
+        with ConceptIndex.__lock, self.__connection:
+            self.__connection.executemany("DELETE FROM files WHERE directory = ?", removed_directories)
+            self.__connection.executemany("DELETE FROM directories WHERE path = ?", removed_directories)
+
+        return True
+
+    def update_dimensions(
+            self,
+            include_subdirectories: bool,
+            is_cancelled: Callable[[], bool] | None = None,
+            progress_callback: Callable[[int], None] | None = None,
+            max_workers: int | None = None,
+    ) -> bool:
+        """
+        Reads the dimensions of all images and videos that don't have them yet. The file headers are read on a pool
+        of worker threads. progress_callback is called with the number of files processed so far. Returns False if
+        cancelled.
+        """
+        with ConceptIndex.__lock:
+            paths = self.__connection.execute(
+                "SELECT path, file_type FROM files WHERE width IS NULL AND file_type IN (?, ?)"
+                + ("" if include_subdirectories else " AND directory = ''"),
+                (int(ConceptFileType.IMAGE), int(ConceptFileType.VIDEO)),
+            ).fetchall()
+
+        def read(path: str, file_type: int) -> tuple[int, int, float | None, float | None] | None:
+            try:
+                return read_dimensions(self.absolute_path(path), ConceptFileType(file_type))
+            except Exception:
+                return None
+
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="concept_index") as executor:
+            for start in range(0, len(paths), _DIMENSIONS_BATCH_SIZE):
+                if is_cancelled is not None and is_cancelled():
+                    return False
+
+                batch = paths[start:start + _DIMENSIONS_BATCH_SIZE]
+                results = list(executor.map(lambda row: read(*row), batch))
+                batch = [(row[0], result) for row, result in zip(batch, results, strict=True) if result is not None]
+
+                widths = np.array([result[0] for _, result in batch], dtype=np.float64)
+                heights = np.array([result[1] for _, result in batch], dtype=np.float64)
+                valid = (widths > 0) & (heights > 0)
+                buckets = np.full(len(batch), np.nan)
+                if valid.any():
+                    buckets[valid] = nearest_aspect_buckets(widths[valid], heights[valid])
+
+                self.__write_dimensions([
+                    (*result, None if np.isnan(bucket) else float(bucket), path)
+                    for (path, result), bucket in zip(batch, buckets, strict=True)
+                ])
+
+                if progress_callback is not None:
+                    progress_callback(start + len(results))
+
+        return True
+
+    def __write_dimensions(self, rows: list[tuple]):
+        if rows:
+            with ConceptIndex.__lock, self.__connection:
+                self.__connection.executemany(
+                    "UPDATE files SET width = ?, height = ?, frames = ?, fps = ?, aspect_bucket = ? WHERE path = ?", rows
+                )
+
+    def __where(self, include_subdirectories: bool, file_types: list[ConceptFileType] | None) -> tuple[str, list]:
+        conditions = []
+        parameters = []
+        if not include_subdirectories:
+            conditions.append("directory = ''")
+        if file_types is not None:
+            conditions.append(f"file_type IN ({', '.join('?' * len(file_types))})")
+            parameters.extend(int(file_type) for file_type in file_types)
+        return (" WHERE " + " AND ".join(conditions)) if conditions else "", parameters
+
+    def entries(
+            self,
+            include_subdirectories: bool,
+            file_types: list[ConceptFileType] | None = None,
+    ) -> list[ConceptIndexEntry]:
+        where, parameters = self.__where(include_subdirectories, file_types)
+        with ConceptIndex.__lock:
+            rows = self.__connection.execute(
+                "SELECT path, directory, file_type, size, mtime_ns, width, height, frames, fps, aspect_bucket, "
+                "has_mask, has_caption FROM files" + where + " ORDER BY path", parameters,
+            ).fetchall()
+        return [
+            ConceptIndexEntry(
+                row[0], row[1], ConceptFileType(row[2]), row[3], row[4], row[5], row[6], row[7], row[8], row[9],
+                bool(row[10]), bool(row[11]),
+            ) for row in rows
+        ]
+
+    def paths(
+            self,
+            include_subdirectories: bool,
+            file_types: list[ConceptFileType] | None = None,
+    ) -> list[str]:
+        """
+        Returns the absolute paths of all indexed files, sorted by their path
+        """
+        where, parameters = self.__where(include_subdirectories, file_types)
+        with ConceptIndex.__lock:
+            rows = self.__connection.execute("SELECT path FROM files" + where + " ORDER BY path", parameters).fetchall()
+        return [self.absolute_path(row[0]) for row in rows]
+
+    def count(
+            self,
+            include_subdirectories: bool,
+            file_types: list[ConceptFileType] | None = None,
+    ) -> int:
+        where, parameters = self.__where(include_subdirectories, file_types)
+        with ConceptIndex.__lock:
+            return self.__connection.execute("SELECT COUNT(*) FROM files" + where, parameters).fetchone()[0]
+
+    def path_at(
+            self,
+            index: int,
+            include_subdirectories: bool,
+            file_types: list[ConceptFileType] | None = None,
+    ) -> str | None:
+        """
+        Returns the absolute path of the file at the index, in the order of paths(), without loading all paths
+        """
+        where, parameters = self.__where(include_subdirectories, file_types)
+        with ConceptIndex.__lock:
+            row = self.__connection.execute(
+                "SELECT path FROM files" + where + " ORDER BY path LIMIT 1 OFFSET ?", [*parameters, index],
+            ).fetchone()
+        return self.absolute_path(row[0]) if row is not None else None
+
+    def directory_count(self, include_subdirectories: bool) -> int:
+        with ConceptIndex.__lock:
+            if not include_subdirectories:
+                return self.__connection.execute("SELECT COUNT(*) FROM directories WHERE path = ''").fetchone()[0]
+            return self.__connection.execute("SELECT COUNT(*) FROM directories").fetchone()[0]
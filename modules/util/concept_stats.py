@@ -2,13 +2,18 @@ import concurrent.futures
 import os
 import threading
 import time
+from collections.abc import Callable
 
 from modules.util import path_util
+from modules.util.concept_index import (
+    ConceptFileType,
+    ConceptIndex,
+    aspect_buckets,
+    nearest_aspect_buckets,
+)
 from modules.util.config.ConceptConfig import ConceptConfig
 from modules.util.image_util import load_image
 
-from mgds.pipelineModules.AspectBucketing import AspectBucketing
-
 import cv2
 import imagesize
 
@@ -70,16 +75,9 @@ def init_concept_stats(advanced_checks : bool):
         stats_dict["min_caption_length"] = [1000000000,"-",0]   #min char count, filepath, word count
         stats_dict["avg_caption_length"] = [0,0]                #avg char count, avg word count
 
-        aspect_ratio_list = []
-        for aspect in AspectBucketing.all_possible_input_aspects:   #input parameters don't matter but can't be blank
-            aspect_ratio_list.append(round(aspect[0]/aspect[1], 6))     #get both wide and tall ratios
-            aspect_ratio_list.append(round(aspect[1]/aspect[0], 6))
-        aspect_ratio_list = list(set(aspect_ratio_list))
-        aspect_ratio_list.sort()
-
         #initialize counts for all buckets to 0
-        for aspect in aspect_ratio_list:
-            stats_dict["aspect_buckets"][aspect] = 0
+        for aspect in aspect_buckets():
+            stats_dict["aspect_buckets"][float(aspect)] = 0
 
     return stats_dict
 
@@ -92,14 +90,21 @@ def folder_scan(dir, stats_dict : dict, advanced_checks : bool, conceptconfig :
     vid_extensions_list = path_util.SUPPORTED_VIDEO_EXTENSIONS
     file_list = [f for f in os.scandir(dir) if f.is_file()]     #this may take time on large directories
     if advanced_checks:
-        aspect_ratio_list = list(stats_dict["aspect_buckets"].keys())
-        file_list_str = [x.path for x in file_list]     #seems faster to check list of strings for matching files than list of path objects
+        file_list_str = {x.path for x in file_list}     #set of strings, so pairing lookups don't search the whole directory
+        widths = []     #aspect buckets are assigned for the whole directory at once
+        heights = []
     stats_dict["directory_count"] += 1
 
+    def count_aspect_buckets():
+        if advanced_checks and widths:
+            for aspect in nearest_aspect_buckets(widths, heights):
+                stats_dict["aspect_buckets"][float(aspect)] += 1
+
     for path in file_list:
         stats_dict["processing_time"] = time.perf_counter() - start_time
         if time.perf_counter() - start_time > wait_time or cancel_scan_flag.is_set():
             stats_dict["force_cancelled"] = True
+            count_aspect_buckets()
             return stats_dict
         basename, extension = os.path.splitext(path)
         if extension.lower() in img_extensions_list and not path.name.endswith("-masklabel.png") and not path.name.endswith("-condlabel.png"):
@@ -137,9 +142,8 @@ def folder_scan(dir, stats_dict : dict, advanced_checks : bool, conceptconfig :
                     width, height = img.size
                     img.close()
                 pixels = width*height
-                true_aspect = height/width
-                nearest_aspect = min(aspect_ratio_list, key=lambda x:abs(x-true_aspect))    #try to match math used in aspect bucketing
-                stats_dict["aspect_buckets"][nearest_aspect] += 1
+                widths.append(width)
+                heights.append(height)
 
                 if pixels > stats_dict["max_pixels"][0]:
                     stats_dict["max_pixels"] = [pixels, os.path.relpath(path, conceptconfig.path), f'{width}w x {height}h']
@@ -180,9 +184,8 @@ def folder_scan(dir, stats_dict : dict, advanced_checks : bool, conceptconfig :
                 vid.release()
 
                 pixels = width*height
-                true_aspect = height/width
-                nearest_aspect = min(aspect_ratio_list, key=lambda x:abs(x-true_aspect))
-                stats_dict["aspect_buckets"][nearest_aspect] += 1
+                widths.append(width)
+                heights.append(height)
 
                 if pixels > stats_dict["max_pixels"][0]:
                     stats_dict["max_pixels"] = [pixels, os.path.relpath(path, conceptconfig.path), f'{width}w x {height}h']
@@ -210,6 +213,7 @@ def folder_scan(dir, stats_dict : dict, advanced_checks : bool, conceptconfig :
             stats_dict["file_size"] += path.stat().st_size
 
     #update every directory loop
+    count_aspect_buckets()
     if advanced_checks:
         #check for number of "orphaned" mask/caption files as the difference between the total count and the count of image/mask or image/caption pairs
         stats_dict["unpaired_masks"] = stats_dict["mask_count"]-stats_dict["paired_masks"]
@@ -217,6 +221,104 @@ def folder_scan(dir, stats_dict : dict, advanced_checks : bool, conceptconfig :
 
     return stats_dict
 
+def index_scan(concept_index : ConceptIndex, stats_dict : dict, advanced_checks : bool, include_subdirectories : bool, start_time : float, wait_time : float, cancel_scan_flag : threading.Event,
+               progress_callback : Callable[[dict], None] | None = None, max_workers : int | None = None):
+    #same statistics as folder_scan, but calculated from the concept index. only changed directories are listed again,
+    #and image dimensions are only read for files that are new or changed since the last advanced scan.
+    #directory listings and header reads run on max_workers threads, progress_callback gets the partial stats about every half second
+    last_update = time.perf_counter()
+
+    def is_cancelled():
+        return time.perf_counter() - start_time > wait_time or cancel_scan_flag.is_set()
+
+    def on_progress(directory_count : int | None = None):
+        nonlocal last_update
+        stats_dict["processing_time"] = time.perf_counter() - start_time
+        if directory_count is not None:
+            stats_dict["directory_count"] = directory_count
+        if progress_callback is not None and time.perf_counter() > last_update + 0.5:
+            last_update = time.perf_counter()
+            progress_callback(stats_dict)
+
+    completed = concept_index.update(include_subdirectories, verify_files=advanced_checks, is_cancelled=is_cancelled,
+                                     progress_callback=on_progress, max_workers=max_workers)
+    if completed and advanced_checks:
+        completed = concept_index.update_dimensions(include_subdirectories, is_cancelled=is_cancelled,
+                                                    progress_callback=lambda count: on_progress(), max_workers=max_workers)
+    stats_dict["force_cancelled"] = not completed
+
+    stats_dict["directory_count"] = concept_index.directory_count(include_subdirectories)
+    for entry in concept_index.entries(include_subdirectories):
+        if entry.file_type == ConceptFileType.CONDITIONING:
+            continue
+        stats_dict["file_size"] += entry.size
+        if entry.file_type == ConceptFileType.MASK:
+            stats_dict["mask_count"] += 1
+            continue
+        if entry.file_type == ConceptFileType.CAPTION:
+            stats_dict["caption_count"] += 1
+            continue
+
+        is_video = entry.file_type == ConceptFileType.VIDEO
+        stats_dict["video_count" if is_video else "image_count"] += 1
+        if not advanced_checks:
+            continue
+
+        media_count = stats_dict["image_count"] + stats_dict["video_count"]
+        if entry.has_mask and not is_video:
+            stats_dict["paired_masks"] += 1
+            stats_dict["image_with_mask_count"] += 1
+        if entry.has_caption:
+            stats_dict["paired_captions"] += 1
+            stats_dict["video_with_caption_count" if is_video else "image_with_caption_count"] += 1
+            caption_path = os.path.splitext(concept_index.absolute_path(entry.path))[0] + ".txt"
+            try:
+                with open(caption_path, "r") as captionfile:
+                    captionlist = captionfile.read().splitlines()
+            except OSError:     #removed since the index was updated
+                captionlist = []
+            for caption in captionlist:
+                stats_dict["subcaption_count"] += 1
+                char_count = len(caption)
+                word_count = len(caption.split())
+                if char_count > stats_dict["max_caption_length"][0]:
+                    stats_dict["max_caption_length"] = [char_count, entry.path, word_count]
+                if char_count < stats_dict["min_caption_length"][0]:
+                    stats_dict["min_caption_length"] = [char_count, entry.path, word_count]
+                stats_dict["avg_caption_length"][0] += (char_count - stats_dict["avg_caption_length"][0])/media_count
+                stats_dict["avg_caption_length"][1] += (word_count - stats_dict["avg_caption_length"][1])/media_count
+
+        if entry.width is None:     #dimensions not read yet, only happens if the scan was cancelled
+            continue
+        pixels = entry.width*entry.height
+        if entry.aspect_bucket is not None:
+            stats_dict["aspect_buckets"][entry.aspect_bucket] = stats_dict["aspect_buckets"].get(entry.aspect_bucket, 0) + 1
+        if pixels > stats_dict["max_pixels"][0]:
+            stats_dict["max_pixels"] = [pixels, entry.path, f'{entry.width}w x {entry.height}h']
+        if pixels < stats_dict["min_pixels"][0]:
+            stats_dict["min_pixels"] = [pixels, entry.path, f'{entry.width}w x {entry.height}h']
+        stats_dict["avg_pixels"] += (pixels - stats_dict["avg_pixels"])/media_count
+
+        if is_video:
+            if entry.frames > stats_dict["max_length"][0]:
+                stats_dict["max_length"] = [entry.frames, entry.path]
+            if entry.frames < stats_dict["min_length"][0]:
+                stats_dict["min_length"] = [entry.frames, entry.path]
+            stats_dict["avg_length"] += (entry.frames - stats_dict["avg_length"])/stats_dict["video_count"]
+
+            if entry.fps > stats_dict["max_fps"][0]:
+                stats_dict["max_fps"] = [entry.fps, entry.path]
+            if entry.fps < stats_dict["min_fps"][0]:
+                stats_dict["min_fps"] = [entry.fps, entry.path]
+            stats_dict["avg_fps"] += (entry.fps - stats_dict["avg_fps"])/stats_dict["video_count"]
+
+    if advanced_checks:
+        stats_dict["unpaired_masks"] = stats_dict["mask_count"]-stats_dict["paired_masks"]
+        stats_dict["unpaired_captions"] = stats_dict["caption_count"]-stats_dict["paired_captions"]
+
+    stats_dict["processing_time"] = time.perf_counter() - start_time
+    return stats_dict
+
 #currently unused
 def combine_stats_dicts(input_dicts : list[dict], advanced_checks : bool):
     final_dict = init_concept_stats(advanced_checks)
@@ -284,7 +386,7 @@ def subfolder_scan(conceptconfig : ConceptConfig, advanced_checks : bool, wait_t
     cancel_scan_flag.clear()
 
     for dir in subfolders:
-        stats_dict = folder_scan(dir, stats_dict, advanced_checks, start_time, wait_time, cancel_scan_flag)
+        stats_dict = folder_scan(dir, stats_dict, advanced_checks, conceptconfig, start_time, wait_time, cancel_scan_flag)
         subfolders.extend([f for f in os.scandir(dir) if f.is_dir()])
 
     return stats_dict
@@ -301,10 +403,10 @@ def subfolder_scan_threaded(conceptconfig : ConceptConfig, advanced_checks : boo
     with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
         stats_futures = []
         for dir in subfolders:
-            stats_futures += [executor.submit(folder_scan, dir, init_concept_stats(advanced_checks), advanced_checks, start_time, wait_time, cancel_scan_flag)]
+            stats_futures += [executor.submit(folder_scan, dir, init_concept_stats(advanced_checks), advanced_checks, conceptconfig, start_time, wait_time, cancel_scan_flag)]
             subfolders.extend([f.path for f in os.scandir(dir) if f.is_dir()])
         stats_results = [f.result() for f in stats_futures]
 
-    final_stats = combine_stats_dicts(stats_results, conceptconfig, advanced_checks)
+    final_stats = combine_stats_dicts(stats_results, advanced_checks)
     final_stats["processing_time"] = time.perf_counter() - start_time
     return final_stats
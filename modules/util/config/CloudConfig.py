@@ -53,6 +53,7 @@ class CloudConfig(BaseConfig):
     enabled: bool
     type: CloudType
     file_sync : CloudFileSync
+    delta_upload : bool
     create : bool
     name: str
     tensorboard_tunnel: bool
@@ -89,6 +90,7 @@ class CloudConfig(BaseConfig):
         data.append(("enabled", False, bool, False))
         data.append(("type", CloudType.RUNPOD, CloudType, False))
         data.append(("file_sync", CloudFileSync.NATIVE_SCP, CloudFileSync, False))
+        data.append(("delta_upload", False, bool, False))
         data.append(("create", True, bool, False))
         data.append(("name", "OneTrainer", str, False))
         data.append(("tensorboard_tunnel", True, bool, False))
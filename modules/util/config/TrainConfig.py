@@ -21,6 +21,7 @@ from modules.util.enum.LearningRateScheduler import LearningRateScheduler
 from modules.util.enum.LossScaler import LossScaler
 from modules.util.enum.LossWeight import LossWeight
 from modules.util.enum.ModelFormat import ModelFormat
+from modules.util.enum.ModelHashMode import ModelHashMode
 from modules.util.enum.ModelType import ModelType, PeftType
 from modules.util.enum.Optimizer import Optimizer
 from modules.util.enum.TimestepDistribution import TimestepDistribution
@@ -351,6 +352,8 @@ class QuantizationConfig(BaseConfig):
     svd_dtype: DataType
     svd_rank: int
     cache_dir: str
+    cache_quantized_weights: bool
+    cache_size_limit: float
 
     @staticmethod
     def default_values():
@@ -363,6 +366,8 @@ class QuantizationConfig(BaseConfig):
         data.append(("svd_dtype", DataType.NONE, DataType, False))
         data.append(("svd_rank", 16, int, False))
         data.append(("cache_dir", None, str, True))
+        data.append(("cache_quantized_weights", False, bool, False))
+        data.append(("cache_size_limit", 50.0, float, False))
         return QuantizationConfig(data)
 
 class TrainConfig(BaseConfig):
@@ -379,6 +384,7 @@ class TrainConfig(BaseConfig):
     validation: bool
     validate_after: float
     validate_after_unit: TimeUnit
+    validation_batch_size: int
     continue_last_backup: bool
     include_train_config: ConfigPart
 
@@ -389,16 +395,20 @@ class TrainConfig(BaseConfig):
     fused_gradient_reduce: bool
     async_gradient_reduce: bool
     async_gradient_reduce_buffer: int
+    gradient_reduce_bucket_size: int
 
     # model settings
     base_model_name: str
     output_dtype: DataType
     output_model_format: ModelFormat
+    output_model_hash: ModelHashMode
     output_model_destination: str
     gradient_checkpointing: GradientCheckpointingMethod
     enable_async_offloading: bool
     enable_activation_offloading: bool
     layer_offload_fraction: float
+    layer_offload_vram_budget: float
+    layer_offload_disk_path: str
     force_circular_padding: bool
     compile: bool
 
@@ -536,6 +546,7 @@ class TrainConfig(BaseConfig):
     lora_decompose: bool
     lora_decompose_norm_epsilon: bool
     lora_decompose_output_axis: bool
+    lora_decompose_low_rank_norm: bool
     lora_weight_dtype: DataType
     bundle_additional_embeddings: bool
 
@@ -560,6 +571,7 @@ class TrainConfig(BaseConfig):
     sample_audio_format: AudioFormat
     samples_to_tensorboard: bool
     non_ema_sampling: bool
+    sample_batch_size: int
 
     # cloud settings
     cloud: CloudConfig
@@ -964,6 +976,7 @@ class TrainConfig(BaseConfig):
         data.append(("validation", False, bool, False))
         data.append(("validate_after", 1, int, False))
         data.append(("validate_after_unit", TimeUnit.EPOCH, TimeUnit, False))
+        data.append(("validation_batch_size", 1, int, False))
         data.append(("continue_last_backup", False, bool, False))
         data.append(("include_train_config", ConfigPart.NONE, ConfigPart, False))
 
@@ -974,16 +987,20 @@ class TrainConfig(BaseConfig):
         data.append(("fused_gradient_reduce", True, bool, False))
         data.append(("async_gradient_reduce", True, bool, False))
         data.append(("async_gradient_reduce_buffer", 100, int, False))
+        data.append(("gradient_reduce_bucket_size", 25, int, False))
 
         # model settings
         data.append(("base_model_name", "stable-diffusion-v1-5/stable-diffusion-v1-5", str, False))
         data.append(("output_dtype", DataType.FLOAT_32, DataType, False))
         data.append(("output_model_format", ModelFormat.SAFETENSORS, ModelFormat, False))
+        data.append(("output_model_hash", ModelHashMode.SHA256, ModelHashMode, False))
         data.append(("output_model_destination", "models/model.safetensors", str, False))
         data.append(("gradient_checkpointing", GradientCheckpointingMethod.ON, GradientCheckpointingMethod, False))
         data.append(("enable_async_offloading", True, bool, False))
         data.append(("enable_activation_offloading", True, bool, False))
         data.append(("layer_offload_fraction", 0.0, float, False))
+        data.append(("layer_offload_vram_budget", 0.0, float, False))
+        data.append(("layer_offload_disk_path", "", str, False))
         data.append(("force_circular_padding", False, bool, False))
         data.append(("compile", False, bool, False))
 
@@ -1165,6 +1182,7 @@ class TrainConfig(BaseConfig):
         data.append(("lora_decompose", False, bool, False))
         data.append(("lora_decompose_norm_epsilon", True, bool, False))
         data.append(("lora_decompose_output_axis", False, bool, False))
+        data.append(("lora_decompose_low_rank_norm", False, bool, False))
         data.append(("lora_weight_dtype", DataType.FLOAT_32, DataType, False))
         data.append(("bundle_additional_embeddings", True, bool, False))
 
@@ -1189,6 +1207,7 @@ class TrainConfig(BaseConfig):
         data.append(("sample_audio_format", AudioFormat.MP3, AudioFormat, False))
         data.append(("samples_to_tensorboard", True, bool, False))
         data.append(("non_ema_sampling", True, bool, False))
+        data.append(("sample_batch_size", 1, int, False))
 
         # backup settings
         data.append(("backup_after", 30, int, False))
@@ -110,9 +110,12 @@ def create_data_loader(
         training_method: TrainingMethod = TrainingMethod.FINE_TUNE,
         config: TrainConfig = None,
         train_progress: TrainProgress | None = None,
-        is_validation: bool = False
+        is_validation: bool = False,
+        pad_batches: bool = False,
 ) -> BaseDataLoader | None:
-    if config.gradient_checkpointing.offload() and config.layer_offload_fraction > 0 and config.dataloader_threads > 1:
+    if config.gradient_checkpointing.offload() \
+            and (config.layer_offload_fraction > 0 or config.layer_offload_vram_budget > 0) \
+            and config.dataloader_threads > 1:
         raise RuntimeError('layer offloading can not be activated if "dataloader_threads" > 1')
 
     if train_progress is None:
@@ -121,7 +124,8 @@ def create_data_loader(
     cls = factory.get(BaseDataLoader, model_type, training_method)
     if cls is None:
         cls = factory.get(BaseDataLoader, model_type)
-    return cls(train_device, temp_device, config, model, model_setup, train_progress, is_validation) if cls is not None else None
+    return cls(train_device, temp_device, config, model, model_setup, train_progress, is_validation, pad_batches) \
+        if cls is not None else None
 
 def create_optimizer(
         parameter_group_collection: NamedParameterGroupCollection,
@@ -135,7 +139,8 @@ def create_optimizer(
     if optimizer_config.optimizer is None:
         return None
 
-    if config.gradient_checkpointing.offload() and config.layer_offload_fraction > 0:
+    if config.gradient_checkpointing.offload() \
+            and (config.layer_offload_fraction > 0 or config.layer_offload_vram_budget > 0):
         if (not optimizer_config.optimizer.supports_fused_back_pass() or not optimizer_config.fused_back_pass) \
                 and config.training_method == TrainingMethod.FINE_TUNE:
             raise RuntimeError('layer offloading can only be used for fine tuning when using an optimizer that supports "fused_back_pass"')
@@ -0,0 +1,10 @@
+from enum import Enum
+
+
+class ModelHashMode(Enum):
+    NONE = 'NONE'
+    SHA256 = 'SHA256'  # sha256 of the tensor data section, compatible with the previous model spec hash
+    SHA256_TREE = 'SHA256_TREE'  # sha256 of the sha256 hashes of fixed size chunks, calculated in parallel
+
+    def __str__(self):
+        return self.value
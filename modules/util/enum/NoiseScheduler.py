@@ -15,5 +15,13 @@ class NoiseScheduler(Enum):
     DPMPP_SDE_KARRAS = 'DPMPP_SDE_KARRAS'
     UNIPC_KARRAS = 'UNIPC_KARRAS'
 
+    def is_stochastic(self) -> bool:
+        # these schedulers add new noise in each step
+        return self in [
+            NoiseScheduler.EULER_A,
+            NoiseScheduler.DPMPP_SDE,
+            NoiseScheduler.DPMPP_SDE_KARRAS,
+        ]
+
     def __str__(self):
         return self.value
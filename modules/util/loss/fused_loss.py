@@ -0,0 +1,97 @@
+import math
+
+import torch
+import torch.nn.functional as F
+from torch import Tensor
+
+_LOG_2 = math.log(2.0)
+
+
+def _elementwise_losses(
+        diff: Tensor,
+        mse_strength: float,
+        mae_strength: float,
+        log_cosh_strength: float,
+        huber_strength: float,
+        huber_delta: float,
+) -> Tensor:
+    # the weighted sum of all enabled loss terms, accumulated in place into a single tensor
+    losses = torch.zeros_like(diff)
+    abs_diff = diff.abs() if mae_strength != 0 or huber_strength != 0 else None
+
+    if mse_strength != 0:
+        losses.addcmul_(diff, diff, value=mse_strength)
+    if mae_strength != 0:
+        losses.add_(abs_diff, alpha=mae_strength)
+    if log_cosh_strength != 0:
+        losses.add_(F.softplus(-2.0 * diff).add_(diff).sub_(_LOG_2), alpha=log_cosh_strength)
+    if huber_strength != 0:
+        # same definition as F.huber_loss
+        losses.add_(torch.where(
+            abs_diff < huber_delta,
+            diff.square().mul_(0.5),
+            abs_diff.sub(0.5 * huber_delta).mul_(huber_delta),
+        ), alpha=huber_strength)
+
+    return losses
+
+
+def fused_losses(
+        predicted: Tensor,
+        target: Tensor,
+        prior_target: Tensor | None,
+        mask: Tensor | None,
+        mse_strength: float,
+        mae_strength: float,
+        log_cosh_strength: float,
+        huber_strength: float,
+        huber_delta: float,
+        unmasked_weight: float,
+        normalize_masked_area_loss: bool,
+        masked_prior_preservation_weight: float,
+) -> Tensor:
+    """
+    Calculates the per sample loss of all enabled MSE, MAE, log-cosh and Huber terms in one pass. The inputs are only
+    converted to float32 once, and all terms share one accumulator. Without a mask, this is the mean of the weighted
+    terms. With a mask, it matches masked_losses_with_prior applied to each term. Every term is linear in the
+    elementwise loss, so masking and normalizing the weighted sum is the same as masking each term on its own.
+    """
+    mean_dim = list(range(1, predicted.ndim))
+    strengths = (mse_strength, mae_strength, log_cosh_strength, huber_strength, huber_delta)
+
+    predicted = predicted.to(dtype=torch.float32)
+    losses = _elementwise_losses(predicted - target.to(dtype=torch.float32), *strengths)
+
+    if mask is None:
+        return losses.mean(mean_dim)
+
+    clamped_mask = torch.clamp(mask.to(dtype=torch.float32), unmasked_weight, 1)
+    losses.mul_(clamped_mask)
+    if normalize_masked_area_loss:
+        losses.div_(clamped_mask.mean(dim=(1, 2, 3), keepdim=True))
+    losses = losses.mean(mean_dim)
+
+    if masked_prior_preservation_weight == 0 or prior_target is None:
+        return losses
+
+    prior_losses = _elementwise_losses(predicted - prior_target.to(dtype=torch.float32), *strengths)
+    inverse_mask = 1 - clamped_mask
+    prior_losses.mul_(inverse_mask).mul_(masked_prior_preservation_weight)
+    if normalize_masked_area_loss:
+        prior_losses.div_(inverse_mask.mean(dim=(1, 2, 3), keepdim=True))
+
+    return losses + prior_losses.mean(mean_dim)
+
+
+_compiled_fused_losses = None
+
+
+def compiled_fused_losses():
+    """
+    Returns fused_losses compiled with torch.compile, which turns the elementwise terms and the reductions into a few
+    kernels without any full resolution temporaries
+    """
+    global _compiled_fused_losses
+    if _compiled_fused_losses is None:
+        _compiled_fused_losses = torch.compile(fused_losses)
+    return _compiled_fused_losses
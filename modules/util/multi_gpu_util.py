@@ -56,45 +56,136 @@ def reduce_tensor_mean(tensor):
         torch.distributed.all_reduce(tensor, op=torch.distributed.ReduceOp.SUM)
         tensor /= world_size()
 
+class _GradientBucket:
+    #a group of gradients with the same reduce dtype, gradient dtype and device, reduced as one flat buffer
+    def __init__(self, reduce_dtype: torch.dtype, grad_dtype: torch.dtype, device: torch.device):
+        self.reduce_dtype = reduce_dtype
+        self.grad_dtype = grad_dtype
+        self.device = device
+        self.entries = []
+        self.nbytes = 0
+        self.flat = None
+
+    def accepts(self, reduce_dtype: torch.dtype, grad_dtype: torch.dtype, device: torch.device) -> bool:
+        return self.reduce_dtype == reduce_dtype and self.grad_dtype == grad_dtype and self.device == device
+
+    def add(self, param: torch.Tensor, after_reduce):
+        self.entries.append((param, after_reduce))
+        self.nbytes += param.grad.numel() * self.reduce_dtype.itemsize
+
+    def pack(self):
+        if len(self.entries) == 1:
+            param, _ = self.entries[0]
+            self.flat = param.grad.to(self.reduce_dtype)
+        else:
+            self.flat = torch.empty(sum(param.grad.numel() for param, _ in self.entries), dtype=self.reduce_dtype, device=self.device)
+            offset = 0
+            for param, _ in self.entries:
+                numel = param.grad.numel()
+                self.flat[offset:offset + numel].view_as(param.grad).copy_(param.grad)
+                offset += numel
+
+    def unpack(self, precision: GradientReducePrecision):
+        stochastic_rounding = precision.stochastic_rounding(self.grad_dtype)
+        flat = self.flat.to(torch.float32) if stochastic_rounding else self.flat
+        flat /= world_size()
+
+        offset = 0
+        for param, after_reduce in self.entries:
+            numel = param.grad.numel()
+            grad = flat[offset:offset + numel].view_as(param.grad)
+            offset += numel
+
+            if stochastic_rounding:
+                copy_stochastic_(param.grad, grad)
+            elif len(self.entries) == 1:
+                param.grad = grad.to(param.grad.dtype)
+            else:
+                param.grad.copy_(grad)
+
+            if after_reduce is not None:
+                after_reduce(param)
+
+        self.flat = None
+
+
 async_deque = deque()
 in_transfer = 0
+pending_bucket = None
 
 
-def reduce_grads_mean(params: list[torch.Tensor], precision: GradientReducePrecision, after_reduce=None, async_op: bool=False, max_buffer: int=0):
+def _launch_bucket(bucket: _GradientBucket, precision: GradientReducePrecision, async_op: bool, max_buffer: int):
+    global in_transfer
+    if async_op:
+        complete_previous_async_ops(precision, next_size=bucket.nbytes, max_buffer=max_buffer)
+        bucket.pack()
+        work = torch.distributed.all_reduce(bucket.flat, op=torch.distributed.ReduceOp.SUM, async_op=True)
+        async_deque.append((work, bucket))
+        in_transfer += bucket.nbytes
+    else:
+        bucket.pack()
+        torch.distributed.all_reduce(bucket.flat, op=torch.distributed.ReduceOp.SUM, async_op=False)
+        bucket.unpack(precision)
+
+
+def _flush_pending_bucket(precision: GradientReducePrecision, async_op: bool, max_buffer: int):
+    global pending_bucket
+    if pending_bucket is not None:
+        bucket = pending_bucket
+        pending_bucket = None
+        _launch_bucket(bucket, precision, async_op, max_buffer)
+
+
+def reduce_grads_mean(
+        params: list[torch.Tensor],
+        precision: GradientReducePrecision,
+        after_reduce=None,
+        async_op: bool=False,
+        max_buffer: int=0,
+        bucket_size: int=0,
+        defer: bool=False,
+):
+    """
+    Averages the gradients of params over all ranks.
+
+    Gradients are packed into flat buckets of up to bucket_size bytes (in the reduce dtype), and one all_reduce is
+    issued per bucket. A bucket_size of 0 reduces each gradient on its own.
+
+    Args:
+        params: the parameters whose gradients are reduced
+        precision: the precision used for the reduce operation
+        after_reduce: called for each parameter after its gradient is reduced
+        async_op: launch the reduce operations asynchronously. Completed by finish_async()
+        max_buffer: maximum number of bytes in transfer if async_op is enabled
+        bucket_size: maximum number of bytes in one bucket
+        defer: keep the last, partially filled bucket open for subsequent calls. Flushed by finish_async()
+    """
+    global pending_bucket
     assert not async_op or max_buffer > 0
     if not is_enabled() and after_reduce is None:
         return
+    if async_op:
+        #a single bucket must fit into the async buffer
+        bucket_size = min(bucket_size, max_buffer)
+
     for param in params:
         if param.requires_grad and param.grad is not None:
             if is_enabled():
-                if async_op:
-                    global async_deque
-                    global in_transfer
-                    grad = param.grad.to(precision.torch_dtype(param.grad.dtype))
-
-                    size = grad.numel() * grad.element_size()
-                    complete_previous_async_ops(precision, next_size=size, max_buffer=max_buffer)
-
-                    work = torch.distributed.all_reduce(grad, op=torch.distributed.ReduceOp.SUM, async_op=True)
-                    async_deque.append((work, param, grad, after_reduce))
-
-                    in_transfer += size
-                else:
-                    grad = param.grad.to(precision.torch_dtype(param.grad.dtype))
-                    torch.distributed.all_reduce(grad, op=torch.distributed.ReduceOp.SUM, async_op=False)
-
-                    grad = grad.to(torch.float32) if precision.stochastic_rounding(param.grad.dtype) else grad
-                    grad /= world_size()
-                    if precision.stochastic_rounding(param.grad.dtype):
-                        copy_stochastic_(param.grad, grad)
-                    else:
-                        param.grad = grad.to(param.grad.dtype)
-
-                    if after_reduce is not None:
-                        after_reduce(param)
+                reduce_dtype = precision.torch_dtype(param.grad.dtype)
+                if pending_bucket is not None and not pending_bucket.accepts(reduce_dtype, param.grad.dtype, param.grad.device):
+                    _flush_pending_bucket(precision, async_op, max_buffer)
+                if pending_bucket is None:
+                    pending_bucket = _GradientBucket(reduce_dtype, param.grad.dtype, param.grad.device)
+
+                pending_bucket.add(param, after_reduce)
+                if pending_bucket.nbytes >= bucket_size:
+                    _flush_pending_bucket(precision, async_op, max_buffer)
             elif after_reduce is not None:
                 after_reduce(param)
 
+    if not defer:
+        _flush_pending_bucket(precision, async_op, max_buffer)
+
 def complete_previous_async_ops(precision: GradientReducePrecision, next_size: int=0, max_buffer: int=0):
     global async_deque
     global in_transfer
@@ -102,22 +193,16 @@ def complete_previous_async_ops(precision: GradientReducePrecision, next_size: i
         in_transfer + next_size > max_buffer
         or async_deque[0][0].is_completed()
     ):
-        work, param, grad, after_reduce = async_deque.popleft()
+        work, bucket = async_deque.popleft()
         work.wait()
-        in_transfer -= grad.numel() * grad.element_size()
-
-        grad = grad.to(torch.float32) if precision.stochastic_rounding(param.grad.dtype) else grad
-        grad /= world_size()
-        if precision.stochastic_rounding(param.grad.dtype):
-            copy_stochastic_(param.grad, grad)
-        else:
-            param.grad = grad.to(param.grad.dtype)
-
-        if after_reduce is not None:
-            after_reduce(param)
+        in_transfer -= bucket.nbytes
+        bucket.unpack(precision)
 
 def finish_async(precision: GradientReducePrecision):
     complete_previous_async_ops(precision, max_buffer=0)
+    #a bucket that is still open was filled by deferred calls. It is reduced synchronously,
+    #because the backward pass is already done and there is nothing left to overlap with:
+    _flush_pending_bucket(precision, async_op=False, max_buffer=0)
 
 
 
@@ -166,8 +251,68 @@ def set_global_commands(commands: TrainCommands):
     global_commands = commands
 
 
+#layout of the command tensor that is broadcast in every step by sync_commands():
+COMMAND_STOP = 0
+COMMAND_SAMPLE_DEFAULT = 1
+COMMAND_BACKUP = 2
+COMMAND_SAVE = 3
+COMMAND_SAMPLE_CUSTOM_COUNT = 4
+COMMAND_TENSOR_SIZE = 5
+
+command_tensor = None
+
+
+def _get_command_tensor() -> torch.Tensor:
+    global command_tensor
+    if command_tensor is None:
+        #NCCL can only broadcast device tensors
+        device = torch.device('cpu') if torch.distributed.get_backend() == 'gloo' \
+            else torch.device('cuda', torch.cuda.current_device())
+        command_tensor = torch.zeros(COMMAND_TENSOR_SIZE, dtype=torch.int32, device=device)
+    return command_tensor
+
+
+def broadcast_bool(value: bool) -> bool:
+    #returns the value of the master process in all processes
+    if is_enabled():
+        tensor = torch.tensor([value], dtype=torch.int32, device=_get_command_tensor().device)
+        torch.distributed.broadcast(tensor, src=0)
+        return bool(tensor.item())
+    return value
+
+
 def sync_commands(commands: TrainCommands):
+    #commands are sent as a small tensor of flags and counters. The custom sample commands are only
+    #pickled and sent if there are any, because broadcast_object_list is expensive to call in every step.
     if is_enabled():
-        object_list= [global_commands] if is_master() else [None]
-        torch.distributed.broadcast_object_list(object_list, src=0)
-        commands.merge(object_list[0])
+        tensor = _get_command_tensor()
+        sample_custom_commands = None
+        if is_master():
+            #read and reset global_commands once, so that commands that the UI adds during the broadcast
+            #are sent in the next step instead of being merged only into the master process:
+            sample_custom_commands = global_commands.get_and_reset_sample_custom_commands()
+            tensor.copy_(torch.tensor([
+                global_commands.get_stop_command(),
+                global_commands.get_and_reset_sample_default_command(),
+                global_commands.get_and_reset_backup_command(),
+                global_commands.get_and_reset_save_command(),
+                len(sample_custom_commands),
+            ], dtype=torch.int32))
+        torch.distributed.broadcast(tensor, src=0)
+        flags = tensor.tolist()
+
+        if flags[COMMAND_SAMPLE_CUSTOM_COUNT] > 0:
+            object_list = [sample_custom_commands]
+            torch.distributed.broadcast_object_list(object_list, src=0)
+            sample_custom_commands = object_list[0]
+
+        if flags[COMMAND_STOP]:
+            commands.stop()
+        for entry in sample_custom_commands or []:
+            commands.sample_custom(entry)
+        if flags[COMMAND_SAMPLE_DEFAULT]:
+            commands.sample_default()
+        if flags[COMMAND_BACKUP]:
+            commands.backup()
+        if flags[COMMAND_SAVE]:
+            commands.save()
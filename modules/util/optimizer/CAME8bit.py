@@ -104,35 +104,52 @@ class CAME8bit(torch.optim.Optimizer):
         # We shift the range of our data between max/min, so the closer data values
         # are to each other, the higher precision our data is. The value of
         # `quant_block_size` should balance space-savings and data precision.
+        #
+        # All blocks are packed into one uint8 tensor, with one scale and min value per block.
+        # The last block is padded with copies of the last value, so it doesn't change its range.
 
         if params.numel() <= 1:
             return params
 
-        data_chunk_list = params.split(quant_block_size)
-        quantized_values: list = [None] * len(data_chunk_list)
-        for index, data_chunk in enumerate(data_chunk_list, start=0):
-            max_value = data_chunk.max()
-            min_value = data_chunk.min()
-            normalize_scale = (max_value - min_value) / 255.0
+        flat_values = params.reshape(-1)
+        padding = -flat_values.numel() % quant_block_size
+        if padding > 0:
+            flat_values = torch.cat([flat_values, flat_values[-1:].expand(padding)])
+        blocks = flat_values.view(-1, quant_block_size)
 
-            values = ((data_chunk - min_value) / normalize_scale).round().byte()
+        min_values, max_values = torch.aminmax(blocks, dim=1)
+        normalize_scales = (max_values - min_values) / 255.0
 
-            quantized_values[index] = {"value": values, "scale": normalize_scale, "min": min_value}
+        # blocks with a single value have a scale of 0, their values are all quantized to 0
+        safe_scales = normalize_scales.clamp(min=torch.finfo(normalize_scales.dtype).tiny)
+        values = blocks.sub(min_values.unsqueeze(1)).div_(safe_scales.unsqueeze(1)).round_().byte()
 
-        return quantized_values
+        return {
+            "value": values.view(-1),
+            "scale": normalize_scales,
+            "min": min_values,
+            "shape": tuple(params.shape),
+        }
 
     @staticmethod
-    def _dequantize_param(quantized_value_list):
-        # If this isn't a quantized list, give it back
-        if not isinstance(quantized_value_list, list):
-            return quantized_value_list
+    def _dequantize_param(quantized_value):
+        # Backups from older versions store a list with one dict per block of rows
+        if isinstance(quantized_value, list):
+            return torch.cat([
+                (quantized_chunk["value"].float() * quantized_chunk["scale"].float()) + quantized_chunk["min"].float()
+                for quantized_chunk in quantized_value
+            ])
 
-        dequantized_values: list = [None] * len(quantized_value_list)
-        for index, quantized_chunk in enumerate(quantized_value_list, start=0):
-            dequantized_values[index] = \
-                (quantized_chunk["value"].float() * quantized_chunk["scale"]) + quantized_chunk["min"]
+        # If this isn't a quantized value, give it back
+        if not isinstance(quantized_value, dict):
+            return quantized_value
 
-        return torch.cat(dequantized_values)
+        scales = quantized_value["scale"]
+        blocks = quantized_value["value"].view(scales.numel(), -1).float()
+        blocks.mul_(scales.unsqueeze(1)).add_(quantized_value["min"].unsqueeze(1))
+
+        shape = quantized_value["shape"]
+        return blocks.view(-1)[:torch.Size(shape).numel()].view(shape)
 
     def _rms(self, tensor):
         return tensor.norm(2) / (tensor.numel() ** 0.5)
@@ -171,7 +188,7 @@ class CAME8bit(torch.optim.Optimizer):
             state["RMS"] = 0
 
             state["exp_avg"] = torch.zeros_like(grad) if not should_quantize_param else \
-                               CAME8bit._quantize_param(torch.zeros_like(grad), group["quant_block_size"])
+                               self._quantize_param(torch.zeros_like(grad), group["quant_block_size"])
 
             if use_factor:
                 state["exp_avg_sq_row"] = torch.zeros(grad_shape[0]).type_as(grad)
@@ -181,7 +198,7 @@ class CAME8bit(torch.optim.Optimizer):
                 state["exp_avg_res_col"] = torch.zeros(grad_shape[1]).type_as(grad)
             else:
                 state["exp_avg_sq"] = torch.zeros_like(grad) if not should_quantize_param else \
-                                      CAME8bit._quantize_param(torch.zeros_like(grad), group["quant_block_size"])
+                                      self._quantize_param(torch.zeros_like(grad), group["quant_block_size"])
 
         state["step"] += 1
         state["RMS"] = self._rms(p.data)
@@ -211,7 +228,7 @@ class CAME8bit(torch.optim.Optimizer):
         else:
             # Dequantize if needed
             exp_avg_sq: torch.Tensor = state["exp_avg_sq"] if not should_quantize_param else \
-                                       CAME8bit._dequantize_param(state["exp_avg_sq"])
+                                       self._dequantize_param(state["exp_avg_sq"])
 
             # Do update
             exp_avg_sq.mul_(group["betas"][1]).add_(update, alpha=1.0 - group["betas"][1])
@@ -219,7 +236,7 @@ class CAME8bit(torch.optim.Optimizer):
 
             # Requantize if needed
             state["exp_avg_sq"] = exp_avg_sq if not should_quantize_param else \
-                                  CAME8bit._quantize_param(exp_avg_sq, group["quant_block_size"])
+                                  self._quantize_param(exp_avg_sq, group["quant_block_size"])
 
         update.mul_(grad)
 
@@ -227,14 +244,14 @@ class CAME8bit(torch.optim.Optimizer):
 
         # Dequantize if needed
         exp_avg = state["exp_avg"] if not should_quantize_param else \
-                  CAME8bit._dequantize_param(state["exp_avg"])
+                  self._dequantize_param(state["exp_avg"])
 
         # Do update
         exp_avg.mul_(group["betas"][0]).add_(update, alpha=1 - group["betas"][0])
 
         # Requantize if needed
         state["exp_avg"] = exp_avg if not should_quantize_param else \
-                           CAME8bit._quantize_param(exp_avg, group["quant_block_size"])
+                           self._quantize_param(exp_avg, group["quant_block_size"])
 
         # Confidence-guided strategy
         # Calculation of instability
@@ -318,14 +335,26 @@ class CAME8bit(torch.optim.Optimizer):
             "exp_avg_sq_col", "exp_avg_sq_row",
             "exp_avg_res_col", "exp_avg_res_row",
         ]
-        for state in self.state.values():
-            for quant_state_key in quantizable_value_keys:
-                if quant_state_key in state:
-                    if isinstance(state[quant_state_key], list):
-                        for quantized_object in state[quant_state_key]:
-                            quantized_object["value"] = quantized_object["value"].byte()
-                    elif isinstance(state[quant_state_key], torch.Tensor):
-                        state[quant_state_key] = state[quant_state_key].float()
+        # Older backups store quantized values as a list of blocks, they are converted to the packed format
+        for group in self.param_groups:
+            for p in group["params"]:
+                if p not in self.state:
+                    continue
+                state = self.state[p]
+
+                for quant_state_key in quantizable_value_keys:
+                    if quant_state_key in state:
+                        value = state[quant_state_key]
+                        if isinstance(value, list):
+                            state[quant_state_key] = self._quantize_param(
+                                self._dequantize_param(value), group["quant_block_size"]
+                            )
+                        elif isinstance(value, dict):
+                            value["value"] = value["value"].byte()
+                            value["scale"] = value["scale"].float()
+                            value["min"] = value["min"].float()
+                        elif isinstance(value, torch.Tensor):
+                            state[quant_state_key] = value.float()
 
         # Not sure if this is GC is needed, but the reference implementation had one
         torch_gc()
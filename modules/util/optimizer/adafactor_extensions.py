@@ -6,17 +6,22 @@
 
 import math
 
-from modules.util.bf16_stochastic_rounding import copy_stochastic_
+from modules.util.bf16_stochastic_rounding import copy_stochastic_, copy_stochastic_foreach_
+from modules.util.optimizer.foreach_util import MAX_BUCKET_NUMEL, foreach_buckets
 
 import torch
+from torch import Tensor
 
 from transformers import Adafactor
 
 
-@torch.no_grad()
-def step_adafactor_parameter(self, p, group, i):
+def _update_parameter(self, p, group) -> Tensor | None:
+    """
+    Updates p. If p has to be stochastically rounded, the update is not written back to p, but the updated
+    float32 copy of p is returned
+    """
     if p.grad is None:
-        return
+        return None
     grad = p.grad
     if grad.dtype in {torch.float16, torch.bfloat16}:
         grad = grad.float()
@@ -90,11 +95,24 @@ def step_adafactor_parameter(self, p, group, i):
     p_data_fp32.add_(-update)
 
     if p.dtype == torch.bfloat16 and self.stochastic_rounding:
-        copy_stochastic_(p, p_data_fp32)
+        return p_data_fp32
     elif p.dtype in {torch.float16, torch.bfloat16}:
         p.copy_(p_data_fp32)
     else:
         assert p_data_fp32 is p
+    return None
+
+
+@torch.no_grad()
+def step_adafactor_parameter(self, p, group, i):
+    p_data_fp32 = _update_parameter(self, p, group)
+    if p_data_fp32 is not None:
+        copy_stochastic_(p, p_data_fp32)
+
+
+def _copy_stochastic_buckets(params: list[Tensor], sources: list[Tensor]):
+    for bucket in foreach_buckets(params):
+        copy_stochastic_foreach_([params[i] for i in bucket], [sources[i] for i in bucket])
 
 
 @torch.no_grad()
@@ -110,9 +128,25 @@ def step_adafactor(self, closure=None):
     if closure is not None:
         loss = closure()
 
+    # the updates are calculated for each parameter, but stochastic rounding is applied to many parameters at once.
+    # The updated float32 copies are kept until they hold MAX_BUCKET_NUMEL elements
+    rounding_params = []
+    rounding_sources = []
+    rounding_numel = 0
     for group in self.param_groups:
-        for i, p in enumerate(group["params"]):
-            step_adafactor_parameter(self, p, group, i)
+        for p in group["params"]:
+            p_data_fp32 = _update_parameter(self, p, group)
+            if p_data_fp32 is not None:
+                rounding_params.append(p)
+                rounding_sources.append(p_data_fp32)
+                rounding_numel += p_data_fp32.numel()
+
+            if rounding_numel >= MAX_BUCKET_NUMEL:
+                _copy_stochastic_buckets(rounding_params, rounding_sources)
+                rounding_params, rounding_sources, rounding_numel = [], [], 0
+
+    if rounding_params:
+        _copy_stochastic_buckets(rounding_params, rounding_sources)
 
     return loss
 
@@ -6,7 +6,8 @@
 
 import math
 
-from modules.util.bf16_stochastic_rounding import addcdiv_stochastic_
+from modules.util.bf16_stochastic_rounding import addcdiv_stochastic_, addcdiv_stochastic_foreach_
+from modules.util.optimizer.foreach_util import foreach_buckets
 
 import torch
 from torch import Tensor
@@ -14,6 +15,29 @@ from torch.optim import AdamW
 from torch.optim.optimizer import _use_grad_for_differentiable
 
 
+def _init_state(state: dict, p: Tensor, group: dict):
+    # note(crcrpar): Deliberately host `step` on CPU if both capturable and fused are off.
+    # This is because kernel launches are costly on CUDA and XLA.
+    state["step"] = (
+        torch.zeros((), dtype=_get_scalar_dtype(is_fused=group["fused"]), device=p.device)
+        if group["capturable"] or group["fused"]
+        else torch.tensor(0.0, dtype=_get_scalar_dtype())
+    )
+    # Exponential moving average of gradient values
+    state["exp_avg"] = torch.zeros_like(
+        p, memory_format=torch.preserve_format
+    )
+    # Exponential moving average of squared gradient values
+    state["exp_avg_sq"] = torch.zeros_like(
+        p, memory_format=torch.preserve_format
+    )
+    if group['amsgrad']:
+        # Maintains max of all exp. moving avg. of sq. grad. values
+        state["max_exp_avg_sq"] = torch.zeros_like(
+            p, memory_format=torch.preserve_format
+        )
+
+
 @torch.no_grad()
 def step_adamw_parameter(self, p, group, i):
     if p.grad is None:
@@ -26,26 +50,7 @@ def step_adamw_parameter(self, p, group, i):
 
     # State initialization
     if len(state) == 0:
-        # note(crcrpar): Deliberately host `step` on CPU if both capturable and fused are off.
-        # This is because kernel launches are costly on CUDA and XLA.
-        state["step"] = (
-            torch.zeros((), dtype=_get_scalar_dtype(is_fused=group["fused"]), device=p.device)
-            if group["capturable"] or group["fused"]
-            else torch.tensor(0.0, dtype=_get_scalar_dtype())
-        )
-        # Exponential moving average of gradient values
-        state["exp_avg"] = torch.zeros_like(
-            p, memory_format=torch.preserve_format
-        )
-        # Exponential moving average of squared gradient values
-        state["exp_avg_sq"] = torch.zeros_like(
-            p, memory_format=torch.preserve_format
-        )
-        if group['amsgrad']:
-            # Maintains max of all exp. moving avg. of sq. grad. values
-            state["max_exp_avg_sq"] = torch.zeros_like(
-                p, memory_format=torch.preserve_format
-            )
+        _init_state(state, p, group)
 
     if group['differentiable'] and state['step'].requires_grad:
         raise RuntimeError('`requires_grad` is not supported for `step` in differentiable mode')
@@ -174,6 +179,84 @@ def _single_tensor_adamw(
         step_adamw_parameter(self, p, group, i)
 
 
+def _supports_multi_tensor(group) -> bool:
+    return not group["capturable"] \
+        and not group["fused"] \
+        and not group["differentiable"] \
+        and not isinstance(group["lr"], Tensor) \
+        and not any(torch.is_complex(p) for p in group["params"])
+
+
+def _multi_tensor_adamw(
+        self,
+        group,
+        grad_scale: Tensor | None,
+        found_inf: Tensor | None,
+):
+    # Same update as step_adamw_parameter, but each bucket of parameters with the same device and dtype is updated
+    # by torch._foreach_* ops. Stochastic rounding generates the random numbers for the whole bucket at once.
+
+    assert grad_scale is None and found_inf is None
+
+    params = [p for p in group["params"] if p.grad is not None]
+    for p in params:
+        if p.grad.is_sparse:
+            raise RuntimeError("AdamW does not support sparse gradients")
+
+        state = self.state[p]
+        if len(state) == 0:
+            _init_state(state, p, group)
+
+    lr = group["lr"]
+    beta1, beta2 = group["betas"]
+
+    for bucket in foreach_buckets(params):
+        device_params = [params[i] for i in bucket]
+        device_grads = [p.grad for p in device_params]
+        device_states = [self.state[p] for p in device_params]
+        device_exp_avgs = [state["exp_avg"] for state in device_states]
+        device_exp_avg_sqs = [state["exp_avg_sq"] for state in device_states]
+        device_state_steps = [state["step"] for state in device_states]
+
+        if group["maximize"]:
+            device_grads = torch._foreach_neg(device_grads)
+
+        # update steps. They are hosted on the CPU, so 1 is wrapped into a tensor once instead of once per step
+        torch._foreach_add_(device_state_steps, torch.tensor(1.0, device="cpu"), alpha=1.0)
+
+        # Perform stepweight decay
+        if group["weight_decay"] != 0:
+            torch._foreach_mul_(device_params, 1 - lr * group["weight_decay"])
+
+        # Decay the first and second moment running average coefficient
+        torch._foreach_lerp_(device_exp_avgs, device_grads, 1 - beta1)
+        torch._foreach_mul_(device_exp_avg_sqs, beta2)
+        torch._foreach_addcmul_(device_exp_avg_sqs, device_grads, device_grads, 1 - beta2)
+
+        steps = [step_t.item() for step_t in device_state_steps]
+        bias_correction2_sqrts = [math.sqrt(1 - beta2 ** step) for step in steps]
+        neg_step_sizes = [-(lr / (1 - beta1 ** step)) for step in steps]
+
+        if group['amsgrad']:
+            # Maintains the maximum of all 2nd moment running avg. till now
+            device_max_exp_avg_sqs = [state["max_exp_avg_sq"] for state in device_states]
+            torch._foreach_maximum_(device_max_exp_avg_sqs, device_exp_avg_sqs)
+
+            # Use the max. for normalizing running avg. of gradient
+            denom = torch._foreach_sqrt(device_max_exp_avg_sqs)
+        else:
+            denom = torch._foreach_sqrt(device_exp_avg_sqs)
+        torch._foreach_div_(denom, bias_correction2_sqrts)
+        torch._foreach_add_(denom, group["eps"])
+
+        if device_params[0].dtype == torch.bfloat16 and self.stochastic_rounding:
+            addcdiv_stochastic_foreach_(device_params, device_exp_avgs, denom, neg_step_sizes)
+        else:
+            torch._foreach_addcdiv_(device_params, device_exp_avgs, denom, neg_step_sizes)
+
+        del device_grads, denom
+
+
 @_use_grad_for_differentiable
 def step_adamw(self, closure=None):
     """Performs a single optimization step.
@@ -190,7 +273,8 @@ def step_adamw(self, closure=None):
             loss = closure()
 
     for group in self.param_groups:
-        _single_tensor_adamw(
+        step_group = _multi_tensor_adamw if _supports_multi_tensor(group) else _single_tensor_adamw
+        step_group(
             self,
             group=group,
             grad_scale=getattr(self, "grad_scale", None),
@@ -0,0 +1,27 @@
+import torch
+from torch import Tensor
+
+# the maximum number of elements in one bucket. Multi tensor steps allocate temporary float32 copies of all tensors in
+# a bucket, so large buckets are split to keep the memory overhead bounded
+MAX_BUCKET_NUMEL = 64 * 1024 * 1024
+
+
+def foreach_buckets(tensors: list[Tensor], max_numel: int = MAX_BUCKET_NUMEL) -> list[list[int]]:
+    """
+    Groups the indices of tensors by device and dtype, so each bucket can be updated by torch._foreach_* ops.
+    Indices keep their original order within each bucket. A bucket is closed once it holds max_numel elements.
+    """
+    open_buckets: dict[tuple[torch.device, torch.dtype], tuple[list[int], int]] = {}
+    buckets = []
+
+    for i, tensor in enumerate(tensors):
+        key = (tensor.device, tensor.dtype)
+        indices, numel = open_buckets.get(key, ([], 0))
+        if indices and numel + tensor.numel() > max_numel:
+            buckets.append(indices)
+            indices, numel = [], 0
+        indices.append(i)
+        open_buckets[key] = (indices, numel + tensor.numel())
+
+    buckets.extend(indices for indices, _ in open_buckets.values())
+    return buckets
@@ -1,5 +1,8 @@
+import os
 import platform
 
+from modules.util.OffloadTrace import start_offload_trace, stop_offload_trace
+
 import torch
 
 
@@ -51,3 +54,27 @@ class TorchProfiler:
             return ret
         else:
             return False
+
+
+class OffloadTraceRecorder:
+    def __init__(self, filename: str = "offload_trace.json", enabled: bool = True):
+        self.filename = filename
+        self.enabled = enabled
+
+    def __enter__(self):
+        if self.enabled:
+            return start_offload_trace()
+        else:
+            return None
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        trace = stop_offload_trace() if self.enabled else None
+        if trace is not None:
+            try:
+                trace.save(self.filename)
+                layer_profiles_filename = os.path.splitext(self.filename)[0] + "_layers.json"
+                trace.save_layer_profiles(layer_profiles_filename)
+                print(f"saved offload trace to {self.filename} and layer profiles to {layer_profiles_filename}")
+            except Exception:
+                print(f"could not write offload trace {self.filename}")
+        return False
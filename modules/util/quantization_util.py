@@ -1,4 +1,10 @@
-from collections.abc import Callable
+import contextlib
+import hashlib
+import json
+import os
+import re
+from collections import defaultdict
+from collections.abc import Callable, Iterable
 from functools import partial
 
 from modules.module.quantized.mixin.QuantizedLinearMixin import QuantizedLinearMixin
@@ -13,6 +19,8 @@ from torch import Tensor, nn
 from diffusers.quantizers.gguf.utils import GGUFLinear, dequantize_gguf_tensor
 
 import accelerate
+from safetensors import safe_open
+from safetensors.torch import save_file
 from tqdm import tqdm
 
 try:
@@ -265,6 +273,140 @@ def quantize_layers(module: nn.Module, device: torch.device, train_dtype: DataTy
             if isinstance(child_module, QuantizedModuleMixin):
                 child_module.quantize(device=device)
 
+# increase when the quantized tensor layout of any layer changes
+QUANTIZATION_CACHE_VERSION = 1
+QUANTIZATION_CACHE_FILENAME_PATTERN = re.compile(r".+-[0-9a-f]{32}\.safetensors")
+
+
+def get_quantization_cache_filename(
+        module: nn.Module,
+        source_filenames: list[str],
+        dtype: DataType,
+        train_dtype: DataType,
+        keep_in_fp32_modules: list[str],
+        quantization: QuantizationConfig | None,
+) -> str | None:
+    """
+    Returns the file name of the quantized weight cache of a module, or None if the module can't be cached.
+    The name is derived from the source checkpoint files and every setting that influences the quantized tensors.
+    """
+    if quantization is None or not quantization.cache_quantized_weights or not quantization.cache_dir \
+            or not dtype.is_quantized() or dtype.is_gguf():
+        return None
+    if not any(isinstance(child_module, QuantizedModuleMixin) for child_module in module.modules()):
+        return None
+
+    sources = []
+    for filename in source_filenames:
+        stat = os.stat(filename)
+        sources.append([os.path.realpath(filename), stat.st_size, stat.st_mtime_ns])
+
+    fingerprint = json.dumps({
+        'version': QUANTIZATION_CACHE_VERSION,
+        'module': type(module).__name__,
+        'sources': sources,
+        'dtype': str(dtype),
+        'train_dtype': str(train_dtype),
+        'keep_in_fp32_modules': sorted(keep_in_fp32_modules),
+        'svd_dtype': str(quantization.svd_dtype),
+        'svd_rank': quantization.svd_rank,
+        'layer_filter': quantization.layer_filter,
+        'layer_filter_regex': quantization.layer_filter_regex,
+    }, sort_keys=True)
+    digest = hashlib.sha256(fingerprint.encode()).hexdigest()[:32]
+
+    return os.path.join(quantization.cache_dir, f"{type(module).__name__}-{digest}.safetensors")
+
+
+def load_quantization_cache(module: nn.Module, filename: str, train_dtype: DataType) -> dict[str, nn.Module]:
+    """
+    Loads the quantized layers of a module from a quantization cache file, without quantizing them again.
+    Returns the tensor keys that were loaded, mapped to their layer.
+    """
+    loaded = {}
+    with safe_open(filename, framework="pt") as file:
+        module_keys = defaultdict(dict)
+        for key in file.keys():  # noqa: SIM118
+            module_name, _, tensor_name = key.rpartition(".")
+            module_keys[module_name][tensor_name] = key
+
+        for name, child_module in module.named_modules():
+            if isinstance(child_module, QuantizedModuleMixin) and name in module_keys:
+                child_module.compute_dtype = train_dtype.torch_dtype()
+                child_module.load_quantized_state_dict(
+                    {tensor_name: file.get_tensor(key) for tensor_name, key in module_keys[name].items()}
+                )
+                loaded |= dict.fromkeys(module_keys[name].values(), child_module)
+
+    # the modification time orders the cache files by their last use, the least recently used ones are removed first
+    os.utime(filename)
+
+    return loaded
+
+
+def save_quantization_cache(
+        module: nn.Module,
+        filename: str,
+        quantized_modules: Iterable[nn.Module],
+        size_limit_bytes: int,
+):
+    """
+    Saves the quantized layers of a module to a quantization cache file. Nothing is saved if any quantized layer
+    of the module is not included in quantized_modules. The least recently used cache files in the same directory are
+    removed to keep the total size of the cache within size_limit_bytes.
+    """
+    quantized_modules = set(quantized_modules)
+    tensors = {}
+    data_ptrs = set()
+    for name, child_module in module.named_modules():
+        if not isinstance(child_module, QuantizedModuleMixin):
+            continue
+        if child_module not in quantized_modules:
+            return
+
+        for tensor_name, tensor in child_module.quantized_state_dict().items():
+            tensor = tensor.to(device="cpu").contiguous()
+            # safetensors can't store shared tensors, like the code tables of bitsandbytes
+            if tensor.data_ptr() in data_ptrs:
+                tensor = tensor.clone()
+            data_ptrs.add(tensor.data_ptr())
+            tensors[f"{name}.{tensor_name}"] = tensor
+
+    size = sum(tensor.element_size() * tensor.numel() for tensor in tensors.values())
+    if size > size_limit_bytes:
+        print(f"Not caching the quantized weights of {type(module).__name__}, "
+              f"they need {size / 1024**3:.1f} GB, more than the cache size limit")
+        return
+
+    cache_dir = os.path.dirname(filename)
+    os.makedirs(cache_dir, exist_ok=True)
+    _prune_quantization_cache(cache_dir, size_limit_bytes - size)
+
+    temp_filename = f"{filename}.{os.getpid()}.tmp"
+    save_file(tensors, temp_filename)
+    os.replace(temp_filename, filename)
+
+
+def _prune_quantization_cache(cache_dir: str, size_limit_bytes: int):
+    # only the files written by save_quantization_cache are counted, other caches can share the directory
+    entries = []
+    with os.scandir(cache_dir) as it:
+        for entry in it:
+            if entry.is_file() and QUANTIZATION_CACHE_FILENAME_PATTERN.fullmatch(entry.name):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+    entries.sort()
+    total_size = sum(size for _, size, _ in entries)
+    for _, size, path in entries:
+        if total_size <= size_limit_bytes:
+            break
+        print(f"Removing the least recently used quantization cache file {path}")
+        with contextlib.suppress(OSError):
+            os.remove(path)
+        total_size -= size
+
+
 def get_unquantized_weight(module: nn.Linear, dtype: torch.dtype, device: torch.device) -> Tensor:
     assert isinstance(module, nn.Linear)
     if isinstance(module, QuantizedLinearMixin):
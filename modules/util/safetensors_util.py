@@ -0,0 +1,320 @@
+import hashlib
+import json
+import os
+import struct
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from modules.util.enum.ModelHashMode import ModelHashMode
+
+import torch
+from torch import Tensor
+
+HASH_KEY = "modelspec.hash_sha256"
+# the tree hash is not a sha256 of the data, so it can't be stored in the model spec entry
+TREE_HASH_KEY = "ot_hash_sha256_tree"
+HASH_MODE_KEY = "ot_hash_mode"
+HASH_CHUNK_SIZE_KEY = "ot_hash_chunk_size"
+DEFAULT_HASH_CHUNK_SIZE = 16 * 1024 * 1024
+
+# written in place of the hash, and overwritten with a value of the same length after the data is written
+_HASH_PLACEHOLDER = "0x" + "0" * 64
+
+# number of tensors or chunks that can be queued for hashing before update() blocks
+_MAX_PENDING_UPDATES = 2
+
+_DTYPES = {
+    torch.float64: "F64",
+    torch.float32: "F32",
+    torch.float16: "F16",
+    torch.bfloat16: "BF16",
+    torch.int64: "I64",
+    torch.int32: "I32",
+    torch.int16: "I16",
+    torch.int8: "I8",
+    torch.uint8: "U8",
+    torch.bool: "BOOL",
+    torch.float8_e4m3fn: "F8_E4M3",
+    torch.float8_e5m2: "F8_E5M2",
+}
+
+
+class _Sha256Hasher:
+    """
+    A single sha256 over the whole stream. Updates are processed on a background thread, so hashing overlaps with
+    the caller writing the same data. hashlib releases the GIL for large updates.
+    """
+
+    def __init__(self):
+        self.__hash = hashlib.sha256()
+        self.__executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sha256")
+        self.__pending: deque[Future] = deque()
+
+    def update(self, data: memoryview):
+        while len(self.__pending) >= _MAX_PENDING_UPDATES:
+            self.__pending.popleft().result()
+        self.__pending.append(self.__executor.submit(self.__hash.update, data))
+
+    def wait(self):
+        # blocks until all data passed to update() is hashed, after which the caller can reuse its buffers
+        while self.__pending:
+            self.__pending.popleft().result()
+
+    def hexdigest(self) -> str:
+        self.wait()
+        self.__executor.shutdown()
+        return self.__hash.hexdigest()
+
+
+class _TreeSha256Hasher:
+    """
+    Splits the stream into chunks of a fixed size and hashes the chunks in parallel. The result is the sha256 of the
+    concatenated chunk hashes. The chunk size is part of the result, so it is stored next to the hash.
+    """
+
+    def __init__(self, chunk_size: int, max_workers: int | None):
+        self.__chunk_size = chunk_size
+        self.__max_workers = max_workers if max_workers is not None else (os.cpu_count() or 1)
+        self.__executor = ThreadPoolExecutor(max_workers=self.__max_workers, thread_name_prefix="sha256_tree")
+        self.__leaves: list[Future] = []
+        self.__finished_leaves = 0
+        self.__buffer = bytearray()
+
+    def __submit(self, chunk: bytes | memoryview):
+        while len(self.__leaves) - self.__finished_leaves >= self.__max_workers * _MAX_PENDING_UPDATES:
+            self.__leaves[self.__finished_leaves].result()
+            self.__finished_leaves += 1
+        self.__leaves.append(self.__executor.submit(lambda: hashlib.sha256(chunk).digest()))
+
+    def update(self, data: memoryview):
+        offset = 0
+
+        if self.__buffer:
+            offset = min(len(data), self.__chunk_size - len(self.__buffer))
+            self.__buffer += data[:offset]
+            if len(self.__buffer) == self.__chunk_size:
+                self.__submit(bytes(self.__buffer))
+                self.__buffer = bytearray()
+
+        while len(data) - offset >= self.__chunk_size:
+            self.__submit(data[offset:offset + self.__chunk_size])
+            offset += self.__chunk_size
+
+        self.__buffer += data[offset:]
+
+    def wait(self):
+        # blocks until all data passed to update() is hashed, after which the caller can reuse its buffers
+        for leaf in self.__leaves[self.__finished_leaves:]:
+            leaf.result()
+        self.__finished_leaves = len(self.__leaves)
+
+    def hexdigest(self) -> str:
+        if self.__buffer or not self.__leaves:
+            self.__submit(bytes(self.__buffer))
+            self.__buffer = bytearray()
+        self.wait()
+        self.__executor.shutdown()
+
+        root = hashlib.sha256()
+        for leaf in self.__leaves:
+            root.update(leaf.result())
+        return root.hexdigest()
+
+
+def create_hasher(
+        hash_mode: ModelHashMode,
+        chunk_size: int = DEFAULT_HASH_CHUNK_SIZE,
+        max_workers: int | None = None,
+) -> _Sha256Hasher | _TreeSha256Hasher:
+    match hash_mode:
+        case ModelHashMode.SHA256:
+            return _Sha256Hasher()
+        case ModelHashMode.SHA256_TREE:
+            return _TreeSha256Hasher(chunk_size, max_workers)
+        case _:
+            raise NotImplementedError(f"no hasher for hash mode {hash_mode}")
+
+
+def _tensor_bytes(tensor: Tensor) -> memoryview:
+    tensor = tensor.detach().to(device="cpu").contiguous()
+    return memoryview(tensor.reshape(-1).view(torch.uint8).numpy())
+
+
+def get_hash_key(hash_mode: ModelHashMode) -> str:
+    return TREE_HASH_KEY if hash_mode == ModelHashMode.SHA256_TREE else HASH_KEY
+
+
+def calculate_hash(
+        state_dict: dict[str, Tensor],
+        hash_mode: ModelHashMode = ModelHashMode.SHA256,
+        chunk_size: int = DEFAULT_HASH_CHUNK_SIZE,
+        max_workers: int | None = None,
+) -> str:
+    """
+    Calculates the hash of the data section that save_file() writes for the state dict, without writing it.
+    """
+    hasher = create_hasher(hash_mode, chunk_size, max_workers)
+    for key in sorted(state_dict.keys()):
+        if state_dict[key].numel() > 0:
+            hasher.update(_tensor_bytes(state_dict[key]))
+    return f"0x{hasher.hexdigest()}"
+
+
+def _needs_staging(tensor: Tensor, dtype: torch.dtype) -> bool:
+    return tensor.device.type != "cpu" or tensor.dtype != dtype or not tensor.is_contiguous()
+
+
+def save_file(
+        state_dict: dict[str, Tensor],
+        filename: str,
+        metadata: dict[str, str] | None = None,
+        dtype: torch.dtype | None = None,
+        hash_mode: ModelHashMode = ModelHashMode.SHA256,
+        chunk_size: int = DEFAULT_HASH_CHUNK_SIZE,
+        max_workers: int | None = None,
+) -> str | None:
+    """
+    Writes a safetensors file, and hashes the tensor data while it is written. Tensors are written in sorted key
+    order, so the SHA256 mode produces the same hash as hashing the sorted state dict. The hash is stored in the
+    metadata entry returned by get_hash_key(), together with the information needed to verify it. Only the SHA256
+    mode writes modelspec.hash_sha256.
+
+    The header is calculated up front. Tensors are then converted to dtype, made contiguous and moved to the cpu one
+    at a time through a reused staging buffer, which is pinned for tensors on the gpu. Tensors on the gpu are double
+    buffered, so the transfer of the next tensor overlaps with writing the current one. Tensors that are already
+    contiguous cpu tensors of the target dtype are written without a copy.
+
+    Returns the hash, or None if hash_mode is NONE
+    """
+    keys = sorted(state_dict.keys())
+
+    metadata = dict(metadata) if metadata is not None else {}
+    hash_key = get_hash_key(hash_mode)
+    if hash_mode != ModelHashMode.NONE:
+        metadata.pop(HASH_KEY, None)
+        metadata[hash_key] = _HASH_PLACEHOLDER
+        metadata[HASH_MODE_KEY] = str(hash_mode)
+        if hash_mode == ModelHashMode.SHA256_TREE:
+            metadata[HASH_CHUNK_SIZE_KEY] = str(chunk_size)
+
+    header = {}
+    if metadata:
+        header["__metadata__"] = metadata
+
+    offset = 0
+    staging_size = 0
+    use_cuda = False
+    for key in keys:
+        tensor = state_dict[key]
+        target_dtype = dtype if dtype is not None else tensor.dtype
+        if target_dtype not in _DTYPES:
+            raise ValueError(f"unsupported dtype {target_dtype} for tensor {key}")
+        size = tensor.numel() * target_dtype.itemsize
+        header[key] = {
+            "dtype": _DTYPES[target_dtype],
+            "shape": list(tensor.shape),
+            "data_offsets": [offset, offset + size],
+        }
+        offset += size
+
+        if _needs_staging(tensor, target_dtype):
+            staging_size = max(staging_size, size)
+            use_cuda = use_cuda or tensor.device.type == "cuda"
+
+    header_bytes = json.dumps(header, separators=(",", ":")).encode("utf-8")
+    header_bytes += b" " * (-len(header_bytes) % 8)
+
+    hasher = create_hasher(hash_mode, chunk_size, max_workers) if hash_mode != ModelHashMode.NONE else None
+
+    staging_buffers = [
+        torch.empty(staging_size, dtype=torch.uint8, pin_memory=use_cuda)
+        for _ in range(2 if use_cuda else 1)
+    ] if staging_size > 0 else []
+    staged_count = 0
+
+    with open(filename, "wb") as f:
+        f.write(struct.pack("<Q", len(header_bytes)))
+        f.write(header_bytes)
+
+        # (data, staging buffer index, cuda event) of the tensor that is transferred, but not yet written
+        pending = None
+
+        def write(data: memoryview, event: torch.cuda.Event | None):
+            if event is not None:
+                event.synchronize()
+            if hasher is not None:
+                hasher.update(data)
+            f.write(data)
+
+        for key in keys:
+            tensor = state_dict[key].detach()
+            if tensor.numel() == 0:
+                continue
+
+            target_dtype = dtype if dtype is not None else tensor.dtype
+            if not _needs_staging(tensor, target_dtype):
+                current = (_tensor_bytes(tensor), None, None)
+            else:
+                buffer_index = staged_count % len(staging_buffers)
+                staged_count += 1
+
+                # the buffer can only be reused after its previous contents are written and hashed
+                if pending is not None and pending[1] == buffer_index:
+                    write(pending[0], pending[2])
+                    pending = None
+                if hasher is not None:
+                    hasher.wait()
+
+                size = tensor.numel() * target_dtype.itemsize
+                staged = staging_buffers[buffer_index][:size]
+                staged.view(target_dtype).view(tensor.shape).copy_(tensor, non_blocking=tensor.device.type == "cuda")
+
+                event = None
+                if tensor.device.type == "cuda":
+                    event = torch.cuda.Event()
+                    event.record(torch.cuda.current_stream(tensor.device))
+                current = (memoryview(staged.numpy()), buffer_index, event)
+
+            if pending is not None:
+                write(pending[0], pending[2])
+            pending = current
+
+        if pending is not None:
+            write(pending[0], pending[2])
+
+        if hasher is None:
+            return None
+
+        hash_value = f"0x{hasher.hexdigest()}"
+
+        placeholder = f"{json.dumps(hash_key)}:{json.dumps(_HASH_PLACEHOLDER)}".encode()
+        hash_position = header_bytes.index(placeholder) + len(placeholder) - len(_HASH_PLACEHOLDER) - 1
+        f.seek(8 + hash_position)
+        f.write(hash_value.encode("utf-8"))
+
+    return hash_value
+
+
+def verify_hash(
+        filename: str,
+        max_workers: int | None = None,
+) -> bool:
+    """
+    Recalculates the hash of a safetensors file written by save_file() and compares it to the stored hash.
+    """
+    with open(filename, "rb") as f:
+        header_size = struct.unpack("<Q", f.read(8))[0]
+        metadata = json.loads(f.read(header_size)).get("__metadata__", {})
+
+        hash_mode = ModelHashMode(metadata.get(HASH_MODE_KEY, str(ModelHashMode.SHA256)))
+        hash_key = get_hash_key(hash_mode)
+        if hash_key not in metadata:
+            raise ValueError(f"{filename} does not contain a {hash_key} entry")
+
+        chunk_size = int(metadata.get(HASH_CHUNK_SIZE_KEY, DEFAULT_HASH_CHUNK_SIZE))
+        hasher = create_hasher(hash_mode, chunk_size, max_workers)
+
+        while data := f.read(chunk_size):
+            hasher.update(memoryview(data))
+
+    return f"0x{hasher.hexdigest()}" == metadata[hash_key]
@@ -0,0 +1,138 @@
+from util.import_util import script_imports
+
+script_imports()
+
+import argparse
+import os
+import pickle
+import socket
+import statistics
+import tempfile
+import threading
+import time
+from contextlib import suppress
+
+from modules.cloud.CallbackStream import CallbackStreamClient, CallbackStreamServer
+from modules.util.commands.TrainCommands import TrainCommands
+
+
+class LatencyCallbacks:
+    # records the latency of every on_update_status call. The parameter is the time the callback was sent
+
+    def __init__(self):
+        self.latencies = []
+
+    def on_update_status(self, sent: float):
+        self.latencies.append(time.perf_counter() - sent)
+
+
+def print_latencies(label: str, latencies: list[float]):
+    latencies = sorted(latencies)
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    print(f"{label:>28}: mean {statistics.mean(latencies) * 1000:8.2f} ms, "
+          f"median {statistics.median(latencies) * 1000:8.2f} ms, p99 {p99 * 1000:8.2f} ms ({len(latencies)} messages)")
+
+
+def write_request(filename: str, name: str, *params):
+    # same protocol as train_remote.py
+    with suppress(FileNotFoundError):
+        os.rename(filename, filename + '.write')
+    with open(filename + '.write', 'ab') as f:
+        pickle.dump(name, f)
+        pickle.dump(params, f)
+    os.rename(filename + '.write', filename)
+
+
+def read_requests(filename: str, callbacks):
+    # same protocol as LinuxCloud, without the SSH round trip
+    try:
+        os.rename(filename, filename + '.read')
+    except FileNotFoundError:
+        return
+    with open(filename + '.read', 'rb') as f:
+        while True:
+            try:
+                name = pickle.load(f)
+            except EOFError:
+                break
+            params = pickle.load(f)
+            getattr(callbacks, name)(*params)
+    os.remove(filename + '.read')
+
+
+def benchmark_file(directory: str, count: int, interval: float, poll_interval: float) -> list[float]:
+    callback_file = os.path.join(directory, "benchmark.callback")
+    callbacks = LatencyCallbacks()
+    stop_event = threading.Event()
+
+    def poll():
+        while not stop_event.is_set():
+            read_requests(callback_file, callbacks)
+            time.sleep(poll_interval)
+        read_requests(callback_file, callbacks)
+
+    thread = threading.Thread(target=poll)
+    thread.start()
+    for _ in range(count):
+        write_request(callback_file, "on_update_status", time.perf_counter())
+        time.sleep(interval)
+    stop_event.set()
+    thread.join()
+    return callbacks.latencies
+
+
+def benchmark_stream(directory: str, count: int, interval: float) -> tuple[list[float], list[float]]:
+    command_latencies = []
+    command_sent = []
+    commands = TrainCommands(on_command=lambda _: command_latencies.append(time.perf_counter() - command_sent[-1]))
+    server = CallbackStreamServer(os.path.join(directory, "benchmark.stream"), commands, fallback=lambda *_: None)
+
+    with open(os.path.join(directory, "benchmark.stream")) as f:
+        port, token = f.read().split()
+    client = CallbackStreamClient(socket.create_connection(("127.0.0.1", int(port))), token)
+
+    callbacks = LatencyCallbacks()
+    stop_event = threading.Event()
+
+    def receive():
+        with suppress(EOFError):
+            while not stop_event.is_set():
+                client.receive(callbacks, timeout=1)
+
+    thread = threading.Thread(target=receive)
+    thread.start()
+    time.sleep(0.5)  # wait until the server has accepted the connection
+
+    for _ in range(count):
+        server.callback("on_update_status", time.perf_counter())
+        sent_commands = TrainCommands()
+        sent_commands.save()
+        command_sent.append(time.perf_counter())
+        client.send_commands(sent_commands)
+        time.sleep(interval)
+
+    server.close()
+    stop_event.set()
+    thread.join()
+    client.close()
+    return callbacks.latencies, command_latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Loopback benchmark of the cloud callback latency.")
+    parser.add_argument("--count", type=int, default=200, dest="count", help="Number of callbacks")
+    parser.add_argument("--interval", type=float, default=0.05, dest="interval", help="Seconds between callbacks")
+    parser.add_argument("--poll-interval", type=float, default=1.0, dest="poll_interval",
+                        help="Seconds between two reads of the callback file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        print_latencies("callback file, polled", benchmark_file(directory, args.count, args.interval, args.poll_interval))
+        callback_latencies, command_latencies = benchmark_stream(directory, args.count, args.interval)
+        print_latencies("callback stream", callback_latencies)
+        print_latencies("command stream", command_latencies)
+    print("The polled callback file excludes the SSH round trip and process start of each poll on a real cloud.")
+
+
+if __name__ == '__main__':
+    main()
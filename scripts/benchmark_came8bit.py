@@ -0,0 +1,109 @@
+from util.import_util import script_imports
+
+script_imports()
+
+import argparse
+import time
+
+from modules.util.optimizer.CAME8bit import CAME8bit
+
+import torch
+
+
+class LegacyCAME8bit(CAME8bit):
+    # the previous state format: a list with one dict per block of quant_block_size rows
+
+    @staticmethod
+    def _quantize_param(params: torch.Tensor, quant_block_size: int):
+        if params.numel() <= 1:
+            return params
+
+        quantized_values = []
+        for data_chunk in params.split(quant_block_size):
+            max_value = data_chunk.max()
+            min_value = data_chunk.min()
+            normalize_scale = (max_value - min_value) / 255.0
+
+            values = ((data_chunk - min_value) / normalize_scale).round().byte()
+
+            quantized_values.append({"value": values, "scale": normalize_scale, "min": min_value})
+
+        return quantized_values
+
+
+def create_parameters(count: int, features: int, device: torch.device) -> list[torch.nn.Parameter]:
+    generator = torch.Generator(device=device).manual_seed(42)
+    return [
+        torch.nn.Parameter(torch.randn((features, features), generator=generator, device=device) * 0.02)
+        for _ in range(count)
+    ]
+
+
+def set_gradients(parameters: list[torch.nn.Parameter], step: int):
+    generator = torch.Generator(device=parameters[0].device).manual_seed(step)
+    for parameter in parameters:
+        parameter.grad = torch.randn(parameter.shape, generator=generator, device=parameter.device) * 0.001
+
+
+def quantization_error(optimizer: CAME8bit, parameters: list[torch.nn.Parameter], quant_block_size: int) -> float:
+    # the relative error of quantizing the current first moment again
+    errors = []
+    for parameter in parameters:
+        exp_avg = optimizer._dequantize_param(optimizer.state[parameter]["exp_avg"])
+        restored = optimizer._dequantize_param(optimizer._quantize_param(exp_avg, quant_block_size))
+        errors.append(((restored - exp_avg).norm() / exp_avg.norm()).item())
+    return sum(errors) / len(errors)
+
+
+def benchmark(optimizer_class, args, device: torch.device):
+    parameters = create_parameters(args.count, args.features, device)
+    optimizer = optimizer_class(parameters, lr=1e-4, quant_block_size=args.quant_block_size)
+
+    times = []
+    for step in range(args.steps + 1):
+        set_gradients(parameters, step)
+        if device.type == "cuda":
+            torch.cuda.synchronize()
+        start = time.perf_counter()
+        optimizer.step()
+        if device.type == "cuda":
+            torch.cuda.synchronize()
+        if step > 0:  # the first step initializes the state
+            times.append(time.perf_counter() - start)
+
+    error = quantization_error(optimizer, parameters, args.quant_block_size)
+    return sum(times) / len(times), error, parameters, optimizer
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the step time of CAME8bit with the packed state format.")
+    parser.add_argument("--device", type=str, default="cuda" if torch.cuda.is_available() else "cpu", dest="device")
+    parser.add_argument("--count", type=int, default=16, dest="count", help="Number of weight matrices")
+    parser.add_argument("--features", type=int, default=3072, dest="features", help="Size of each weight matrix")
+    parser.add_argument("--steps", type=int, default=10, dest="steps", help="Number of timed optimizer steps")
+    parser.add_argument("--quant-block-size", type=int, default=2048, dest="quant_block_size")
+    args = parser.parse_args()
+
+    device = torch.device(args.device)
+
+    for name, optimizer_class in [("legacy", LegacyCAME8bit), ("packed", CAME8bit)]:
+        step_time, error, _, _ = benchmark(optimizer_class, args, device)
+        print(f"{name:>8}: {step_time * 1000:8.2f} ms/step, relative quantization error {error:.2e}")
+
+    # a backup written with the legacy format has to be loadable
+    _, _, parameters, legacy_optimizer = benchmark(LegacyCAME8bit, args, device)
+    optimizer = CAME8bit(parameters, lr=1e-4, quant_block_size=args.quant_block_size)
+    optimizer.load_state_dict(legacy_optimizer.state_dict())
+    difference = max(
+        (optimizer._dequantize_param(optimizer.state[p]["exp_avg"])
+         - legacy_optimizer._dequantize_param(legacy_optimizer.state[p]["exp_avg"])).abs().max().item()
+        for p in parameters
+    )
+    set_gradients(parameters, args.steps + 1)
+    optimizer.step()
+    print(f"loaded a legacy state, max difference of the first moment {difference:.2e}, "
+          f"step after loading finite: {all(p.isfinite().all().item() for p in parameters)}")
+
+
+if __name__ == '__main__':
+    main()
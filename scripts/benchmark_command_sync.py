@@ -0,0 +1,67 @@
+from util.import_util import script_imports
+
+script_imports()
+
+import argparse
+import os
+import time
+
+import modules.util.multi_gpu_util as multi
+from modules.util.commands.TrainCommands import TrainCommands
+
+import torch
+
+
+def sync_commands_pickled(commands: TrainCommands):
+    #the previous implementation of multi.sync_commands(), for comparison
+    object_list = [multi.global_commands] if multi.is_master() else [None]
+    torch.distributed.broadcast_object_list(object_list, src=0)
+    commands.merge(object_list[0])
+
+
+def run(rank: int, world_size: int, args: argparse.Namespace):
+    os.environ.setdefault('MASTER_ADDR', 'localhost')
+    os.environ.setdefault('MASTER_PORT', str(args.port))
+    torch.distributed.init_process_group(backend='gloo', rank=rank, world_size=world_size)
+
+    if multi.is_master():
+        multi.set_global_commands(TrainCommands())
+    commands = TrainCommands()
+
+    results = []
+    for label, sync in [
+        ("broadcast_object_list", sync_commands_pickled),
+        ("command tensor", multi.sync_commands),
+    ]:
+        for _ in range(args.warmup):
+            sync(commands)
+
+        torch.distributed.barrier()
+        start = time.perf_counter()
+        for _ in range(args.steps):
+            sync(commands)
+        elapsed = time.perf_counter() - start
+        results.append((label, elapsed / args.steps * 1e6))
+
+    if multi.is_master():
+        for label, microseconds in results:
+            print(f"world size {world_size}  {label:>22}: {microseconds:9.1f} us/step")
+
+    torch.distributed.destroy_process_group()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the per-step command synchronization on the gloo backend.")
+    parser.add_argument("--world-sizes", type=int, nargs="+", default=[2, 4, 8], dest="world_sizes", help="Numbers of processes to benchmark")
+    parser.add_argument("--steps", type=int, default=1000, dest="steps", help="Number of measured steps")
+    parser.add_argument("--warmup", type=int, default=50, dest="warmup", help="Number of warmup steps")
+    parser.add_argument("--port", type=int, default=12357, dest="port", help="Port for the process group")
+    args = parser.parse_args()
+
+    for world_size in args.world_sizes:
+        args.port += 1
+        torch.multiprocessing.spawn(run, args=(world_size, args), nprocs=world_size, join=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+from util.import_util import script_imports
+
+script_imports()
+
+import argparse
+import os
+import random
+import struct
+import tempfile
+import threading
+import time
+import zlib
+
+from modules.util import concept_stats
+from modules.util.concept_index import ConceptIndex, aspect_buckets, nearest_aspect_buckets
+from modules.util.config.ConceptConfig import ConceptConfig
+
+import numpy as np
+
+
+def png_header(width: int, height: int) -> bytes:
+    # imagesize only reads the IHDR chunk, so a header without image data is enough
+    ihdr = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + struct.pack(">I", 13) + b"IHDR" + ihdr + struct.pack(">I", zlib.crc32(b"IHDR" + ihdr))
+
+
+def create_tree(path: str, file_count: int, directory_count: int):
+    # every image has a caption, every fourth image has a mask
+    image_count = int(file_count / 2.25)
+    rng = random.Random(42)
+    for i in range(image_count):
+        directory = os.path.join(path, f"dir_{i % directory_count:04d}")
+        os.makedirs(directory, exist_ok=True)
+        basename = os.path.join(directory, f"image_{i:07d}")
+        with open(basename + ".png", "wb") as f:
+            f.write(png_header(rng.randint(256, 2048), rng.randint(256, 2048)))
+        with open(basename + ".txt", "w") as f:
+            f.write(f"a photo of object {i}, seen from the side\nobject {i}")
+        if i % 4 == 0:
+            with open(basename + "-masklabel.png", "wb") as f:
+                f.write(png_header(64, 64))
+
+
+def folder_walk(path: str, advanced_checks: bool) -> dict:
+    # the single threaded scan, as it was done before the concept index
+    concept = ConceptConfig.default_values()
+    concept.path = path
+    stats_dict = concept_stats.init_concept_stats(advanced_checks)
+    start_time = time.perf_counter()
+    cancel_scan_flag = threading.Event()
+    subfolders = [path]
+    for directory in subfolders:
+        stats_dict = concept_stats.folder_scan(
+            directory, stats_dict, advanced_checks, concept, start_time, float("inf"), cancel_scan_flag,
+        )
+        subfolders.extend([f.path for f in os.scandir(directory) if f.is_dir()])
+    return stats_dict
+
+
+def index_walk(path: str, cache_dir: str, advanced_checks: bool, max_workers: int | None) -> dict:
+    stats_dict = concept_stats.init_concept_stats(advanced_checks)
+    with ConceptIndex(path, cache_dir) as concept_index:
+        return concept_stats.index_scan(
+            concept_index, stats_dict, advanced_checks, True, time.perf_counter(), float("inf"), threading.Event(),
+            max_workers=max_workers,
+        )
+
+
+def benchmark_lookups(count: int):
+    names = [f"/data/image_{i:07d}.txt" for i in range(count)]
+    queries = random.Random(0).sample(names, min(count, 1000))
+
+    start = time.perf_counter()
+    for query in queries:
+        _ = query in names
+    list_time = (time.perf_counter() - start) / len(queries)
+
+    name_set = set(names)
+    start = time.perf_counter()
+    for query in queries:
+        _ = query in name_set
+    set_time = (time.perf_counter() - start) / len(queries)
+    print(f"pairing lookup in a directory of {count} files: list {list_time * 1e6:.2f} us, set {set_time * 1e6:.3f} us")
+
+    rng = np.random.default_rng(0)
+    widths = rng.integers(256, 2048, count)
+    heights = rng.integers(256, 2048, count)
+    buckets = list(aspect_buckets())
+
+    start = time.perf_counter()
+    for width, height in zip(widths, heights, strict=True):
+        min(buckets, key=lambda x, aspect=height / width: abs(x - aspect))
+    min_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    nearest_aspect_buckets(widths, heights)
+    searchsorted_time = time.perf_counter() - start
+    print(f"aspect buckets for {count} images: min() {min_time:.3f} s, searchsorted {searchsorted_time:.4f} s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of concept statistics on a synthetic dataset.")
+    parser.add_argument("--files", type=int, default=100000, dest="files", help="Number of files in the dataset")
+    parser.add_argument("--directories", type=int, default=100, dest="directories", help="Number of directories")
+    parser.add_argument("--workers", type=int, default=None, dest="workers", help="Threads for the index scan")
+    parser.add_argument("--dir", type=str, default=None, dest="dir", help="Directory for the temporary files")
+    args = parser.parse_args()
+
+    benchmark_lookups(args.files // args.directories)
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as directory:
+        concept_path = os.path.join(directory, "concept")
+        cache_dir = os.path.join(directory, "cache")
+
+        start = time.perf_counter()
+        create_tree(concept_path, args.files, args.directories)
+        print(f"created {args.files} files in {time.perf_counter() - start:.2f} s")
+
+        def run(label: str, scan_fn):
+            start = time.perf_counter()
+            stats_dict = scan_fn()
+            elapsed = time.perf_counter() - start
+            print(f"{label:>32}: {elapsed:7.2f} s  {stats_dict['image_count']} images, "
+                  f"{stats_dict['paired_captions']} captions, {stats_dict['paired_masks']} masks")
+
+        run("folder scan", lambda: folder_walk(concept_path, True))
+        run("index scan, cold, 1 thread", lambda: index_walk(concept_path, os.path.join(directory, "cache_1"), True, 1))
+        run("index scan, cold", lambda: index_walk(concept_path, cache_dir, True, args.workers))
+        run("index scan, unchanged, basic", lambda: index_walk(concept_path, cache_dir, False, args.workers))
+        run("index scan, unchanged, advanced", lambda: index_walk(concept_path, cache_dir, True, args.workers))
+
+
+if __name__ == '__main__':
+    main()
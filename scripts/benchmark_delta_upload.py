@@ -0,0 +1,131 @@
+from util.import_util import script_imports
+
+script_imports()
+
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+from modules.cloud.BaseSSHFileSync import BaseSSHFileSync
+from modules.util.config.CloudConfig import CloudConfig, CloudSecretsConfig
+
+import invoke
+
+
+class LoopbackConnection(invoke.Context):
+    # runs the remote commands of the file sync on the local machine
+
+    def open(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class LoopbackFileSync(BaseSSHFileSync):
+    # "uploads" by copying files, and counts the transferred bytes
+
+    def __init__(self, config: CloudConfig, secrets: CloudSecretsConfig, cache_dir: str = None):
+        super().__init__(config, secrets, cache_dir)
+        self.sync_connection = LoopbackConnection()
+        self.uploaded_bytes = 0
+
+    def upload_files(self, local_files, remote_dir: Path):
+        for local_file in local_files:
+            self.upload_file(local_file, remote_dir / local_file.name)
+
+    def download_files(self, local_dir: Path, remote_files):
+        for remote_file in remote_files:
+            self.download_file(local_dir / remote_file.name, remote_file)
+
+    def upload_file(self, local_file: Path, remote_file: Path):
+        shutil.copyfile(local_file, remote_file)
+        self.uploaded_bytes += local_file.stat().st_size
+
+    def download_file(self, local_file: Path, remote_file: Path):
+        shutil.copyfile(remote_file, local_file)
+
+
+def create_concept(path: Path, size: int, image_size: int, directory_count: int):
+    rng = random.Random(42)
+    image_count = max(1, size // image_size)
+    for i in range(image_count):
+        directory = path / f"dir_{i % directory_count:04d}"
+        directory.mkdir(parents=True, exist_ok=True)
+        (directory / f"image_{i:07d}.png").write_bytes(rng.randbytes(image_size))
+        (directory / f"image_{i:07d}.txt").write_text(f"a photo of object {i}, seen from the side")
+
+
+def edit_concept(path: Path, count: int):
+    # a small edit: some captions are changed, some are saved again without changes, some images are re-exported
+    # with identical content, and a few images change
+    rng = random.Random(0)
+    captions = sorted(path.rglob("*.txt"))
+    images = sorted(path.rglob("*.png"))
+    mtime = time.time() + 10  # the sync compares mtimes with a resolution of one second
+
+    def touch(file: Path):
+        os.utime(file, (mtime, mtime))
+
+    for caption in rng.sample(captions, min(count, len(captions))):
+        caption.write_text(caption.read_text() + ", edited")
+        touch(caption)
+    for caption in rng.sample(captions, min(count, len(captions))):
+        caption.write_text(caption.read_text())
+        touch(caption)
+    for image in rng.sample(images, min(count, len(images))):
+        image.write_bytes(image.read_bytes())
+        touch(image)
+    for image in rng.sample(images, min(max(1, count // 10), len(images))):
+        with image.open(mode="r+b") as f:
+            f.write(rng.randbytes(1024))
+        touch(image)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Loopback benchmark of the cloud upload, with and without delta upload.")
+    parser.add_argument("--size-gb", type=float, default=50, dest="size_gb", help="Size of the concept in GB")
+    parser.add_argument("--image-size-mb", type=float, default=2, dest="image_size_mb", help="Size of each image in MB")
+    parser.add_argument("--directories", type=int, default=100, dest="directories", help="Number of directories")
+    parser.add_argument("--edits", type=int, default=100, dest="edits", help="Number of files changed by the edit")
+    parser.add_argument("--dir", type=str, default=None, dest="dir", help="Directory for the temporary files")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as directory:
+        directory = Path(directory)
+        concept_path = directory / "concept"
+
+        start = time.perf_counter()
+        create_concept(concept_path, int(args.size_gb * 1024**3), int(args.image_size_mb * 1024**2), args.directories)
+        print(f"created a concept of {args.size_gb} GB in {time.perf_counter() - start:.2f} s")
+
+        file_syncs = {}
+        for name, delta_upload in [("mtime", False), ("delta", True)]:
+            config = CloudConfig.default_values()
+            config.remote_dir = str(directory / f"remote_{name}")
+            config.delta_upload = delta_upload
+            file_syncs[name] = LoopbackFileSync(config, CloudSecretsConfig.default_values(), str(directory / "cache"))
+
+        def run(label: str):
+            for name, file_sync in file_syncs.items():
+                file_sync.uploaded_bytes = 0
+                start = time.perf_counter()
+                file_sync.sync_up_dir(concept_path, Path(file_sync.config.remote_dir, "concept"), recursive=True)
+                elapsed = time.perf_counter() - start
+                print(f"{label:>16} {name:>6}: {elapsed:8.2f} s  {file_sync.uploaded_bytes / 1024**2:12.1f} MiB uploaded")
+
+        run("initial upload")
+        run("unchanged")
+        edit_concept(concept_path, args.edits)
+        run("small edit")
+
+        for file_sync in file_syncs.values():
+            file_sync.close()
+
+
+if __name__ == '__main__':
+    main()
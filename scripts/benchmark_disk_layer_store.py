@@ -0,0 +1,138 @@
+from util.import_util import script_imports
+
+script_imports()
+
+import argparse
+import tempfile
+import time
+
+from modules.util.DiskLayerStore import DiskLayerStore
+from modules.util.LayerOffloadConductor import LayerOffloadStrategy
+
+import torch
+from torch import nn
+
+
+def create_layers(num_layers: int, features: int, dtype: torch.dtype) -> nn.ModuleList:
+    generator = torch.Generator().manual_seed(42)
+    layers = nn.ModuleList()
+    for _ in range(num_layers):
+        layer = nn.Sequential(nn.Linear(features, features * 2), nn.Linear(features * 2, features)).to(dtype=dtype)
+        for parameter in layer.parameters():
+            parameter.data = torch.randn(parameter.shape, generator=generator).to(dtype=dtype)
+        layers.append(layer)
+    return layers
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Replays the layer offloading schedule of a synthetic layer stack on the CPU with the disk tier, "
+                    "and checks that every loaded layer contains the expected data.")
+    parser.add_argument("--layers", type=int, default=24, dest="layers", help="Number of synthetic layers")
+    parser.add_argument("--features", type=int, default=1024, dest="features", help="Width of each layer")
+    parser.add_argument("--fraction", type=float, default=0.75, dest="fraction", help="Layer offload fraction")
+    parser.add_argument("--steps", type=int, default=3, dest="steps", help="Number of training steps")
+    parser.add_argument("--slots", type=int, default=4, dest="slots", help="Number of staging buffers")
+    parser.add_argument("--trained", action="store_true", dest="trained",
+                        help="Change the weights during the backward pass, so they need to be written back")
+    parser.add_argument("--directory", type=str, default=None, dest="directory",
+                        help="Directory of the layer file, ideally on an NVMe drive. Defaults to the temp directory")
+    args = parser.parse_args()
+
+    layers = create_layers(args.layers, args.features, torch.bfloat16)
+    layer_tensors = [list(layer.parameters()) for layer in layers]
+    expected = [[tensor.detach().clone() for tensor in tensors] for tensors in layer_tensors]
+    layer_bytes = [sum(tensor.element_size() * tensor.numel() for tensor in tensors) for tensors in layer_tensors]
+
+    directory = args.directory if args.directory is not None else tempfile.gettempdir()
+    store = DiskLayerStore(directory, "disk_layer_store_benchmark_", layer_tensors, args.slots)
+    for layer_index, tensors in enumerate(layer_tensors):
+        store.write(layer_index, tensors)
+
+    # the same placement and schedule as LayerOffloadConductor, with the "train device" being a copy on the CPU
+    strategy = LayerOffloadStrategy(layer_bytes, args.fraction)
+    loaded_layers = set(strategy.initial_loaded_layers)
+    for layer_index, tensors in enumerate(layer_tensors):
+        for tensor, host_tensor in zip(tensors, store.host_tensors(layer_index), strict=True):
+            tensor.data = host_tensor.clone() if layer_index in loaded_layers else host_tensor
+
+    dirty_layers = set()
+    loaded_bytes = 0
+    written_bytes = 0
+    mismatches = 0
+
+    def offload(layer_index: int):
+        nonlocal written_bytes
+        tensors = layer_tensors[layer_index]
+        if layer_index in dirty_layers:
+            dirty_layers.discard(layer_index)
+            for tensor, staged_tensor in zip(tensors, store.begin_write(layer_index), strict=True):
+                staged_tensor.copy_(tensor.data)
+            store.end_write(layer_index, tensors, None)
+            written_bytes += layer_bytes[layer_index]
+        else:
+            for tensor, host_tensor in zip(tensors, store.host_tensors(layer_index), strict=True):
+                tensor.data = host_tensor
+        loaded_layers.discard(layer_index)
+
+    def load(layer_index: int):
+        nonlocal loaded_bytes, mismatches
+        tensors = layer_tensors[layer_index]
+        for tensor, staged_tensor, expected_tensor in zip(
+                tensors, store.load(layer_index), expected[layer_index], strict=True):
+            tensor.data = staged_tensor.clone()
+            if not torch.equal(tensor.data, expected_tensor):
+                mismatches += 1
+        store.release(layer_index, None)
+        loaded_bytes += layer_bytes[layer_index]
+        loaded_layers.add(layer_index)
+
+    def prefetch(layer_index: int, is_forward: bool):
+        simulated_loaded_layers = set(loaded_layers)
+        direction = 1 if is_forward else -1
+        for next_layer_index in range(layer_index + direction, layer_index + direction * (store.num_staging_slots() + 1),
+                                      direction):
+            if not 0 <= next_layer_index < len(layers):
+                return
+            simulated_loaded_layers -= set(strategy.get_layers_to_offload(
+                next_layer_index, is_forward, False, sorted(simulated_loaded_layers)))
+            for i in strategy.get_layers_to_load(next_layer_index, is_forward, False, sorted(simulated_loaded_layers)):
+                simulated_loaded_layers.add(i)
+                if i not in loaded_layers and not store.prefetch(i):
+                    return
+
+    start = time.perf_counter()
+    for _ in range(args.steps):
+        for is_forward, layer_indices in [(True, range(len(layers))), (False, range(len(layers) - 1, -1, -1))]:
+            for layer_index in layer_indices:
+                for i in strategy.get_layers_to_offload(layer_index, is_forward, False, sorted(loaded_layers)):
+                    offload(i)
+                for i in strategy.get_layers_to_load(layer_index, is_forward, False, sorted(loaded_layers)):
+                    load(i)
+                prefetch(layer_index, is_forward)
+
+                if not is_forward and args.trained:
+                    # a stand-in for the optimizer step of a fused back pass
+                    for tensor, expected_tensor in zip(layer_tensors[layer_index], expected[layer_index], strict=True):
+                        tensor.data.add_(1.0)
+                        expected_tensor.add_(1.0)
+                    dirty_layers.add(layer_index)
+    store.synchronize()
+    elapsed = time.perf_counter() - start
+
+    for layer_index, tensors in enumerate(layer_tensors):
+        for tensor, expected_tensor in zip(tensors, expected[layer_index], strict=True):
+            if not torch.equal(tensor.data, expected_tensor):
+                mismatches += 1
+
+    total_bytes = sum(layer_bytes)
+    print(f"{len(layers)} layers, {total_bytes / 1024**2:.1f} MiB, "
+          f"staging buffers {store.staging_bytes() / 1024**2:.1f} MiB")
+    print(f"loaded {loaded_bytes / 1024**2:.1f} MiB, written back {written_bytes / 1024**2:.1f} MiB "
+          f"in {elapsed:.2f} s, {(loaded_bytes + written_bytes) / 1024**3 / elapsed:.2f} GiB/s")
+    print("all loaded layers are correct" if mismatches == 0 else f"{mismatches} mismatching tensors")
+    store.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+from util.import_util import script_imports
+
+script_imports()
+
+import argparse
+import time
+
+from modules.module.LoRAModule import DoRAModule
+from modules.util.config.TrainConfig import TrainConfig
+from modules.util.enum.DataType import DataType
+from modules.util.quantization_util import quantize_layers
+
+import torch
+from torch import nn
+
+
+def create_layer(layer_type: str, in_features: int, out_features: int, device: torch.device) -> nn.Linear:
+    if layer_type == "nf4":
+        from modules.module.quantized.LinearNf4 import LinearNf4
+        layer = LinearNf4(in_features, out_features, bias=True)
+    elif layer_type == "int8":
+        from modules.module.quantized.LinearW8A8 import LinearW8A8
+        layer = LinearW8A8(torch.int8, in_features, out_features, bias=True)
+    elif layer_type == "fp8":
+        from modules.module.quantized.LinearW8A8 import LinearW8A8
+        layer = LinearW8A8(torch.float8_e4m3fn, in_features, out_features, bias=True)
+    else:
+        layer = nn.Linear(in_features, out_features, bias=True, dtype=torch.bfloat16)
+
+    layer.to(device=device)
+    layer.requires_grad_(False)
+    quantize_layers(layer, device, DataType.BFLOAT_16, TrainConfig.default_values())
+    return layer
+
+
+def run(layer_type: str, low_rank_norm: bool, output_axis: bool, args: argparse.Namespace, device: torch.device):
+    layer = create_layer(layer_type, args.in_features, args.out_features, device)
+    dora = DoRAModule(
+        "benchmark", layer, args.rank, args.rank,
+        norm_epsilon=True,
+        decompose_output_axis=output_axis,
+        low_rank_norm=low_rank_norm,
+        train_device=device,
+    )
+    dora.to(device=device)
+    torch.nn.init.normal_(dora.lora_up.weight, std=0.01)
+    dora.hook_to_module()
+
+    x = torch.randn(args.batch_size, args.tokens, args.in_features, device=device, dtype=torch.bfloat16, requires_grad=True)
+
+    def step():
+        with torch.autocast(device_type=device.type, dtype=torch.bfloat16):
+            y = layer(x)
+        y.float().square().mean().backward()
+
+    for _ in range(args.warmup):
+        step()
+    torch.cuda.synchronize()
+    torch.cuda.reset_peak_memory_stats()
+    memory_before = torch.cuda.memory_allocated()
+
+    start = time.perf_counter()
+    for _ in range(args.steps):
+        step()
+    torch.cuda.synchronize()
+    elapsed = time.perf_counter() - start
+
+    peak_memory = torch.cuda.max_memory_allocated() - memory_before
+    label = f"{layer_type} {'output' if output_axis else 'input'} axis {'low-rank norm' if low_rank_norm else 'full weight'}"
+    print(f"{label:>40}: {elapsed / args.steps * 1000:8.3f} ms/step  {peak_memory / 1024 ** 2:9.1f} MB peak")
+
+    # compare with the full weight path on the same weights
+    if low_rank_norm:
+        with torch.no_grad(), torch.autocast(device_type=device.type, dtype=torch.bfloat16):
+            y = layer(x).float()
+            dora.low_rank_norm = False
+            y_reference = layer(x).float()
+        error = (y - y_reference).abs().max().item() / y_reference.abs().max().item()
+        print(f"{'':>40}  max relative difference to full weight path: {error:.2e}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the DoRA forward and backward pass on quantized layers.")
+    parser.add_argument("--layers", type=str, nargs="+", default=["nf4", "int8"], choices=["bf16", "nf4", "int8", "fp8"],
+                        dest="layers", help="Base layer types")
+    parser.add_argument("--in-features", type=int, default=3072, dest="in_features", help="Input features")
+    parser.add_argument("--out-features", type=int, default=12288, dest="out_features", help="Output features")
+    parser.add_argument("--rank", type=int, default=32, dest="rank", help="DoRA rank")
+    parser.add_argument("--batch-size", type=int, default=2, dest="batch_size", help="Batch size")
+    parser.add_argument("--tokens", type=int, default=1024, dest="tokens", help="Tokens per sample")
+    parser.add_argument("--steps", type=int, default=100, dest="steps", help="Number of measured steps")
+    parser.add_argument("--warmup", type=int, default=10, dest="warmup", help="Number of warmup steps")
+    args = parser.parse_args()
+
+    device = torch.device("cuda")
+    for layer_type in args.layers:
+        for output_axis in [False, True]:
+            for low_rank_norm in [False, True]:
+                run(layer_type, low_rank_norm, output_axis, args, device)
+
+
+if __name__ == '__main__':
+    main()
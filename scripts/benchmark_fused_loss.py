@@ -0,0 +1,129 @@
+from util.import_util import script_imports
+
+script_imports()
+
+import argparse
+import time
+
+from modules.util.loss.fused_loss import compiled_fused_losses, fused_losses
+from modules.util.loss.masked_loss import masked_losses_with_prior
+
+import torch
+import torch.nn.functional as F
+
+
+def log_cosh_loss(pred: torch.Tensor, target: torch.Tensor) -> torch.Tensor:
+    diff = pred - target
+    return diff + F.softplus(-2.0 * diff) - torch.log(torch.tensor(2.0, dtype=torch.float32, device=diff.device))
+
+
+def reference_losses(predicted, target, prior_target, mask, strengths, huber_delta, unmasked_weight,
+                     normalize_masked_area_loss, masked_prior_preservation_weight):
+    # the loss calculation before the fused implementation, with one pass per term
+    mean_dim = list(range(1, predicted.ndim))
+    loss_functions = [
+        lambda p, t: F.mse_loss(p, t, reduction='none'),
+        lambda p, t: F.l1_loss(p, t, reduction='none'),
+        log_cosh_loss,
+        lambda p, t: F.huber_loss(p, t, reduction='none', delta=huber_delta),
+    ]
+
+    losses = 0
+    for loss_function, strength in zip(loss_functions, strengths, strict=True):
+        if strength == 0:
+            continue
+        term = loss_function(predicted.to(dtype=torch.float32), target.to(dtype=torch.float32))
+        if mask is not None:
+            term = masked_losses_with_prior(
+                losses=term,
+                prior_losses=loss_function(
+                    predicted.to(dtype=torch.float32),
+                    prior_target.to(dtype=torch.float32),
+                ) if prior_target is not None else None,
+                mask=mask.to(dtype=torch.float32),
+                unmasked_weight=unmasked_weight,
+                normalize_masked_area_loss=normalize_masked_area_loss,
+                masked_prior_preservation_weight=masked_prior_preservation_weight,
+            )
+        losses += term.mean(mean_dim) * strength
+    return losses
+
+
+def create_inputs(shape: tuple[int, ...], dtype: torch.dtype, device: torch.device, masked: bool):
+    generator = torch.Generator(device=device).manual_seed(42)
+    predicted = torch.randn(shape, generator=generator, device=device, dtype=dtype, requires_grad=True)
+    target = torch.randn(shape, generator=generator, device=device, dtype=dtype)
+    prior_target = torch.randn(shape, generator=generator, device=device, dtype=dtype) if masked else None
+    mask = (torch.rand((shape[0], 1, *shape[2:]), generator=generator, device=device) > 0.5).to(dtype) \
+        if masked else None
+    return predicted, target, prior_target, mask
+
+
+def run(function, inputs, strengths, huber_delta, masked: bool, device: torch.device):
+    predicted, target, prior_target, mask = inputs
+    predicted.grad = None
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+        torch.cuda.reset_peak_memory_stats()
+        base_memory = torch.cuda.memory_allocated()
+
+    start = time.perf_counter()
+    losses = function(
+        predicted, target, prior_target, mask, strengths, huber_delta,
+        unmasked_weight=0.1, normalize_masked_area_loss=masked, masked_prior_preservation_weight=0.5 if masked else 0.0,
+    )
+    losses.mean().backward()
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+    elapsed = time.perf_counter() - start
+
+    peak_memory = torch.cuda.max_memory_allocated() - base_memory if device.type == "cuda" else 0
+    return losses.detach(), predicted.grad.clone(), elapsed, peak_memory
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compares the fused diffusion loss with the per term implementation.")
+    parser.add_argument("--device", type=str, default="cuda" if torch.cuda.is_available() else "cpu", dest="device")
+    parser.add_argument("--dtype", type=str, default="bfloat16", dest="dtype", help="Dtype of the model prediction")
+    parser.add_argument("--compile", action="store_true", dest="compile", help="Also run the compiled fused loss")
+    args = parser.parse_args()
+
+    device = torch.device(args.device)
+    dtype = getattr(torch, args.dtype)
+    strengths = (1.0, 0.5, 0.25, 0.75)
+    huber_delta = 1.0
+
+    shapes = {
+        "image 1024px": (4, 16, 128, 128),
+        "video 33 frames": (1, 16, 9, 68, 120),
+    }
+
+    def fused(predicted, target, prior_target, mask, strengths, huber_delta, **kwargs):
+        return fused_losses(predicted, target, prior_target, mask, *strengths, huber_delta, **kwargs)
+
+    def compiled(predicted, target, prior_target, mask, strengths, huber_delta, **kwargs):
+        return compiled_fused_losses()(predicted, target, prior_target, mask, *strengths, huber_delta, **kwargs)
+
+    functions = {"per term": reference_losses, "fused": fused}
+    if args.compile:
+        functions["compiled"] = compiled
+
+    for shape_name, shape in shapes.items():
+        for masked in [False, True]:
+            inputs = create_inputs(shape, dtype, device, masked)
+            reference_loss, reference_grad = None, None
+            for name, function in functions.items():
+                run(function, inputs, strengths, huber_delta, masked, device)  # warmup
+                loss, grad, elapsed, peak_memory = run(function, inputs, strengths, huber_delta, masked, device)
+                if reference_loss is None:
+                    reference_loss, reference_grad = loss, grad
+                loss_error = ((loss - reference_loss).abs().max() / reference_loss.abs().max()).item()
+                grad_error = ((grad.float() - reference_grad.float()).abs().max()
+                              / reference_grad.float().abs().max()).item()
+                print(f"{shape_name:>16} {'masked' if masked else 'unmasked':>8} {name:>8}: "
+                      f"{elapsed * 1000:8.2f} ms, peak {peak_memory / 1024**2:9.1f} MiB, "
+                      f"loss error {loss_error:.2e}, grad error {grad_error:.2e}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+from util.import_util import script_imports
+
+script_imports()
+
+import argparse
+import os
+import time
+
+import modules.util.multi_gpu_util as multi
+from modules.util.enum.GradientReducePrecision import GradientReducePrecision
+
+import torch
+
+
+def create_parameters(num_parameters: int, max_numel: int, dtype: torch.dtype) -> list[torch.nn.Parameter]:
+    #mix of many small tensors (biases, norms, LoRA adapters) and a few large ones, similar to a transformer model
+    generator = torch.Generator().manual_seed(42)
+    params = []
+    for i in range(num_parameters):
+        numel = max_numel if i % 16 == 0 else int(torch.randint(64, max_numel // 64, (1,), generator=generator))
+        param = torch.nn.Parameter(torch.zeros(numel, dtype=dtype))
+        param.grad = torch.randn(numel, generator=generator).to(dtype)
+        params.append(param)
+    return params
+
+
+def run(rank: int, world_size: int, args: argparse.Namespace):
+    os.environ.setdefault('MASTER_ADDR', 'localhost')
+    os.environ.setdefault('MASTER_PORT', str(args.port))
+    torch.distributed.init_process_group(backend='gloo', rank=rank, world_size=world_size)
+
+    dtype = torch.bfloat16 if args.bf16 else torch.float32
+    precision = GradientReducePrecision(args.precision)
+    params = create_parameters(args.parameters, args.max_numel, dtype)
+
+    collectives = 0
+    all_reduce = torch.distributed.all_reduce
+
+    def counting_all_reduce(*a, **kw):
+        nonlocal collectives
+        collectives += 1
+        return all_reduce(*a, **kw)
+
+    torch.distributed.all_reduce = counting_all_reduce
+
+    for label, bucket_size, async_op in [
+        ("per-tensor", 0, False),
+        ("per-tensor async", 0, True),
+        ("bucketed", args.bucket_size * 1024 * 1024, False),
+        ("bucketed async", args.bucket_size * 1024 * 1024, True),
+    ]:
+        for _ in range(args.warmup):
+            multi.reduce_grads_mean(params, precision, async_op=async_op, max_buffer=args.buffer * 1024 * 1024,
+                                    bucket_size=bucket_size, defer=True)
+            multi.finish_async(precision)
+
+        torch.distributed.barrier()
+        collectives = 0
+        start = time.perf_counter()
+        for _ in range(args.steps):
+            multi.reduce_grads_mean(params, precision, async_op=async_op, max_buffer=args.buffer * 1024 * 1024,
+                                    bucket_size=bucket_size, defer=True)
+            multi.finish_async(precision)
+        elapsed = time.perf_counter() - start
+
+        if multi.is_master():
+            print(f"{label:>18}: {collectives / args.steps:8.1f} collectives/step  {elapsed / args.steps * 1000:9.2f} ms/step")
+
+    torch.distributed.all_reduce = all_reduce
+    torch.distributed.destroy_process_group()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of per-tensor vs. bucketed gradient reduction on the gloo backend.")
+    parser.add_argument("--world-size", type=int, default=2, dest="world_size", help="Number of processes")
+    parser.add_argument("--parameters", type=int, default=2000, dest="parameters", help="Number of parameter tensors")
+    parser.add_argument("--max-numel", type=int, default=1024 * 1024, dest="max_numel", help="Number of elements of the largest tensors")
+    parser.add_argument("--bucket-size", type=int, default=25, dest="bucket_size", help="Bucket size in MB")
+    parser.add_argument("--buffer", type=int, default=100, dest="buffer", help="Async buffer size in MB")
+    parser.add_argument("--precision", type=str, default=str(GradientReducePrecision.FLOAT_32_STOCHASTIC), dest="precision",
+                        choices=[str(x) for x in GradientReducePrecision], help="Gradient reduce precision")
+    parser.add_argument("--bf16", action="store_true", dest="bf16", help="Use bfloat16 gradients")
+    parser.add_argument("--steps", type=int, default=10, dest="steps", help="Number of measured steps")
+    parser.add_argument("--warmup", type=int, default=2, dest="warmup", help="Number of warmup steps")
+    parser.add_argument("--port", type=int, default=12356, dest="port", help="Port for the process group")
+    args = parser.parse_args()
+
+    torch.multiprocessing.spawn(run, args=(args.world_size, args), nprocs=args.world_size, join=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+from util.import_util import script_imports
+
+script_imports()
+
+import argparse
+import time
+
+from modules.util import bf16_stochastic_rounding
+from modules.util.optimizer.adafactor_extensions import patch_adafactor
+from modules.util.optimizer.adam_extensions import patch_adam
+from modules.util.optimizer.adamw_extensions import patch_adamw
+
+import torch
+from torch.optim import Adam, AdamW
+
+from transformers import Adafactor
+
+
+def create_parameters(count: int, rank: int, features: int, dtype: torch.dtype, device: torch.device):
+    # LoRA like parameters: many small down and up matrices
+    generator = torch.Generator(device=device).manual_seed(42)
+    parameters = []
+    for i in range(count):
+        shape = (rank, features) if i % 2 == 0 else (features, rank)
+        parameters.append(torch.randn(shape, generator=generator, device=device, dtype=dtype) * 0.01)
+    return parameters
+
+
+def create_gradients(parameters: list[torch.Tensor], steps: int):
+    generator = torch.Generator(device=parameters[0].device).manual_seed(0)
+    return [
+        [torch.randn(p.shape, generator=generator, device=p.device, dtype=p.dtype) * 0.001 for p in parameters]
+        for _ in range(steps)
+    ]
+
+
+def create_optimizer(name: str, parameters: list[torch.Tensor], stochastic_rounding: bool):
+    match name:
+        case "adam":
+            optimizer = Adam(parameters, lr=1e-3, weight_decay=1e-2, foreach=False)
+            patch_adam(optimizer, stochastic_rounding)
+        case "adamw":
+            optimizer = AdamW(parameters, lr=1e-3, weight_decay=1e-2, foreach=False)
+            patch_adamw(optimizer, stochastic_rounding)
+        case "adafactor":
+            optimizer = Adafactor(
+                parameters, lr=1e-3, weight_decay=1e-2, relative_step=False, scale_parameter=False, warmup_init=False,
+            )
+            patch_adafactor(optimizer, stochastic_rounding)
+    return optimizer
+
+
+def run(name: str, initial_parameters, gradients, stochastic_rounding: bool, per_parameter: bool, seed: int):
+    parameters = [torch.nn.Parameter(p.clone()) for p in initial_parameters]
+    optimizer = create_optimizer(name, parameters, stochastic_rounding)
+    bf16_stochastic_rounding.set_seed(seed, parameters[0].device)
+
+    elapsed = 0.0
+    for step_gradients in gradients:
+        for parameter, gradient in zip(parameters, step_gradients, strict=True):
+            parameter.grad = gradient.clone()
+
+        start = time.perf_counter()
+        if per_parameter:
+            for group in optimizer.param_groups:
+                for i, parameter in enumerate(group["params"]):
+                    optimizer.step_parameter(parameter, group, i)
+        else:
+            optimizer.step()
+        if parameters[0].device.type == "cuda":
+            torch.cuda.synchronize()
+        elapsed += time.perf_counter() - start
+
+    return [p.detach() for p in parameters], elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compares the multi tensor optimizer steps with the per parameter steps.")
+    parser.add_argument("--device", type=str, default="cpu", dest="device")
+    parser.add_argument("--count", type=int, default=2000, dest="count", help="Number of parameters")
+    parser.add_argument("--rank", type=int, default=16, dest="rank", help="LoRA rank")
+    parser.add_argument("--features", type=int, default=3072, dest="features", help="Input and output features")
+    parser.add_argument("--steps", type=int, default=5, dest="steps", help="Number of optimizer steps")
+    parser.add_argument("--seed", type=int, default=1234, dest="seed", help="Seed of the stochastic rounding")
+    args = parser.parse_args()
+
+    device = torch.device(args.device)
+
+    for dtype, stochastic_rounding in [(torch.float32, False), (torch.bfloat16, True)]:
+        initial_parameters = create_parameters(args.count, args.rank, args.features, dtype, device)
+        gradients = create_gradients(initial_parameters, args.steps)
+
+        for name in ["adam", "adamw", "adafactor"]:
+            per_parameter, per_parameter_time = run(
+                name, initial_parameters, gradients, stochastic_rounding, per_parameter=True, seed=args.seed)
+            multi_tensor, multi_tensor_time = run(
+                name, initial_parameters, gradients, stochastic_rounding, per_parameter=False, seed=args.seed)
+
+            identical = all(torch.equal(a, b) for a, b in zip(per_parameter, multi_tensor, strict=True))
+            print(f"{name:>10} {str(dtype):>15}: per parameter {per_parameter_time / args.steps * 1000:8.2f} ms/step, "
+                  f"multi tensor {multi_tensor_time / args.steps * 1000:8.2f} ms/step, "
+                  f"bitwise identical: {identical}")
+
+    if device.type != "cpu":
+        print("The random numbers of stochastic rounding are only drawn in the same order on the CPU, "
+              "on other devices the results are not expected to be bitwise identical.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+from util.import_util import script_imports
+
+script_imports()
+
+import argparse
+import hashlib
+import os
+import tempfile
+import time
+from collections import OrderedDict
+
+from modules.util import safetensors_util
+from modules.util.enum.ModelHashMode import ModelHashMode
+
+import torch
+
+import safetensors.torch as safetensors
+
+
+def legacy_save(state_dict: dict[str, torch.Tensor], filename: str) -> str:
+    # the previous implementation: hash the sorted state dict in a separate pass, then write the file
+    sha256_hash = hashlib.sha256()
+    for key, tensor in OrderedDict(sorted(state_dict.items())).items():
+        sha256_hash.update(safetensors._tobytes(tensor, key))
+    hash_value = f"0x{sha256_hash.hexdigest()}"
+
+    safetensors.save_file(state_dict, filename, {safetensors_util.HASH_KEY: hash_value})
+    return hash_value
+
+
+def create_state_dict(size_gb: float, tensor_mb: int, dtype: torch.dtype) -> dict[str, torch.Tensor]:
+    element_size = torch.empty(0, dtype=dtype).element_size()
+    elements = tensor_mb * 1024 ** 2 // element_size
+    count = max(1, int(size_gb * 1024 / tensor_mb))
+
+    # odd shapes, so tensors don't line up with the hash chunks
+    return {
+        f"model.layers.{i}.weight": torch.randn(elements + i * 17, dtype=torch.float32).to(dtype)
+        for i in range(count)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of hashing safetensors files while saving them.")
+    parser.add_argument("--size", type=float, default=4.0, dest="size", help="State dict size in GB")
+    parser.add_argument("--tensor-size", type=int, default=64, dest="tensor_size", help="Tensor size in MB")
+    parser.add_argument("--workers", type=int, default=None, dest="workers", help="Threads for the tree hash")
+    parser.add_argument("--chunk-size", type=int, default=16, dest="chunk_size", help="Tree hash chunk size in MB")
+    parser.add_argument("--dir", type=str, default=None, dest="dir", help="Directory for the temporary files")
+    args = parser.parse_args()
+
+    state_dict = create_state_dict(args.size, args.tensor_size, torch.bfloat16)
+    size = sum(tensor.numel() * tensor.element_size() for tensor in state_dict.values())
+    print(f"{len(state_dict)} tensors, {size / 1024 ** 3:.2f} GB")
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as directory:
+        filename = os.path.join(directory, "model.safetensors")
+
+        def run(label: str, save_fn, verify: bool = False) -> str:
+            start = time.perf_counter()
+            hash_value = save_fn()
+            elapsed = time.perf_counter() - start
+            print(f"{label:>22}: {elapsed:7.2f} s  {size / 1024 ** 3 / elapsed:6.2f} GB/s  {hash_value}")
+            if verify:
+                print(f"{'':>22}  verified: {safetensors_util.verify_hash(filename, args.workers)}")
+            os.remove(filename)
+            return hash_value
+
+        legacy_hash = run("legacy hash + write", lambda: legacy_save(state_dict, filename))
+
+        streaming_hash = run("streaming sha256", lambda: safetensors_util.save_file(
+            state_dict, filename, hash_mode=ModelHashMode.SHA256,
+        ), verify=True)
+        print(f"{'':>22}  matches legacy hash: {streaming_hash == legacy_hash}")
+
+        run("tree sha256", lambda: safetensors_util.save_file(
+            state_dict, filename, hash_mode=ModelHashMode.SHA256_TREE,
+            chunk_size=args.chunk_size * 1024 ** 2, max_workers=args.workers,
+        ), verify=True)
+
+        run("no hash", lambda: safetensors_util.save_file(state_dict, filename, hash_mode=ModelHashMode.NONE))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+from util.import_util import script_imports
+
+script_imports()
+
+import argparse
+import json
+
+from modules.util.OffloadSimulator import OffloadSimulator
+
+
+def load_profile(args) -> tuple[list[int], list[float], int]:
+    if args.profile is None:
+        layer_bytes = [int(args.layer_mb * 1024**2)] * args.layers
+        return layer_bytes, [args.forward_ms] * args.layers, int(args.max_tensor_mb * 1024**2)
+
+    # a layer profile written by OffloadTraceRecorder
+    with open(args.profile) as f:
+        profiles = json.load(f)
+    # by default, the module with the most bytes, usually the transformer or unet
+    module = args.module if args.module is not None \
+        else max(profiles, key=lambda x: sum(profiles[x]["layer_bytes"]))
+    profile = profiles[module]
+    print(f"using the layer profile of {module}, available: {', '.join(profiles)}")
+
+    forward_ms = [x if x is not None else args.forward_ms for x in profile["forward_ms"]]
+    return profile["layer_bytes"], forward_ms, profile["max_tensor_bytes"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Predicts the step time and memory usage of layer offloading on the CPU.")
+    parser.add_argument("--profile", type=str, default=None, dest="profile",
+                        help="Layer profile json, written next to an offload trace. Replaces the synthetic layers")
+    parser.add_argument("--module", type=str, default=None, dest="module", help="Module name in the layer profile")
+    parser.add_argument("--layers", type=int, default=57, dest="layers", help="Number of synthetic layers")
+    parser.add_argument("--layer-mb", type=float, default=400, dest="layer_mb", help="Size of each synthetic layer")
+    parser.add_argument("--max-tensor-mb", type=float, default=72, dest="max_tensor_mb",
+                        help="Size of the largest tensor of the synthetic layers")
+    parser.add_argument("--forward-ms", type=float, default=10, dest="forward_ms",
+                        help="Forward time of each layer, used for layers without a measured time")
+    parser.add_argument("--backward-factor", type=float, default=2.0, dest="backward_factor",
+                        help="Backward time of a layer, relative to its forward time")
+    parser.add_argument("--h2d-gbps", type=float, default=24, dest="h2d_gbps", help="Host to device bandwidth in GB/s")
+    parser.add_argument("--d2h-gbps", type=float, default=24, dest="d2h_gbps", help="Device to host bandwidth in GB/s")
+    parser.add_argument("--fractions", type=str, default="0.0,0.25,0.5,0.6,0.7,0.8,0.9", dest="fractions",
+                        help="Comma separated list of layer offload fractions to simulate")
+    parser.add_argument("--inference", action="store_true", dest="inference",
+                        help="Simulate forward passes only, like during sampling")
+    args = parser.parse_args()
+
+    layer_bytes, forward_ms, max_tensor_bytes = load_profile(args)
+    simulator = OffloadSimulator(
+        layer_bytes=layer_bytes,
+        forward_ms=forward_ms,
+        max_tensor_bytes=max_tensor_bytes,
+        host_to_device_bytes_per_s=args.h2d_gbps * 1e9,
+        device_to_host_bytes_per_s=args.d2h_gbps * 1e9,
+        backward_factor=args.backward_factor,
+        training=not args.inference,
+    )
+
+    print(f"{len(layer_bytes)} layers, {sum(layer_bytes) / 1024**3:.2f} GiB")
+    print(f"{'fraction':>8} {'step ms':>10} {'compute ms':>10} {'stall ms':>10} {'transfer GiB':>12} "
+          f"{'VRAM GiB':>9} {'pinned GiB':>10}")
+    for fraction in [float(x) for x in args.fractions.split(",")]:
+        result = simulator.simulate(fraction)
+        print(f"{result.layer_offload_fraction:>8.2f} {result.step_time_ms:>10.1f} {result.compute_time_ms:>10.1f} "
+              f"{result.stall_time_ms:>10.1f} {result.transferred_bytes / 1024**3:>12.2f} "
+              f"{result.train_device_cache_bytes / 1024**3:>9.2f} {result.temp_device_cache_bytes / 1024**3:>10.2f}")
+    print("VRAM is the layer cache on the train device. Activations and the rest of the model are not included.")
+
+
+if __name__ == '__main__':
+    main()
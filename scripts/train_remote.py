@@ -2,6 +2,7 @@ from util.import_util import script_imports
 
 script_imports()
 
+import functools
 import json
 import os
 import pickle
@@ -9,6 +10,8 @@ import threading
 import traceback
 from contextlib import suppress
 
+from modules.cloud.CallbackStream import CallbackStreamServer
+from modules.cloud.WorkspaceManifest import WorkspaceManifest
 from modules.util import create
 from modules.util.args.TrainArgs import TrainArgs
 from modules.util.callbacks.TrainCallbacks import TrainCallbacks
@@ -51,18 +54,24 @@ def command_thread_function(commands: TrainCommands,filename : str,stop_event):
 
 def main():
     args = TrainArgs.parse_args()
+    commands = TrainCommands()
+    callback_stream = None
     if args.callback_path:
+        request = functools.partial(write_request, args.callback_path)
+        if args.stream_path:
+            #callbacks are streamed to the client while it is connected, and written to the callback file otherwise:
+            callback_stream = CallbackStreamServer(args.stream_path, commands, fallback=request)
+            request = callback_stream.callback
         callbacks = TrainCallbacks(
-            on_update_train_progress=lambda *fargs:write_request(args.callback_path,"on_update_train_progress",*fargs),
-            on_update_status=lambda *fargs:write_request(args.callback_path,"on_update_status",*fargs),
-            on_sample_default=lambda *fargs:write_request(args.callback_path,"on_sample_default",*fargs),
-            on_update_sample_default_progress=lambda *fargs:write_request(args.callback_path,"on_update_sample_default_progress",*fargs),
-            on_sample_custom=lambda *fargs:write_request(args.callback_path,"on_sample_custom",*fargs),
-            on_update_sample_custom_progress=lambda *fargs:write_request(args.callback_path,"on_update_sample_custom_progress",*fargs),
+            on_update_train_progress=lambda *fargs:request("on_update_train_progress",*fargs),
+            on_update_status=lambda *fargs:request("on_update_status",*fargs),
+            on_sample_default=lambda *fargs:request("on_sample_default",*fargs),
+            on_update_sample_default_progress=lambda *fargs:request("on_update_sample_default_progress",*fargs),
+            on_sample_custom=lambda *fargs:request("on_sample_custom",*fargs),
+            on_update_sample_custom_progress=lambda *fargs:request("on_update_sample_custom_progress",*fargs),
         )
     else:
         callbacks = TrainCallbacks()
-    commands = TrainCommands()
 
     train_config = TrainConfig.default_values()
     with open(args.config_path, "r") as f:
@@ -84,6 +93,10 @@ def main():
         command_thread = threading.Thread(target=command_thread_function,args=(commands,args.command_path,stop_event))
         command_thread.start()
 
+    if args.manifest_path:
+        manifest = WorkspaceManifest(train_config.workspace_dir, args.manifest_path)
+        manifest.start()
+
     try:
         trainer.start()
         trainer.train()
@@ -96,6 +109,11 @@ def main():
 
         trainer.end()
 
+        if args.manifest_path:
+            manifest.stop()
+
+        if callback_stream:
+            callback_stream.close()
 
 
 if __name__ == '__main__':